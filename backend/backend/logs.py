@@ -0,0 +1,306 @@
+"""
+Logging
+Structured JSON log records shipped to disk off the request thread.
+
+Request threads only format the record and put it on a bounded queue; a
+QueueListener thread per process writes it to a file that rotates by size
+and by time and gzips rotated files. When the queue is full records are
+dropped and counted (the log_records_dropped metric) rather than blocking
+the request.
+
+Every gunicorn worker appends to the same file. Rotation is serialized
+with a lock file, and a worker reopens the file when another one has
+rotated it (as WatchedFileHandler does), so no worker keeps writing to a
+file that has been renamed and compressed.
+
+RequestContextMiddleware stores the current request in a context variable
+so every record carries its request id, user id and route.
+"""
+import contextvars
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils.functional import SimpleLazyObject, empty
+
+from backend.metrics import Counter
+
+try:
+    import fcntl
+except ImportError:  # Windows: rotation is not coordinated between processes
+    fcntl = None
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_ROTATE_SECONDS = 24 * 60 * 60
+DEFAULT_BACKUP_COUNT = 14
+DEFAULT_QUEUE_SIZE = 10000
+
+REQUEST_ID_HEADER = 'HTTP_X_REQUEST_ID'
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+log_records_dropped = Counter('log_records_dropped', 'Log records dropped because the log queue was full')
+
+_current_request = contextvars.ContextVar('log_current_request', default=None)
+
+
+def request_context(request):
+    """request id, user id and route for a request, without forcing lazy auth"""
+    if request is None:
+        return None, None, None
+
+    user_id = None
+    user = request.__dict__.get('user')
+    if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        user = None
+    if user is not None and getattr(user, 'is_authenticated', False):
+        user_id = user.pk
+
+    match = getattr(request, 'resolver_match', None)
+    return getattr(request, 'request_id', None), user_id, match.view_name if match else None
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds request_id, user_id and route to every record"""
+
+    def filter(self, record):
+        record.request_id, record.user_id, record.route = request_context(_current_request.get())
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a share of INFO and lower records; warnings and errors always pass.
+
+    Records from one request are kept or dropped together by hashing the
+    request id, so a sampled request keeps all of its lines.
+    """
+
+    def __init__(self, rate=1.0, name=''):
+        super().__init__(name)
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        request_id = getattr(_current_request.get(), 'request_id', None)
+        if request_id:
+            return zlib.crc32(request_id.encode()) % 10000 < self.rate * 10000
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        payload = {
+            'timestamp': datetime.fromtimestamp(record.created, tz=dt_timezone.utc).isoformat(
+                timespec='milliseconds'
+            ),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+            'request_id': getattr(record, 'request_id', None),
+            'user_id': getattr(record, 'user_id', None),
+            'route': getattr(record, 'route', None),
+        }
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            payload['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(payload, default=str)
+
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotates when the file exceeds max_bytes or when the current interval
+    (aligned to the epoch, i.e. UTC midnight for a day) ends. Rotated files
+    are gzipped: django.log.1.gz, django.log.2.gz, ...
+
+    Safe to share between processes: rollovers take an exclusive lock on
+    <file>.lock, which also records the last time-based rollover so each
+    interval is rotated once, and a process whose open file has been
+    rotated away reopens the new one before writing.
+    """
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, rotate_seconds=DEFAULT_ROTATE_SECONDS,
+                 backup_count=DEFAULT_BACKUP_COUNT, compress=True, encoding='utf-8'):
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.lock_filename = self.baseFilename + '.lock'
+        self.rotate_seconds = rotate_seconds
+        self.rollover_at = self._next_rollover(time.time())
+        self._stream_id = None
+        self._time_due = False
+        if compress:
+            self.namer = lambda name: name + '.gz'
+            self.rotator = _gzip_rotator
+
+    def _next_rollover(self, now):
+        if not self.rotate_seconds:
+            return None
+        return (int(now) // self.rotate_seconds + 1) * self.rotate_seconds
+
+    def _open(self):
+        stream = super()._open()
+        stat = os.fstat(stream.fileno())
+        self._stream_id = (stat.st_dev, stat.st_ino)
+        return stream
+
+    def _reopen_if_rotated(self):
+        """Reopen the file if another process has rotated it; True if it had"""
+        if self.stream is None:
+            return False
+        try:
+            stat = os.stat(self.baseFilename)
+            current = (stat.st_dev, stat.st_ino)
+        except FileNotFoundError:
+            current = None
+        if current == self._stream_id:
+            return False
+        self.stream.close()
+        self.stream = self._open()
+        return True
+
+    @contextmanager
+    def _rollover_lock(self):
+        with open(self.lock_filename, 'a+', encoding='ascii') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield lock_file
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def emit(self, record):
+        self._reopen_if_rotated()
+        super().emit(record)
+
+    def shouldRollover(self, record):
+        self._time_due = False
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+                self._time_due = True
+                return True
+            self.rollover_at = self._next_rollover(time.time())
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with self._rollover_lock() as lock_file:
+            lock_file.seek(0)
+            last_interval = lock_file.read().strip()
+            # Another process may have rotated while this one waited for the lock
+            rotated_elsewhere = self._reopen_if_rotated() or (
+                self._time_due and bool(last_interval) and float(last_interval) >= self.rollover_at
+            )
+            if not rotated_elsewhere:
+                super().doRollover()
+                if self._time_due:
+                    lock_file.truncate(0)
+                    lock_file.write(str(self.rollover_at))
+                    lock_file.flush()
+        self.rollover_at = self._next_rollover(time.time())
+
+
+class QueuedRotatingFileHandler(logging.handlers.QueueHandler):
+    """
+    Formats on the calling thread, writes from a per-process listener thread.
+
+    The listener is started lazily and restarted in forked workers, since
+    threads do not survive fork.
+    """
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, rotate_seconds=DEFAULT_ROTATE_SECONDS,
+                 backup_count=DEFAULT_BACKUP_COUNT, compress=True, queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.queue_size = queue_size
+        self.target = CompressingRotatingFileHandler(
+            filename, max_bytes=max_bytes, rotate_seconds=rotate_seconds,
+            backup_count=backup_count, compress=compress
+        )
+        self.listener = None
+        self.dropped = 0
+        self._listener_pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._listener_pid == os.getpid():
+                return
+            if self._listener_pid is not None:
+                # Forked: the inherited queue may hold a lock taken by a dead thread
+                self.queue = queue.Queue(self.queue_size)
+            self.listener = logging.handlers.QueueListener(self.queue, self.target)
+            self.listener.start()
+            self._listener_pid = os.getpid()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            log_records_dropped.inc()
+
+    def flush(self):
+        """Wait until the listener has written everything queued so far"""
+        if self._listener_pid == os.getpid():
+            self.listener.stop()
+            self._listener_pid = None
+            self._ensure_listener()
+        self.target.flush()
+
+    def close(self):
+        if self._listener_pid == os.getpid():
+            self.listener.stop()
+            self._listener_pid = None
+        self.target.close()
+        super().close()
+
+
+class RequestContextMiddleware:
+    """
+    Assigns a request id (from X-Request-ID when it looks safe) and exposes
+    the request to RequestContextFilter for the duration of the request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.META.get(REQUEST_ID_HEADER, '')
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+
+        token = _current_request.set(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        response['X-Request-ID'] = request_id
+        return response
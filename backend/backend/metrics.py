@@ -0,0 +1,417 @@
+"""
+Prometheus metrics
+Counters and histograms stored in mmap-backed files, one per process, so
+every gunicorn worker records locally without locks between processes and
+the /metrics view sums all workers' files at scrape time.
+
+Each file starts with the number of used bytes, followed by entries of
+(key length, JSON key padded to 8 bytes, float64 value). A process only
+ever writes its own file; readers take a snapshot of the used region.
+When a worker exits the gunicorn master folds its file into a shared
+archive file so counters never go backwards, and the directory is cleared
+when the master starts (see gunicorn.conf.py).
+"""
+import glob
+import hmac
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+INITIAL_FILE_SIZE = 1 << 16
+HEADER_SIZE = 8
+
+# Request latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+FILE_PATTERN = re.compile(r'metrics_(\d+)\.db$')
+# Values of exited workers, written by the gunicorn master only
+ARCHIVE_FILE = 'metrics_archive.db'
+
+
+def get_metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'code2deploy-metrics')
+
+
+def _padded_length(length):
+    # Keep each float64 8-byte aligned after the 4-byte length prefix
+    return length + (8 - (length + 4) % 8)
+
+
+def read_entries(data):
+    """Yield (key, value, value_offset) from the bytes of a metrics file"""
+    if len(data) < HEADER_SIZE:
+        return
+    used = struct.unpack_from('<i', data, 0)[0]
+    pos = HEADER_SIZE
+    while pos < used:
+        length = struct.unpack_from('<i', data, pos)[0]
+        pos += 4
+        key = bytes(data[pos:pos + length]).decode()
+        pos += _padded_length(length)
+        value = struct.unpack_from('<d', data, pos)[0]
+        yield key, value, pos
+        pos += 8
+
+
+class MmapValues:
+    """Float values keyed by string in a single process's mmap-backed file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < INITIAL_FILE_SIZE:
+            self._file.truncate(INITIAL_FILE_SIZE)
+            size = INITIAL_FILE_SIZE
+        self._capacity = size
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._positions = {}
+        self._used = struct.unpack_from('<i', self._map, 0)[0]
+        if self._used == 0:
+            self._used = HEADER_SIZE
+            struct.pack_into('<i', self._map, 0, self._used)
+        else:
+            for key, _, pos in read_entries(self._map):
+                self._positions[key] = pos
+
+    def _grow(self, needed):
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        self._map.close()
+        self._file.truncate(capacity)
+        self._capacity = capacity
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+
+    def _position(self, key):
+        pos = self._positions.get(key)
+        if pos is not None:
+            return pos
+        encoded = key.encode()
+        padded = _padded_length(len(encoded))
+        entry = struct.pack(f'<i{padded}sd', len(encoded), encoded, 0.0)
+        if self._used + len(entry) > self._capacity:
+            self._grow(self._used + len(entry))
+        self._map[self._used:self._used + len(entry)] = entry
+        pos = self._used + 4 + padded
+        # Publish the entry only once it is fully written
+        self._used += len(entry)
+        struct.pack_into('<i', self._map, 0, self._used)
+        self._positions[key] = pos
+        return pos
+
+    def inc(self, key, amount):
+        with self._lock:
+            pos = self._position(key)
+            value = struct.unpack_from('<d', self._map, pos)[0]
+            struct.pack_into('<d', self._map, pos, value + amount)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _values():
+    """This process's value file, reopened after a fork or a directory change"""
+    global _store
+    directory = get_metrics_dir()
+    path = os.path.join(directory, f'metrics_{os.getpid()}.db')
+    store = _store
+    if store is not None and store.path == path:
+        return store
+    with _store_lock:
+        if _store is None or _store.path != path:
+            os.makedirs(directory, exist_ok=True)
+            _store = MmapValues(path)
+        return _store
+
+
+def _key(name, sample, labels):
+    return json.dumps([name, sample, sorted(labels.items())])
+
+
+REGISTRY = {}
+COLLECTORS = []
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY[name] = self
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return {name: str(value) for name, value in labels.items()}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        _values().inc(_key(self.name, f'{self.name}_total', self._labels(labels)), amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        values = _values()
+        # Buckets are stored per range and made cumulative at scrape time
+        bound = next((bucket for bucket in self.buckets if value <= bucket), float('inf'))
+        values.inc(_key(self.name, f'{self.name}_bucket', {**labels, 'le': _format_value(bound)}), 1)
+        values.inc(_key(self.name, f'{self.name}_sum', labels), value)
+        values.inc(_key(self.name, f'{self.name}_count', labels), 1)
+
+
+def register_collector(collector):
+    """
+    Register a callable evaluated at scrape time.
+
+    The callable returns (name, kind, documentation, [(labels, value), ...]);
+    use it for gauges that are cheaper to read than to track.
+    """
+    COLLECTORS.append(collector)
+    return collector
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return f'{value:.1f}'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect_samples(directory=None):
+    """
+    Sum every process's file.
+
+    Returns:
+        (samples, pids) where samples maps metric name to
+        {(sample name, labels tuple): value}
+    """
+    samples = defaultdict(lambda: defaultdict(float))
+    pids = []
+    for path in glob.glob(os.path.join(directory or get_metrics_dir(), 'metrics_*.db')):
+        match = FILE_PATTERN.search(path)
+        if match:
+            pids.append(int(match.group(1)))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue
+        for key, value, _ in read_entries(data):
+            name, sample, labels = json.loads(key)
+            samples[name][(sample, tuple(tuple(label) for label in labels))] += value
+    return samples, pids
+
+
+def _histogram_lines(metric, values):
+    lines = []
+    series = defaultdict(dict)
+    totals = {}
+    for (sample, labels), value in values.items():
+        if sample.endswith('_bucket'):
+            bound = dict(labels)['le']
+            base = tuple(label for label in labels if label[0] != 'le')
+            series[base][bound] = value
+        else:
+            totals[(sample, labels)] = value
+
+    for base in sorted(set(series) | {labels for _, labels in totals}):
+        running = 0.0
+        for bound in metric.buckets + (float('inf'),):
+            running += series.get(base, {}).get(_format_value(bound), 0)
+            lines.append(f'{metric.name}_bucket{_format_labels(base + (("le", _format_value(bound)),))} {running}')
+        lines.append(f'{metric.name}_sum{_format_labels(base)} {totals.get((metric.name + "_sum", base), 0)}')
+        lines.append(f'{metric.name}_count{_format_labels(base)} {totals.get((metric.name + "_count", base), 0)}')
+    return lines
+
+
+def generate_latest(directory=None):
+    """Render all metrics in the Prometheus text exposition format"""
+    samples, pids = collect_samples(directory)
+    lines = []
+
+    for name in sorted(REGISTRY):
+        metric = REGISTRY[name]
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        values = samples.get(name, {})
+        if metric.kind == 'histogram':
+            lines.extend(_histogram_lines(metric, values))
+        else:
+            for (sample, labels), value in sorted(values.items()):
+                lines.append(f'{sample}{_format_labels(labels)} {value}')
+
+    live = sorted(pid for pid in pids if _pid_alive(pid))
+    lines.append('# HELP gunicorn_workers Worker processes with a live metrics file')
+    lines.append('# TYPE gunicorn_workers gauge')
+    lines.append(f'gunicorn_workers {len(live)}')
+    lines.append('# HELP gunicorn_worker_info Live worker processes by pid')
+    lines.append('# TYPE gunicorn_worker_info gauge')
+    for pid in live:
+        lines.append(f'gunicorn_worker_info{{pid="{pid}"}} 1')
+
+    for collector in COLLECTORS:
+        name, kind, documentation, collected = collector()
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in collected:
+            lines.append(f'{name}{_format_labels(sorted(labels.items()))} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def clear_metrics_dir(directory=None):
+    """Remove all value files; call once when the server starts"""
+    for path in glob.glob(os.path.join(directory or get_metrics_dir(), 'metrics_*.db')):
+        os.remove(path)
+
+
+def mark_process_dead(pid, directory=None):
+    """
+    Fold an exited process's values into the archive file and remove its
+    own file; call from the gunicorn master when a worker exits
+    """
+    directory = directory or get_metrics_dir()
+    path = os.path.join(directory, f'metrics_{pid}.db')
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    archive = MmapValues(os.path.join(directory, ARCHIVE_FILE))
+    try:
+        for key, value, _ in read_entries(data):
+            if value:
+                archive.inc(key, value)
+    finally:
+        archive.close()
+    os.remove(path)
+
+
+def _authorized(request):
+    token = getattr(settings, 'METRICS_AUTH_TOKEN', '')
+    if token:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        return hmac.compare_digest(header, f'Bearer {token}')
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+
+
+def metrics_view(request):
+    if not _authorized(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """Counts every request, its latency and its database queries per view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        http_requests.inc(view=view, method=request.method, status=response.status_code)
+        http_request_duration.observe(duration, view=view)
+        if queries[0]:
+            db_queries.inc(queries[0], view=view)
+        if response.status_code == 429:
+            throttle_blocks.inc(view=view)
+        return response
+
+
+# Application metrics
+
+http_requests = Counter(
+    'http_requests', 'HTTP requests by view, method and status', ['view', 'method', 'status']
+)
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by view', ['view']
+)
+db_queries = Counter('db_queries', 'Database queries executed by view', ['view'])
+throttle_blocks = Counter('throttle_blocks', 'Requests rejected by rate limiting', ['view'])
+notifications_created = Counter(
+    'notifications_created', 'Notifications created by type and path', ['type', 'path']
+)
+push_messages = Counter('push_messages', 'Web Push deliveries by result', ['result'])
+
+
+@register_collector
+def email_outbox_depth():
+    from django.db.models import Count
+    from notifications.models import NotificationDigestItem
+
+    rows = NotificationDigestItem.objects.filter(sent_at__isnull=True).order_by().values(
+        'frequency'
+    ).annotate(depth=Count('id'))
+    return (
+        'email_outbox_depth',
+        'gauge',
+        'Digest emails waiting to be sent',
+        [({'frequency': row['frequency']}, row['depth']) for row in rows]
+    )
@@ -0,0 +1,122 @@
+"""
+Keyset pagination on (created_at, id)
+
+Pages are addressed by an opaque cursor holding the last row's created_at
+and id, so each page is an index range scan regardless of depth and no
+COUNT(*) is needed unless explicitly requested with ?count=true.
+"""
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_cursor(created_at, pk):
+    raw = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor into (created_at, id).
+
+    Raises:
+        ValueError if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, pk = raw.rsplit('|', 1)
+        position = parse_datetime(created_at)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if position is None:
+        raise ValueError('Invalid cursor')
+    return position, pk
+
+
+def keyset_filter(queryset, cursor, descending=True):
+    """Restrict a queryset to rows after the cursor in (created_at, id) order"""
+    position, pk = decode_cursor(cursor)
+    if descending:
+        return queryset.filter(Q(created_at__lt=position) | Q(created_at=position, id__lt=pk))
+    return queryset.filter(Q(created_at__gt=position) | Q(created_at=position, id__gt=pk))
+
+
+class KeysetPagination(BasePagination):
+    """Newest-first keyset pagination for models with created_at and id"""
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    ordering = ('-created_at', '-id')
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = None
+
+        queryset = queryset.order_by(*self.ordering)
+        if request.query_params.get(self.count_query_param, '').lower() == 'true':
+            self.count = queryset.count()
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                queryset = keyset_filter(queryset, cursor)
+            except ValueError:
+                raise NotFound('Invalid cursor')
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_next_cursor(self):
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        return encode_cursor(last.created_at, last.pk)
+
+    def get_next_link(self):
+        cursor = self.get_next_cursor()
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict([
+            ('next', self.get_next_link()),
+            ('next_cursor', self.get_next_cursor()),
+            ('results', data),
+        ])
+        if self.count is not None:
+            payload['count'] = self.count
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -26,6 +27,9 @@ SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-your-secret-key-here')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
 
+# Running under `manage.py test`
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', 'localhost,127.0.0.1,0.0.0.0,*').split(',')
 
 # CORS settings
@@ -100,6 +104,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.metrics.MetricsMiddleware',
+    'backend.logs.RequestContextMiddleware',
+    'security.middleware.IPFilterMiddleware',
+    'security.middleware.RequestProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -107,6 +115,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'security.middleware.AuditLogMiddleware',
+    'security.middleware.AnomalyDetectionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -154,6 +164,17 @@ DATABASES = {
     }
 }
 
+# Cache
+# Defaults to a per-process memory cache; point CACHE_BACKEND/CACHE_LOCATION at a
+# shared cache (e.g. django.core.cache.backends.redis.RedisCache) in production
+# so invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -329,12 +350,69 @@ ALLOWED_IMAGE_TYPES = os.getenv('ALLOWED_IMAGE_TYPES', 'image/jpeg,image/png,ima
 # Notification settings
 PUSH_NOTIFICATIONS_ENABLED = os.getenv('PUSH_NOTIFICATIONS_ENABLED', 'True').lower() == 'true'
 EMAIL_NOTIFICATIONS_ENABLED = os.getenv('EMAIL_NOTIFICATIONS_ENABLED', 'True').lower() == 'true'
+# Web Push (VAPID) keys; generate a P-256 key pair and set the base64url values
+VAPID_PUBLIC_KEY = os.getenv('VAPID_PUBLIC_KEY', '')
+VAPID_PRIVATE_KEY = os.getenv('VAPID_PRIVATE_KEY', '')
+VAPID_SUBJECT = os.getenv('VAPID_SUBJECT', 'mailto:support@code2deploy.tech')
+# Seconds a user's cached preference bits are trusted (bounds staleness with per-process caches)
+NOTIFICATION_PREFERENCE_CACHE_TIMEOUT = int(os.getenv('NOTIFICATION_PREFERENCE_CACHE_TIMEOUT', 300))
+# Days to keep notifications before prune_notifications removes them. The
+# defaults live in notifications/retention.py; set variables override them.
+NOTIFICATION_RETENTION = {
+    'status': {
+        status: int(os.environ[f'NOTIFICATION_RETENTION_{status.upper()}_DAYS'])
+        for status in ('unread', 'read', 'archived')
+        if os.getenv(f'NOTIFICATION_RETENTION_{status.upper()}_DAYS')
+    },
+    'type': {
+        notification_type: int(os.environ[f'NOTIFICATION_RETENTION_{notification_type.upper()}_DAYS'])
+        for notification_type in ('reminder',)
+        if os.getenv(f'NOTIFICATION_RETENTION_{notification_type.upper()}_DAYS')
+    },
+}
 
 # Monitoring settings
 AUDIT_LOGGING_ENABLED = os.getenv('AUDIT_LOGGING_ENABLED', 'True').lower() == 'true'
 SECURITY_MONITORING_ENABLED = os.getenv('SECURITY_MONITORING_ENABLED', 'True').lower() == 'true'
+# Audit events are buffered and written in batches by a background thread
+AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', 10000))
+AUDIT_FLUSH_INTERVAL_MS = int(os.getenv('AUDIT_FLUSH_INTERVAL_MS', 500))
+AUDIT_FLUSH_BATCH = int(os.getenv('AUDIT_FLUSH_BATCH', 200))
+
+# Months of security logs kept attached before manage_log_partitions detaches them
+LOG_PARTITION_RETENTION_MONTHS = {
+    'security.AuditLog': int(os.getenv('AUDIT_LOG_RETENTION_MONTHS', 24)),
+    'security.SecurityEvent': int(os.getenv('SECURITY_EVENT_RETENTION_MONTHS', 24)),
+    'security.RateLimitLog': int(os.getenv('RATE_LIMIT_LOG_RETENTION_MONTHS', 3)),
+}
+
+# System health probes (run_health_checks)
+HEALTH_SAMPLE_RETENTION_HOURS = int(os.getenv('HEALTH_SAMPLE_RETENTION_HOURS', 24))
+HEALTH_HOURLY_RETENTION_DAYS = int(os.getenv('HEALTH_HOURLY_RETENTION_DAYS', 90))
+
+# Request profiling (security.middleware.RequestProfilingMiddleware); off
+# under the test runner, whose database is gone before the exit flush
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False' if TESTING else 'True').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.05))
+PROFILING_FLUSH_INTERVAL = int(os.getenv('PROFILING_FLUSH_INTERVAL', 60))
+PROFILING_N_PLUS_ONE_THRESHOLD = int(os.getenv('PROFILING_N_PLUS_ONE_THRESHOLD', 5))
+
+# Prometheus metrics (/metrics); one value file per worker process in METRICS_DIR
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN', '')
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+# IP blocklist/allowlist (security.middleware.IPFilterMiddleware)
+IP_FILTER_ENABLED = os.getenv('IP_FILTER_ENABLED', 'True').lower() == 'true'
+IP_RULES_RELOAD_INTERVAL = int(os.getenv('IP_RULES_RELOAD_INTERVAL', 5))
+# Reverse proxies in front of the app whose X-Forwarded-For entries are
+# trusted; deployments sit behind one load balancer, local runs behind none
+IP_FILTER_PROXY_COUNT = int(os.getenv('IP_FILTER_PROXY_COUNT', 0 if DEBUG else 1))
 
 # Logging configuration
+# The file handler writes JSON lines from a background thread and rotates by
+# size and time, gzipping rotated files (see backend/logs.py)
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -347,13 +425,30 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'backend.logs.JsonFormatter',
+        },
+    },
+    'filters': {
+        'request_context': {
+            '()': 'backend.logs.RequestContextFilter',
+        },
+        'profile_sampling': {
+            '()': 'backend.logs.SamplingFilter',
+            'rate': float(os.getenv('PROFILE_LOG_SAMPLE_RATE', 0.1)),
+        },
     },
     'handlers': {
         'file': {
             'level': os.getenv('LOG_LEVEL', 'INFO'),
-            'class': 'logging.FileHandler',
+            'class': 'backend.logs.QueuedRotatingFileHandler',
             'filename': os.getenv('LOG_FILE', 'logs/django.log'),
-            'formatter': 'verbose',
+            'max_bytes': int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024)),
+            'rotate_seconds': int(os.getenv('LOG_ROTATE_SECONDS', 24 * 60 * 60)),
+            'backup_count': int(os.getenv('LOG_BACKUP_COUNT', 14)),
+            'queue_size': int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+            'formatter': 'json',
+            'filters': ['request_context'],
         },
         'console': {
             'level': 'INFO',
@@ -371,6 +466,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        # Per-request profile update traces, sampled per request
+        'users.views.profile': {
+            'filters': ['profile_sampling'],
+        },
     },
 }
 
@@ -407,6 +506,43 @@ PAYPAL_CLIENT_ID = os.getenv('PAYPAL_CLIENT_ID', '')
 PAYPAL_CLIENT_SECRET = os.getenv('PAYPAL_CLIENT_SECRET', '')
 PAYPAL_MODE = os.getenv('PAYPAL_MODE', 'sandbox')  # 'sandbox' for testing, 'live' for production
 PAYPAL_WEBHOOK_ID = os.getenv('PAYPAL_WEBHOOK_ID', '')
+# How process_webhook_events verifies webhook signatures: 'local' checks them
+# against PayPal's cached signing certificate, 'api' asks PayPal, 'none' skips
+PAYPAL_WEBHOOK_VERIFICATION = os.getenv('PAYPAL_WEBHOOK_VERIFICATION', 'local')
+
+# PayPal HTTP client: pooled keep-alive connections, timeouts in seconds,
+# retries for network errors and 429/5xx (writes carry PayPal-Request-Id)
+PAYPAL_POOL_SIZE = int(os.getenv('PAYPAL_POOL_SIZE', 10))
+PAYPAL_CONNECT_TIMEOUT = float(os.getenv('PAYPAL_CONNECT_TIMEOUT', 3.05))
+PAYPAL_READ_TIMEOUT = float(os.getenv('PAYPAL_READ_TIMEOUT', 20))
+PAYPAL_MAX_RETRIES = int(os.getenv('PAYPAL_MAX_RETRIES', 2))
+
+# ============== M-PESA CONFIGURATION ==============
+# Daraja (Lipa Na M-Pesa Online) credentials from: https://developer.safaricom.co.ke/
+
+MPESA_ENVIRONMENT = os.getenv('MPESA_ENVIRONMENT', 'sandbox')  # 'sandbox' or 'production'
+MPESA_CONSUMER_KEY = os.getenv('MPESA_CONSUMER_KEY', '')
+MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET', '')
+MPESA_SHORTCODE = os.getenv('MPESA_SHORTCODE', '')
+MPESA_PASSKEY = os.getenv('MPESA_PASSKEY', '')
+# Public HTTPS origin Safaricom posts STK callbacks to; the secret token is
+# part of the callback path because Daraja does not sign callbacks
+MPESA_CALLBACK_BASE_URL = os.getenv('MPESA_CALLBACK_BASE_URL', '')
+MPESA_CALLBACK_TOKEN = os.getenv('MPESA_CALLBACK_TOKEN', '')
+
+# M-Pesa HTTP client, as for PayPal; STK pushes themselves are never retried
+MPESA_POOL_SIZE = int(os.getenv('MPESA_POOL_SIZE', 10))
+MPESA_CONNECT_TIMEOUT = float(os.getenv('MPESA_CONNECT_TIMEOUT', 3.05))
+MPESA_READ_TIMEOUT = float(os.getenv('MPESA_READ_TIMEOUT', 20))
+MPESA_MAX_RETRIES = int(os.getenv('MPESA_MAX_RETRIES', 2))
+
+# Seconds a worker may serve its pricing catalog snapshot before rebuilding,
+# even without a version bump (see payments/catalog.py)
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', 60))
+
+# Hours a stored Idempotency-Key response is replayed to retries before
+# purge_idempotency_keys removes it (see payments/idempotency.py)
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
 
 # Frontend URL for payment redirects
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:5173')
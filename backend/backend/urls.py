@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from django.shortcuts import redirect
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
+from .metrics import metrics_view
 
 urlpatterns = [
     path('', lambda request: redirect('http://localhost:3000/', permanent=False)),
@@ -35,6 +36,7 @@ urlpatterns = [
     path('api/security/', include('security.urls')),
     path('api/payments/', include('payments.urls')),
     path('api/contact/', include('contact.urls')),
+    path('metrics', metrics_view, name='metrics'),
     
     # API Documentation
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
@@ -6,6 +6,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from .models import Event, EventRegistration
 from .serializers import EventSerializer, EventRegistrationSerializer, MessageSerializer, EventStatsSerializer
+from security.audit import audited
 
 # Create your views here.
 
@@ -24,6 +25,7 @@ class EventRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 class RegisterForEventView(APIView):
     permission_classes = [IsAuthenticated]
     serializer_class = MessageSerializer
+    @audited('registration', 'Registered for event {event_id}', target_model=Event, target_param='event_id')
     def post(self, request, event_id):
         user = request.user
         try:
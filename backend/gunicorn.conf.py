@@ -0,0 +1,18 @@
+"""
+Gunicorn settings, loaded automatically from the backend directory.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+
+def on_starting(server):
+    # Metric files from a previous run would otherwise be summed into this one
+    from backend.metrics import clear_metrics_dir
+    clear_metrics_dir()
+
+
+def child_exit(server, worker):
+    # Keep the worker's counters without leaving one file per worker ever started
+    from backend.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
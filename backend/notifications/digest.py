@@ -0,0 +1,168 @@
+"""
+Notification Digest Service
+Rolls queued notifications up into one email per user per period
+"""
+import logging
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import Notification, NotificationDigestItem
+from .preferences import get_preference_bits_bulk, wants_email
+
+logger = logging.getLogger(__name__)
+
+# Number of digest emails sent over a single SMTP session
+DIGEST_BATCH_SIZE = 500
+
+# Rows fetched per round trip while streaming pending items
+DIGEST_CHUNK_SIZE = 2000
+
+
+def pending_digest_items(frequency, cutoff):
+    """
+    All unsent digest items for a frequency, grouped by user.
+
+    Recipients and their notifications come back in a single query,
+    ordered so that each user's items are contiguous.
+    """
+    return NotificationDigestItem.objects.filter(
+        frequency=frequency,
+        sent_at__isnull=True,
+        created_at__lte=cutoff
+    ).select_related('user', 'notification').only(
+        'id', 'user', 'notification',
+        'user__username', 'user__first_name', 'user__email',
+        'notification__notification_type', 'notification__title', 'notification__message',
+        'notification__action_text', 'notification__action_url',
+        'notification__created_at'
+    ).order_by('user_id', 'id')
+
+
+def build_digest_message(user, notifications, frequency):
+    """Build the rolled-up email for one user"""
+    count = len(notifications)
+    subject = f"{settings.EMAIL_SUBJECT_PREFIX} Your {frequency} digest: {count} new notification{'s' if count != 1 else ''}"
+
+    entries = []
+    for notification in notifications:
+        entry = f"- {notification.title}\n  {notification.message}"
+        if notification.action_url:
+            entry += f"\n  {notification.action_text or 'View'}: {notification.action_url}"
+        entries.append(entry)
+
+    message = f"""
+Hello {user.first_name or user.username},
+
+Here is what happened since your last {frequency} digest:
+
+{chr(10).join(entries)}
+
+--
+Code2Deploy Team
+{settings.FRONTEND_URL}
+"""
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+
+
+def send_digests(frequency, batch_size=DIGEST_BATCH_SIZE, cutoff=None):
+    """
+    Send one digest email per user for all pending items of a frequency.
+
+    Emails are sent in batches that each reuse one SMTP connection, and
+    items are marked as sent per batch so an interrupted run can resume.
+    Preferences are checked again per batch, so items of a type the user
+    stopped accepting by email since they were queued are dropped.
+
+    Returns:
+        dict with counts of users, notifications, sent emails and failures
+    """
+    cutoff = cutoff or timezone.now()
+    stats = {
+        'users': 0,
+        'notifications': 0,
+        'emails_sent': 0,
+        'failed': 0,
+        'skipped': 0,
+        'smtp_sessions': 0,
+    }
+
+    batch = []
+    items = pending_digest_items(frequency, cutoff).iterator(chunk_size=DIGEST_CHUNK_SIZE)
+    for user_id, user_items in groupby(items, key=lambda item: item.user_id):
+        user_items = list(user_items)
+        stats['users'] += 1
+        stats['notifications'] += len(user_items)
+        batch.append(user_items)
+
+        if len(batch) >= batch_size:
+            _send_batch(_build_batch(batch, frequency), stats)
+            batch = []
+
+    if batch:
+        _send_batch(_build_batch(batch, frequency), stats)
+
+    return stats
+
+
+def _build_batch(batch, frequency):
+    """Digest messages for a batch of users' items, with one preference read"""
+    bits_by_user = get_preference_bits_bulk([user_items[0].user_id for user_items in batch])
+    built = []
+    for user_items in batch:
+        user = user_items[0].user
+        bits = bits_by_user[user.id]
+        notifications = [
+            item.notification for item in user_items
+            if wants_email(bits, item.notification.notification_type)
+        ]
+        message = build_digest_message(user, notifications, frequency) if user.email and notifications else None
+        built.append((
+            message,
+            [item.id for item in user_items],
+            [notification.id for notification in notifications]
+        ))
+    return built
+
+
+def _send_batch(batch, stats):
+    """Send a batch of digests over one connection and mark them as sent"""
+    sent_item_ids = []
+    sent_notification_ids = []
+
+    # Users without an email address or wanted items have nothing to send; drop their items
+    pending = []
+    for message, item_ids, notification_ids in batch:
+        if message is None:
+            stats['skipped'] += 1
+            sent_item_ids.extend(item_ids)
+        else:
+            pending.append((message, item_ids, notification_ids))
+
+    if pending:
+        delivered = 0
+        try:
+            with get_connection(fail_silently=False) as connection:
+                stats['smtp_sessions'] += 1
+                for message, item_ids, notification_ids in pending:
+                    try:
+                        connection.send_messages([message])
+                    except Exception as e:
+                        stats['failed'] += 1
+                        logger.error(f"Failed to send digest email to {message.to}: {str(e)}")
+                        continue
+                    stats['emails_sent'] += 1
+                    delivered += 1
+                    sent_item_ids.extend(item_ids)
+                    sent_notification_ids.extend(notification_ids)
+        except Exception as e:
+            stats['failed'] += len(pending) - delivered
+            logger.error(f"Failed to open email connection for digest batch: {str(e)}")
+
+    now = timezone.now()
+    if sent_item_ids:
+        NotificationDigestItem.objects.filter(id__in=sent_item_ids).update(sent_at=now)
+    if sent_notification_ids:
+        Notification.objects.filter(id__in=sent_notification_ids).update(sent_via_email=True)
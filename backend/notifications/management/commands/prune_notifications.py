@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from notifications.retention import prune_notifications, PRUNE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Delete notifications past their retention period, optionally archiving them first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PRUNE_BATCH_SIZE,
+                            help='Primary-key span deleted per statement')
+        parser.add_argument('--archive', type=str, default=None,
+                            help='Append pruned rows to this .jsonl.gz file before deleting')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count expired notifications')
+
+    def handle(self, *args, **options):
+        result = prune_notifications(
+            batch_size=options['batch_size'],
+            archive_path=options['archive'],
+            dry_run=options['dry_run'],
+            pause=options['pause']
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"{result['matched']} notifications would be pruned")
+            return
+
+        if options['archive']:
+            self.stdout.write(f"Archived {result['archived']} notifications to {options['archive']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Pruned {result['deleted']} notifications in {result['batches']} batches"
+        ))
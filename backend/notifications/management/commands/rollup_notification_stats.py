@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from notifications.stats import rollup_notification_stats, DEFAULT_ROLLUP_DAYS
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily notification counters used by the admin statistics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=DEFAULT_ROLLUP_DAYS,
+                            help='Number of full days to re-aggregate (use a large value to backfill)')
+
+    def handle(self, *args, **options):
+        written = rollup_notification_stats(days=options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {options['days']} days into {written} counter rows"
+        ))
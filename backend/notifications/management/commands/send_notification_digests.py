@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from notifications.digest import send_digests, DIGEST_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Send daily or weekly notification digest emails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frequency', type=str, choices=['daily', 'weekly'], required=True)
+        parser.add_argument('--batch-size', type=int, default=DIGEST_BATCH_SIZE,
+                            help='Number of emails sent per SMTP session')
+
+    def handle(self, *args, **options):
+        frequency = options['frequency']
+        stats = send_digests(frequency, batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {stats['emails_sent']} {frequency} digests covering "
+            f"{stats['notifications']} notifications for {stats['users']} users"
+        ))
+        self.stdout.write(f"SMTP sessions: {stats['smtp_sessions']}")
+        if stats['skipped']:
+            self.stdout.write(self.style.WARNING(f"Skipped {stats['skipped']} users without an email address"))
+        if stats['failed']:
+            self.stdout.write(self.style.ERROR(f"Failed to send {stats['failed']} digests"))
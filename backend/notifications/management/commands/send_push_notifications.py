@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from notifications.push import (
+    WebPushSender, PushConfigurationError, claim_notifications, deliver_notifications
+)
+
+
+class Command(BaseCommand):
+    help = 'Deliver new notifications as Web Push messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Notifications claimed per batch')
+        parser.add_argument('--workers', type=int, default=20,
+                            help='Parallel push requests (also the HTTP pool size)')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, polling every N seconds (0 runs once)')
+        parser.add_argument('--max-age-minutes', type=int, default=60,
+                            help='Mark notifications older than this as skipped instead of pushing them')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'PUSH_NOTIFICATIONS_ENABLED', False):
+            self.stdout.write(self.style.WARNING('Push notifications are disabled'))
+            return
+
+        try:
+            sender = WebPushSender(pool_size=options['workers'])
+        except PushConfigurationError as e:
+            raise CommandError(str(e))
+
+        max_age = timedelta(minutes=options['max_age_minutes'])
+        try:
+            while True:
+                while True:
+                    notifications = claim_notifications(batch_size=options['batch_size'], max_age=max_age)
+                    if not notifications:
+                        break
+                    result = deliver_notifications(notifications, sender, max_workers=options['workers'])
+                    self.stdout.write(
+                        f"Pushed {result['notifications']} notifications: {result['sent']} sent, "
+                        f"{result['failed']} failed, {result['pruned']} expired subscriptions removed"
+                    )
+
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sender.close()
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_notificationdigestitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('notification_type', models.CharField(choices=[('program_enrollment', 'Program Enrollment'), ('event_registration', 'Event Registration'), ('certificate_issued', 'Certificate Issued'), ('badge_awarded', 'Badge Awarded'), ('application_update', 'Application Update'), ('system_announcement', 'System Announcement'), ('mentor_message', 'Mentor Message'), ('reminder', 'Reminder')], max_length=50)),
+                ('priority', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('urgent', 'Urgent')], max_length=20)),
+                ('status', models.CharField(choices=[('unread', 'Unread'), ('read', 'Read'), ('archived', 'Archived')], max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-day'],
+                'unique_together': {('day', 'notification_type', 'priority', 'status')},
+            },
+        ),
+    ]
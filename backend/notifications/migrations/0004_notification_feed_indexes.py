@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('applications', '0001_initial'),
+        ('certificates', '0003_alter_badge_icon'),
+        ('events', '0005_alter_event_image'),
+        ('notifications', '0003_notificationstat'),
+        ('programs', '0009_enrollment_amount_paid_enrollment_payment_status_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notificatio_user_id_7088ed_idx',
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notif_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'status', '-created_at', '-id'], name='notif_user_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'notification_type', '-created_at', '-id'], name='notif_user_type_created_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_push_subscriptions'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='PushDispatchCursor',
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='push_lease_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # Existing notifications were already handled by the cursor-based worker
+        migrations.AddField(
+            model_name='notification',
+            name='push_state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('done', 'Done'), ('skipped', 'Skipped (too old)')], default='done', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='push_state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('done', 'Done'), ('skipped', 'Skipped (too old)')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('push_state__in', ['pending', 'sending'])), fields=['id'], name='notif_push_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:22
+
+from datetime import datetime, time
+
+from django.db import migrations, models
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def rebuild_notification_stats(apps, schema_editor):
+    """
+    Rebuild every daily counter from the current statuses, which become the
+    counted ones, so older days no longer hold statuses from past rollups
+    """
+    Notification = apps.get_model('notifications', 'Notification')
+    NotificationStat = apps.get_model('notifications', 'NotificationStat')
+
+    counted = Notification.objects.filter(
+        created_at__lt=timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    )
+    counted.update(counted_status=F('status'))
+    rows = counted.annotate(day=TruncDate('created_at')).values(
+        'day', 'notification_type', 'priority', 'counted_status'
+    ).annotate(total=Count('id')).order_by()
+
+    NotificationStat.objects.all().delete()
+    NotificationStat.objects.bulk_create([
+        NotificationStat(
+            day=row['day'],
+            notification_type=row['notification_type'],
+            priority=row['priority'],
+            status=row['counted_status'],
+            count=row['total']
+        ) for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0006_push_delivery_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='counted_status',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('status', models.F('counted_status')), _negated=True), fields=['created_at'], name='notif_stat_changed_idx'),
+        ),
+        migrations.RunPython(rebuild_notification_stats, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from backend.metrics import notifications_created
 
 
 class Notification(models.Model):
@@ -27,6 +28,13 @@ class Notification(models.Model):
         ('archived', 'Archived'),
     ]
     
+    PUSH_STATE_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('done', 'Done'),
+        ('skipped', 'Skipped (too old)'),
+    ]
+    
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
     notification_type = models.CharField(max_length=50, choices=NOTIFICATION_TYPES)
     title = models.CharField(max_length=200)
@@ -51,12 +59,36 @@ class Notification(models.Model):
     sent_via_email = models.BooleanField(default=False)
     sent_via_push = models.BooleanField(default=False)
     
+    # Push delivery queue (see notifications/push.py): a claimed row stays
+    # 'sending' until delivered, and is claimed again once its lease runs out
+    push_state = models.CharField(max_length=10, choices=PUSH_STATE_CHOICES, default='pending')
+    push_lease_until = models.DateTimeField(null=True, blank=True)
+    
+    # Status the daily NotificationStat counters hold for this row ('' until
+    # rolled up); differs from status after a change the counters have not seen.
+    # Only stats.py writes it, with conditional UPDATEs; other changes name
+    # their update_fields so a copy loaded before a rollup never writes it back
+    counted_status = models.CharField(max_length=20, blank=True, default='')
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['user', 'status']),
+            # Feed indexes match UserNotificationsView filters and keyset order
+            models.Index(fields=['user', '-created_at', '-id'], name='notif_user_created_idx'),
+            models.Index(fields=['user', 'status', '-created_at', '-id'], name='notif_user_status_created_idx'),
+            models.Index(fields=['user', 'notification_type', '-created_at', '-id'], name='notif_user_type_created_idx'),
             models.Index(fields=['notification_type']),
             models.Index(fields=['created_at']),
+            # Rows whose status changed since they were counted (see notifications/stats.py)
+            models.Index(
+                fields=['created_at'], name='notif_stat_changed_idx',
+                condition=~models.Q(status=models.F('counted_status'))
+            ),
+            # Only undelivered rows are indexed, so the push queue index stays small
+            models.Index(
+                fields=['id'], name='notif_push_queue_idx',
+                condition=models.Q(push_state__in=['pending', 'sending'])
+            ),
         ]
     
     def __str__(self):
@@ -68,12 +100,12 @@ class Notification(models.Model):
         if self.status == 'unread':
             self.status = 'read'
             self.read_at = timezone.now()
-            self.save()
+            self.save(update_fields=['status', 'read_at'])
     
     def mark_as_archived(self):
         """Mark notification as archived"""
         self.status = 'archived'
-        self.save()
+        self.save(update_fields=['status'])
     
     @classmethod
     def create_notification(cls, user, notification_type, title, message, **kwargs):
@@ -88,7 +120,12 @@ class Notification(models.Model):
     
     @classmethod
     def send_bulk_notification(cls, users, notification_type, title, message, **kwargs):
-        """Send notification to multiple users"""
+        """
+        Send notification to multiple users. bulk_create sends no post_save,
+        so emails go out here for the recipients whose preferences accept them.
+        """
+        from .signals import dispatch_bulk_emails
+
         notifications = []
         for user in users:
             notifications.append(cls(
@@ -98,11 +135,32 @@ class Notification(models.Model):
                 message=message,
                 **kwargs
             ))
-        return cls.objects.bulk_create(notifications)
+        created = cls.objects.bulk_create(notifications)
+        notifications_created.inc(len(created), type=notification_type, path='bulk')
+        dispatch_bulk_emails(created)
+        return created
 
 
 class NotificationPreference(models.Model):
     """User notification preferences"""
+    # Preference field consulted for each notification type
+    EMAIL_PREFERENCE_FIELDS = {
+        'program_enrollment': 'email_program_updates',
+        'event_registration': 'email_event_reminders',
+        'certificate_issued': 'email_certificate_issued',
+        'badge_awarded': 'email_badge_awarded',
+        'application_update': 'email_application_updates',
+        'system_announcement': 'email_system_announcements',
+    }
+    PUSH_PREFERENCE_FIELDS = {
+        'program_enrollment': 'push_program_updates',
+        'event_registration': 'push_event_reminders',
+        'certificate_issued': 'push_certificate_issued',
+        'badge_awarded': 'push_badge_awarded',
+        'application_update': 'push_application_updates',
+        'system_announcement': 'push_system_announcements',
+    }
+    
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notification_preferences')
     
     # Email preferences
@@ -142,24 +200,70 @@ class NotificationPreference(models.Model):
     
     def get_email_preference(self, notification_type):
         """Get email preference for specific notification type"""
-        preference_map = {
-            'program_enrollment': self.email_program_updates,
-            'event_registration': self.email_event_reminders,
-            'certificate_issued': self.email_certificate_issued,
-            'badge_awarded': self.email_badge_awarded,
-            'application_update': self.email_application_updates,
-            'system_announcement': self.email_system_announcements,
-        }
-        return preference_map.get(notification_type, self.email_enabled)
+        field = self.EMAIL_PREFERENCE_FIELDS.get(notification_type, 'email_enabled')
+        return getattr(self, field)
     
     def get_push_preference(self, notification_type):
         """Get push preference for specific notification type"""
-        preference_map = {
-            'program_enrollment': self.push_program_updates,
-            'event_registration': self.push_event_reminders,
-            'certificate_issued': self.push_certificate_issued,
-            'badge_awarded': self.push_badge_awarded,
-            'application_update': self.push_application_updates,
-            'system_announcement': self.push_system_announcements,
-        }
-        return preference_map.get(notification_type, self.push_enabled) 
\ No newline at end of file
+        field = self.PUSH_PREFERENCE_FIELDS.get(notification_type, 'push_enabled')
+        return getattr(self, field)
+
+
+class NotificationDigestItem(models.Model):
+    """Notification queued for a daily or weekly digest email"""
+    FREQUENCY_CHOICES = [
+        ('daily', 'Daily Digest'),
+        ('weekly', 'Weekly Digest'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notification_digest_items')
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='digest_items')
+    frequency = models.CharField(max_length=20, choices=FREQUENCY_CHOICES)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['frequency', 'sent_at', 'user']),
+        ]
+    
+    def __str__(self):
+        return f"{self.frequency} digest item for {self.user.username}"
+
+
+class NotificationStat(models.Model):
+    """Daily notification counts rolled up for admin statistics"""
+    day = models.DateField()
+    notification_type = models.CharField(max_length=50, choices=Notification.NOTIFICATION_TYPES)
+    priority = models.CharField(max_length=20, choices=Notification.PRIORITY_CHOICES)
+    status = models.CharField(max_length=20, choices=Notification.STATUS_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-day']
+        unique_together = ['day', 'notification_type', 'priority', 'status']
+    
+    def __str__(self):
+        return f"{self.day} {self.notification_type}/{self.priority}/{self.status}: {self.count}"
+
+
+class PushSubscription(models.Model):
+    """Browser Web Push subscription for a user"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='push_subscriptions')
+    endpoint = models.URLField(max_length=1000, unique=True)
+    p256dh = models.CharField(max_length=200)  # Browser public key (base64url)
+    auth = models.CharField(max_length=100)  # Browser auth secret (base64url)
+    user_agent = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Push subscription - {self.user.username}"
@@ -0,0 +1,152 @@
+"""
+Notification Preference Cache
+Packs each user's email and push preferences into a single integer so
+dispatch can filter recipients with bit operations instead of queries
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import NotificationPreference
+
+CACHE_KEY_PREFIX = 'notification_prefs'
+
+# Boolean preference fields, one bit each in field order
+BIT_FIELDS = [
+    'email_enabled',
+    'email_program_updates',
+    'email_event_reminders',
+    'email_certificate_issued',
+    'email_badge_awarded',
+    'email_application_updates',
+    'email_system_announcements',
+    'push_enabled',
+    'push_program_updates',
+    'push_event_reminders',
+    'push_certificate_issued',
+    'push_badge_awarded',
+    'push_application_updates',
+    'push_system_announcements',
+]
+FIELD_BITS = {field: 1 << index for index, field in enumerate(BIT_FIELDS)}
+
+# Digest frequency is stored in the two bits above the boolean fields
+DIGEST_FREQUENCIES = ['immediate', 'daily', 'weekly']
+DIGEST_SHIFT = len(BIT_FIELDS)
+DIGEST_MASK = 0b11 << DIGEST_SHIFT
+
+EMAIL_TYPE_BITS = {
+    notification_type: FIELD_BITS[field]
+    for notification_type, field in NotificationPreference.EMAIL_PREFERENCE_FIELDS.items()
+}
+PUSH_TYPE_BITS = {
+    notification_type: FIELD_BITS[field]
+    for notification_type, field in NotificationPreference.PUSH_PREFERENCE_FIELDS.items()
+}
+
+# Users without a preference row get the model defaults
+DEFAULT_BITS = sum(
+    bit for field, bit in FIELD_BITS.items()
+    if NotificationPreference._meta.get_field(field).default
+)
+
+
+def cache_key(user_id):
+    return f'{CACHE_KEY_PREFIX}:{user_id}'
+
+
+def encode_preferences(values):
+    """
+    Encode preference values into a bitset.
+
+    Args:
+        values: NotificationPreference instance or dict keyed by field name
+    """
+    if isinstance(values, NotificationPreference):
+        values = {field: getattr(values, field) for field in BIT_FIELDS + ['digest_frequency']}
+
+    bits = 0
+    for field, bit in FIELD_BITS.items():
+        if values[field]:
+            bits |= bit
+    frequency = values.get('digest_frequency', 'immediate')
+    if frequency in DIGEST_FREQUENCIES:
+        bits |= DIGEST_FREQUENCIES.index(frequency) << DIGEST_SHIFT
+    return bits
+
+
+def get_preference_bits(user_id):
+    """Get the preference bitset for a single user"""
+    return get_preference_bits_bulk([user_id])[user_id]
+
+
+def get_preference_bits_bulk(user_ids):
+    """
+    Get preference bitsets for a batch of users.
+
+    Cached entries are read in one round trip and all misses are loaded
+    with a single query.
+
+    Returns:
+        dict of {user_id: bits}
+    """
+    user_ids = list(set(user_ids))
+    cached = cache.get_many([cache_key(user_id) for user_id in user_ids])
+
+    result = {}
+    missing = []
+    for user_id in user_ids:
+        bits = cached.get(cache_key(user_id))
+        if bits is None:
+            missing.append(user_id)
+        else:
+            result[user_id] = bits
+
+    if missing:
+        loaded = {user_id: DEFAULT_BITS for user_id in missing}
+        rows = NotificationPreference.objects.filter(user_id__in=missing).values(
+            'user_id', 'digest_frequency', *BIT_FIELDS
+        )
+        for row in rows:
+            loaded[row['user_id']] = encode_preferences(row)
+        cache.set_many(
+            {cache_key(user_id): bits for user_id, bits in loaded.items()},
+            getattr(settings, 'NOTIFICATION_PREFERENCE_CACHE_TIMEOUT', 300)
+        )
+        result.update(loaded)
+
+    return result
+
+
+def invalidate_preference_bits(user_id):
+    cache.delete(cache_key(user_id))
+
+
+def wants_email(bits, notification_type):
+    """Email preference for a notification type, same rules as the model"""
+    return bool(bits & EMAIL_TYPE_BITS.get(notification_type, FIELD_BITS['email_enabled']))
+
+
+def wants_push(bits, notification_type):
+    """Push preference for a notification type, same rules as the model"""
+    return bool(bits & PUSH_TYPE_BITS.get(notification_type, FIELD_BITS['push_enabled']))
+
+
+def digest_frequency(bits):
+    return DIGEST_FREQUENCIES[(bits & DIGEST_MASK) >> DIGEST_SHIFT]
+
+
+def filter_recipients(user_ids, notification_type, channel='email'):
+    """
+    Return the users among user_ids that accept a notification type on a channel.
+
+    Args:
+        user_ids: Iterable of user IDs
+        notification_type: Notification type key
+        channel: 'email' or 'push'
+
+    Returns:
+        dict of {user_id: bits} for the accepting users
+    """
+    check = wants_email if channel == 'email' else wants_push
+    bits_by_user = get_preference_bits_bulk(user_ids)
+    return {user_id: bits for user_id, bits in bits_by_user.items() if check(bits, notification_type)}
@@ -0,0 +1,314 @@
+"""
+Web Push Delivery
+VAPID-signed, aes128gcm-encrypted Web Push (RFC 8291/8292) over a pooled
+HTTP session, with batched parallel delivery for the push worker
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlparse
+
+import jwt
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from backend.metrics import push_messages
+
+from .models import Notification, PushSubscription
+from .preferences import get_preference_bits_bulk, wants_push
+
+logger = logging.getLogger(__name__)
+
+# Push services answer these when a subscription no longer exists
+EXPIRED_STATUS_CODES = (404, 410)
+
+DEFAULT_TTL = 60 * 60 * 24
+RECORD_SIZE = 4096
+VAPID_TOKEN_LIFETIME = 12 * 60 * 60
+
+# A claimed batch is handed to another worker if not delivered within this
+PUSH_CLAIM_LEASE = timedelta(minutes=5)
+
+URGENCY_BY_PRIORITY = {
+    'low': 'low',
+    'medium': 'normal',
+    'high': 'high',
+    'urgent': 'high',
+}
+
+
+class PushConfigurationError(Exception):
+    pass
+
+
+def b64url_decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def b64url_encode(value):
+    return base64.urlsafe_b64encode(value).rstrip(b'=').decode()
+
+
+def _hkdf(salt, ikm, info, length):
+    """Single-block HKDF-SHA256 (all Web Push outputs are <= 32 bytes)"""
+    prk = hmac.new(salt, ikm, hashlib.sha256).digest()
+    return hmac.new(prk, info + b'\x01', hashlib.sha256).digest()[:length]
+
+
+def encrypt_payload(payload, p256dh, auth):
+    """
+    Encrypt a payload for a subscription using aes128gcm (RFC 8291).
+
+    Args:
+        payload: bytes to deliver
+        p256dh: Browser public key (base64url, uncompressed point)
+        auth: Browser auth secret (base64url)
+
+    Returns:
+        bytes body including the aes128gcm header
+    """
+    ua_public = b64url_decode(p256dh)
+    auth_secret = b64url_decode(auth)
+
+    ua_key = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), ua_public)
+    server_key = ec.generate_private_key(ec.SECP256R1())
+    server_public = server_key.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    shared_secret = server_key.exchange(ec.ECDH(), ua_key)
+
+    ikm = _hkdf(auth_secret, shared_secret, b'WebPush: info\x00' + ua_public + server_public, 32)
+    salt = os.urandom(16)
+    cek = _hkdf(salt, ikm, b'Content-Encoding: aes128gcm\x00', 16)
+    nonce = _hkdf(salt, ikm, b'Content-Encoding: nonce\x00', 12)
+
+    # Single record: payload followed by the last-record delimiter
+    ciphertext = AESGCM(cek).encrypt(nonce, payload + b'\x02', None)
+    header = salt + struct.pack('!L', RECORD_SIZE) + bytes([len(server_public)]) + server_public
+    return header + ciphertext
+
+
+def load_vapid_key(value):
+    """Load a VAPID private key from PEM or a base64url raw scalar"""
+    if not value:
+        raise PushConfigurationError('VAPID_PRIVATE_KEY is not configured')
+    if value.strip().startswith('-----BEGIN'):
+        return serialization.load_pem_private_key(value.encode(), password=None)
+    return ec.derive_private_key(int.from_bytes(b64url_decode(value.strip()), 'big'), ec.SECP256R1())
+
+
+class WebPushSender:
+    """Sends Web Push messages over a shared, bounded connection pool"""
+
+    def __init__(self, private_key=None, subject=None, pool_size=20, timeout=(3.05, 10)):
+        self.private_key = load_vapid_key(private_key or getattr(settings, 'VAPID_PRIVATE_KEY', ''))
+        self.subject = subject or getattr(settings, 'VAPID_SUBJECT', 'mailto:support@code2deploy.tech')
+        self.public_key = b64url_encode(self.private_key.public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+        ))
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # VAPID tokens are valid per push service origin; sign each once
+        self._tokens = {}
+        self._tokens_lock = threading.Lock()
+
+    def _vapid_header(self, endpoint):
+        parsed = urlparse(endpoint)
+        audience = f'{parsed.scheme}://{parsed.netloc}'
+        now = int(time.time())
+        with self._tokens_lock:
+            token, expires = self._tokens.get(audience, (None, 0))
+            if expires - now < 60 * 60:
+                expires = now + VAPID_TOKEN_LIFETIME
+                token = jwt.encode(
+                    {'aud': audience, 'exp': expires, 'sub': self.subject},
+                    self.private_key,
+                    algorithm='ES256'
+                )
+                self._tokens[audience] = (token, expires)
+        return f'vapid t={token}, k={self.public_key}'
+
+    def send(self, subscription, payload, ttl=DEFAULT_TTL, urgency='normal'):
+        """
+        Send one encrypted message.
+
+        Args:
+            subscription: dict or PushSubscription with endpoint, p256dh and auth
+            payload: dict serialized to JSON
+
+        Returns:
+            HTTP status code from the push service
+        """
+        if isinstance(subscription, PushSubscription):
+            subscription = {
+                'endpoint': subscription.endpoint,
+                'p256dh': subscription.p256dh,
+                'auth': subscription.auth,
+            }
+        body = encrypt_payload(
+            json.dumps(payload).encode(), subscription['p256dh'], subscription['auth']
+        )
+        response = self.session.post(
+            subscription['endpoint'],
+            data=body,
+            headers={
+                'Authorization': self._vapid_header(subscription['endpoint']),
+                'Content-Encoding': 'aes128gcm',
+                'Content-Type': 'application/octet-stream',
+                'TTL': str(ttl),
+                'Urgency': urgency,
+            },
+            timeout=self.timeout
+        )
+        return response.status_code
+
+    def close(self):
+        self.session.close()
+
+
+def build_payload(notification):
+    return {
+        'id': notification.id,
+        'type': notification.notification_type,
+        'title': notification.title,
+        'body': notification.message,
+        'url': notification.action_url,
+        'action_text': notification.action_text,
+    }
+
+
+def deliver_notifications(notifications, sender, max_workers=20):
+    """
+    Push a batch of notifications to every subscription of their users.
+
+    Recipients are filtered with cached preference bits, subscriptions are
+    loaded in one query, and messages are sent in parallel. Subscriptions the
+    push service reports as gone are deleted, and the whole batch is marked
+    done once sending is over.
+
+    Returns:
+        dict with counts of sent, failed and pruned deliveries
+    """
+    result = {'sent': 0, 'failed': 0, 'pruned': 0, 'notifications': 0}
+    if not notifications:
+        return result
+    claimed = [notification.id for notification in notifications]
+
+    bits = get_preference_bits_bulk([notification.user_id for notification in notifications])
+    notifications = [
+        notification for notification in notifications
+        if wants_push(bits[notification.user_id], notification.notification_type)
+    ]
+
+    subscriptions = defaultdict(list)
+    rows = PushSubscription.objects.filter(
+        user_id__in={notification.user_id for notification in notifications}
+    ).values('id', 'user_id', 'endpoint', 'p256dh', 'auth')
+    for row in rows:
+        subscriptions[row['user_id']].append(row)
+
+    tasks = [
+        (notification, subscription)
+        for notification in notifications
+        for subscription in subscriptions.get(notification.user_id, [])
+    ]
+
+    def _send(task):
+        notification, subscription = task
+        try:
+            return sender.send(
+                subscription,
+                build_payload(notification),
+                urgency=URGENCY_BY_PRIORITY.get(notification.priority, 'normal')
+            )
+        except Exception as e:
+            logger.error(f"Push delivery to subscription {subscription['id']} failed: {str(e)}")
+            return None
+
+    delivered = set()
+    succeeded = set()
+    expired = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for (notification, subscription), status_code in zip(tasks, executor.map(_send, tasks)):
+            if status_code is not None and 200 <= status_code < 300:
+                result['sent'] += 1
+                delivered.add(notification.id)
+                succeeded.add(subscription['id'])
+            elif status_code in EXPIRED_STATUS_CODES:
+                expired.add(subscription['id'])
+            else:
+                result['failed'] += 1
+
+    for outcome in ('sent', 'failed'):
+        if result[outcome]:
+            push_messages.inc(result[outcome], result=outcome)
+    if expired:
+        push_messages.inc(len(expired), result='expired')
+
+    if delivered:
+        Notification.objects.filter(id__in=delivered).update(sent_via_push=True)
+    if succeeded:
+        PushSubscription.objects.filter(id__in=succeeded).update(last_success_at=timezone.now())
+    if expired:
+        result['pruned'], _ = PushSubscription.objects.filter(id__in=expired).delete()
+    result['notifications'] = len(delivered)
+    Notification.objects.filter(id__in=claimed, push_state='sending').update(
+        push_state='done', push_lease_until=None
+    )
+    return result
+
+
+def claim_notifications(batch_size=500, max_age=None, lease=PUSH_CLAIM_LEASE):
+    """
+    Claim the next batch of undelivered notifications for push delivery.
+
+    Each row carries its own push state, so rows committed out of id order
+    are still picked up. Rows are locked with SKIP LOCKED and leased to the
+    caller as 'sending'; deliver_notifications marks them done, and a batch
+    whose worker died is claimed again once the lease runs out.
+
+    Notifications older than max_age are marked skipped rather than pushed.
+    """
+    now = timezone.now()
+    queue = Notification.objects.filter(
+        Q(push_state='pending') | Q(push_state='sending', push_lease_until__lt=now)
+    )
+
+    if max_age is not None:
+        skipped = queue.filter(created_at__lt=now - max_age).update(push_state='skipped', push_lease_until=None)
+        if skipped:
+            logger.warning(f"Skipped push delivery of {skipped} notifications older than {max_age}")
+
+    with transaction.atomic():
+        notifications = list(
+            queue.select_for_update(skip_locked=True).order_by('id').only(
+                'id', 'user_id', 'notification_type', 'title', 'message',
+                'priority', 'action_url', 'action_text', 'created_at'
+            )[:batch_size]
+        )
+        if notifications:
+            Notification.objects.filter(id__in=[notification.id for notification in notifications]).update(
+                push_state='sending', push_lease_until=now + lease
+            )
+    return notifications
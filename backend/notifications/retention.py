@@ -0,0 +1,145 @@
+"""
+Notification Retention
+Deletes expired notifications in primary-key windows, optionally
+archiving them to compressed JSONL first
+"""
+import gzip
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from .models import Notification
+from .stats import subtract_notification_stats
+
+logger = logging.getLogger(__name__)
+
+# Days to keep notifications, by status and by type. A notification is
+# pruned once it is older than the shortest TTL that applies to it.
+# settings.NOTIFICATION_RETENTION overrides individual entries.
+DEFAULT_RETENTION = {
+    'status': {
+        'unread': 365,
+        'read': 90,
+        'archived': 30,
+    },
+    'type': {
+        'reminder': 30,
+    },
+}
+
+# Primary-key span deleted per statement
+PRUNE_BATCH_SIZE = 5000
+
+ARCHIVE_FIELDS = [
+    'id', 'user_id', 'notification_type', 'title', 'message', 'priority', 'status',
+    'program_id', 'event_id', 'certificate_id', 'badge_id', 'application_id',
+    'action_url', 'action_text', 'created_at', 'read_at', 'sent_via_email', 'sent_via_push',
+]
+
+
+def get_retention_policy():
+    policy = getattr(settings, 'NOTIFICATION_RETENTION', None) or {}
+    return {
+        'status': {**DEFAULT_RETENTION['status'], **policy.get('status', {})},
+        'type': {**DEFAULT_RETENTION['type'], **policy.get('type', {})},
+    }
+
+
+def expired_filter(now=None, policy=None):
+    """
+    Build the filter matching expired notifications.
+
+    Returns:
+        tuple of (Q filter, newest cutoff) or (None, None) if nothing expires
+    """
+    now = now or timezone.now()
+    policy = policy or get_retention_policy()
+
+    condition = Q()
+    cutoffs = []
+    for field, rules in (('status', policy['status']), ('notification_type', policy['type'])):
+        for value, days in rules.items():
+            if days is None:
+                continue
+            cutoff = now - timedelta(days=days)
+            cutoffs.append(cutoff)
+            condition |= Q(**{field: value, 'created_at__lt': cutoff})
+
+    if not cutoffs:
+        return None, None
+    return condition, max(cutoffs)
+
+
+def prune_notifications(batch_size=PRUNE_BATCH_SIZE, archive_path=None, dry_run=False, pause=0, now=None):
+    """
+    Delete expired notifications in primary-key windows.
+
+    Every window is its own short transaction, so no statement holds locks
+    on more than `batch_size` ids. Daily statistics counters are decremented
+    for the deleted rows.
+
+    Args:
+        batch_size: Width of each primary-key window
+        archive_path: Optional .jsonl.gz file expired rows are appended to
+        dry_run: Only count expired rows
+        pause: Seconds to sleep between windows
+
+    Returns:
+        dict with counts of matched, archived and deleted notifications
+    """
+    result = {'matched': 0, 'archived': 0, 'deleted': 0, 'batches': 0}
+
+    condition, newest_cutoff = expired_filter(now=now)
+    if condition is None:
+        return result
+
+    bounds = Notification.objects.filter(created_at__lt=newest_cutoff).aggregate(
+        low=Min('id'), high=Max('id')
+    )
+    if bounds['low'] is None:
+        return result
+
+    archive = gzip.open(archive_path, 'at', encoding='utf-8') if archive_path and not dry_run else None
+    try:
+        start = bounds['low']
+        while start <= bounds['high']:
+            end = start + batch_size
+            window = Notification.objects.filter(id__gte=start, id__lt=end).filter(condition)
+            start = end
+
+            if dry_run:
+                result['matched'] += window.count()
+                continue
+
+            if archive:
+                rows = list(window.values(*ARCHIVE_FIELDS))
+                if not rows:
+                    continue
+                for row in rows:
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                result['archived'] += len(rows)
+                window = Notification.objects.filter(id__in=[row['id'] for row in rows])
+
+            with transaction.atomic():
+                subtract_notification_stats(window)
+                _, per_model = window.delete()
+            deleted = per_model.get(Notification._meta.label, 0)
+            result['matched'] += deleted
+            result['deleted'] += deleted
+            result['batches'] += 1
+
+            if pause:
+                time.sleep(pause)
+    finally:
+        if archive:
+            archive.close()
+
+    logger.info(f"Pruned {result['deleted']} notifications in {result['batches']} batches")
+    return result
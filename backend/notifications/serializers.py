@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Notification, NotificationPreference
+from .models import Notification, NotificationPreference, PushSubscription
 from programs.serializers import ProgramSerializer
 from events.serializers import EventSerializer
 from certificates.serializers import CertificateSerializer, BadgeSerializer
@@ -47,6 +47,15 @@ class NotificationPreferenceSerializer(serializers.ModelSerializer):
         ]
 
 
+class PushSubscriptionSerializer(serializers.ModelSerializer):
+    """Browser PushSubscription, flattened from its JSON keys"""
+    class Meta:
+        model = PushSubscription
+        fields = ['id', 'endpoint', 'p256dh', 'auth', 'user_agent', 'created_at']
+        read_only_fields = ['id', 'created_at']
+        extra_kwargs = {'endpoint': {'validators': []}}
+
+
 class NotificationStatsSerializer(serializers.Serializer):
     """Serializer for notification statistics"""
     total_notifications = serializers.IntegerField()
@@ -1,10 +1,14 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
-from .models import Notification, NotificationPreference
+from .models import Notification, NotificationPreference, NotificationDigestItem
+from .preferences import (
+    get_preference_bits, invalidate_preference_bits, wants_email, digest_frequency, filter_recipients
+)
 import threading
 import logging
+from backend.metrics import notifications_created
 
 logger = logging.getLogger(__name__)
 
@@ -16,39 +20,84 @@ def send_notification_email(sender, instance, created, **kwargs):
     """
     if not created:
         return
+
+    notifications_created.inc(type=instance.notification_type, path='single')
+    
+    bits = get_preference_bits(instance.user_id)
         
     # Check if we should send email
-    if not should_send_email(instance):
+    if not should_send_email(instance, bits):
+        return
+    
+    # Queue for the user's digest instead of emailing right away
+    frequency = digest_frequency(bits)
+    if frequency != 'immediate':
+        NotificationDigestItem.objects.create(
+            user=instance.user,
+            notification=instance,
+            frequency=frequency
+        )
         return
         
     # Send email asynchronously
     send_email_async(instance)
 
-def should_send_email(notification):
+@receiver(post_save, sender=NotificationPreference)
+@receiver(post_delete, sender=NotificationPreference)
+def clear_preference_cache(sender, instance, **kwargs):
+    """Drop the cached preference bits when a user's preferences change"""
+    invalidate_preference_bits(instance.user_id)
+
+def should_send_email(notification, bits=None):
     """Check user preferences for email notifications"""
-    user = notification.user
-    
     # Check global setting
     if not getattr(settings, 'EMAIL_NOTIFICATIONS_ENABLED', True):
         return False
         
-    # Check user preferences
-    try:
-        prefs = user.notification_preferences
-        return prefs.get_email_preference(notification.notification_type)
-    except NotificationPreference.DoesNotExist:
-        # Default to True if no preferences exist
-        # Or create default preferences
-        NotificationPreference.objects.create(user=user)
-        return True
+    # Check user preferences (cached; defaults apply when no row exists)
+    if bits is None:
+        bits = get_preference_bits(notification.user_id)
+    return wants_email(bits, notification.notification_type)
 
-def send_email_async(notification):
-    """Send email in a background thread"""
-    def _send():
-        try:
-            subject = f"{settings.EMAIL_SUBJECT_PREFIX} {notification.title}"
-            # Simple text message for now, can be HTML template later
-            message = f"""
+def dispatch_bulk_emails(notifications):
+    """
+    Email side of notifications created with bulk_create: one preference read
+    for all recipients, then the same digest or immediate split as
+    send_notification_email
+    """
+    if not notifications or not getattr(settings, 'EMAIL_NOTIFICATIONS_ENABLED', True):
+        return
+
+    accepted = {}
+    for notification_type in {notification.notification_type for notification in notifications}:
+        user_ids = [
+            notification.user_id for notification in notifications
+            if notification.notification_type == notification_type
+        ]
+        accepted[notification_type] = filter_recipients(user_ids, notification_type)
+
+    digest_items, immediate = [], []
+    for notification in notifications:
+        bits = accepted[notification.notification_type].get(notification.user_id)
+        if bits is None:
+            continue
+        frequency = digest_frequency(bits)
+        if frequency != 'immediate':
+            digest_items.append(NotificationDigestItem(
+                user_id=notification.user_id, notification=notification, frequency=frequency
+            ))
+        else:
+            immediate.append(notification)
+
+    if digest_items:
+        NotificationDigestItem.objects.bulk_create(digest_items)
+    if immediate:
+        send_emails_async(immediate)
+
+def build_notification_email(notification):
+    subject = f"{settings.EMAIL_SUBJECT_PREFIX} {notification.title}"
+    # Simple text message for now, can be HTML template later
+    message = f"""
 Hello {notification.user.first_name or notification.user.username},
 
 {notification.message}
@@ -59,14 +108,38 @@ Hello {notification.user.first_name or notification.user.username},
 Code2Deploy Team
 {settings.FRONTEND_URL}
 """
-            
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [notification.user.email],
-                fail_silently=False,
-            )
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [notification.user.email])
+
+def send_emails_async(notifications):
+    """Send the emails of many notifications in one background thread over one connection"""
+    def _send():
+        sent = []
+        try:
+            with get_connection(fail_silently=False) as connection:
+                for notification in notifications:
+                    if not notification.user.email:
+                        continue
+                    try:
+                        connection.send_messages([build_notification_email(notification)])
+                    except Exception as e:
+                        logger.error(f"Failed to send notification email to {notification.user.email}: {str(e)}")
+                        continue
+                    sent.append(notification.id)
+        except Exception as e:
+            logger.error(f"Failed to open email connection for bulk notifications: {str(e)}")
+        if sent:
+            Notification.objects.filter(id__in=sent).update(sent_via_email=True)
+        logger.info(f"Sent {len(sent)} of {len(notifications)} bulk notification emails")
+
+    thread = threading.Thread(target=_send)
+    thread.daemon = True
+    thread.start()
+
+def send_email_async(notification):
+    """Send email in a background thread"""
+    def _send():
+        try:
+            build_notification_email(notification).send(fail_silently=False)
             
             # Update status
             notification.sent_via_email = True
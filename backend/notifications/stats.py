@@ -0,0 +1,171 @@
+"""
+Notification Statistics Rollups
+Daily counters per type, priority and status so admin statistics do not
+aggregate the whole notifications table
+
+Each notification records the status its day's counters hold for it
+(counted_status). Recent days are rebuilt outright; older notifications
+whose status changed since they were counted are moved between counters,
+and pruning subtracts rows under the status they were counted with.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Notification, NotificationStat
+
+# Days re-aggregated on each rollup so late status changes are picked up
+DEFAULT_ROLLUP_DAYS = 7
+
+STAT_FIELDS = ('notification_type', 'priority', 'status')
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _counted_rows(queryset):
+    return queryset.annotate(day=TruncDate('created_at')).values(
+        'day', 'notification_type', 'priority', 'counted_status'
+    ).annotate(total=Count('id')).order_by()
+
+
+def _add_to_stat(day, notification_type, priority, status, amount):
+    key = {'day': day, 'notification_type': notification_type, 'priority': priority, 'status': status}
+    if amount < 0:
+        NotificationStat.objects.filter(count__gte=-amount, **key).update(count=F('count') + amount)
+    elif not NotificationStat.objects.filter(**key).update(count=F('count') + amount):
+        NotificationStat.objects.create(count=amount, **key)
+
+
+def rollup_notification_stats(days=DEFAULT_ROLLUP_DAYS, today=None):
+    """
+    Rebuild the daily counters for the last `days` full days, and move
+    older notifications whose status has changed since they were counted.
+
+    Each day in the range is replaced from a single GROUP BY over the
+    created_at index range. Today is never materialized; it is counted live.
+
+    Returns:
+        number of counter rows written
+    """
+    today = today or timezone.localdate()
+    first_day = today - timedelta(days=days)
+
+    recent = Notification.objects.filter(
+        created_at__gte=start_of_day(first_day),
+        created_at__lt=start_of_day(today)
+    )
+    changed = Notification.objects.filter(created_at__lt=start_of_day(first_day)).exclude(
+        counted_status=F('status')
+    )
+    moves = list(changed.annotate(day=TruncDate('created_at')).values(
+        'day', 'notification_type', 'priority', 'counted_status', 'status'
+    ).annotate(total=Count('id')).order_by())
+
+    with transaction.atomic():
+        # Counters are built from counted_status, so a status changed after
+        # this UPDATE is still seen as a change by the next rollup
+        recent.exclude(counted_status=F('status')).update(counted_status=F('status'))
+        stats = [
+            NotificationStat(
+                day=row['day'],
+                notification_type=row['notification_type'],
+                priority=row['priority'],
+                status=row['counted_status'],
+                count=row['total']
+            ) for row in _counted_rows(recent)
+        ]
+        NotificationStat.objects.filter(day__gte=first_day, day__lt=today).delete()
+        NotificationStat.objects.bulk_create(stats)
+
+        for row in moves:
+            # Claim the rows still in this state and move exactly those
+            moved = changed.filter(
+                created_at__gte=start_of_day(row['day']),
+                created_at__lt=start_of_day(row['day'] + timedelta(days=1)),
+                notification_type=row['notification_type'],
+                priority=row['priority'],
+                counted_status=row['counted_status'],
+                status=row['status']
+            ).update(counted_status=row['status'])
+            if not moved:
+                continue
+            if row['counted_status']:
+                _add_to_stat(row['day'], row['notification_type'], row['priority'], row['counted_status'], -moved)
+            _add_to_stat(row['day'], row['notification_type'], row['priority'], row['status'], moved)
+
+    return len(stats)
+
+
+def subtract_notification_stats(queryset):
+    """Decrement counters for notifications about to be deleted, by the status they were counted under"""
+    for row in _counted_rows(queryset.exclude(counted_status='')):
+        _add_to_stat(row['day'], row['notification_type'], row['priority'], row['counted_status'], -row['total'])
+
+
+def notification_stats(now=None):
+    """
+    System-wide notification statistics for the admin dashboard.
+
+    Full days come from the rolled-up counters and today is counted live
+    over the created_at index, so the cost does not grow with table size.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    today_start = start_of_day(today)
+
+    totals = {}
+
+    def add(key, count):
+        totals[key] = totals.get(key, 0) + count
+
+    rolled_up = NotificationStat.objects.filter(day__lt=today).values(*STAT_FIELDS).annotate(
+        total=Sum('count')
+    ).order_by()
+    live = Notification.objects.filter(created_at__gte=today_start).values(*STAT_FIELDS).annotate(
+        total=Count('id')
+    ).order_by()
+    today_count = 0
+    for source in (rolled_up, live):
+        for row in source:
+            add(('type', row['notification_type']), row['total'])
+            add(('priority', row['priority']), row['total'])
+            add(('status', row['status']), row['total'])
+            if source is live:
+                today_count += row['total']
+
+    daily = dict(
+        NotificationStat.objects.filter(
+            day__gte=today - timedelta(days=29), day__lt=today
+        ).values('day').annotate(total=Sum('count')).order_by().values_list('day', 'total')
+    )
+
+    def last_days(days):
+        first_day = today - timedelta(days=days - 1)
+        return today_count + sum(total for day, total in daily.items() if day >= first_day)
+
+    status_counts = {status: totals.get(('status', status), 0) for status, _ in Notification.STATUS_CHOICES}
+
+    return {
+        'total_notifications': sum(status_counts.values()),
+        'unread_count': status_counts['unread'],
+        'read_count': status_counts['read'],
+        'archived_count': status_counts['archived'],
+        'by_type': {
+            notification_type: totals.get(('type', notification_type), 0)
+            for notification_type, _ in Notification.NOTIFICATION_TYPES
+        },
+        'by_priority': {
+            priority: totals.get(('priority', priority), 0)
+            for priority, _ in Notification.PRIORITY_CHOICES
+        },
+        'recent_activity': {
+            'last_24_hours': Notification.objects.filter(created_at__gte=now - timedelta(days=1)).count(),
+            'last_7_days': last_days(7),
+            'last_30_days': last_days(30),
+        }
+    }
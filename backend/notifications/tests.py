@@ -0,0 +1,505 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.core import mail
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase
+from rest_framework import status
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .models import (
+    Notification, NotificationPreference, NotificationDigestItem, NotificationStat,
+    PushSubscription
+)
+from .push import WebPushSender, claim_notifications, deliver_notifications, b64url_encode, _hkdf
+from .digest import send_digests
+from .retention import prune_notifications
+from .stats import rollup_notification_stats, notification_stats
+from .preferences import (
+    get_preference_bits, get_preference_bits_bulk, filter_recipients,
+    wants_email, wants_push, digest_frequency, DEFAULT_BITS
+)
+
+User = get_user_model()
+
+
+class NotificationDigestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = []
+        for i in range(3):
+            user = User.objects.create_user(
+                username=f'digestuser{i}',
+                email=f'digest{i}@example.com',
+                password='testpass123'
+            )
+            NotificationPreference.objects.create(user=user, digest_frequency='daily')
+            self.users.append(user)
+
+    def _notify(self, user, title):
+        return Notification.create_notification(
+            user=user,
+            notification_type='system_announcement',
+            title=title,
+            message=f'{title} message'
+        )
+
+    def test_non_immediate_notifications_are_queued(self):
+        notification = self._notify(self.users[0], 'Queued')
+        item = NotificationDigestItem.objects.get(notification=notification)
+        self.assertEqual(item.frequency, 'daily')
+        self.assertIsNone(item.sent_at)
+
+    def test_one_email_per_user(self):
+        for user in self.users:
+            self._notify(user, 'First')
+            self._notify(user, 'Second')
+
+        stats = send_digests('daily')
+
+        self.assertEqual(stats['emails_sent'], 3)
+        self.assertEqual(stats['notifications'], 6)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('First', mail.outbox[0].body)
+        self.assertIn('Second', mail.outbox[0].body)
+        self.assertFalse(NotificationDigestItem.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(Notification.objects.filter(sent_via_email=True).count(), 6)
+
+    def test_batched_run_uses_bounded_queries(self):
+        for user in self.users:
+            self._notify(user, 'Batched')
+
+        # One grouped read plus two bulk updates per batch
+        with self.assertNumQueries(3):
+            stats = send_digests('daily', batch_size=10)
+        self.assertEqual(stats['smtp_sessions'], 1)
+
+    def test_weekly_items_not_sent_in_daily_run(self):
+        prefs = self.users[0].notification_preferences
+        prefs.digest_frequency = 'weekly'
+        prefs.save()
+        self._notify(self.users[0], 'Weekly')
+
+        stats = send_digests('daily')
+        self.assertEqual(stats['emails_sent'], 0)
+        self.assertEqual(send_digests('weekly')['emails_sent'], 1)
+
+    def test_types_opted_out_after_queueing_are_dropped(self):
+        self._notify(self.users[0], 'Dropped')
+        prefs = self.users[0].notification_preferences
+        prefs.email_system_announcements = False
+        prefs.save()
+
+        stats = send_digests('daily')
+
+        self.assertEqual((stats['emails_sent'], stats['skipped']), (0, 1))
+        self.assertFalse(NotificationDigestItem.objects.filter(sent_at__isnull=True).exists())
+        self.assertFalse(Notification.objects.filter(sent_via_email=True).exists())
+
+
+# Admin actions are audited; write them inline rather than from the writer thread
+@override_settings(AUDIT_LOG_ASYNC=False, EMAIL_NOTIFICATIONS_ENABLED=True)
+class BulkNotificationDispatchTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='bulkadmin', email='admin@example.com', password='x')
+        self.immediate = User.objects.create_user(username='immediate', email='now@example.com', password='x')
+        self.daily = User.objects.create_user(username='daily', email='daily@example.com', password='x')
+        NotificationPreference.objects.create(user=self.daily, digest_frequency='daily')
+        self.opted_out = User.objects.create_user(username='optedout', email='out@example.com', password='x')
+        NotificationPreference.objects.create(user=self.opted_out, email_system_announcements=False)
+        self.client.force_authenticate(user=self.admin)
+
+    def test_bulk_send_respects_email_preferences(self):
+        with mock.patch('notifications.signals.send_emails_async') as send_emails:
+            response = self.client.post('/api/notifications/admin/send/', {
+                'notification_type': 'system_announcement', 'title': 'Maintenance', 'message': 'Tonight',
+                'user_ids': [self.immediate.id, self.daily.id, self.opted_out.id],
+            }, format='json')
+
+        self.assertEqual(response.data['sent_count'], 3)
+        self.assertEqual(Notification.objects.count(), 3)
+        (emailed,), _ = send_emails.call_args
+        self.assertEqual([notification.user_id for notification in emailed], [self.immediate.id])
+        self.assertEqual(
+            list(NotificationDigestItem.objects.values_list('user_id', 'frequency')), [(self.daily.id, 'daily')]
+        )
+
+
+class NotificationPreferenceCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='prefuser',
+            email='pref@example.com',
+            password='testpass123'
+        )
+        self.prefs = NotificationPreference.objects.create(
+            user=self.user,
+            email_badge_awarded=False,
+            push_enabled=False,
+            digest_frequency='weekly'
+        )
+        self.other = User.objects.create_user(
+            username='otheruser',
+            email='other@example.com',
+            password='testpass123'
+        )
+
+    def test_bits_match_model_preferences(self):
+        bits = get_preference_bits(self.user.id)
+        for notification_type, _ in Notification.NOTIFICATION_TYPES:
+            self.assertEqual(wants_email(bits, notification_type), self.prefs.get_email_preference(notification_type))
+            self.assertEqual(wants_push(bits, notification_type), self.prefs.get_push_preference(notification_type))
+        self.assertEqual(digest_frequency(bits), 'weekly')
+
+    def test_bulk_load_is_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            bits = get_preference_bits_bulk([self.user.id, self.other.id])
+        self.assertEqual(bits[self.other.id], DEFAULT_BITS)
+        with self.assertNumQueries(0):
+            get_preference_bits_bulk([self.user.id, self.other.id])
+
+    def test_missing_preferences_do_not_create_rows(self):
+        get_preference_bits(self.other.id)
+        self.assertFalse(NotificationPreference.objects.filter(user=self.other).exists())
+
+    def test_update_invalidates_cache(self):
+        self.assertEqual(list(filter_recipients([self.user.id, self.other.id], 'badge_awarded')), [self.other.id])
+        self.prefs.email_badge_awarded = True
+        self.prefs.save()
+        self.assertCountEqual(
+            filter_recipients([self.user.id, self.other.id], 'badge_awarded'),
+            [self.user.id, self.other.id]
+        )
+
+
+@override_settings(EMAIL_NOTIFICATIONS_ENABLED=False)
+class NotificationRetentionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='retentionuser',
+            email='retention@example.com',
+            password='testpass123'
+        )
+
+    def _notify(self, status, days_old, notification_type='system_announcement'):
+        notification = Notification.create_notification(
+            user=self.user,
+            notification_type=notification_type,
+            title=f'{status} {days_old}',
+            message='Retention test',
+            status=status
+        )
+        Notification.objects.filter(id=notification.id).update(
+            created_at=timezone.now() - timedelta(days=days_old)
+        )
+        return notification
+
+    def test_prune_respects_status_and_type_ttls(self):
+        expired_read = self._notify('read', 100)
+        kept_read = self._notify('read', 10)
+        expired_archived = self._notify('archived', 40)
+        kept_unread = self._notify('unread', 100)
+        expired_reminder = self._notify('unread', 40, notification_type='reminder')
+
+        with self.settings(NOTIFICATION_RETENTION={'type': {'reminder': 30}}):
+            result = prune_notifications(batch_size=2)
+
+        self.assertEqual(result['deleted'], 3)
+        remaining = set(Notification.objects.values_list('id', flat=True))
+        self.assertEqual(remaining, {kept_read.id, kept_unread.id})
+        self.assertNotIn(expired_read.id, remaining)
+        self.assertNotIn(expired_archived.id, remaining)
+        self.assertNotIn(expired_reminder.id, remaining)
+
+    def test_prune_archives_to_compressed_jsonl(self):
+        expired = self._notify('read', 100)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'notifications.jsonl.gz')
+            result = prune_notifications(archive_path=path)
+            with gzip.open(path, 'rt') as archive:
+                rows = [json.loads(line) for line in archive]
+
+        self.assertEqual(result['archived'], 1)
+        self.assertEqual(rows[0]['id'], expired.id)
+        self.assertFalse(Notification.objects.filter(id=expired.id).exists())
+
+    def test_admin_stats_from_rollups(self):
+        self._notify('read', 3)
+        self._notify('unread', 3)
+        self._notify('unread', 0)
+        rollup_notification_stats(days=7)
+        self.assertEqual(NotificationStat.objects.count(), 2)
+
+        stats = notification_stats()
+        self.assertEqual(stats['total_notifications'], 3)
+        self.assertEqual(stats['unread_count'], 2)
+        self.assertEqual(stats['by_type']['system_announcement'], 3)
+        self.assertEqual(stats['recent_activity']['last_7_days'], 3)
+
+        # Pruning decrements the rolled-up counters
+        with self.settings(NOTIFICATION_RETENTION={'status': {'read': 1}}):
+            prune_notifications()
+        self.assertEqual(notification_stats()['read_count'], 0)
+
+    def test_late_status_changes_move_between_counters(self):
+        old = self._notify('unread', 30)
+        old.refresh_from_db()
+        rollup_notification_stats(days=60)
+        self.assertEqual(notification_stats()['unread_count'], 1)
+
+        # Read long after its day left the default rollup window
+        old.mark_as_read()
+        rollup_notification_stats()
+        stats = notification_stats()
+        self.assertEqual((stats['unread_count'], stats['read_count']), (0, 1))
+
+        # Archived but not rolled up yet: pruning subtracts the counted (read) status
+        old.mark_as_archived()
+        with self.settings(NOTIFICATION_RETENTION={'status': {'archived': 1}}):
+            prune_notifications()
+        self.assertEqual(notification_stats()['total_notifications'], 0)
+
+    def test_explicit_counted_status_writes_are_kept(self):
+        notification = self._notify('read', 30)
+        notification.counted_status = 'read'
+        notification.save()
+        self.assertEqual(Notification.objects.get(pk=notification.pk).counted_status, 'read')
+
+
+@override_settings(EMAIL_NOTIFICATIONS_ENABLED=False)
+class NotificationFeedTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='feeduser',
+            email='feed@example.com',
+            password='testpass123'
+        )
+        same_time = timezone.now()
+        for i in range(5):
+            notification = Notification.create_notification(
+                user=self.user,
+                notification_type='reminder',
+                title=f'Feed {i}',
+                message='Feed test',
+                status='unread' if i % 2 else 'read'
+            )
+            # Identical timestamps exercise the id tie-breaker
+            Notification.objects.filter(id=notification.id).update(created_at=same_time)
+        self.client.force_authenticate(user=self.user)
+
+    def test_cursor_pages_cover_feed_without_count(self):
+        seen = []
+        url = '/api/notifications/me/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+
+        expected = list(Notification.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_count_on_request(self):
+        response = self.client.get('/api/notifications/me/?status=unread&count=true')
+        self.assertEqual(response.data['count'], 2)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/notifications/me/?cursor=bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'query plan checks are backend specific')
+    def test_feed_query_uses_index_order(self):
+        queryset = Notification.objects.filter(user=self.user, status='unread').order_by('-created_at', '-id')[:21]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertIn('notif_user_status_created_idx', plan)
+            self.assertNotIn('Sort', plan)
+        else:
+            plan = queryset.explain()
+            self.assertIn('notif_user_status_created_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class FakePushServiceHandler(BaseHTTPRequestHandler):
+    """Local stand-in for a browser push service"""
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.received.append({'path': self.path, 'headers': dict(self.headers), 'body': body})
+        self.send_response(410 if self.path.endswith('/gone') else 201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def decrypt_push_body(body, ua_private_key, auth_secret):
+    """Browser side of RFC 8291, used to check what the push service received"""
+    salt, id_length = body[:16], body[20]
+    server_public = body[21:21 + id_length]
+    ciphertext = body[21 + id_length:]
+    ua_public = ua_private_key.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    shared_secret = ua_private_key.exchange(
+        ec.ECDH(), ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), server_public)
+    )
+    ikm = _hkdf(auth_secret, shared_secret, b'WebPush: info\x00' + ua_public + server_public, 32)
+    cek = _hkdf(salt, ikm, b'Content-Encoding: aes128gcm\x00', 16)
+    nonce = _hkdf(salt, ikm, b'Content-Encoding: nonce\x00', 12)
+    return AESGCM(cek).decrypt(nonce, ciphertext, None).rstrip(b'\x02')
+
+
+@override_settings(EMAIL_NOTIFICATIONS_ENABLED=False)
+class WebPushDeliveryTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakePushServiceHandler)
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        FakePushServiceHandler.received = []
+        self.user = User.objects.create_user(
+            username='pushuser',
+            email='push@example.com',
+            password='testpass123'
+        )
+        self.browser_key = ec.generate_private_key(ec.SECP256R1())
+        self.auth_secret = os.urandom(16)
+        keys = {
+            'p256dh': b64url_encode(self.browser_key.public_key().public_bytes(
+                serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+            )),
+            'auth': b64url_encode(self.auth_secret),
+        }
+        self.live = PushSubscription.objects.create(user=self.user, endpoint=f'{self.base_url}/push/live', **keys)
+        self.gone = PushSubscription.objects.create(user=self.user, endpoint=f'{self.base_url}/push/gone', **keys)
+
+        vapid_key = ec.generate_private_key(ec.SECP256R1())
+        self.vapid_public = vapid_key.public_key()
+        self.sender = WebPushSender(
+            private_key=b64url_encode(vapid_key.private_numbers().private_value.to_bytes(32, 'big')),
+            subject='mailto:test@example.com'
+        )
+
+    def tearDown(self):
+        self.sender.close()
+
+    def test_delivers_encrypted_signed_push_and_prunes_gone_subscriptions(self):
+        self.assertEqual(claim_notifications(), [])
+        notification = Notification.create_notification(
+            user=self.user,
+            notification_type='system_announcement',
+            title='Push title',
+            message='Push body',
+            priority='urgent'
+        )
+
+        claimed = claim_notifications()
+        self.assertEqual([n.id for n in claimed], [notification.id])
+        self.assertEqual(claim_notifications(), [])
+
+        result = deliver_notifications(claimed, self.sender, max_workers=4)
+        self.assertEqual(result['sent'], 1)
+        self.assertEqual(result['pruned'], 1)
+        self.assertFalse(PushSubscription.objects.filter(id=self.gone.id).exists())
+        notification.refresh_from_db()
+        self.assertTrue(notification.sent_via_push)
+
+        request = next(r for r in FakePushServiceHandler.received if r['path'] == '/push/live')
+        self.assertEqual(request['headers']['Content-Encoding'], 'aes128gcm')
+        self.assertEqual(request['headers']['Urgency'], 'high')
+        token = request['headers']['Authorization'].split('t=')[1].split(',')[0]
+        claims = jwt.decode(token, self.vapid_public, algorithms=['ES256'], audience=self.base_url)
+        self.assertEqual(claims['sub'], 'mailto:test@example.com')
+
+        payload = json.loads(decrypt_push_body(request['body'], self.browser_key, self.auth_secret))
+        self.assertEqual(payload['title'], 'Push title')
+        self.assertEqual(payload['body'], 'Push body')
+        self.assertEqual(notification.push_state, 'done')
+
+    def test_unfinished_claims_are_retried_and_stale_ones_skipped(self):
+        first = Notification.create_notification(
+            user=self.user, notification_type='system_announcement', title='First', message='First'
+        )
+        stale = Notification.create_notification(
+            user=self.user, notification_type='system_announcement', title='Stale', message='Stale'
+        )
+        Notification.objects.filter(id=stale.id).update(created_at=timezone.now() - timedelta(hours=2))
+
+        claimed = claim_notifications(max_age=timedelta(hours=1))
+        self.assertEqual([n.id for n in claimed], [first.id])
+        stale.refresh_from_db()
+        self.assertEqual(stale.push_state, 'skipped')
+
+        # The worker died before delivering: the batch returns once its lease is up
+        self.assertEqual(claim_notifications(), [])
+        Notification.objects.filter(id=first.id).update(push_lease_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([n.id for n in claim_notifications()], [first.id])
+
+    def test_push_preferences_are_respected(self):
+        NotificationPreference.objects.create(user=self.user, push_system_announcements=False)
+        notification = Notification.create_notification(
+            user=self.user,
+            notification_type='system_announcement',
+            title='Muted',
+            message='Muted'
+        )
+        result = deliver_notifications([notification], self.sender)
+        self.assertEqual(result['sent'], 0)
+        self.assertEqual(FakePushServiceHandler.received, [])
+
+
+class PushSubscriptionAPITest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='subscriber',
+            email='subscriber@example.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_subscribe_with_browser_json_and_unsubscribe(self):
+        subscription = {
+            'endpoint': 'https://push.example.com/send/abc',
+            'keys': {'p256dh': 'BPublicKey', 'auth': 'AuthSecret'},
+        }
+        response = self.client.post('/api/notifications/me/push-subscriptions/', subscription, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post('/api/notifications/me/push-subscriptions/', subscription, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(PushSubscription.objects.filter(user=self.user).count(), 1)
+
+        response = self.client.delete(
+            '/api/notifications/me/push-subscriptions/', {'endpoint': subscription['endpoint']}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(PushSubscription.objects.exists())
@@ -4,7 +4,8 @@ from .views import (
     MarkAllNotificationsReadView, ArchiveNotificationView, NotificationStatsView,
     NotificationPreferencesView, AdminNotificationManagementView,
     AdminNotificationStatsView, AdminNotificationsListView,
-    DeleteNotificationView, ClearAllNotificationsView
+    DeleteNotificationView, ClearAllNotificationsView,
+    PushSubscriptionView, VapidPublicKeyView
 )
 
 app_name = 'notifications'
@@ -20,6 +21,8 @@ urlpatterns = [
     path('me/clear/', ClearAllNotificationsView.as_view(), name='clear-all'),
     path('me/stats/', NotificationStatsView.as_view(), name='notification-stats'),
     path('me/preferences/', NotificationPreferencesView.as_view(), name='notification-preferences'),
+    path('me/push-subscriptions/', PushSubscriptionView.as_view(), name='push-subscriptions'),
+    path('push/vapid-public-key/', VapidPublicKeyView.as_view(), name='vapid-public-key'),
     
     # Admin endpoints
     path('admin/', AdminNotificationsListView.as_view(), name='admin-list'),
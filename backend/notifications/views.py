@@ -1,25 +1,29 @@
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from django.db.models import Count, Q
 from django.utils import timezone
-from .models import Notification, NotificationPreference
+from django.conf import settings
+from .models import Notification, NotificationPreference, PushSubscription
 from .serializers import (
     NotificationSerializer, NotificationListSerializer,
     NotificationPreferenceSerializer, NotificationStatsSerializer,
-    MessageSerializer
+    MessageSerializer, PushSubscriptionSerializer
 )
+from .stats import notification_stats
+from backend.pagination import KeysetPagination
 
 
 class UserNotificationsView(generics.ListAPIView):
-    """User: Get their notifications with filtering"""
+    """User: Get their notifications with filtering, newest first by cursor"""
     serializer_class = NotificationListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         user = self.request.user
-        queryset = Notification.objects.filter(user=user)
+        queryset = Notification.objects.filter(user=user).select_related('program', 'event')
         
         # Filter by status
         status_param = self.request.query_params.get('status')
@@ -157,6 +161,59 @@ class NotificationPreferencesView(generics.RetrieveUpdateAPIView):
         return preferences
 
 
+class PushSubscriptionView(APIView):
+    """User: Register or remove a Web Push subscription"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = PushSubscriptionSerializer
+    
+    def post(self, request):
+        # Accept both the flat format and the browser's subscription.toJSON()
+        data = {key: value for key, value in request.data.items()}
+        keys = data.pop('keys', None) or {}
+        data.setdefault('p256dh', keys.get('p256dh'))
+        data.setdefault('auth', keys.get('auth'))
+        data.setdefault('user_agent', request.META.get('HTTP_USER_AGENT', ''))
+        
+        serializer = PushSubscriptionSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        
+        # Endpoints are unique per browser; re-subscribing moves it to this user
+        subscription, created = PushSubscription.objects.update_or_create(
+            endpoint=serializer.validated_data['endpoint'],
+            defaults={
+                'user': request.user,
+                'p256dh': serializer.validated_data['p256dh'],
+                'auth': serializer.validated_data['auth'],
+                'user_agent': serializer.validated_data.get('user_agent', ''),
+            }
+        )
+        return Response(
+            PushSubscriptionSerializer(subscription).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+    
+    def delete(self, request):
+        endpoint = request.data.get('endpoint') or request.query_params.get('endpoint')
+        if not endpoint:
+            return Response({'detail': 'endpoint is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        deleted, _ = PushSubscription.objects.filter(user=request.user, endpoint=endpoint).delete()
+        if not deleted:
+            return Response({'detail': 'Subscription not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'detail': 'Push subscription removed.'})
+
+
+class VapidPublicKeyView(APIView):
+    """Public: VAPID application server key for PushManager.subscribe()"""
+    permission_classes = [AllowAny]
+    
+    def get(self, request):
+        return Response({
+            'enabled': settings.PUSH_NOTIFICATIONS_ENABLED and bool(settings.VAPID_PUBLIC_KEY),
+            'public_key': settings.VAPID_PUBLIC_KEY,
+        })
+
+
 class AdminNotificationManagementView(APIView):
     """Admin: Send notifications to users"""
     permission_classes = [IsAdminUser]
@@ -185,20 +242,15 @@ class AdminNotificationManagementView(APIView):
             # Send to all users if no specific users provided
             users = User.objects.filter(is_active=True)
         
-        notifications = []
-        for user in users:
-            notification = Notification(
-                user=user,
-                notification_type=notification_type,
-                title=title,
-                message=message,
-                priority=priority,
-                action_url=action_url,
-                action_text=action_text
-            )
-            notifications.append(notification)
-        
-        created_notifications = Notification.objects.bulk_create(notifications)
+        created_notifications = Notification.send_bulk_notification(
+            users,
+            notification_type,
+            title,
+            message,
+            priority=priority,
+            action_url=action_url,
+            action_text=action_text
+        )
         
         return Response({
             'detail': f'Successfully sent {len(created_notifications)} notifications.',
@@ -245,41 +297,8 @@ class AdminNotificationStatsView(APIView):
     serializer_class = NotificationStatsSerializer
     
     def get(self, request):
-        notifications = Notification.objects.all()
-        
-        stats = {
-            'total_notifications': notifications.count(),
-            'unread_count': notifications.filter(status='unread').count(),
-            'read_count': notifications.filter(status='read').count(),
-            'archived_count': notifications.filter(status='archived').count(),
-            'by_type': {},
-            'by_priority': {},
-            'recent_activity': {
-                'last_24_hours': notifications.filter(
-                    created_at__gte=timezone.now() - timezone.timedelta(days=1)
-                ).count(),
-                'last_7_days': notifications.filter(
-                    created_at__gte=timezone.now() - timezone.timedelta(days=7)
-                ).count(),
-                'last_30_days': notifications.filter(
-                    created_at__gte=timezone.now() - timezone.timedelta(days=30)
-                ).count(),
-            }
-        }
-        
-        # Count by notification type
-        for notification_type, _ in Notification.NOTIFICATION_TYPES:
-            stats['by_type'][notification_type] = notifications.filter(
-                notification_type=notification_type
-            ).count()
-        
-        # Count by priority
-        for priority, _ in Notification.PRIORITY_CHOICES:
-            stats['by_priority'][priority] = notifications.filter(
-                priority=priority
-            ).count()
-        
-        return Response(stats)
+        # Served from daily rollups plus a live count of today
+        return Response(notification_stats())
 
 
 class DeleteNotificationView(APIView):
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     PaymentMethod, PricingPlan, Order, Payment, 
-    Subscription, Coupon, CouponUsage
+    Subscription, Coupon, CouponUsage, WebhookEvent, LedgerDaily
 )
 
 
@@ -116,3 +116,33 @@ class CouponUsageAdmin(admin.ModelAdmin):
     list_filter = ['used_at']
     search_fields = ['coupon__code', 'user__email']
     readonly_fields = ['used_at']
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'provider', 'event_type', 'status', 'attempts', 'event_time', 'received_at']
+    list_filter = ['provider', 'status', 'event_type']
+    search_fields = ['event_id']
+    readonly_fields = ['provider', 'event_id', 'event_type', 'event_time', 'headers', 'body', 'received_at',
+                       'processed_at']
+    actions = ['replay']
+
+    @admin.action(description='Replay selected events')
+    def replay(self, request, queryset):
+        from .webhooks import replay_webhook_events
+        count = replay_webhook_events(queryset)
+        self.message_user(request, f'{count} events queued for processing')
+
+
+@admin.register(LedgerDaily)
+class LedgerDailyAdmin(admin.ModelAdmin):
+    list_display = ['day', 'currency', 'pricing_plan', 'provider', 'orders_created', 'payments_completed',
+                    'gross_amount', 'refunded_amount']
+    list_filter = ['currency', 'provider']
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -5,3 +5,6 @@ class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
     verbose_name = 'Payments & Billing'
+
+    def ready(self):
+        import payments.signals
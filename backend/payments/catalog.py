@@ -0,0 +1,174 @@
+"""
+Pricing Catalog
+In-process snapshot of active pricing plans, payment methods and coupons,
+with serialized plan/method payloads and effective prices per plan and
+coupon computed once per snapshot.
+
+Snapshots are tagged with a version kept in the cache. Model signals bump
+the version (immediately and again on commit), and a reader rebuilds when
+its snapshot's version is stale or older than CATALOG_CACHE_TTL, which
+bounds staleness when the cache is not shared between processes.
+Reading a current snapshot runs no database queries.
+"""
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+VERSION_KEY = 'payments:catalog:version'
+DEFAULT_TTL = 60
+
+
+@dataclass(frozen=True)
+class CatalogCoupon:
+    id: int
+    code: str
+    discount_type: str
+    discount_value: object
+    max_uses_per_user: int
+    valid_from: datetime
+    valid_until: datetime = None
+    # plan id -> price after discount, for the plans the coupon applies to
+    effective_prices: dict = field(default_factory=dict)
+
+    def is_current(self, now=None):
+        now = now or timezone.now()
+        return self.valid_from <= now and (self.valid_until is None or now <= self.valid_until)
+
+    def instance(self):
+        """Unsaved Coupon carrying what Coupon.redeem needs"""
+        from .models import Coupon
+
+        return Coupon(
+            pk=self.id, code=self.code, discount_type=self.discount_type, discount_value=self.discount_value,
+            max_uses_per_user=self.max_uses_per_user, valid_from=self.valid_from, valid_until=self.valid_until
+        )
+
+
+class Catalog:
+    def __init__(self, version, plans, payment_methods, coupons, plan_prices):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.plans = plans
+        self.plans_by_id = {plan['id']: plan for plan in plans}
+        self.plans_by_program = {}
+        for plan in plans:
+            self.plans_by_program.setdefault(str(plan['program']), []).append(plan)
+        self.payment_methods = payment_methods
+        self.payment_method_ids = {method['id'] for method in payment_methods}
+        self.coupons = coupons
+        self.plan_prices = plan_prices
+
+    def plans_for(self, program_id=None):
+        if program_id:
+            return self.plans_by_program.get(str(program_id), [])
+        return self.plans
+
+    def plan(self, plan_id):
+        return self.plans_by_id.get(plan_id)
+
+    def price(self, plan_id, coupon_code=None, now=None):
+        """
+        Amount to charge for a plan with an optional coupon.
+
+        Returns:
+            (amount, CatalogCoupon or None); the coupon is None when it does
+            not exist, is not current or does not apply to the plan
+        """
+        price = self.plan_prices[plan_id]
+        coupon = self.coupons.get(coupon_code.lower()) if coupon_code else None
+        if coupon is None or plan_id not in coupon.effective_prices or not coupon.is_current(now):
+            return price, None
+        return coupon.effective_prices[plan_id], coupon
+
+
+def build_catalog(version):
+    from .models import Coupon, PaymentMethod, PricingPlan
+    from .serializers import PaymentMethodSerializer, PricingPlanSerializer
+
+    plans = list(PricingPlan.objects.filter(is_active=True).select_related('program'))
+    methods = PaymentMethod.objects.filter(is_active=True)
+    plan_prices = {plan.id: plan.price for plan in plans}
+
+    coupons = {}
+    for coupon in Coupon.objects.filter(is_active=True).prefetch_related('applicable_plans'):
+        applicable = {plan.id for plan in coupon.applicable_plans.all()} or set(plan_prices)
+        coupons[coupon.code.lower()] = CatalogCoupon(
+            id=coupon.id,
+            code=coupon.code,
+            discount_type=coupon.discount_type,
+            discount_value=coupon.discount_value,
+            max_uses_per_user=coupon.max_uses_per_user,
+            valid_from=coupon.valid_from,
+            valid_until=coupon.valid_until,
+            effective_prices={
+                plan_id: coupon.discounted_price(price)
+                for plan_id, price in plan_prices.items()
+                if plan_id in applicable
+                and (coupon.minimum_order_amount is None or price >= coupon.minimum_order_amount)
+            }
+        )
+
+    return Catalog(
+        version,
+        plans=PricingPlanSerializer(plans, many=True).data,
+        payment_methods=PaymentMethodSerializer(methods, many=True).data,
+        coupons=coupons,
+        plan_prices=plan_prices
+    )
+
+
+class CatalogCache:
+    """Per-process holder of the current catalog snapshot"""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.catalog = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = cache.get(VERSION_KEY)
+        catalog = self.catalog
+        if catalog is not None and catalog.version == version and time.monotonic() - catalog.built_at < self.ttl:
+            return catalog
+
+        with self._lock:
+            if self.catalog is not None and self.catalog is not catalog:
+                # Rebuilt by another thread while this one waited
+                return self.catalog
+            self.catalog = build_catalog(version)
+            return self.catalog
+
+    def clear(self):
+        self.catalog = None
+
+
+catalog_cache = CatalogCache(ttl=getattr(settings, 'CATALOG_CACHE_TTL', DEFAULT_TTL))
+
+
+def get_catalog():
+    return catalog_cache.get()
+
+
+def _bump_version():
+    # A random token rather than a counter, so a cleared or evicted key can
+    # never match an old snapshot's version
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_catalog():
+    """
+    Make every reader rebuild its snapshot.
+
+    The second bump after commit discards snapshots rebuilt from data read
+    before the change was visible.
+    """
+    _bump_version()
+    catalog_cache.clear()
+    transaction.on_commit(_bump_version)
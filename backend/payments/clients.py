@@ -0,0 +1,169 @@
+"""
+Payment Provider HTTP Clients
+Base for provider API clients that use OAuth client-credentials tokens.
+
+Calls go through one pooled requests.Session per process (keep-alive, bounded
+pool) with connect/read timeouts; a forked child builds its own session and
+locks. The token is cached until shortly before it expires and refreshed by a
+single thread while others wait. Network errors
+and 429/5xx answers are retried with backoff, honouring Retry-After.
+"""
+import abc
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Refresh the token this many seconds before the provider expires it
+TOKEN_EXPIRY_MARGIN = 60
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Longest wait between attempts (a capped Retry-After)
+MAX_BACKOFF = 10.0
+
+
+class GatewayError(Exception):
+    """A provider call failed; status_code is None for network errors"""
+
+    def __init__(self, message, status_code=None, response_text=''):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response_text = response_text
+
+
+class PooledApiClient(abc.ABC):
+    """
+    Subclasses set `name` and `error_class` and implement _fetch_token,
+    returning (access token, lifetime in seconds).
+    """
+    name = 'provider'
+    error_class = GatewayError
+
+    def __init__(self, base_url, timeout, max_retries, pool_size, clock=time.monotonic):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.clock = clock
+        # Retries are logged under the subclass's module, e.g. payments.paypal_service
+        self.logger = logging.getLogger(type(self).__module__)
+
+        self._access_token = None
+        self._token_expires_at = 0
+        self._token_lock = threading.Lock()
+        self._session_lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+
+        if hasattr(os, 'register_at_fork'):
+            reset = weakref.WeakMethod(self._reset_after_fork)
+            os.register_at_fork(after_in_child=lambda: reset() and reset()())
+
+    def _reset_after_fork(self):
+        # Locks held by other threads at fork time stay locked in the child,
+        # and the parent's sockets must not be shared
+        self._token_lock = threading.Lock()
+        self._session_lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def session(self):
+        """Per-process pooled session; sockets are not shared across fork"""
+        session = self._session
+        if session is not None and self._session_pid == os.getpid():
+            return session
+        with self._session_lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size, pool_block=True, max_retries=0
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+                self._session_pid = os.getpid()
+            return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    @abc.abstractmethod
+    def _fetch_token(self, session):
+        """Request a new access token; returns (token, lifetime in seconds)"""
+
+    def _get_access_token(self):
+        """Cached OAuth access token, refreshed once shortly before expiry"""
+        token = self._access_token
+        if token and self.clock() < self._token_expires_at:
+            return token
+
+        session = self.session
+        with self._token_lock:
+            # Another thread may have refreshed while this one waited
+            if self._access_token and self.clock() < self._token_expires_at:
+                return self._access_token
+
+            token, expires_in = self._fetch_token(session)
+            self._access_token = token
+            self._token_expires_at = self.clock() + max(0, expires_in - TOKEN_EXPIRY_MARGIN)
+            return self._access_token
+
+    def _invalidate_token(self, token):
+        with self._token_lock:
+            if self._access_token == token:
+                self._access_token = None
+                self._token_expires_at = 0
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF)
+        return min(0.25 * (2 ** attempt), 4.0) * random.uniform(0.5, 1.0)
+
+    def _send(self, session, method, path, max_retries=None, **kwargs):
+        """
+        Send with timeouts, retrying network errors and 429/5xx.
+
+        Only idempotent calls should be retried; pass max_retries=0 for
+        writes the provider cannot deduplicate.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            try:
+                response = session.request(method, f'{self.base_url}{path}', timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                if attempt >= max_retries:
+                    raise self.error_class(f"{self.name} request {method} {path} failed: {str(e)}") from e
+                self.logger.warning(f"{self.name} request {method} {path} failed, retrying: {str(e)}")
+                time.sleep(self._backoff(attempt))
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                    return response
+                self.logger.warning(f"{self.name} request {method} {path} returned {response.status_code}, retrying")
+                time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    def _request(self, method, path, headers=None, max_retries=None, **kwargs):
+        """Authenticated call; a 401 refreshes the token and retries once"""
+        session = self.session
+        for _ in range(2):
+            token = self._get_access_token()
+            response = self._send(
+                session, method, path, max_retries=max_retries,
+                headers={**(headers or {}), 'Authorization': f'Bearer {token}'}, **kwargs
+            )
+            if response.status_code != 401:
+                return response
+            self._invalidate_token(token)
+        return response
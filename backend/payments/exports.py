@@ -0,0 +1,30 @@
+"""
+Order Exports
+Columns of the finance order export, streamed by backend.exports
+"""
+
+
+def _plan_name(row):
+    return row.pricing_plan.name if row.pricing_plan_id else ''
+
+
+def _provider(row):
+    return row.payment_method.provider if row.payment_method_id else ''
+
+
+# (column, model fields to load, getter)
+ORDER_EXPORT_COLUMNS = [
+    ('id', ['id'], lambda row: row.id),
+    ('created_at', ['created_at'], lambda row: row.created_at.isoformat()),
+    ('order_id', ['order_id'], lambda row: str(row.order_id)),
+    ('status', ['status'], lambda row: row.status),
+    ('amount', ['amount'], lambda row: str(row.amount)),
+    ('currency', ['currency'], lambda row: row.currency),
+    ('user_id', ['user_id'], lambda row: row.user_id),
+    ('email', ['user__email'], lambda row: row.user.email),
+    ('plan', ['pricing_plan__name'], _plan_name),
+    ('provider', ['payment_method__provider'], _provider),
+    ('billing_name', ['billing_name'], lambda row: row.billing_name),
+    ('billing_country', ['billing_country'], lambda row: row.billing_country),
+    ('paid_at', ['paid_at'], lambda row: row.paid_at.isoformat() if row.paid_at else ''),
+]
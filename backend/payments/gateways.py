@@ -0,0 +1,390 @@
+"""
+Payment Gateways
+One interface over the payment providers, looked up by Payment.provider.
+
+A gateway creates and captures payments, charges saved payment methods (used
+by renewals), refunds them, turns provider webhooks into stored events and
+verifies them, and reports the status the provider holds for a payment (used
+by reconciliation). Operations a provider does not offer raise GatewayError.
+"""
+import hmac
+import json
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .clients import GatewayError
+from .mpesa_service import mpesa_service
+from .paypal_service import paypal_service
+
+# Unapproved PayPal orders are treated as abandoned after this long
+ABANDONED_AFTER = timedelta(days=3)
+
+PAYPAL_CAPTURE_STATUSES = {
+    'COMPLETED': 'completed',
+    'REFUNDED': 'refunded',
+    'DECLINED': 'failed',
+    'FAILED': 'failed',
+}
+
+# PayPal answers that mean a saved instrument refused the charge; any other
+# error (outage, bad request, auth) is worth retrying
+PAYPAL_DECLINE_STATUS_CODES = {402, 422}
+PAYPAL_DECLINE_ISSUES = {'INSTRUMENT_DECLINED', 'TRANSACTION_REFUSED'}
+
+GATEWAYS = {}
+
+
+class ResultPending(GatewayError):
+    """The provider has no result yet; ask again later"""
+
+
+@dataclass
+class PaymentResult:
+    # Local payment status the provider implies, or None when it is undecided
+    status: str = None
+    provider_payment_id: str = ''
+    capture_id: str = ''
+    payer_id: str = ''
+    # Where the customer approves the payment, for redirect flows
+    redirect_url: str = ''
+    provider_status: str = ''
+    message: str = ''
+    # Total refunded on the payment so far, for refunds
+    refunded_amount: Decimal = None
+    raw: dict = field(default_factory=dict, repr=False)
+
+
+class PaymentGateway:
+    provider = None
+    # Currencies the provider can charge in; None for any
+    currencies = None
+    # Whether charge_saved_payment is available (subscription renewals)
+    saved_payments = False
+
+    def create_payment(self, order, **details):
+        raise GatewayError(f'{self.provider} does not support creating payments')
+
+    def capture_payment(self, payment):
+        raise GatewayError(f'{self.provider} does not support capturing payments')
+
+    def charge_saved_payment(self, order, token, description=''):
+        """
+        Charge a saved payment method without the customer present.
+
+        Returns:
+            PaymentResult, failed when the instrument refused the charge and
+            with no status while the provider has not settled it; errors
+            worth retrying raise GatewayError
+        """
+        raise GatewayError(f'{self.provider} does not support saved payment methods')
+
+    def refund_payment(self, payment, amount=None, note=''):
+        raise GatewayError(f'{self.provider} does not support refunds')
+
+    def parse_webhook(self, payload, headers):
+        """
+        Identify a decoded webhook body.
+
+        Returns:
+            dict with event_id, event_type, event_time and the headers to
+            keep for verification, or None if it is not an event
+        """
+        return None
+
+    def verify_webhook(self, event):
+        """True if a stored WebhookEvent really comes from the provider"""
+        raise GatewayError(f'{self.provider} does not support webhooks')
+
+    def query_status(self, payment, now=None):
+        raise GatewayError(f'{self.provider} does not support status queries')
+
+
+def register_gateway(gateway):
+    GATEWAYS[gateway.provider] = gateway
+    return gateway
+
+
+def get_gateway(provider):
+    try:
+        return GATEWAYS[provider]
+    except KeyError:
+        raise GatewayError(f'Unsupported payment provider: {provider}') from None
+
+
+def paypal_issues(error):
+    """Issue codes in a PayPal error response's details"""
+    try:
+        details = json.loads(error.response_text or '{}').get('details') or []
+    except (ValueError, AttributeError):
+        return set()
+    return {detail.get('issue') for detail in details if isinstance(detail, dict)}
+
+
+def is_paypal_decline(error):
+    """Whether a PayPal error says the instrument refused the charge"""
+    return error.status_code in PAYPAL_DECLINE_STATUS_CODES and bool(paypal_issues(error) & PAYPAL_DECLINE_ISSUES)
+
+
+def outcome_unknown(error):
+    """Whether a failed provider call may still have gone through (network error, timeout or 5xx)"""
+    return error.status_code is None or error.status_code >= 500
+
+
+class PayPalGateway(PaymentGateway):
+    provider = 'paypal'
+    saved_payments = True
+
+    def __init__(self, service):
+        self.service = service
+
+    def create_payment(self, order, return_url=None, cancel_url=None):
+        description = f"Code2Deploy - {order.pricing_plan.name}" if order.pricing_plan else "Code2Deploy Payment"
+        result = self.service.create_order(
+            amount=float(order.amount),
+            currency=order.currency,
+            description=description,
+            order_id=order.order_id,
+            return_url=return_url,
+            cancel_url=cancel_url
+        )
+        return PaymentResult(
+            'pending', result['paypal_order_id'], redirect_url=result['approval_url'],
+            provider_status=result['status'], raw=result['raw_response']
+        )
+
+    def capture_payment(self, payment):
+        try:
+            # One request id per payment, so PayPal answers a retried capture
+            # with the original result instead of capturing again
+            result = self.service.capture_order(
+                payment.provider_payment_id, request_id=f'capture-{payment.payment_id}'
+            )
+        except GatewayError as e:
+            if e.status_code != 422 or 'ORDER_ALREADY_CAPTURED' not in paypal_issues(e):
+                raise
+            # Captured by an earlier attempt under another request id
+            return self.query_status(payment)
+        return PaymentResult(
+            'completed' if result['status'] == 'COMPLETED' else 'failed',
+            result['paypal_order_id'],
+            capture_id=result.get('capture_id') or '',
+            payer_id=result.get('payer', {}).get('payer_id', ''),
+            provider_status=result['status'],
+            raw=result.get('raw_response', {})
+        )
+
+    def charge_saved_payment(self, order, token, description=''):
+        try:
+            result = self.service.charge_vaulted_payment(
+                order.amount, order.currency, token, description=description, order_id=order.order_id
+            )
+        except GatewayError as e:
+            if not is_paypal_decline(e):
+                raise
+            return PaymentResult('failed', provider_status='DECLINED', message=str(e))
+        if result['capture_status'] == 'PENDING':
+            # Neither paid nor declined yet; PayPal settles it later
+            return PaymentResult(
+                None, result['paypal_order_id'] or '', capture_id=result['capture_id'] or '',
+                provider_status='PENDING', message='Capture pending at PayPal', raw=result['raw_response']
+            )
+        completed = result['capture_status'] == 'COMPLETED'
+        return PaymentResult(
+            'completed' if completed else 'failed',
+            result['paypal_order_id'] or '',
+            capture_id=result['capture_id'] or '',
+            provider_status=result['capture_status'] or result['status'] or '',
+            message='' if completed else f"Capture status {result['capture_status']}",
+            raw=result['raw_response']
+        )
+
+    def refund_payment(self, payment, amount=None, note=''):
+        result = self.service.refund_payment(payment.provider_capture_id, amount, payment.currency, note)
+        refund = PaymentResult(
+            provider_payment_id=payment.provider_payment_id, capture_id=payment.provider_capture_id,
+            provider_status=result.get('status', ''), raw=result
+        )
+        if refund.provider_status == 'COMPLETED':
+            if amount is not None and not result.get('amount'):
+                result = dict(result, amount={'value': str(amount)})
+            refund.refunded_amount = paypal_refund_total(payment, result)
+            # A partial refund leaves the payment completed
+            refund.status = 'refunded' if refund.refunded_amount >= Decimal(payment.amount) else 'completed'
+        return refund
+
+    def parse_webhook(self, payload, headers):
+        # webhooks imports this module
+        from .webhooks import SIGNATURE_HEADERS
+
+        if not payload.get('id'):
+            return None
+        try:
+            event_time = parse_datetime(str(payload.get('create_time') or ''))
+        except ValueError:
+            event_time = None
+        return {
+            'event_id': str(payload['id']),
+            'event_type': str(payload.get('event_type') or ''),
+            'event_time': event_time,
+            'headers': {name: headers[name] for name in SIGNATURE_HEADERS if headers.get(name)},
+        }
+
+    def verify_webhook(self, event):
+        from .webhooks import verify_paypal_event
+
+        return verify_paypal_event(event)
+
+    def query_status(self, payment, now=None):
+        """
+        Status implied by PayPal's order: its capture when there is one,
+        otherwise failed for voided, abandoned and unknown orders
+        """
+        now = now or timezone.now()
+        try:
+            paypal_order = self.service.get_order_details(payment.provider_payment_id)
+        except GatewayError as e:
+            if e.status_code != 404:
+                raise
+            return PaymentResult(
+                'failed' if payment.status == 'pending' else None, payment.provider_payment_id,
+                provider_status='NOT_FOUND'
+            )
+
+        result = PaymentResult(
+            provider_payment_id=payment.provider_payment_id,
+            payer_id=(paypal_order.get('payer') or {}).get('payer_id', ''),
+            provider_status=paypal_order.get('status', ''),
+            raw=paypal_order
+        )
+        captures = []
+        for unit in paypal_order.get('purchase_units') or []:
+            captures.extend((unit.get('payments') or {}).get('captures') or [])
+        if captures:
+            result.status = PAYPAL_CAPTURE_STATUSES.get(captures[0].get('status'))
+            result.capture_id = captures[0].get('id', '')
+        elif result.provider_status == 'VOIDED' or (
+            result.provider_status in ('CREATED', 'PAYER_ACTION_REQUIRED')
+            and payment.created_at <= now - ABANDONED_AFTER
+        ):
+            result.status = 'failed'
+        return result
+
+
+def paypal_refund_total(payment, refund):
+    """
+    Total refunded on a payment's capture once a PayPal refund resource has
+    been applied. PayPal reports the capture's running total in the refund's
+    seller_payable_breakdown; without it the refund's own amount is added,
+    and a refund with neither is taken as a full refund.
+    """
+    total = ((refund.get('seller_payable_breakdown') or {}).get('total_refunded_amount') or {}).get('value')
+    if total:
+        total = Decimal(total)
+    elif (refund.get('amount') or {}).get('value'):
+        total = Decimal(payment.refunded_amount or 0) + Decimal(refund['amount']['value'])
+    else:
+        total = Decimal(payment.amount)
+    return min(max(total, Decimal(payment.refunded_amount or 0)), Decimal(payment.amount))
+
+
+def normalize_phone_number(phone_number):
+    """Safaricom MSISDN (2547XXXXXXXX / 2541XXXXXXXX) for a Kenyan mobile number, or None"""
+    digits = ''.join(char for char in str(phone_number or '') if char.isdigit())
+    if digits.startswith('0'):
+        digits = '254' + digits[1:]
+    elif len(digits) == 9:
+        digits = '254' + digits
+    if len(digits) == 12 and digits[:4] in ('2547', '2541'):
+        return digits
+    return None
+
+
+class MpesaGateway(PaymentGateway):
+    """
+    Lipa Na M-Pesa Online (STK push). Payments complete asynchronously via
+    the callback; Daraja does not sign callbacks, so each one is confirmed
+    with an STK query before it is applied.
+    """
+    provider = 'mpesa'
+    currencies = ('KES',)
+
+    def __init__(self, service):
+        self.service = service
+
+    def callback_url(self):
+        base_url = getattr(settings, 'MPESA_CALLBACK_BASE_URL', '')
+        token = getattr(settings, 'MPESA_CALLBACK_TOKEN', '')
+        if not base_url or not token:
+            raise GatewayError('MPESA_CALLBACK_BASE_URL and MPESA_CALLBACK_TOKEN must be configured')
+        return base_url.rstrip('/') + reverse('payments:mpesa-callback', args=[token])
+
+    def check_callback_token(self, token):
+        expected = getattr(settings, 'MPESA_CALLBACK_TOKEN', '')
+        return bool(expected) and hmac.compare_digest(str(token), expected)
+
+    def create_payment(self, order, phone_number=None):
+        phone_number = normalize_phone_number(phone_number)
+        if phone_number is None:
+            raise GatewayError('A Safaricom phone number is required', 400)
+        if order.currency not in self.currencies:
+            raise GatewayError(f'M-Pesa payments must be in KES, not {order.currency}', 400)
+        if Decimal(order.amount) != Decimal(order.amount).to_integral_value():
+            raise GatewayError('M-Pesa amounts must be whole shillings', 400)
+
+        result = self.service.stk_push(
+            order.amount, phone_number,
+            account_reference=str(order.order_id).replace('-', '')[:12],
+            description='Code2Deploy',
+            callback_url=self.callback_url()
+        )
+        return PaymentResult(
+            'pending', result['checkout_request_id'], payer_id=phone_number, provider_status='STK_SENT',
+            message=result['customer_message'], raw=result['raw_response']
+        )
+
+    def capture_payment(self, payment):
+        # Nothing to capture: the customer's PIN entry completes the payment
+        return self.query_status(payment)
+
+    def parse_webhook(self, payload, headers):
+        callback = (payload.get('Body') or {}).get('stkCallback')
+        if not isinstance(callback, dict) or not callback.get('CheckoutRequestID'):
+            return None
+        return {
+            'event_id': str(callback['CheckoutRequestID']),
+            'event_type': 'STK_CALLBACK',
+            'event_time': None,
+            'headers': {},
+        }
+
+    def verify_webhook(self, event):
+        callback = json.loads(event.body)['Body']['stkCallback']
+        result = self.service.stk_query(callback['CheckoutRequestID'])
+        if result['result_code'] is None:
+            raise ResultPending(f"M-Pesa has no result yet for {callback['CheckoutRequestID']}")
+        return result['result_code'] == int(callback.get('ResultCode', -1))
+
+    def query_status(self, payment, now=None):
+        if payment.status != 'pending':
+            # STK query only reports the prompt's outcome, not later reversals
+            return PaymentResult(provider_payment_id=payment.provider_payment_id)
+        result = self.service.stk_query(payment.provider_payment_id)
+        if result['result_code'] is None:
+            return PaymentResult(
+                provider_payment_id=payment.provider_payment_id, provider_status='PROCESSING',
+                raw=result['raw_response']
+            )
+        return PaymentResult(
+            'completed' if result['result_code'] == 0 else 'failed', payment.provider_payment_id,
+            provider_status=str(result['result_code']), message=result['result_desc'], raw=result['raw_response']
+        )
+
+
+register_gateway(PayPalGateway(paypal_service))
+register_gateway(MpesaGateway(mpesa_service))
@@ -0,0 +1,193 @@
+"""
+Idempotent Requests
+Views decorated with @idempotent(scope) honour an Idempotency-Key header.
+
+The first request with a key claims it by inserting a row (unique per user,
+scope and key) before the view runs, and stores the response status and body
+when it finishes. A retry with the same key and the same request is answered
+from that row without running the view again, so it creates no second order,
+payment or coupon redemption and makes no provider call. A key reused for a
+different request is rejected, and a retry that arrives while the first
+request is still running gets 409.
+
+A request that ends in a 5xx response or an exception stores no response;
+its key is kept as failed so the client can retry. A provider call in that
+request may still have gone through, so the retry runs the view with
+request.idempotent_retry set and the view looks up the outcome instead of
+repeating the call. Keys expire after IDEMPOTENCY_KEY_TTL_HOURS; purge_idempotency_keys deletes
+expired rows.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .clients import MAX_BACKOFF
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# A claim left in progress this long (e.g. by a killed worker) can be taken
+# over; in_progress_timeout() raises it to cover the slowest provider call
+IN_PROGRESS_TIMEOUT = timedelta(minutes=5)
+
+# Provider clients whose timeouts bound how long a payment view can run
+PROVIDER_SETTINGS = ('PAYPAL', 'MPESA')
+
+
+def key_ttl():
+    return timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
+
+def in_progress_timeout():
+    """
+    Age at which an in-progress claim counts as abandoned. It must outlast a
+    request that is still running, so it is at least twice (token fetch and
+    API call) the worst case of one provider call: every attempt timing out
+    plus the longest backoff between attempts.
+    """
+    slowest = 0
+    for provider in PROVIDER_SETTINGS:
+        attempts = getattr(settings, f'{provider}_MAX_RETRIES', 2) + 1
+        per_attempt = getattr(settings, f'{provider}_CONNECT_TIMEOUT', 3.05) + getattr(
+            settings, f'{provider}_READ_TIMEOUT', 20
+        )
+        slowest = max(slowest, attempts * per_attempt + (attempts - 1) * MAX_BACKOFF)
+    return max(IN_PROGRESS_TIMEOUT, timedelta(seconds=2 * slowest))
+
+
+def request_fingerprint(request):
+    """SHA-256 of the method, path and parsed body"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps(
+        {'method': request.method, 'path': request.path, 'data': data},
+        sort_keys=True, cls=DjangoJSONEncoder
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _in_progress():
+    return Response(
+        {'error': 'A request with this Idempotency-Key is still being processed'},
+        status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'}
+    )
+
+
+def claim_key(user, scope, key, fingerprint, now=None):
+    """
+    Claim a key for a new request.
+
+    Returns:
+        (IdempotencyKey claimed for this request, None) or (None, Response to
+        send instead of running the view). A key taken over from a failed or
+        abandoned attempt at the same request has retry set.
+    """
+    now = now or timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=user, scope=scope, key=key, request_fingerprint=fingerprint, expires_at=now + key_ttl()
+                ), None
+        except IntegrityError:
+            pass
+
+        existing = IdempotencyKey.objects.filter(user=user, scope=scope, key=key).first()
+        if existing is None:
+            # Purged since the insert failed
+            continue
+
+        same_request = existing.request_fingerprint == fingerprint
+        if existing.expires_at <= now or (existing.status == 'failed' and same_request) or (
+            existing.status == 'in_progress' and existing.updated_at <= now - in_progress_timeout()
+        ):
+            # Expired, failed or abandoned: take it over unless a concurrent retry just did
+            retry = same_request and existing.status != 'completed'
+            claimed = IdempotencyKey.objects.filter(pk=existing.pk, updated_at=existing.updated_at).update(
+                request_fingerprint=fingerprint, status='in_progress', response_status=None,
+                response_body=None, expires_at=now + key_ttl(), updated_at=now
+            )
+            if not claimed:
+                return None, _in_progress()
+            existing.refresh_from_db()
+            existing.retry = retry
+            return existing, None
+
+        if existing.status == 'in_progress':
+            return None, _in_progress()
+        if not same_request:
+            return None, Response(
+                {'error': 'This Idempotency-Key was already used for a different request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        return None, Response(
+            existing.response_body, status=existing.response_status, headers={'Idempotent-Replayed': 'true'}
+        )
+    return None, _in_progress()
+
+
+def idempotent(scope):
+    """
+    Decorator for view methods of authenticated views that replays stored
+    responses to requests repeating an Idempotency-Key.
+
+    Args:
+        scope: Name separating the keys of different endpoints
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            request.idempotent_retry = False
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return view_method(view, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            record, replay = claim_key(request.user, scope, key, request_fingerprint(request))
+            if replay is not None:
+                return replay
+
+            request.idempotent_retry = getattr(record, 'retry', False)
+            try:
+                response = view_method(view, request, *args, **kwargs)
+            except Exception:
+                record.status = 'failed'
+                record.save(update_fields=['status', 'updated_at'])
+                raise
+
+            if response.status_code >= 500 or not hasattr(response, 'data'):
+                record.status = 'failed'
+                record.save(update_fields=['status', 'updated_at'])
+            else:
+                record.status = 'completed'
+                record.response_status = response.status_code
+                record.response_body = response.data
+                record.save(update_fields=['status', 'response_status', 'response_body', 'updated_at'])
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_keys(batch_size=1000, now=None):
+    """Delete expired keys in batches; returns the number deleted"""
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
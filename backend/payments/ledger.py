@@ -0,0 +1,204 @@
+"""
+Payments Ledger
+Daily totals per currency, pricing plan and provider.
+
+Counters are incremented as orders are created and payments change status
+(payments/signals.py), in the same transaction as the change, so reports
+read a few ledger rows per day instead of aggregating orders and payments.
+Amounts are never added across currencies.
+
+rebuild_ledger re-derives a date range from orders and payments; it is used
+to backfill history and to repair drift after bulk updates that bypass save().
+"""
+from collections import Counter
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import LedgerDaily, Order, Payment
+
+COUNTERS = ('orders_created', 'payments_completed', 'gross_amount', 'payments_failed', 'refunds', 'refunded_amount')
+
+# Report dimensions accepted by ledger_report, in addition to currency
+GROUP_BY_FIELDS = {
+    'day': ('day',),
+    'plan': ('pricing_plan', 'pricing_plan__name'),
+    'provider': ('provider',),
+}
+
+DEFAULT_REPORT_DAYS = 30
+
+# Currency shown as the dashboard's single total_revenue figure
+PRIMARY_CURRENCY = 'USD'
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _apply(day, currency, plan_id, provider, **deltas):
+    """Add deltas to one ledger row, creating it on first use"""
+    key = {'day': day, 'currency': currency, 'pricing_plan_id': plan_id, 'provider': provider or ''}
+    updates = {name: F(name) + value for name, value in deltas.items()}
+    if LedgerDaily.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            LedgerDaily.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Created by a concurrent transaction since the update above
+        LedgerDaily.objects.filter(**key).update(**updates)
+
+
+def record_orders_created(orders):
+    """Count new orders, including ones inserted with bulk_create"""
+    counts = Counter(
+        (
+            timezone.localdate(order.created_at), order.currency, order.pricing_plan_id,
+            order.payment_method.provider if order.payment_method_id else ''
+        ) for order in orders
+    )
+    for key, count in counts.items():
+        _apply(*key, orders_created=count)
+
+
+def record_order_created(order):
+    record_orders_created([order])
+
+
+def record_payment_transition(payment, previous_status, now=None, previous_refunded_amount=None):
+    """
+    Account for a payment moving from previous_status (None for a new
+    payment) to its current status, and for money refunded since
+    previous_refunded_amount. A payment counts as one refund, however many
+    partial refunds it takes.
+    """
+    status = payment.status
+    previous_refunded = Decimal(previous_refunded_amount or 0)
+    refunded = Decimal(payment.refunded_amount or 0) - previous_refunded
+    if status == previous_status and refunded <= 0:
+        return
+    now = now or timezone.now()
+    key = (payment.currency, payment.order.pricing_plan_id, payment.provider)
+
+    counted_completed = previous_status in ('completed', 'refunded')
+    if status in ('completed', 'refunded') and not counted_completed:
+        # A refund reported before the capture still counts the capture
+        _apply(
+            timezone.localdate(payment.completed_at or now), *key,
+            payments_completed=1, gross_amount=payment.amount
+        )
+    if refunded > 0:
+        _apply(timezone.localdate(now), *key, refunds=0 if previous_refunded else 1, refunded_amount=refunded)
+    if status == 'failed' and previous_status != 'failed':
+        _apply(timezone.localdate(now), *key, payments_failed=1)
+    elif previous_status == 'failed' and status != 'failed':
+        # A capture recorded as failed went through after all; the failure
+        # is taken back on the day it is corrected
+        _apply(timezone.localdate(now), *key, payments_failed=-1)
+
+
+def _grouped(queryset, date_field, **aggregates):
+    return queryset.annotate(
+        day=TruncDate(date_field)
+    ).values('day', 'currency', 'plan', 'method_provider').annotate(**aggregates).order_by()
+
+
+def rebuild_ledger(start, end):
+    """
+    Recompute the ledger for days start..end (inclusive).
+
+    Refunds and failures are dated by the payment's updated_at, since the
+    exact transition time is not stored on the payment; partial refunds of
+    one payment all land on that day.
+
+    Returns:
+        number of ledger rows written
+    """
+    since, until = start_of_day(start), start_of_day(end + timedelta(days=1))
+    payments = Payment.objects.annotate(plan=F('order__pricing_plan'), method_provider=F('provider'))
+    sources = [
+        _grouped(
+            Order.objects.filter(created_at__gte=since, created_at__lt=until).annotate(
+                plan=F('pricing_plan'), method_provider=Coalesce('payment_method__provider', Value(''))
+            ),
+            'created_at', orders_created=Count('id')
+        ),
+        _grouped(
+            payments.filter(status__in=['completed', 'refunded'], completed_at__gte=since, completed_at__lt=until),
+            'completed_at', payments_completed=Count('id'), gross_amount=Sum('amount')
+        ),
+        _grouped(
+            payments.filter(refunded_amount__gt=0, updated_at__gte=since, updated_at__lt=until),
+            'updated_at', refunds=Count('id'), refunded_amount=Sum('refunded_amount')
+        ),
+        _grouped(
+            payments.filter(status='failed', updated_at__gte=since, updated_at__lt=until),
+            'updated_at', payments_failed=Count('id')
+        ),
+    ]
+
+    rows = {}
+    for source in sources:
+        for row in source:
+            key = (row.pop('day'), row.pop('currency'), row.pop('plan'), row.pop('method_provider') or '')
+            entry = rows.setdefault(key, dict.fromkeys(COUNTERS, 0))
+            for name, value in row.items():
+                entry[name] += value
+
+    ledger = [
+        LedgerDaily(day=day, currency=currency, pricing_plan_id=plan_id, provider=provider, **counters)
+        for (day, currency, plan_id, provider), counters in rows.items()
+    ]
+    with transaction.atomic():
+        LedgerDaily.objects.filter(day__gte=start, day__lte=end).delete()
+        LedgerDaily.objects.bulk_create(ledger)
+    return len(ledger)
+
+
+def rebuild_full_ledger(today=None):
+    """Rebuild the ledger from the first order up to today"""
+    today = today or timezone.localdate()
+    first = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+    start = min(timezone.localdate(first), today) if first else today
+    return start, today, rebuild_ledger(start, today)
+
+
+def ledger_report(start, end, group_by=()):
+    """
+    Ledger totals for days start..end (inclusive), per currency and the
+    requested dimensions ('day', 'plan', 'provider').
+    """
+    dimensions = ['currency']
+    for name in group_by:
+        dimensions.extend(GROUP_BY_FIELDS[name])
+
+    rows = LedgerDaily.objects.filter(day__gte=start, day__lte=end).values(*dimensions).annotate(
+        **{name: Sum(name) for name in COUNTERS}
+    ).order_by(*dimensions)
+
+    report = []
+    for row in rows:
+        row['net_amount'] = row['gross_amount'] - row['refunded_amount']
+        row['conversion_rate'] = (
+            round(row['payments_completed'] / row['orders_created'], 4) if row['orders_created'] else None
+        )
+        report.append(row)
+    return report
+
+
+def revenue_by_currency(start=None, end=None):
+    """Net revenue (gross minus refunds) per currency"""
+    rows = LedgerDaily.objects.all()
+    if start:
+        rows = rows.filter(day__gte=start)
+    if end:
+        rows = rows.filter(day__lte=end)
+    totals = rows.values('currency').annotate(
+        gross=Sum('gross_amount'), refunded=Sum('refunded_amount')
+    ).order_by('currency')
+    return {row['currency']: (row['gross'] or Decimal('0')) - (row['refunded'] or Decimal('0')) for row in totals}
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from payments.ledger import rebuild_full_ledger, rebuild_ledger
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily payments ledger from orders and payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Number of days up to and including today to rebuild (default: all history)')
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD); overrides --days')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD, default: today)')
+
+    def handle(self, *args, **options):
+        if options['days'] is None and not options['start']:
+            if options['end']:
+                raise CommandError('--end needs --start or --days')
+            start, end, written = rebuild_full_ledger()
+        else:
+            end = parse_date(options['end']) if options['end'] else timezone.localdate()
+            start = parse_date(options['start']) if options['start'] else end - timedelta(days=options['days'] - 1)
+            if start is None or end is None or start > end:
+                raise CommandError('Invalid date range')
+            written = rebuild_ledger(start, end)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt ledger for {start} to {end} into {written} rows"
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from payments.webhooks import process_webhook_events
+
+
+class Command(BaseCommand):
+    help = 'Verify stored payment webhooks and apply them in event order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Events processed per transaction')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, polling every N seconds (0 runs once)')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                while True:
+                    counts = process_webhook_events(batch_size=options['batch_size'])
+                    if not counts:
+                        break
+                    self.stdout.write(', '.join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,50 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from payments.reconciliation import DEFAULT_REFUND_LOOKBACK, DEFAULT_STALE_AFTER, reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Compare stale and recently completed payments with their provider and fix the ones that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Payments checked per page')
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Parallel provider lookups (bounded by each provider's connection pool)")
+        parser.add_argument('--rate', type=float, default=20,
+                            help='Provider lookups per second across all workers')
+        parser.add_argument('--stale-minutes', type=int, default=int(DEFAULT_STALE_AFTER.total_seconds() // 60),
+                            help='Check pending payments older than this')
+        parser.add_argument('--lookback-days', type=int, default=DEFAULT_REFUND_LOOKBACK.days,
+                            help='Check payments completed within this many days for refunds, and failed ones for a late capture')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report differences without changing anything')
+        parser.add_argument('--report', help='Write the differences to this file as JSON lines')
+
+    def handle(self, *args, **options):
+        counts, report = reconcile_payments(
+            batch_size=options['batch_size'],
+            max_workers=options['workers'],
+            rate=options['rate'],
+            dry_run=options['dry_run'],
+            stale_after=timedelta(minutes=options['stale_minutes']),
+            refund_lookback=timedelta(days=options['lookback_days'])
+        )
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                for row in report:
+                    f.write(json.dumps(row) + '\n')
+        else:
+            for row in report:
+                self.stdout.write(
+                    f"{row['payment_id']} {row['local_status']} -> {row['action']} "
+                    f"(PayPal: {row['provider_status'] or '-'}){' ' + row['error'] if row['error'] else ''}"
+                )
+
+        summary = ', '.join(f'{count} {action}' for action, count in sorted(counts.items())) or 'nothing to check'
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Dry run: ' if options['dry_run'] else ''}Reconciliation finished: {summary}"
+        ))
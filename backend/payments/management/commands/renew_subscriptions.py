@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.renewals import run_renewals
+
+
+class Command(BaseCommand):
+    help = 'Renew, cancel and expire subscriptions whose billing period has ended'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Subscriptions claimed per batch')
+        parser.add_argument('--workers', type=int, default=10,
+                            help='Parallel provider charges')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, polling every N seconds (0 runs once)')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                while True:
+                    counts = run_renewals(batch_size=options['batch_size'], max_workers=options['workers'])
+                    if not counts:
+                        break
+                    self.stdout.write(
+                        'Renewal batch: ' + ', '.join(f'{count} {outcome}' for outcome, count in sorted(counts.items()))
+                    )
+                    if sum(counts.values()) < options['batch_size']:
+                        break
+
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from payments.models import WebhookEvent
+from payments.webhooks import process_webhook_events, replay_webhook_events
+
+
+class Command(BaseCommand):
+    help = 'Queue stored payment webhooks for processing again'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_ids', nargs='*',
+                            help='Provider event ids to replay (default: all events matching the filters)')
+        parser.add_argument('--status', action='append', choices=['failed', 'invalid', 'ignored', 'processed'],
+                            help='Only replay events in this status (repeatable, default: failed)')
+        parser.add_argument('--event-type', help='Only replay this event type')
+        parser.add_argument('--since', help='Only replay events received at or after this ISO datetime')
+        parser.add_argument('--process', action='store_true',
+                            help='Process the replayed events right away')
+
+    def handle(self, *args, **options):
+        events = WebhookEvent.objects.all()
+        if options['event_ids']:
+            events = events.filter(event_id__in=options['event_ids'])
+            if options['status']:
+                events = events.filter(status__in=options['status'])
+        else:
+            events = events.filter(status__in=options['status'] or ['failed'])
+        if options['event_type']:
+            events = events.filter(event_type=options['event_type'])
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since datetime: {options['since']}")
+            events = events.filter(received_at__gte=since)
+
+        replayed = replay_webhook_events(events)
+        self.stdout.write(self.style.SUCCESS(f"Queued {replayed} events for processing"))
+
+        if options['process'] and replayed:
+            while True:
+                counts = process_webhook_events()
+                if not counts:
+                    break
+                self.stdout.write(', '.join(f"{count} {status}" for status, count in sorted(counts.items())))
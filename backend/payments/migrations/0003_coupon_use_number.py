@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def number_existing_usages(apps, schema_editor):
+    """Give each user's earlier uses of a coupon distinct use numbers"""
+    CouponUsage = apps.get_model('payments', 'CouponUsage')
+    seen = {}
+    to_update = []
+    for usage in CouponUsage.objects.order_by('coupon_id', 'user_id', 'used_at', 'id').only(
+        'id', 'coupon_id', 'user_id', 'use_number'
+    ).iterator():
+        key = (usage.coupon_id, usage.user_id)
+        seen[key] = seen.get(key, 0) + 1
+        if usage.use_number != seen[key]:
+            usage.use_number = seen[key]
+            to_update.append(usage)
+    CouponUsage.objects.bulk_update(to_update, ['use_number'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_webhook_events'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='couponusage',
+            name='use_number',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(number_existing_usages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='couponusage',
+            constraint=models.UniqueConstraint(fields=('coupon', 'user', 'use_number'), name='unique_coupon_use_per_user'),
+        ),
+    ]
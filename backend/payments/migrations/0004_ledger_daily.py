@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_coupon_use_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('currency', models.CharField(max_length=3)),
+                ('provider', models.CharField(blank=True, max_length=50)),
+                ('orders_created', models.PositiveIntegerField(default=0)),
+                ('payments_completed', models.PositiveIntegerField(default=0)),
+                ('gross_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payments_failed', models.PositiveIntegerField(default=0)),
+                ('refunds', models.PositiveIntegerField(default=0)),
+                ('refunded_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('pricing_plan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.pricingplan')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'unique_together': {('day', 'currency', 'pricing_plan', 'provider')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_ledger_daily'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='next_renewal_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='renewal_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='renewal_order',
+            field=models.ForeignKey(blank=True, help_text='Renewal order being charged; reused until the charge succeeds or is declined', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payments.order'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['status', 'current_period_end'], name='subscription_renewal_idx'),
+        ),
+    ]
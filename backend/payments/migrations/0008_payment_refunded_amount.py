@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:11
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_refunded_amount(apps, schema_editor):
+    # Refunds recorded so far were all full refunds
+    Payment = apps.get_model('payments', 'Payment')
+    Payment.objects.filter(status='refunded').update(refunded_amount=F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='refunded_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(fill_refunded_amount, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+from django.db import migrations
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+COUNTERS = ('orders_created', 'payments_completed', 'gross_amount', 'payments_failed', 'refunds', 'refunded_amount')
+
+
+def _grouped(queryset, date_field, **aggregates):
+    return queryset.annotate(
+        day=TruncDate(date_field)
+    ).values('day', 'currency', 'plan', 'method_provider').annotate(**aggregates).order_by()
+
+
+def backfill_ledger(apps, schema_editor):
+    """
+    Fill the daily ledger from all existing orders and payments, so reports
+    and the dashboard's revenue cover history from the first deploy on.
+
+    A frozen copy of payments.ledger.rebuild_ledger, so later changes to the
+    app code do not alter this migration.
+    """
+    LedgerDaily = apps.get_model('payments', 'LedgerDaily')
+    Order = apps.get_model('payments', 'Order')
+    Payment = apps.get_model('payments', 'Payment')
+
+    payments = Payment.objects.annotate(plan=F('order__pricing_plan'), method_provider=F('provider'))
+    sources = [
+        _grouped(
+            Order.objects.annotate(
+                plan=F('pricing_plan'), method_provider=Coalesce('payment_method__provider', Value(''))
+            ),
+            'created_at', orders_created=Count('id')
+        ),
+        _grouped(
+            payments.filter(status__in=['completed', 'refunded'], completed_at__isnull=False),
+            'completed_at', payments_completed=Count('id'), gross_amount=Sum('amount')
+        ),
+        _grouped(
+            payments.filter(refunded_amount__gt=0),
+            'updated_at', refunds=Count('id'), refunded_amount=Sum('refunded_amount')
+        ),
+        _grouped(payments.filter(status='failed'), 'updated_at', payments_failed=Count('id')),
+    ]
+
+    rows = {}
+    for source in sources:
+        for row in source:
+            key = (row.pop('day'), row.pop('currency'), row.pop('plan'), row.pop('method_provider') or '')
+            entry = rows.setdefault(key, dict.fromkeys(COUNTERS, 0))
+            for name, value in row.items():
+                entry[name] += value
+
+    LedgerDaily.objects.all().delete()
+    LedgerDaily.objects.bulk_create([
+        LedgerDaily(day=day, currency=currency, pricing_plan_id=plan_id, provider=provider, **counters)
+        for (day, currency, plan_id, provider), counters in rows.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_payment_refunded_amount'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
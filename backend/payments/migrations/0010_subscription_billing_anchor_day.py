@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_backfill_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='billing_anchor_day',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Day of month periods end on; set at the first renewal, shorter months end on their last day', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_idempotencykey_failed_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='renewal_retries',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Charges of the current renewal retried after a provider error or a pending result'),
+        ),
+    ]
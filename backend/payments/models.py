@@ -1,9 +1,16 @@
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
 from django.conf import settings
 from django.utils import timezone
 import uuid
 
 
+class CouponRedemptionError(Exception):
+    """The coupon could not be redeemed (invalid, used up, or per-user limit reached)"""
+
+
 class PaymentMethod(models.Model):
     """Supported payment methods"""
     PROVIDER_CHOICES = [
@@ -113,6 +120,11 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Admin browsing: newest first, optionally by status, keyset on (created_at, id)
+            models.Index(fields=['status', 'created_at', 'id'], name='order_status_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_id} - {self.user.email}"
@@ -121,6 +133,16 @@ class Order(models.Model):
         self.status = 'paid'
         self.paid_at = timezone.now()
         self.save()
+    
+    def enroll_user(self):
+        """Enroll the buyer in the plan's program, if it has one"""
+        if self.pricing_plan and self.pricing_plan.program:
+            from programs.models import Enrollment
+            Enrollment.objects.get_or_create(
+                user=self.user,
+                program=self.pricing_plan.program,
+                defaults={'status': 'ongoing'}
+            )
 
 
 class Payment(models.Model):
@@ -139,11 +161,14 @@ class Payment(models.Model):
     provider = models.CharField(max_length=50)  # paypal, stripe, mpesa, etc.
     provider_payment_id = models.CharField(max_length=255, blank=True)  # PayPal order ID, etc.
     provider_payer_id = models.CharField(max_length=255, blank=True)
+    provider_capture_id = models.CharField(max_length=255, blank=True, db_index=True)  # PayPal capture ID
     
     # Transaction details
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, default='USD')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Total refunded so far; the status becomes refunded once it reaches amount
+    refunded_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
     # Response from payment provider
     provider_response = models.JSONField(default=dict, blank=True)
@@ -158,6 +183,32 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment {self.payment_id} - {self.status}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so post_save can record status transitions and refunds in the ledger
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_refunded_amount = instance.__dict__.get('refunded_amount')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        previous = getattr(self, '_loaded_status', None)
+        with transaction.atomic():
+            if self.pk and previous is not None and self.status != previous:
+                # Claim the transition with a conditional UPDATE. If another
+                # process (e.g. the webhook worker) moved the payment first, its
+                # status is kept and post_save sees no transition, so the ledger
+                # never counts one twice
+                if not Payment.objects.filter(pk=self.pk, status=previous).update(status=self.status):
+                    current = Payment.objects.filter(pk=self.pk).values_list('status', 'refunded_amount').first()
+                    if current is not None:
+                        self.status, self.refunded_amount = current
+                        self._loaded_status, self._loaded_refunded_amount = current
+            if self.status == 'refunded' and Decimal(self.refunded_amount or 0) < Decimal(self.amount):
+                # A full refund reported without an amount
+                self.refunded_amount = self.amount
+            super().save(*args, **kwargs)
+    
     def mark_as_completed(self, provider_response=None):
         self.status = 'completed'
         self.completed_at = timezone.now()
@@ -165,8 +216,33 @@ class Payment(models.Model):
             self.provider_response = provider_response
         self.save()
         
-        # Also mark the order as paid
-        self.order.mark_as_paid()
+        # Also mark the order as paid, unless a concurrent refund got there first
+        if self.status == 'completed':
+            self.order.mark_as_paid()
+    
+    def record_refund(self, refunded_amount, provider_response=None):
+        """
+        Record the provider's running refund total. The payment and its order
+        become refunded once the whole amount has been refunded; a partial
+        refund only raises refunded_amount.
+        
+        Returns:
+            True if the refund total changed
+        """
+        refunded_amount = min(Decimal(refunded_amount), Decimal(self.amount))
+        if self.status == 'refunded' or refunded_amount <= Decimal(self.refunded_amount or 0):
+            return False
+        self.refunded_amount = refunded_amount
+        if refunded_amount >= Decimal(self.amount):
+            self.status = 'refunded'
+        if provider_response:
+            self.provider_response = provider_response
+        self.save()
+        
+        if self.status == 'refunded':
+            self.order.status = 'refunded'
+            self.order.save()
+        return True
 
 
 class Subscription(models.Model):
@@ -196,11 +272,29 @@ class Subscription(models.Model):
     cancelled_at = models.DateTimeField(null=True, blank=True)
     cancel_at_period_end = models.BooleanField(default=False)
     
+    # Renewal (see payments/renewals.py)
+    renewal_order = models.ForeignKey(
+        Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+        help_text='Renewal order being charged; reused until the charge succeeds or is declined'
+    )
+    renewal_attempts = models.PositiveSmallIntegerField(default=0)
+    renewal_retries = models.PositiveSmallIntegerField(
+        default=0, help_text='Charges of the current renewal retried after a provider error or a pending result'
+    )
+    next_renewal_attempt_at = models.DateTimeField(null=True, blank=True)
+    billing_anchor_day = models.PositiveSmallIntegerField(
+        null=True, blank=True,
+        help_text='Day of month periods end on; set at the first renewal, shorter months end on their last day'
+    )
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'current_period_end'], name='subscription_renewal_idx'),
+        ]
     
     def __str__(self):
         return f"Subscription {self.subscription_id} - {self.user.email}"
@@ -249,6 +343,56 @@ class Coupon(models.Model):
         if self.max_uses and self.times_used >= self.max_uses:
             return False
         return True
+    
+    def discounted_price(self, price):
+        """Price after this coupon's discount, never below zero"""
+        if self.discount_type == 'percentage':
+            discount = price * (self.discount_value / 100)
+        else:
+            discount = self.discount_value
+        return max(Decimal('0'), price - discount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    
+    def redeem(self, user, order):
+        """
+        Claim one use of the coupon for an order.
+        
+        The global limit is enforced by a conditional UPDATE, so concurrent
+        redemptions cannot push times_used past max_uses. The per-user limit
+        is enforced by the unique (coupon, user, use_number) constraint on
+        CouponUsage. Both happen in one transaction; a failure rolls back
+        the counter.
+        
+        Raises:
+            CouponRedemptionError
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            claimed = Coupon.objects.filter(
+                Q(valid_until__isnull=True) | Q(valid_until__gte=now),
+                Q(max_uses__isnull=True) | Q(max_uses=0) | Q(times_used__lt=F('max_uses')),
+                pk=self.pk,
+                is_active=True,
+                valid_from__lte=now
+            ).update(times_used=F('times_used') + 1)
+            if not claimed:
+                raise CouponRedemptionError('Coupon is expired or no longer valid')
+            
+            # Lowest free number, so uses freed by deleted usages are reused
+            taken = set(CouponUsage.objects.filter(coupon=self, user=user).values_list('use_number', flat=True))
+            use_number = next(
+                (number for number in range(1, self.max_uses_per_user + 1) if number not in taken), None
+            )
+            if use_number is None:
+                raise CouponRedemptionError('Coupon usage limit reached for this user')
+            try:
+                with transaction.atomic():
+                    usage = CouponUsage.objects.create(coupon=self, user=user, order=order, use_number=use_number)
+            except IntegrityError:
+                # A concurrent redemption by the same user took this use
+                raise CouponRedemptionError('Coupon usage limit reached for this user')
+        
+        self.times_used += 1
+        return usage
 
 
 class CouponUsage(models.Model):
@@ -256,7 +400,109 @@ class CouponUsage(models.Model):
     coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='usages')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    use_number = models.PositiveIntegerField(default=1)  # 1..coupon.max_uses_per_user for this user
     used_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         unique_together = ['coupon', 'order']
+        constraints = [
+            models.UniqueConstraint(fields=['coupon', 'user', 'use_number'], name='unique_coupon_use_per_user'),
+        ]
+
+
+class WebhookEvent(models.Model):
+    """
+    Raw provider webhook, stored on receipt and applied later by
+    process_webhook_events
+    """
+    STATUS_CHOICES = [
+        ('received', 'Received'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('invalid', 'Invalid Signature'),
+        ('failed', 'Failed'),
+    ]
+
+    provider = models.CharField(max_length=50)
+    event_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=100, blank=True)
+    event_time = models.DateTimeField(default=timezone.now)
+
+    # Exactly as received; signatures are computed over the raw body
+    headers = models.JSONField(default=dict, blank=True)
+    body = models.TextField()
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='received')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-received_at']
+        unique_together = ['provider', 'event_id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type} {self.event_id} - {self.status}"
+
+
+class LedgerDaily(models.Model):
+    """
+    Daily payment totals per currency, plan and provider, maintained on order
+    creation and payment status transitions (see payments/ledger.py)
+    """
+    day = models.DateField()
+    currency = models.CharField(max_length=3)
+    pricing_plan = models.ForeignKey(PricingPlan, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    provider = models.CharField(max_length=50, blank=True)
+
+    orders_created = models.PositiveIntegerField(default=0)
+    payments_completed = models.PositiveIntegerField(default=0)
+    gross_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments_failed = models.PositiveIntegerField(default=0)
+    refunds = models.PositiveIntegerField(default=0)
+    refunded_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-day']
+        unique_together = ['day', 'currency', 'pricing_plan', 'provider']
+
+    def __str__(self):
+        return f"{self.day} {self.currency} {self.provider or '-'}: {self.gross_amount}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a request sent with an Idempotency-Key header, replayed to
+    retries of the same request (see payments/idempotency.py)
+    """
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} - {self.status}"
@@ -0,0 +1,156 @@
+"""
+M-Pesa Payment Service
+Handles Safaricom Daraja (Lipa Na M-Pesa Online) API interactions
+
+STK push prompts the customer's phone for their PIN; the result arrives
+later as a callback to our server. Calls share the pooled, token-caching
+client in payments/clients.py. Daraja has no request ids, so an STK push is
+never retried (a retry could prompt the customer twice); queries are.
+"""
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+
+from .clients import GatewayError, PooledApiClient
+
+# Daraja timestamps are in East Africa Time
+EAT = dt_timezone(timedelta(hours=3), 'EAT')
+
+# STK query answers this while the customer has not responded yet
+PROCESSING_ERROR_CODE = '500.001.1001'
+
+
+class MpesaError(GatewayError):
+    """An M-Pesa call failed; status_code is None for network errors"""
+
+
+class MpesaService(PooledApiClient):
+    """Service class for M-Pesa STK push payments"""
+    name = 'M-Pesa'
+    error_class = MpesaError
+
+    def __init__(self, consumer_key=None, consumer_secret=None, shortcode=None, passkey=None, environment=None,
+                 base_url=None, connect_timeout=None, read_timeout=None, max_retries=None, pool_size=None,
+                 **kwargs):
+        self.consumer_key = consumer_key if consumer_key is not None else getattr(settings, 'MPESA_CONSUMER_KEY', '')
+        self.consumer_secret = consumer_secret if consumer_secret is not None else getattr(
+            settings, 'MPESA_CONSUMER_SECRET', ''
+        )
+        self.shortcode = shortcode if shortcode is not None else getattr(settings, 'MPESA_SHORTCODE', '')
+        self.passkey = passkey if passkey is not None else getattr(settings, 'MPESA_PASSKEY', '')
+        self.environment = environment or getattr(settings, 'MPESA_ENVIRONMENT', 'sandbox')
+
+        if not base_url:
+            base_url = 'https://api.safaricom.co.ke' if self.environment == 'production' \
+                else 'https://sandbox.safaricom.co.ke'
+
+        super().__init__(
+            base_url,
+            timeout=(
+                connect_timeout if connect_timeout is not None else getattr(settings, 'MPESA_CONNECT_TIMEOUT', 3.05),
+                read_timeout if read_timeout is not None else getattr(settings, 'MPESA_READ_TIMEOUT', 20),
+            ),
+            max_retries=max_retries if max_retries is not None else getattr(settings, 'MPESA_MAX_RETRIES', 2),
+            pool_size=pool_size or getattr(settings, 'MPESA_POOL_SIZE', 10),
+            **kwargs
+        )
+
+    def _fetch_token(self, session):
+        """Get OAuth access token from Daraja"""
+        response = self._send(
+            session, 'GET', '/oauth/v1/generate?grant_type=client_credentials',
+            auth=(self.consumer_key, self.consumer_secret)
+        )
+        if response.status_code != 200:
+            raise MpesaError(
+                f"Failed to get M-Pesa access token: {response.text}", response.status_code, response.text
+            )
+        data = response.json()
+        # Daraja sends expires_in as a string
+        return data.get('access_token'), int(data.get('expires_in') or 0)
+
+    def _password(self, now=None):
+        timestamp = (now or datetime.now(EAT)).astimezone(EAT).strftime('%Y%m%d%H%M%S')
+        password = base64.b64encode(f'{self.shortcode}{self.passkey}{timestamp}'.encode()).decode()
+        return password, timestamp
+
+    def stk_push(self, amount, phone_number, account_reference, description, callback_url):
+        """
+        Prompt a customer to pay a paybill amount from their phone
+
+        Args:
+            amount: Whole KES amount
+            phone_number: Customer MSISDN, 2547XXXXXXXX or 2541XXXXXXXX
+            account_reference: Shown to the customer (max 12 characters)
+            description: Transaction description (max 13 characters)
+            callback_url: HTTPS URL Safaricom posts the result to
+
+        Returns:
+            dict with checkout_request_id and merchant_request_id
+        """
+        password, timestamp = self._password()
+        payload = {
+            'BusinessShortCode': self.shortcode,
+            'Password': password,
+            'Timestamp': timestamp,
+            'TransactionType': 'CustomerPayBillOnline',
+            'Amount': int(Decimal(amount)),
+            'PartyA': phone_number,
+            'PartyB': self.shortcode,
+            'PhoneNumber': phone_number,
+            'CallBackURL': callback_url,
+            'AccountReference': account_reference[:12],
+            'TransactionDesc': description[:13],
+        }
+
+        response = self._request(
+            'POST', '/mpesa/stkpush/v1/processrequest',
+            headers={'Content-Type': 'application/json'}, max_retries=0, json=payload
+        )
+
+        data = response.json() if response.content else {}
+        if response.status_code != 200 or str(data.get('ResponseCode')) != '0':
+            raise MpesaError(f"Failed to send M-Pesa STK push: {response.text}", response.status_code, response.text)
+        return {
+            'checkout_request_id': data.get('CheckoutRequestID'),
+            'merchant_request_id': data.get('MerchantRequestID'),
+            'customer_message': data.get('CustomerMessage', ''),
+            'raw_response': data
+        }
+
+    def stk_query(self, checkout_request_id):
+        """
+        Get the result of an STK push
+
+        Returns:
+            dict with result_code (int, or None while the customer has not
+            answered yet) and result_desc
+        """
+        password, timestamp = self._password()
+        response = self._request(
+            'POST', '/mpesa/stkpushquery/v1/query',
+            headers={'Content-Type': 'application/json'},
+            json={
+                'BusinessShortCode': self.shortcode,
+                'Password': password,
+                'Timestamp': timestamp,
+                'CheckoutRequestID': checkout_request_id,
+            }
+        )
+
+        data = response.json() if response.content else {}
+        if data.get('errorCode') == PROCESSING_ERROR_CODE:
+            return {'result_code': None, 'result_desc': data.get('errorMessage', ''), 'raw_response': data}
+        if response.status_code != 200 or 'ResultCode' not in data:
+            raise MpesaError(f"Failed to query M-Pesa STK push: {response.text}", response.status_code, response.text)
+        return {
+            'result_code': int(data['ResultCode']),
+            'result_desc': data.get('ResultDesc', ''),
+            'raw_response': data
+        }
+
+
+# Create a singleton instance
+mpesa_service = MpesaService()
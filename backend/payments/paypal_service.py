@@ -1,65 +1,78 @@
 """
 PayPal Payment Service
 Handles all PayPal API interactions
+
+Calls go through the pooled, token-caching client in payments/clients.py.
+Writes carry a PayPal-Request-Id that is reused across retries, so a retried
+create/capture/refund is applied once by PayPal.
 """
 import os
-import requests
-import base64
+import time
+import uuid
 from django.conf import settings
 
+from .clients import GatewayError, PooledApiClient
+
+
+class PayPalError(GatewayError):
+    """A PayPal call failed; status_code is None for network errors"""
+
 
-class PayPalService:
+class PayPalService(PooledApiClient):
     """Service class for PayPal payment operations"""
+    name = 'PayPal'
+    error_class = PayPalError
     
-    def __init__(self):
-        self.client_id = os.getenv('PAYPAL_CLIENT_ID', '')
-        self.client_secret = os.getenv('PAYPAL_CLIENT_SECRET', '')
-        self.mode = os.getenv('PAYPAL_MODE', 'sandbox')
+    def __init__(self, client_id=None, client_secret=None, mode=None, base_url=None,
+                 connect_timeout=None, read_timeout=None, max_retries=None, pool_size=None,
+                 clock=time.monotonic):
+        self.client_id = client_id if client_id is not None else os.getenv('PAYPAL_CLIENT_ID', '')
+        self.client_secret = client_secret if client_secret is not None else os.getenv('PAYPAL_CLIENT_SECRET', '')
+        self.mode = mode or os.getenv('PAYPAL_MODE', 'sandbox')
         
         # API URLs
-        if self.mode == 'live':
-            self.base_url = 'https://api-m.paypal.com'
-        else:
-            self.base_url = 'https://api-m.sandbox.paypal.com'
+        if not base_url:
+            base_url = 'https://api-m.paypal.com' if self.mode == 'live' else 'https://api-m.sandbox.paypal.com'
         
-        self._access_token = None
+        super().__init__(
+            base_url,
+            timeout=(
+                connect_timeout if connect_timeout is not None else getattr(settings, 'PAYPAL_CONNECT_TIMEOUT', 3.05),
+                read_timeout if read_timeout is not None else getattr(settings, 'PAYPAL_READ_TIMEOUT', 20),
+            ),
+            max_retries=max_retries if max_retries is not None else getattr(settings, 'PAYPAL_MAX_RETRIES', 2),
+            pool_size=pool_size or getattr(settings, 'PAYPAL_POOL_SIZE', 10),
+            clock=clock
+        )
     
-    def _get_access_token(self):
+    def _fetch_token(self, session):
         """Get OAuth access token from PayPal"""
-        if self._access_token:
-            return self._access_token
-        
-        auth = base64.b64encode(
-            f"{self.client_id}:{self.client_secret}".encode()
-        ).decode()
-        
-        headers = {
-            'Authorization': f'Basic {auth}',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
-        response = requests.post(
-            f'{self.base_url}/v1/oauth2/token',
-            headers=headers,
+        response = self._send(
+            session, 'POST', '/v1/oauth2/token',
+            auth=(self.client_id, self.client_secret),
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
             data={'grant_type': 'client_credentials'}
         )
-        
-        if response.status_code == 200:
-            self._access_token = response.json().get('access_token')
-            return self._access_token
-        else:
-            raise Exception(f"Failed to get PayPal access token: {response.text}")
+        if response.status_code != 200:
+            raise PayPalError(
+                f"Failed to get PayPal access token: {response.text}",
+                response.status_code, response.text
+            )
+        data = response.json()
+        return data.get('access_token'), int(data.get('expires_in', 0))
     
-    def _get_headers(self):
-        """Get headers for API requests"""
-        token = self._get_access_token()
-        return {
-            'Authorization': f'Bearer {token}',
+    def _request(self, method, path, request_id=None, **kwargs):
+        """Authenticated call carrying PayPal-Request-Id, so retried writes are applied once"""
+        headers = {
             'Content-Type': 'application/json',
             'Prefer': 'return=representation'
         }
+        if request_id:
+            headers['PayPal-Request-Id'] = request_id
+        return super()._request(method, path, headers=headers, **kwargs)
     
-    def create_order(self, amount, currency='USD', description='', order_id=None, return_url=None, cancel_url=None):
+    def create_order(self, amount, currency='USD', description='', order_id=None, return_url=None, cancel_url=None,
+                     request_id=None):
         """
         Create a PayPal order
         
@@ -70,6 +83,7 @@ class PayPalService:
             order_id: Internal order ID for reference
             return_url: URL to redirect after payment approval
             cancel_url: URL to redirect if payment is cancelled
+            request_id: PayPal-Request-Id; a fresh one is generated if omitted
         
         Returns:
             dict with paypal_order_id and approval_url
@@ -100,9 +114,9 @@ class PayPalService:
             }
         }
         
-        response = requests.post(
-            f'{self.base_url}/v2/checkout/orders',
-            headers=self._get_headers(),
+        response = self._request(
+            'POST', '/v2/checkout/orders',
+            request_id=request_id or str(uuid.uuid4()),
             json=payload
         )
         
@@ -123,21 +137,26 @@ class PayPalService:
                 'raw_response': data
             }
         else:
-            raise Exception(f"Failed to create PayPal order: {response.text}")
+            raise PayPalError(f"Failed to create PayPal order: {response.text}", response.status_code, response.text)
     
-    def capture_order(self, paypal_order_id):
+    def capture_order(self, paypal_order_id, request_id=None):
         """
         Capture (complete) a PayPal order after approval
         
         Args:
             paypal_order_id: The PayPal order ID to capture
+            request_id: PayPal-Request-Id; pass one that is stable per
+                payment so a retried capture gets the original result. A
+                fresh one is used by default, so a declined capture can be
+                retried once the buyer picks another funding source
+                (retries inside one call reuse it)
         
         Returns:
             dict with capture details
         """
-        response = requests.post(
-            f'{self.base_url}/v2/checkout/orders/{paypal_order_id}/capture',
-            headers=self._get_headers()
+        response = self._request(
+            'POST', f'/v2/checkout/orders/{paypal_order_id}/capture',
+            request_id=request_id or f'capture-{paypal_order_id}-{uuid.uuid4().hex}'
         )
         
         if response.status_code in [200, 201]:
@@ -159,7 +178,61 @@ class PayPalService:
                 'raw_response': data
             }
         else:
-            raise Exception(f"Failed to capture PayPal order: {response.text}")
+            raise PayPalError(f"Failed to capture PayPal order: {response.text}", response.status_code, response.text)
+    
+    def charge_vaulted_payment(self, amount, currency, vault_id, description='', order_id=None, request_id=None):
+        """
+        Charge a saved PayPal payment method without buyer approval
+        
+        Args:
+            amount: Amount to charge
+            currency: Currency code
+            vault_id: PayPal vault id of the saved payment method
+            description: Order description
+            order_id: Internal order ID for reference
+            request_id: PayPal-Request-Id; defaults to one derived from the
+                internal order so a retried charge is applied once
+        
+        Returns:
+            dict with capture details, as capture_order
+        """
+        payload = {
+            'intent': 'CAPTURE',
+            'purchase_units': [{
+                'reference_id': str(order_id) if order_id else None,
+                'description': description,
+                'amount': {
+                    'currency_code': currency,
+                    'value': str(amount)
+                }
+            }],
+            'payment_source': {
+                'paypal': {'vault_id': vault_id}
+            }
+        }
+        
+        response = self._request(
+            'POST', '/v2/checkout/orders',
+            request_id=request_id or (f'charge-{order_id}' if order_id else str(uuid.uuid4())),
+            json=payload
+        )
+        
+        if response.status_code in [200, 201]:
+            data = response.json()
+            captures = []
+            if data.get('purchase_units'):
+                captures = data['purchase_units'][0].get('payments', {}).get('captures', [])
+            capture_details = captures[0] if captures else {}
+            return {
+                'paypal_order_id': data.get('id'),
+                'status': data.get('status'),
+                'payer': data.get('payer', {}),
+                'capture_id': capture_details.get('id'),
+                'capture_status': capture_details.get('status'),
+                'raw_response': data
+            }
+        else:
+            raise PayPalError(f"Failed to charge PayPal vault: {response.text}", response.status_code, response.text)
     
     def get_order_details(self, paypal_order_id):
         """
@@ -171,17 +244,14 @@ class PayPalService:
         Returns:
             dict with order details
         """
-        response = requests.get(
-            f'{self.base_url}/v2/checkout/orders/{paypal_order_id}',
-            headers=self._get_headers()
-        )
+        response = self._request('GET', f'/v2/checkout/orders/{paypal_order_id}')
         
         if response.status_code == 200:
             return response.json()
         else:
-            raise Exception(f"Failed to get PayPal order details: {response.text}")
+            raise PayPalError(f"Failed to get PayPal order details: {response.text}", response.status_code, response.text)
     
-    def refund_payment(self, capture_id, amount=None, currency='USD', note=''):
+    def refund_payment(self, capture_id, amount=None, currency='USD', note='', request_id=None):
         """
         Refund a captured payment
         
@@ -190,6 +260,7 @@ class PayPalService:
             amount: Amount to refund (None for full refund)
             currency: Currency code
             note: Refund note
+            request_id: PayPal-Request-Id; a fresh one is generated if omitted
         
         Returns:
             dict with refund details
@@ -203,16 +274,16 @@ class PayPalService:
         if note:
             payload['note_to_payer'] = note
         
-        response = requests.post(
-            f'{self.base_url}/v2/payments/captures/{capture_id}/refund',
-            headers=self._get_headers(),
+        response = self._request(
+            'POST', f'/v2/payments/captures/{capture_id}/refund',
+            request_id=request_id or str(uuid.uuid4()),
             json=payload
         )
         
         if response.status_code in [200, 201]:
             return response.json()
         else:
-            raise Exception(f"Failed to refund PayPal payment: {response.text}")
+            raise PayPalError(f"Failed to refund PayPal payment: {response.text}", response.status_code, response.text)
     
     def verify_webhook_signature(self, headers, body, webhook_id=None):
         """
@@ -239,11 +310,7 @@ class PayPalService:
             'webhook_event': body
         }
         
-        response = requests.post(
-            f'{self.base_url}/v1/notifications/verify-webhook-signature',
-            headers=self._get_headers(),
-            json=payload
-        )
+        response = self._request('POST', '/v1/notifications/verify-webhook-signature', json=payload)
         
         if response.status_code == 200:
             return response.json().get('verification_status') == 'SUCCESS'
@@ -0,0 +1,231 @@
+"""
+Payment Reconciliation
+Compares local payments with their provider and repairs the ones that
+drifted: pending payments whose capture response or callback was lost,
+payments recorded as failed that the provider captured after all, and
+completed payments refunded or reversed at PayPal without a webhook reaching
+us.
+
+Candidates are paged by primary key (keyset), each page is looked up in
+parallel through the provider's gateway under a shared request rate, and
+corrections are written per page with bulk updates. Payments that changed
+locally while PayPal was being asked are left alone.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .clients import GatewayError
+from .gateways import GATEWAYS, get_gateway
+from .ledger import record_payment_transition
+from .models import Order, Payment
+
+logger = logging.getLogger(__name__)
+
+# Pending payments younger than this are still in the normal checkout flow
+DEFAULT_STALE_AFTER = timedelta(minutes=30)
+
+# Completed payments are checked for refunds, and failed ones for a late
+# capture, for this long
+DEFAULT_REFUND_LOOKBACK = timedelta(days=30)
+
+# Everyone waits this long after a provider still answers 429 once retries are spent
+RATE_LIMIT_PAUSE = 10
+
+
+class RateLimiter:
+    """Spaces requests from all threads evenly; pause() holds them all back"""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_at = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+
+@dataclass
+class Finding:
+    payment_id: str
+    order_id: str
+    local_status: str
+    provider_status: str = ''
+    # Local status the provider implies, or None when nothing should change
+    expected_status: str = None
+    capture_id: str = ''
+    response: dict = field(default_factory=dict, repr=False)
+    error: str = ''
+
+    @property
+    def action(self):
+        if self.error:
+            return 'error'
+        if self.expected_status and self.expected_status != self.local_status:
+            return self.expected_status
+        return 'unchanged'
+
+    def as_dict(self):
+        return {
+            'payment_id': self.payment_id,
+            'order_id': self.order_id,
+            'local_status': self.local_status,
+            'provider_status': self.provider_status,
+            'action': self.action,
+            'error': self.error,
+        }
+
+
+def candidate_payments(now=None, stale_after=DEFAULT_STALE_AFTER, refund_lookback=DEFAULT_REFUND_LOOKBACK):
+    now = now or timezone.now()
+    return Payment.objects.filter(provider__in=list(GATEWAYS)).exclude(provider_payment_id='').filter(
+        Q(status='pending', created_at__lte=now - stale_after)
+        | Q(status='completed', completed_at__gte=now - refund_lookback)
+        | Q(status='failed', updated_at__gte=now - refund_lookback)
+    )
+
+
+def check_payment(payment, limiter, now):
+    finding = Finding(str(payment.payment_id), str(payment.order.order_id), payment.status)
+    limiter.wait()
+    try:
+        result = get_gateway(payment.provider).query_status(payment, now)
+    except GatewayError as e:
+        if e.status_code == 429:
+            limiter.pause(RATE_LIMIT_PAUSE)
+        finding.error = str(e)
+        return finding
+
+    finding.provider_status = result.provider_status
+    finding.expected_status = result.status
+    finding.capture_id = result.capture_id
+    finding.response = result.raw
+    return finding
+
+
+def apply_findings(findings, now=None):
+    """
+    Write the corrections from one page of findings in bulk.
+
+    Only forward moves are applied (pending -> completed/failed,
+    completed -> refunded, and failed -> completed for a capture that went
+    through after all), to payments still in the status that was checked.
+
+    Returns:
+        number of payments corrected
+    """
+    now = now or timezone.now()
+    allowed = {
+        ('pending', 'completed'), ('pending', 'failed'), ('pending', 'refunded'), ('completed', 'refunded'),
+        ('failed', 'completed'),
+    }
+    changes = {
+        finding.payment_id: finding for finding in findings
+        if (finding.local_status, finding.action) in allowed
+    }
+    if not changes:
+        return 0
+
+    with transaction.atomic():
+        payments = list(
+            Payment.objects.select_for_update(of=('self',)).select_related('order').filter(
+                payment_id__in=list(changes)
+            )
+        )
+        payments = [payment for payment in payments if payment.status == changes[str(payment.payment_id)].local_status]
+
+        orders = {}
+        for payment in payments:
+            finding = changes[str(payment.payment_id)]
+            payment.status = finding.expected_status
+            payment.provider_response = finding.response
+            payment.updated_at = now
+            if finding.capture_id:
+                payment.provider_capture_id = finding.capture_id
+            if finding.expected_status in ('completed', 'refunded') and payment.completed_at is None:
+                payment.completed_at = now
+            if finding.expected_status == 'refunded':
+                payment.refunded_amount = payment.amount
+            orders.setdefault(finding.expected_status, []).append(payment.order_id)
+
+        Payment.objects.bulk_update(
+            payments, ['status', 'refunded_amount', 'provider_response', 'provider_capture_id', 'completed_at',
+                       'updated_at']
+        )
+        order_updates = {
+            'completed': {'status': 'paid', 'paid_at': now},
+            'refunded': {'status': 'refunded'},
+            'failed': {'status': 'failed'},
+        }
+        for status, order_ids in orders.items():
+            queryset = Order.objects.filter(id__in=order_ids)
+            if status == 'failed':
+                queryset = queryset.filter(status__in=['pending', 'processing'])
+            queryset.update(**order_updates[status], updated_at=now)
+
+        # Bulk updates skip post_save, so the ledger is told directly
+        for payment in payments:
+            record_payment_transition(
+                payment, changes[str(payment.payment_id)].local_status, now=now,
+                previous_refunded_amount=payment._loaded_refunded_amount
+            )
+
+        # A repaired capture (e.g. a lost M-Pesa callback) still owes the buyer their enrollment
+        completed = [payment.order_id for payment in payments if payment.status == 'completed']
+        for order in Order.objects.select_related('user', 'pricing_plan__program').filter(id__in=completed):
+            order.enroll_user()
+    return len(payments)
+
+
+def reconcile_payments(batch_size=200, max_workers=8, rate=20, dry_run=False, now=None,
+                       stale_after=DEFAULT_STALE_AFTER, refund_lookback=DEFAULT_REFUND_LOOKBACK):
+    """
+    Check every candidate payment against its provider and fix drifted ones.
+
+    Args:
+        rate: Provider lookups per second across all threads
+
+    Returns:
+        (Counter of actions, list of report rows for payments that differ or
+        could not be checked)
+    """
+    now = now or timezone.now()
+    limiter = RateLimiter(rate)
+    candidates = candidate_payments(now, stale_after, refund_lookback).select_related('order').order_by('id')
+    counts, report = Counter(), []
+    last_id = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            page = list(candidates.filter(id__gt=last_id)[:batch_size])
+            if not page:
+                break
+            last_id = page[-1].id
+
+            findings = list(executor.map(lambda payment: check_payment(payment, limiter, now), page))
+            corrected = 0 if dry_run else apply_findings(findings, now=now)
+            counts['corrected'] += corrected
+            for finding in findings:
+                counts[finding.action] += 1
+                if finding.action != 'unchanged':
+                    report.append(finding.as_dict())
+            logger.info(f"Reconciled {len(page)} payments up to id {last_id}, {corrected} corrected")
+
+    return counts, report
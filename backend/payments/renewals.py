@@ -0,0 +1,289 @@
+"""
+Subscription Renewals
+Renews, cancels and expires subscriptions whose period has ended.
+
+Each run claims a batch of due subscriptions with SELECT ... FOR UPDATE SKIP
+LOCKED, creates their renewal orders in bulk and leases them by pushing
+next_renewal_attempt_at forward before committing, so concurrent runs on
+other hosts skip them. Charges are then sent through a bounded thread pool
+with no database locks held, and each outcome is recorded under a fresh row
+lock.
+
+A renewal order is reused until its charge succeeds or is declined, and the
+provider request id is derived from it, so a charge retried after a crash or
+timeout is applied once by the provider, and a charge the provider reported
+as pending is asked about again rather than made twice. Such retries back
+off, and a renewal still failing with provider errors after RETRY_LIMIT
+retries expires the subscription.
+"""
+import calendar
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .clients import GatewayError
+from .gateways import get_gateway
+from .ledger import record_orders_created
+from .models import Order, Payment, PaymentMethod, Subscription
+
+logger = logging.getLogger(__name__)
+
+BILLING_CYCLE_MONTHS = {'monthly': 1, 'quarterly': 3, 'yearly': 12}
+
+# How long a claimed renewal is hidden from other runs while it is charged
+LEASE = timedelta(minutes=15)
+
+# Delay before retrying a declined renewal; the subscription expires when a
+# decline happens with no retries left
+DECLINE_RETRY_DELAYS = (timedelta(days=1), timedelta(days=3), timedelta(days=5))
+
+# Retries after a provider error or a pending charge wait LEASE, doubling up
+# to MAX_RETRY_DELAY; the subscription expires when an error happens with
+# RETRY_LIMIT retries spent (about a day past the period end)
+MAX_RETRY_DELAY = timedelta(hours=6)
+RETRY_LIMIT = 8
+
+
+@dataclass
+class RenewalCharge:
+    outcome: str  # completed, declined, pending or retry
+    provider_payment_id: str = ''
+    capture_id: str = ''
+    response: dict = field(default_factory=dict)
+    error: str = ''
+
+
+def add_billing_period(start, billing_cycle, anchor_day=None):
+    """
+    start moved forward by one billing cycle onto anchor_day (start's day by
+    default), clamped to the end of month so Jan 31 renews on Feb 28 and then
+    back on Mar 31
+    """
+    months = start.month - 1 + BILLING_CYCLE_MONTHS[billing_cycle]
+    year, month = start.year + months // 12, months % 12 + 1
+    day = min(anchor_day or start.day, calendar.monthrange(year, month)[1])
+    return start.replace(year=year, month=month, day=day)
+
+
+def charge_renewal(subscription, order):
+    """Charge a renewal order to the subscription's saved payment method"""
+    try:
+        gateway = get_gateway(subscription.provider)
+    except GatewayError:
+        gateway = None
+    if gateway is None or not gateway.saved_payments:
+        return RenewalCharge('declined', error=f'Renewals are not supported for {subscription.provider}')
+    if not subscription.provider_subscription_id:
+        return RenewalCharge('declined', error='No saved payment method')
+
+    try:
+        result = gateway.charge_saved_payment(
+            order, subscription.provider_subscription_id,
+            description=f'Renewal: {subscription.pricing_plan.name}'
+        )
+    except GatewayError as e:
+        return RenewalCharge('retry', error=str(e))
+    except Exception as e:
+        logger.error(f"Renewal charge for subscription {subscription.subscription_id} failed: {str(e)}")
+        return RenewalCharge('retry', error=str(e))
+
+    if result.status is None:
+        return RenewalCharge('pending', result.provider_payment_id, response=result.raw, error=result.message)
+    if result.status != 'completed':
+        return RenewalCharge('declined', result.provider_payment_id, response=result.raw, error=result.message)
+    return RenewalCharge('completed', result.provider_payment_id, result.capture_id, result.raw)
+
+
+def retry_delay(retries):
+    """Wait before the next retry of a renewal retried `retries` times so far"""
+    return min(LEASE * 2 ** min(retries, 16), MAX_RETRY_DELAY)
+
+
+def claim_due_subscriptions(batch_size=100, now=None):
+    """
+    Lock the next batch of due subscriptions and prepare their renewals.
+
+    Subscriptions set to cancel at period end are cancelled and ones that
+    cannot renew (no active recurring plan) expire here.
+
+    Returns:
+        (list of (subscription, renewal order) to charge, Counter of outcomes)
+    """
+    now = now or timezone.now()
+    counts = Counter()
+    with transaction.atomic():
+        subscriptions = list(
+            Subscription.objects.select_for_update(skip_locked=True, of=('self',)).select_related(
+                'pricing_plan', 'renewal_order'
+            ).filter(
+                status='active', current_period_end__lte=now
+            ).filter(
+                Q(next_renewal_attempt_at__isnull=True) | Q(next_renewal_attempt_at__lte=now)
+            ).order_by('current_period_end')[:batch_size]
+        )
+        if not subscriptions:
+            return [], counts
+
+        methods = {}
+        for method in PaymentMethod.objects.filter(provider__in={sub.provider for sub in subscriptions}):
+            methods.setdefault(method.provider, method)
+
+        due, new_orders = [], []
+        for subscription in subscriptions:
+            plan = subscription.pricing_plan
+            pending = subscription.renewal_order
+            if pending is not None and pending.status not in ('pending', 'processing'):
+                pending = None
+
+            if subscription.cancel_at_period_end:
+                subscription.status = 'cancelled'
+                subscription.cancelled_at = subscription.cancelled_at or now
+            elif plan is None or not plan.is_active or plan.billing_cycle not in BILLING_CYCLE_MONTHS:
+                subscription.status = 'expired'
+            else:
+                if pending is None:
+                    pending = Order(
+                        user_id=subscription.user_id,
+                        pricing_plan=plan,
+                        amount=plan.price,
+                        currency=plan.currency,
+                        status='processing',
+                        payment_method=methods.get(subscription.provider),
+                        metadata={
+                            'subscription_id': str(subscription.subscription_id),
+                            'renewal_period_start': subscription.current_period_end.isoformat()
+                        }
+                    )
+                    new_orders.append(pending)
+                subscription.renewal_order = pending
+                subscription.next_renewal_attempt_at = now + LEASE
+                due.append((subscription, pending))
+                continue
+
+            counts[subscription.status] += 1
+            if pending is not None:
+                pending.status = 'cancelled'
+                pending.save(update_fields=['status', 'updated_at'])
+            subscription.renewal_order = None
+
+        if new_orders:
+            Order.objects.bulk_create(new_orders)
+            record_orders_created(new_orders)
+        for subscription in subscriptions:
+            # Re-attach so renewal_order_id picks up the keys bulk_create assigned
+            subscription.renewal_order = subscription.renewal_order
+            subscription.updated_at = now
+        Subscription.objects.bulk_update(
+            subscriptions, ['status', 'cancelled_at', 'renewal_order', 'next_renewal_attempt_at', 'updated_at']
+        )
+    return due, counts
+
+
+def record_renewal(subscription, order, charge, now=None):
+    """
+    Apply a charge outcome, unless another run has taken the renewal over.
+
+    Returns:
+        the outcome recorded ('renewed', 'retry', 'pending', 'declined',
+        'expired'), or None when the subscription no longer waits for this
+        order
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        subscription = Subscription.objects.select_for_update().select_related('pricing_plan').filter(
+            pk=subscription.pk, status='active', renewal_order=order
+        ).first()
+        if subscription is None:
+            return None
+
+        if charge.outcome == 'retry' and subscription.renewal_retries >= RETRY_LIMIT:
+            order.status = 'failed'
+            order.notes = charge.error
+            order.save(update_fields=['status', 'notes', 'updated_at'])
+            logger.error(
+                f"Renewal of subscription {subscription.subscription_id} expired after "
+                f"{subscription.renewal_retries} retries: {charge.error}"
+            )
+            subscription.status = 'expired'
+            subscription.renewal_order = None
+            subscription.renewal_retries = 0
+            subscription.next_renewal_attempt_at = None
+            subscription.save()
+            return 'expired'
+        if charge.outcome in ('retry', 'pending'):
+            # The renewal order, and so the provider request id, is kept
+            subscription.next_renewal_attempt_at = now + retry_delay(subscription.renewal_retries)
+            subscription.renewal_retries += 1
+            subscription.save(update_fields=['next_renewal_attempt_at', 'renewal_retries', 'updated_at'])
+            return charge.outcome
+
+        payment = Payment.objects.create(
+            order=order,
+            provider=subscription.provider,
+            provider_payment_id=charge.provider_payment_id,
+            provider_capture_id=charge.capture_id,
+            amount=order.amount,
+            currency=order.currency,
+            provider_response=charge.response
+        )
+
+        if charge.outcome == 'completed':
+            payment.mark_as_completed()
+            if subscription.billing_anchor_day is None:
+                subscription.billing_anchor_day = subscription.current_period_end.day
+            subscription.current_period_start = subscription.current_period_end
+            subscription.current_period_end = add_billing_period(
+                subscription.current_period_end, subscription.pricing_plan.billing_cycle,
+                subscription.billing_anchor_day
+            )
+            subscription.renewal_attempts = 0
+            subscription.next_renewal_attempt_at = None
+            outcome = 'renewed'
+        else:
+            payment.status = 'failed'
+            payment.save()
+            order.status = 'failed'
+            order.notes = charge.error
+            order.save(update_fields=['status', 'notes', 'updated_at'])
+            logger.warning(
+                f"Renewal of subscription {subscription.subscription_id} declined: {charge.error}"
+            )
+            if subscription.renewal_attempts < len(DECLINE_RETRY_DELAYS):
+                subscription.next_renewal_attempt_at = now + DECLINE_RETRY_DELAYS[subscription.renewal_attempts]
+                outcome = 'declined'
+            else:
+                subscription.status = 'expired'
+                subscription.next_renewal_attempt_at = None
+                outcome = 'expired'
+            subscription.renewal_attempts += 1
+
+        subscription.renewal_order = None
+        subscription.renewal_retries = 0
+        subscription.save()
+        return outcome
+
+
+def run_renewals(batch_size=100, max_workers=10, now=None):
+    """
+    Claim and charge one batch of due subscriptions.
+
+    Returns:
+        Counter of outcomes; empty when nothing was due
+    """
+    due, counts = claim_due_subscriptions(batch_size=batch_size, now=now)
+    if not due:
+        return counts
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        charges = list(executor.map(lambda claim: charge_renewal(*claim), due))
+
+    for (subscription, order), charge in zip(due, charges):
+        outcome = record_renewal(subscription, order, charge, now=now)
+        counts[outcome or 'skipped'] += 1
+    return counts
@@ -47,6 +47,22 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['order_id', 'user', 'paid_at']
 
 
+class AdminOrderListSerializer(serializers.ModelSerializer):
+    """Order row for admin listings; see AdminOrderListView.list_fields"""
+    user_email = serializers.CharField(source='user.email', read_only=True)
+    plan_name = serializers.CharField(source='pricing_plan.name', read_only=True, default=None)
+    payment_provider = serializers.CharField(source='payment_method.provider', read_only=True, default=None)
+    
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_id', 'user', 'user_email', 'billing_name',
+            'pricing_plan', 'plan_name', 'amount', 'currency', 'status',
+            'payment_provider', 'created_at', 'paid_at'
+        ]
+        read_only_fields = fields
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     order_id = serializers.UUIDField(source='order.order_id', read_only=True)
     
@@ -55,7 +71,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'payment_id', 'order', 'order_id', 'provider',
             'provider_payment_id', 'provider_payer_id',
-            'amount', 'currency', 'status',
+            'amount', 'currency', 'status', 'refunded_amount',
             'created_at', 'completed_at'
         ]
         read_only_fields = ['payment_id', 'completed_at']
@@ -127,6 +143,7 @@ class PayPalCaptureSerializer(serializers.Serializer):
 class PaymentStatsSerializer(serializers.Serializer):
     """Serializer for payment statistics"""
     total_revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+    revenue_by_currency = serializers.DictField(child=serializers.DecimalField(max_digits=14, decimal_places=2))
     total_orders = serializers.IntegerField()
     paid_orders = serializers.IntegerField()
     pending_orders = serializers.IntegerField()
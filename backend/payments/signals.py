@@ -0,0 +1,37 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import invalidate_catalog
+from .ledger import record_order_created, record_payment_transition
+from .models import Coupon, Order, Payment, PaymentMethod, PricingPlan
+
+
+@receiver(post_save, sender=PricingPlan)
+@receiver(post_delete, sender=PricingPlan)
+@receiver(post_save, sender=PaymentMethod)
+@receiver(post_delete, sender=PaymentMethod)
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+@receiver(m2m_changed, sender=Coupon.applicable_plans.through)
+def refresh_catalog(sender, **kwargs):
+    """Bump the pricing catalog version so every worker rebuilds it"""
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Order)
+def ledger_order_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_order_created(instance)
+
+
+@receiver(post_save, sender=Payment)
+def ledger_payment_transition(sender, instance, raw=False, **kwargs):
+    """Record status changes made through save() in the daily ledger"""
+    if raw:
+        return
+    record_payment_transition(
+        instance, getattr(instance, '_loaded_status', None),
+        previous_refunded_amount=getattr(instance, '_loaded_refunded_amount', None)
+    )
+    instance._loaded_status = instance.status
+    instance._loaded_refunded_amount = instance.refunded_amount
@@ -1,3 +1,1334 @@
-from django.test import TestCase
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections
+from django.db.models import Sum
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from programs.models import Enrollment, Program
+
+from .catalog import get_catalog
+from .clients import GatewayError
+from .idempotency import in_progress_timeout
+from .gateways import get_gateway, is_paypal_decline
+from .ledger import rebuild_ledger
+from .models import (
+    Coupon, CouponRedemptionError, CouponUsage, IdempotencyKey, LedgerDaily, Order, Payment, PaymentMethod,
+    PricingPlan, Subscription, WebhookEvent
+)
+from .mpesa_service import mpesa_service
+from .paypal_service import PayPalError, PayPalService, paypal_service
+from .reconciliation import reconcile_payments
+from .renewals import (
+    LEASE, MAX_RETRY_DELAY, RETRY_LIMIT, add_billing_period, charge_renewal, claim_due_subscriptions, run_renewals
+)
+from .webhooks import cache_certificate, process_webhook_events, replay_webhook_events
+
+User = get_user_model()
+
+
+class FakePayPalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.app.handle(self, 'GET')
+
+    def do_POST(self):
+        self.server.app.handle(self, 'POST')
+
+
+class FakePayPal:
+    """Local stand-in for the PayPal REST API"""
+
+    def __init__(self, expires_in=32400):
+        self.expires_in = expires_in
+        self.token_calls = 0
+        self.token_delay = 0
+        self.delay = 0
+        self.fail_next = []
+        self.declined_vaults = set()
+        self.pending_vaults = set()
+        self.declined_captures = set()
+        self.requests = []
+        self.tokens = set()
+        self.orders = {}
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakePayPalHandler)
+        self.server.daemon_threads = True
+        self.server.app = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, handler, status_code, data):
+        body = json.dumps(data).encode()
+        handler.send_response(status_code)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        try:
+            handler.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (read timeout)
+            pass
+
+    def handle(self, handler, method):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        path = handler.path
+        request_id = handler.headers.get('PayPal-Request-Id')
+        with self.lock:
+            self.requests.append((method, path, request_id, handler.client_address[1]))
+
+        if path == '/v1/oauth2/token':
+            time.sleep(self.token_delay)
+            with self.lock:
+                self.token_calls += 1
+                token = f'token-{self.token_calls}'
+                self.tokens.add(token)
+            return self.respond(handler, 200, {'access_token': token, 'expires_in': self.expires_in})
+
+        if handler.headers.get('Authorization', '')[len('Bearer '):] not in self.tokens:
+            return self.respond(handler, 401, {'error': 'invalid_token'})
+        with self.lock:
+            failure = self.fail_next.pop(0) if self.fail_next else None
+        if failure:
+            return self.respond(handler, failure, {'name': 'SERVICE_UNAVAILABLE'})
+        time.sleep(self.delay)
+
+        with self.lock:
+            if request_id and request_id in self.responses:
+                return self.respond(handler, *self.responses[request_id])
+            status_code, data = self.route(method, path, json.loads(body) if body else {})
+            if request_id:
+                self.responses[request_id] = (status_code, data)
+        return self.respond(handler, status_code, data)
+
+    def route(self, method, path, payload):
+        parts = path.strip('/').split('/')
+        if method == 'POST' and path == '/v2/checkout/orders' and payload.get('payment_source'):
+            # Saved payment method: captured at once, without buyer approval
+            if payload['payment_source']['paypal']['vault_id'] in self.declined_vaults:
+                return 422, {'name': 'UNPROCESSABLE_ENTITY', 'details': [{'issue': 'INSTRUMENT_DECLINED'}]}
+            order_id = uuid.uuid4().hex[:17].upper()
+            units = payload['purchase_units']
+            capture_status = 'PENDING' if payload['payment_source']['paypal']['vault_id'] in self.pending_vaults \
+                else 'COMPLETED'
+            units[0]['payments'] = {'captures': [{'id': f'CAP-{order_id}', 'status': capture_status}]}
+            self.orders[order_id] = {'id': order_id, 'status': 'COMPLETED', 'purchase_units': units}
+            return 201, self.orders[order_id]
+        if method == 'POST' and path == '/v2/checkout/orders':
+            order_id = uuid.uuid4().hex[:17].upper()
+            self.orders[order_id] = {
+                'id': order_id,
+                'status': 'CREATED',
+                'purchase_units': payload.get('purchase_units', []),
+                'links': [{'rel': 'approve', 'href': f'{self.url}/checkoutnow?token={order_id}'}],
+            }
+            return 201, self.orders[order_id]
+        if parts[:3] == ['v2', 'checkout', 'orders'] and len(parts) >= 4 and parts[3] in self.orders:
+            order = self.orders[parts[3]]
+            if method == 'POST' and parts[4:] == ['capture']:
+                if order['status'] == 'COMPLETED':
+                    return 422, {'name': 'UNPROCESSABLE_ENTITY', 'details': [{'issue': 'ORDER_ALREADY_CAPTURED'}]}
+                if order['id'] in self.declined_captures:
+                    # The buyer then picks another funding source
+                    self.declined_captures.discard(order['id'])
+                    return 422, {'name': 'UNPROCESSABLE_ENTITY', 'details': [{'issue': 'INSTRUMENT_DECLINED'}]}
+                order['status'] = 'COMPLETED'
+                order['payer'] = {'payer_id': 'FAKEPAYER'}
+                order['purchase_units'][0]['payments'] = {
+                    'captures': [{'id': f'CAP-{order["id"]}', 'status': 'COMPLETED'}]
+                }
+                return 201, order
+            if method == 'GET':
+                return 200, order
+        if method == 'POST' and parts[:3] == ['v2', 'payments', 'captures'] and parts[4:] == ['refund']:
+            return 201, {'id': f'REF-{parts[3]}', 'status': 'COMPLETED'}
+        return 404, {'name': 'RESOURCE_NOT_FOUND'}
+
+
+def use_fake_paypal(test, fake):
+    """Point the shared PayPal client at a fake server for one test"""
+    saved = {name: getattr(paypal_service, name) for name in ('base_url', 'client_id', 'client_secret', 'timeout')}
+    paypal_service.base_url, paypal_service.client_id, paypal_service.client_secret = fake.url, 'client', 'secret'
+    paypal_service.timeout = (1, 1)
+
+    def restore():
+        paypal_service.close()
+        paypal_service._access_token = None
+        for name, value in saved.items():
+            setattr(paypal_service, name, value)
+    test.addCleanup(restore)
+
+
+class FakeMpesa(FakePayPal):
+    """Local stand-in for the Daraja STK push API"""
+
+    def __init__(self):
+        super().__init__(expires_in='3599')
+        # CheckoutRequestID -> ResultCode the STK query reports; absent while the customer has not answered
+        self.results = {}
+        self.pushes = []
+
+    def handle(self, handler, method):
+        length = int(handler.headers.get('Content-Length') or 0)
+        payload = json.loads(handler.rfile.read(length)) if length else {}
+        path = handler.path
+        with self.lock:
+            self.requests.append((method, path, None, handler.client_address[1]))
+
+        if path == '/oauth/v1/generate?grant_type=client_credentials':
+            with self.lock:
+                self.token_calls += 1
+                token = f'token-{self.token_calls}'
+                self.tokens.add(token)
+            return self.respond(handler, 200, {'access_token': token, 'expires_in': self.expires_in})
+        if handler.headers.get('Authorization', '')[len('Bearer '):] not in self.tokens:
+            return self.respond(handler, 401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+
+        if method == 'POST' and path == '/mpesa/stkpush/v1/processrequest':
+            with self.lock:
+                self.pushes.append(payload)
+                checkout_id = f'ws_CO_{len(self.pushes)}'
+            return self.respond(handler, 200, {
+                'MerchantRequestID': f'MR-{len(self.pushes)}',
+                'CheckoutRequestID': checkout_id,
+                'ResponseCode': '0',
+                'ResponseDescription': 'Success. Request accepted for processing',
+                'CustomerMessage': 'Success. Request accepted for processing',
+            })
+        if method == 'POST' and path == '/mpesa/stkpushquery/v1/query':
+            result_code = self.results.get(payload.get('CheckoutRequestID'))
+            if result_code is None:
+                return self.respond(handler, 500, {
+                    'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'
+                })
+            return self.respond(handler, 200, {
+                'ResponseCode': '0',
+                'CheckoutRequestID': payload['CheckoutRequestID'],
+                'ResultCode': str(result_code),
+                'ResultDesc': 'The service request is processed successfully.' if result_code == 0
+                else 'Request cancelled by user',
+            })
+        return self.respond(handler, 404, {'errorCode': '404.001.01', 'errorMessage': 'Resource not found'})
+
+
+def use_fake_mpesa(test, fake):
+    """Point the shared M-Pesa client at a fake server for one test"""
+    names = ('base_url', 'consumer_key', 'consumer_secret', 'shortcode', 'passkey', 'timeout', 'max_retries')
+    saved = {name: getattr(mpesa_service, name) for name in names}
+    mpesa_service.base_url, mpesa_service.consumer_key, mpesa_service.consumer_secret = fake.url, 'key', 'secret'
+    mpesa_service.shortcode, mpesa_service.passkey = '174379', 'passkey'
+    mpesa_service.timeout, mpesa_service.max_retries = (1, 1), 0
+
+    def restore():
+        mpesa_service.close()
+        mpesa_service._access_token = None
+        for name, value in saved.items():
+            setattr(mpesa_service, name, value)
+    test.addCleanup(restore)
+
+
+class PayPalClientTest(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakePayPal()
+        self.addCleanup(self.fake.stop)
+        self.now = 1000.0
+        self.service = PayPalService(
+            client_id='client', client_secret='secret', base_url=self.fake.url,
+            connect_timeout=1, read_timeout=1, max_retries=2, clock=lambda: self.now
+        )
+        self.addCleanup(self.service.close)
+
+    def test_reuses_token_and_connection(self):
+        created = self.service.create_order(10, order_id='order-1')
+        self.service.get_order_details(created['paypal_order_id'])
+        captured = self.service.capture_order(created['paypal_order_id'])
+
+        self.assertEqual(captured['capture_status'], 'COMPLETED')
+        self.assertEqual(self.fake.token_calls, 1)
+        self.assertEqual(len({port for _, _, _, port in self.fake.requests}), 1)
+
+    def test_refreshes_token_before_expiry(self):
+        self.fake.expires_in = 3600
+        created = self.service.create_order(10)
+        self.now += 3600 - 30
+        self.service.get_order_details(created['paypal_order_id'])
+        self.assertEqual(self.fake.token_calls, 2)
+
+    def test_single_flight_token_refresh(self):
+        self.fake.token_delay = 0.2
+        order_id = self.service.create_order(10)['paypal_order_id']
+        self.service._access_token = None
+
+        threads = [
+            threading.Thread(target=self.service.get_order_details, args=(order_id,)) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fake.token_calls, 2)
+
+    def test_rejected_token_is_refreshed(self):
+        order_id = self.service.create_order(10)['paypal_order_id']
+        self.fake.tokens.clear()
+        self.assertEqual(self.service.get_order_details(order_id)['id'], order_id)
+        self.assertEqual(self.fake.token_calls, 2)
+
+    def test_retries_reuse_paypal_request_id(self):
+        self.fake.fail_next = [503, 503]
+        with self.assertLogs('payments.paypal_service', 'WARNING'):
+            order_id = self.service.create_order(10, request_id='create-1')['paypal_order_id']
+
+        attempts = [request for request in self.fake.requests if request[1] == '/v2/checkout/orders']
+        self.assertEqual([request_id for _, _, request_id, _ in attempts], ['create-1'] * 3)
+        # A replay with the same id returns the original order instead of a new one
+        self.assertEqual(self.service.create_order(10, request_id='create-1')['paypal_order_id'], order_id)
+        self.assertEqual(len(self.fake.orders), 1)
+
+    def test_declined_capture_can_be_retried(self):
+        order_id = self.service.create_order(10)['paypal_order_id']
+        self.fake.declined_captures.add(order_id)
+        with self.assertRaises(PayPalError) as raised:
+            self.service.capture_order(order_id)
+        self.assertEqual(raised.exception.status_code, 422)
+
+        self.assertEqual(self.service.capture_order(order_id)['capture_status'], 'COMPLETED')
+
+    def test_concurrent_callers_share_one_session(self):
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(self.service.session)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(session) for session in sessions}), 1)
+
+        token_lock = self.service._token_lock
+        self.service._reset_after_fork()
+        self.assertIsNot(self.service.session, sessions[0])
+        self.assertIsNot(self.service._token_lock, token_lock)
+
+    def test_read_timeout_raises_after_retries(self):
+        self.service.create_order(10)
+        self.fake.delay = 0.5
+        self.service.timeout = (1, 0.1)
+        self.service.max_retries = 1
+        with self.assertLogs('payments.paypal_service', 'WARNING'):
+            with self.assertRaises(PayPalError) as raised:
+                self.service.get_order_details('missing')
+        self.assertIsNone(raised.exception.status_code)
+
+
+CERT_URL = 'https://api.sandbox.paypal.com/v1/notifications/certs/CERT-test'
+
+
+def signing_certificate():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'messageverificationcerts.paypal.com')])
+    now = datetime.now(dt_timezone.utc)
+    certificate = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(
+        key.public_key()
+    ).serial_number(x509.random_serial_number()).not_valid_before(now - timedelta(days=1)).not_valid_after(
+        now + timedelta(days=30)
+    ).sign(key, hashes.SHA256())
+    return key, certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+@override_settings(PAYPAL_WEBHOOK_ID='WH-TEST', PAYPAL_WEBHOOK_VERIFICATION='local')
+class PayPalWebhookTest(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.key, cls.certificate = signing_certificate()
+
+    def setUp(self):
+        cache.clear()
+        cache_certificate(CERT_URL, self.certificate)
+        self.user = User.objects.create_user(username='payer', email='payer@example.com', password='testpass123')
+        self.order = Order.objects.create(user=self.user, amount=50, status='processing')
+        self.payment = Payment.objects.create(
+            order=self.order, provider='paypal', provider_payment_id='PAYPAL-ORDER-1', amount=50
+        )
+
+    def _event(self, event_id, event_type, minutes=0, resource=None):
+        return json.dumps({
+            'id': event_id,
+            'event_type': event_type,
+            'create_time': (datetime(2026, 10, 1, 12, tzinfo=dt_timezone.utc) + timedelta(minutes=minutes)).isoformat(),
+            'resource': resource or {
+                'id': 'CAPTURE-1',
+                'supplementary_data': {'related_ids': {'order_id': 'PAYPAL-ORDER-1'}},
+            },
+        }).encode()
+
+    def _post(self, body, tamper=False):
+        transmission_id, transmission_time = str(uuid.uuid4()), '2026-10-01T12:00:00Z'
+        message = f'{transmission_id}|{transmission_time}|WH-TEST|{zlib.crc32(body)}'
+        signature = self.key.sign(message.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return self.client.generic(
+            'POST', '/api/payments/paypal/webhook/', body + (b' ' if tamper else b''),
+            content_type='application/json',
+            HTTP_PAYPAL_AUTH_ALGO='SHA256withRSA',
+            HTTP_PAYPAL_CERT_URL=CERT_URL,
+            HTTP_PAYPAL_TRANSMISSION_ID=transmission_id,
+            HTTP_PAYPAL_TRANSMISSION_SIG=base64.b64encode(signature).decode(),
+            HTTP_PAYPAL_TRANSMISSION_TIME=transmission_time,
+        )
+
+    def test_ingest_is_a_single_idempotent_insert(self):
+        body = self._event('WH-1', 'PAYMENT.CAPTURE.COMPLETED')
+        # Warm the per-process IP rule cache consulted by the middleware
+        self._post(b'not json')
+        with self.assertNumQueries(1):
+            response = self._post(body)
+        self._post(body)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(WebhookEvent.objects.filter(event_id='WH-1').count(), 1)
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'pending')
+        self.assertEqual(self._post(b'not json').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_worker_verifies_and_applies_in_event_order(self):
+        refund = {
+            'id': 'REFUND-1',
+            'links': [{'rel': 'up', 'href': 'https://api.sandbox.paypal.com/v2/payments/captures/CAPTURE-1'}],
+            'supplementary_data': {'related_ids': {'order_id': 'PAYPAL-ORDER-1'}},
+        }
+        # Delivered out of order: the refund arrives before the capture
+        self._post(self._event('WH-2', 'PAYMENT.CAPTURE.REFUNDED', minutes=5, resource=refund))
+        self._post(self._event('WH-1', 'PAYMENT.CAPTURE.COMPLETED'))
+        self._post(self._event('WH-3', 'PAYMENT.CAPTURE.COMPLETED', minutes=1), tamper=True)
+        self._post(self._event('WH-4', 'CHECKOUT.ORDER.APPROVED', minutes=2))
+
+        counts = process_webhook_events()
+
+        self.assertEqual(counts, {'processed': 2, 'invalid': 1, 'ignored': 1})
+        payment = Payment.objects.get(pk=self.payment.pk)
+        self.assertEqual((payment.status, payment.provider_capture_id), ('refunded', 'CAPTURE-1'))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'refunded')
+        self.assertEqual(WebhookEvent.objects.get(event_id='WH-3').last_error, 'Signature verification failed')
+
+    def test_partial_refunds_keep_the_payment_completed(self):
+        def refund(refund_id, value, total):
+            return {
+                'id': refund_id,
+                'amount': {'value': value, 'currency_code': 'USD'},
+                'seller_payable_breakdown': {'total_refunded_amount': {'value': total, 'currency_code': 'USD'}},
+                'supplementary_data': {'related_ids': {'order_id': 'PAYPAL-ORDER-1'}},
+            }
+
+        self._post(self._event('WH-1', 'PAYMENT.CAPTURE.COMPLETED'))
+        self._post(self._event('WH-2', 'PAYMENT.CAPTURE.REFUNDED', minutes=1, resource=refund('R-1', '20.00', '20.00')))
+        process_webhook_events()
+        payment = Payment.objects.get(pk=self.payment.pk)
+        self.assertEqual((payment.status, payment.refunded_amount), ('completed', Decimal('20.00')))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'paid')
+
+        # A replayed refund does not count twice; the rest of the amount completes the refund
+        replay_webhook_events(WebhookEvent.objects.filter(event_id='WH-2'))
+        self._post(self._event('WH-3', 'PAYMENT.CAPTURE.REFUNDED', minutes=2, resource=refund('R-2', '30.00', '50.00')))
+        process_webhook_events()
+        payment = Payment.objects.get(pk=self.payment.pk)
+        self.assertEqual((payment.status, payment.refunded_amount), ('refunded', Decimal('50.00')))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'refunded')
+
+    def test_failed_events_retry_and_replay(self):
+        self._post(self._event('WH-1', 'PAYMENT.CAPTURE.COMPLETED'))
+        with override_settings(PAYPAL_WEBHOOK_ID=''):
+            process_webhook_events()
+        event = WebhookEvent.objects.get(event_id='WH-1')
+        self.assertEqual((event.status, event.last_error), ('invalid', 'PAYPAL_WEBHOOK_ID is not configured'))
+
+        out = StringIO()
+        call_command('replay_webhook_events', 'WH-1', '--process', stdout=out)
+        self.assertIn('1 processed', out.getvalue())
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'completed')
+
+    def test_capture_webhook_enrolls_the_buyer(self):
+        program = Program.objects.create(
+            title='Backend Bootcamp', description='APIs', duration='12 Weeks', level='Beginner',
+            technologies='Python'
+        )
+        self.order.pricing_plan = PricingPlan.objects.create(name='Bootcamp', price='50.00', program=program)
+        self.order.save()
+
+        # The buyer's capture response was lost; only the webhook reports it
+        self._post(self._event('WH-1', 'PAYMENT.CAPTURE.COMPLETED'))
+        process_webhook_events()
+
+        self.assertEqual(Payment.objects.get(pk=self.payment.pk).status, 'completed')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'paid')
+        self.assertTrue(Enrollment.objects.filter(user=self.user, program=program).exists())
+
+
+class CouponRedemptionTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', email='shopper@example.com', password='testpass123')
+        self.plan = PricingPlan.objects.create(name='Bootcamp', price='200.00')
+        self.coupon = Coupon.objects.create(
+            code='LAUNCH', discount_type='percentage', discount_value='25', max_uses=2,
+            max_uses_per_user=1, valid_from=timezone.now() - timedelta(days=1)
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def _order(self):
+        return self.client.post('/api/payments/orders/create/', {
+            'pricing_plan_id': self.plan.id, 'coupon_code': 'launch'
+        })
+
+    def test_order_redeems_coupon_once_per_user(self):
+        first, second = self._order(), self._order()
+
+        self.assertEqual(first.data['amount'], '150.00')
+        # The per-user limit is reached, so the second order keeps the full price
+        self.assertEqual(second.data['amount'], '200.00')
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.times_used, 1)
+        self.assertEqual(CouponUsage.objects.filter(coupon=self.coupon).count(), 1)
+
+    def test_redeem_respects_global_limit(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        third = User.objects.create_user(username='third', email='third@example.com', password='testpass123')
+        for user in (self.user, other):
+            self.coupon.redeem(user, Order.objects.create(user=user, amount=150))
+        with self.assertRaises(CouponRedemptionError):
+            self.coupon.redeem(third, Order.objects.create(user=third, amount=150))
+        self.assertEqual(Coupon.objects.get(pk=self.coupon.pk).times_used, 2)
+
+    def test_uses_freed_by_deleted_usages_are_reused(self):
+        Coupon.objects.filter(pk=self.coupon.pk).update(max_uses=None, max_uses_per_user=3)
+        self.coupon.refresh_from_db()
+        usages = [
+            self.coupon.redeem(self.user, Order.objects.create(user=self.user, amount=150)) for _ in range(3)
+        ]
+        self.assertEqual([usage.use_number for usage in usages], [1, 2, 3])
+
+        usages[0].delete()
+        reused = self.coupon.redeem(self.user, Order.objects.create(user=self.user, amount=150))
+        self.assertEqual(reused.use_number, 1)
+        with self.assertRaises(CouponRedemptionError):
+            self.coupon.redeem(self.user, Order.objects.create(user=self.user, amount=150))
+
+
+class PricingCatalogTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.basic = PricingPlan.objects.create(name='Basic', price='100.00')
+        self.pro = PricingPlan.objects.create(name='Pro', price='300.00', original_price='400.00')
+        PaymentMethod.objects.create(name='PayPal', provider='paypal')
+        self.coupon = Coupon.objects.create(
+            code='PRO50', discount_type='fixed', discount_value='50', valid_from=timezone.now() - timedelta(days=1)
+        )
+        self.coupon.applicable_plans.add(self.pro)
+
+    def test_checkout_reads_run_no_queries(self):
+        get_catalog()
+        # Warm the per-process IP rule cache consulted by the middleware
+        self.client.get('/api/payments/methods/')
+        with self.assertNumQueries(0):
+            plans = self.client.get('/api/payments/plans/')
+            detail = self.client.get(f'/api/payments/plans/{self.pro.id}/')
+            methods = self.client.get('/api/payments/methods/')
+
+        self.assertEqual([plan['name'] for plan in plans.data['results']], ['Basic', 'Pro'])
+        self.assertEqual(detail.data['savings'], 100.0)
+        self.assertEqual(methods.data['count'], 1)
+        self.assertEqual(self.client.get('/api/payments/plans/999/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_effective_prices_and_invalidation(self):
+        catalog = get_catalog()
+        self.assertEqual(str(catalog.price(self.pro.id, 'pro50')[0]), '250.00')
+        # The coupon is restricted to Pro
+        self.assertEqual(catalog.price(self.basic.id, 'PRO50'), (Decimal('100.00'), None))
+
+        self.pro.price = '350.00'
+        self.pro.save()
+        self.assertEqual(str(get_catalog().price(self.pro.id, 'PRO50')[0]), '300.00')
+
+        self.pro.is_active = False
+        self.pro.save()
+        self.assertEqual(self.client.get(f'/api/payments/plans/{self.pro.id}/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PaymentLedgerTest(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='finance', email='finance@example.com', password='x')
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        self.plan = PricingPlan.objects.create(name='Bootcamp', price='200.00')
+        self.method = PaymentMethod.objects.create(name='PayPal', provider='paypal')
+        self.client.force_authenticate(user=self.admin)
+
+    def _sale(self, amount, currency='USD', final_status='completed'):
+        order = Order.objects.create(
+            user=self.user, pricing_plan=self.plan, amount=amount, currency=currency, payment_method=self.method
+        )
+        payment = Payment.objects.create(order=order, provider='paypal', amount=amount, currency=currency)
+        payment = Payment.objects.get(pk=payment.pk)
+        if final_status == 'failed':
+            payment.status = 'failed'
+            payment.save()
+        elif final_status != 'pending':
+            payment.mark_as_completed()
+            if final_status == 'refunded':
+                payment.status = 'refunded'
+                payment.save()
+        return payment
+
+    def _ledger(self):
+        return {
+            (row.currency, row.provider): (
+                row.orders_created, row.payments_completed, row.gross_amount, row.payments_failed,
+                row.refunds, row.refunded_amount
+            ) for row in LedgerDaily.objects.all()
+        }
+
+    def test_transitions_maintain_ledger_and_match_rebuild(self):
+        self._sale('200.00')
+        self._sale('150.00', final_status='refunded')
+        self._sale('200.00', final_status='failed')
+        self._sale('5000.00', currency='KES')
+        # Saving again without a status change is not counted twice
+        Payment.objects.filter(status='completed').first().save()
+
+        live = self._ledger()
+        self.assertEqual(live[('USD', 'paypal')], (3, 2, Decimal('350.00'), 1, 1, Decimal('150.00')))
+        self.assertEqual(live[('KES', 'paypal')], (1, 1, Decimal('5000.00'), 0, 0, Decimal('0')))
+
+        LedgerDaily.objects.all().delete()
+        today = timezone.localdate()
+        call_command('backfill_ledger', days=2, stdout=StringIO())
+        self.assertEqual(self._ledger(), live)
+        self.assertEqual(rebuild_ledger(today, today), 2)
+
+    def test_partial_refunds_and_full_history_backfill(self):
+        payment = self._sale('200.00')
+        payment.refunded_amount = Decimal('50.00')
+        payment.save()
+        payment.status = 'refunded'
+        payment.save()
+        old = self._sale('80.00')
+        Order.objects.filter(pk=old.order_id).update(created_at=timezone.now() - timedelta(days=90))
+        Payment.objects.filter(pk=old.pk).update(completed_at=timezone.now() - timedelta(days=90))
+
+        totals = ('orders_created', 'payments_completed', 'gross_amount', 'refunds', 'refunded_amount')
+        live = LedgerDaily.objects.aggregate(*[Sum(name) for name in totals])
+        self.assertEqual(live['refunds__sum'], 1)
+        self.assertEqual(live['refunded_amount__sum'], Decimal('200.00'))
+
+        # Without a range the command rebuilds everything, back to the oldest order
+        call_command('backfill_ledger', stdout=StringIO())
+        self.assertEqual(LedgerDaily.objects.aggregate(*[Sum(name) for name in totals]), live)
+        self.assertEqual(LedgerDaily.objects.filter(day__lt=timezone.localdate() - timedelta(days=30)).count(), 1)
+        # So does the migration that fills the ledger on deploy
+        LedgerDaily.objects.all().delete()
+        import_module('payments.migrations.0009_backfill_ledger').backfill_ledger(django_apps, None)
+        self.assertEqual(LedgerDaily.objects.aggregate(*[Sum(name) for name in totals]), live)
+
+    def test_concurrent_completion_is_counted_once(self):
+        payment = self._sale('200.00', final_status='pending')
+        # The capture view and the webhook worker each loaded the pending payment
+        view_copy, worker_copy = Payment.objects.get(pk=payment.pk), Payment.objects.get(pk=payment.pk)
+        worker_copy.mark_as_completed()
+        view_copy.mark_as_completed()
+
+        self.assertEqual(self._ledger()[('USD', 'paypal')][1:3], (1, Decimal('200.00')))
+
+    def test_reports_group_by_currency_and_dimension(self):
+        self._sale('200.00')
+        self._sale('150.00', final_status='refunded')
+        self._sale('5000.00', currency='KES')
+        Order.objects.create(user=self.user, pricing_plan=self.plan, amount='200.00')
+
+        # Warm the per-process IP rule cache consulted by the middleware
+        self.client.get('/api/payments/admin/stats/')
+        with self.assertNumQueries(1):
+            revenue = self.client.get('/api/payments/admin/reports/revenue/', {'group_by': 'provider'})
+        self.assertEqual(revenue.status_code, status.HTTP_200_OK)
+        rows = {(row['currency'], row['provider']): row for row in revenue.data['results']}
+        usd = rows[('USD', 'paypal')]
+        self.assertEqual(usd['net_amount'], Decimal('200.00'))
+        # The order without a payment method is recorded under no provider
+        self.assertEqual(rows[('USD', '')]['net_amount'], 0)
+        self.assertNotIn('orders_created', usd)
+
+        conversion = self.client.get('/api/payments/admin/reports/conversion/', {'group_by': 'plan'})
+        usd = [row for row in conversion.data['results'] if row['currency'] == 'USD']
+        self.assertEqual([(row['pricing_plan__name'], row['orders_created'], row['payments_completed'])
+                          for row in usd], [('Bootcamp', 3, 2)])
+        self.assertEqual(usd[0]['conversion_rate'], 0.6667)
+
+        stats = self.client.get('/api/payments/admin/stats/')
+        self.assertEqual(stats.data['total_revenue'], Decimal('200.00'))
+        self.assertEqual(stats.data['revenue_by_currency']['KES'], Decimal('5000.00'))
+
+        bad = self.client.get('/api/payments/admin/reports/refunds/', {'group_by': 'user'})
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+        bad = self.client.get('/api/payments/admin/reports/refunds/', {'start': '2026-02-30'})
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SubscriptionRenewalTest(APITestCase):
+    def setUp(self):
+        self.fake = FakePayPal()
+        self.addCleanup(self.fake.stop)
+        use_fake_paypal(self, self.fake)
+        self.fake.declined_vaults.add('VAULT-DECLINED')
+        self.now = timezone.now()
+        self.user = User.objects.create_user(username='member', email='member@example.com', password='testpass123')
+        self.plan = PricingPlan.objects.create(name='Mentorship', price='20.00', billing_cycle='monthly')
+        PaymentMethod.objects.create(name='PayPal', provider='paypal')
+
+    def _subscription(self, vault='VAULT-OK', plan=None, ends_in=timedelta(hours=-1), **fields):
+        end = self.now + ends_in
+        return Subscription.objects.create(
+            user=self.user, pricing_plan=plan or self.plan, provider='paypal', provider_subscription_id=vault,
+            current_period_start=end - timedelta(days=30), current_period_end=end, **fields
+        )
+
+    def _vault_charges(self):
+        return [request for request in self.fake.requests if request[:2] == ('POST', '/v2/checkout/orders')]
+
+    def test_renews_cancels_and_expires_due_subscriptions(self):
+        renewing = self._subscription()
+        cancelling = self._subscription(cancel_at_period_end=True)
+        declined = self._subscription(vault='VAULT-DECLINED')
+        one_time = self._subscription(plan=PricingPlan.objects.create(name='Course', price='99.00'))
+        later = self._subscription(ends_in=timedelta(days=3))
+
+        with self.assertLogs('payments.renewals', level='WARNING'):
+            counts = run_renewals(now=self.now)
+        self.assertEqual(counts, {'renewed': 1, 'cancelled': 1, 'declined': 1, 'expired': 1})
+        # Nothing is due again until the declined retry
+        self.assertEqual(run_renewals(now=self.now), {})
+        self.assertEqual(len(self._vault_charges()), 2)
+
+        renewing.refresh_from_db()
+        self.assertEqual(renewing.current_period_end, add_billing_period(self.now - timedelta(hours=1), 'monthly'))
+        self.assertIsNone(renewing.renewal_order)
+        order = Order.objects.get(metadata__subscription_id=str(renewing.subscription_id))
+        self.assertEqual(order.status, 'paid')
+        self.assertEqual(order.payments.get().status, 'completed')
+
+        declined.refresh_from_db()
+        self.assertEqual((declined.status, declined.renewal_attempts), ('active', 1))
+        self.assertEqual(declined.next_renewal_attempt_at, self.now + timedelta(days=1))
+        statuses = {sub.pk: sub.status for sub in Subscription.objects.all()}
+        self.assertEqual(statuses[cancelling.pk], 'cancelled')
+        self.assertEqual(statuses[one_time.pk], 'expired')
+        self.assertEqual(statuses[later.pk], 'active')
+        self.assertEqual(LedgerDaily.objects.get(provider='paypal').payments_completed, 1)
+
+    def test_charge_lost_before_recording_is_not_billed_twice(self):
+        subscription = self._subscription()
+        (claimed, order), = claim_due_subscriptions(now=self.now)[0]
+        self.assertEqual(charge_renewal(claimed, order).outcome, 'completed')
+        # The worker dies here; another run picks the renewal up after the lease
+        self.assertEqual(run_renewals(now=self.now), {})
+        counts = run_renewals(now=self.now + LEASE + timedelta(minutes=1))
+
+        self.assertEqual(counts, {'renewed': 1})
+        self.assertEqual(len(self.fake.orders), 1)
+        self.assertEqual({request[2] for request in self._vault_charges()}, {f'charge-{order.order_id}'})
+        self.assertEqual(Order.objects.filter(metadata__subscription_id=str(subscription.subscription_id)).count(), 1)
+        self.assertEqual(Payment.objects.filter(order=order).count(), 1)
+
+    def test_billing_period_clamps_to_month_end(self):
+        start = datetime(2027, 1, 31, 12, tzinfo=dt_timezone.utc)
+        self.assertEqual(add_billing_period(start, 'monthly'), datetime(2027, 2, 28, 12, tzinfo=dt_timezone.utc))
+        self.assertEqual(add_billing_period(start, 'yearly'), datetime(2028, 1, 31, 12, tzinfo=dt_timezone.utc))
+
+    def test_renewals_return_to_the_anchor_day_after_short_months(self):
+        january = datetime(2027, 1, 31, 12, tzinfo=dt_timezone.utc)
+        subscription = Subscription.objects.create(
+            user=self.user, pricing_plan=self.plan, provider='paypal', provider_subscription_id='VAULT-OK',
+            current_period_start=january - timedelta(days=31), current_period_end=january
+        )
+
+        for now, expected_end in (
+            (january + timedelta(hours=1), datetime(2027, 2, 28, 12, tzinfo=dt_timezone.utc)),
+            (datetime(2027, 2, 28, 13, tzinfo=dt_timezone.utc), datetime(2027, 3, 31, 12, tzinfo=dt_timezone.utc)),
+        ):
+            self.assertEqual(run_renewals(now=now), {'renewed': 1})
+            subscription.refresh_from_db()
+            self.assertEqual(subscription.current_period_end, expected_end)
+        self.assertEqual(subscription.billing_anchor_day, 31)
+
+    def test_provider_errors_back_off_and_expire_the_subscription(self):
+        subscription = self._subscription()
+        now, delays = self.now, []
+        with mock.patch.object(get_gateway('paypal'), 'charge_saved_payment',
+                               side_effect=GatewayError('Service unavailable', 503)):
+            for _ in range(RETRY_LIMIT):
+                self.assertEqual(run_renewals(now=now), {'retry': 1})
+                subscription.refresh_from_db()
+                delays.append(subscription.next_renewal_attempt_at - now)
+                now = subscription.next_renewal_attempt_at
+            with self.assertLogs('payments.renewals', level='ERROR'):
+                self.assertEqual(run_renewals(now=now), {'expired': 1})
+
+        self.assertEqual(delays[:3], [LEASE, LEASE * 2, LEASE * 4])
+        self.assertEqual(max(delays), MAX_RETRY_DELAY)
+        subscription.refresh_from_db()
+        self.assertEqual((subscription.status, subscription.renewal_order), ('expired', None))
+        self.assertEqual(Order.objects.get(metadata__subscription_id=str(subscription.subscription_id)).status, 'failed')
+        self.assertFalse(Payment.objects.exists())
+
+    def test_pending_charge_is_asked_about_again_not_repeated(self):
+        self.fake.pending_vaults.add('VAULT-PENDING')
+        subscription = self._subscription(vault='VAULT-PENDING')
+
+        self.assertEqual(run_renewals(now=self.now), {'pending': 1})
+        subscription.refresh_from_db()
+        self.assertEqual((subscription.status, subscription.renewal_attempts), ('active', 0))
+        self.assertIsNotNone(subscription.renewal_order)
+        self.assertFalse(Payment.objects.exists())
+
+        # PayPal settles the capture; the retry repeats the request id and gets the order's latest state
+        paypal_order, = self.fake.orders.values()
+        paypal_order['purchase_units'][0]['payments']['captures'][0]['status'] = 'COMPLETED'
+        self.assertEqual(run_renewals(now=subscription.next_renewal_attempt_at), {'renewed': 1})
+
+        self.assertEqual(len(self.fake.orders), 1)
+        self.assertEqual(len({request[2] for request in self._vault_charges()}), 1)
+        subscription.refresh_from_db()
+        self.assertEqual((subscription.renewal_retries, subscription.renewal_order), (0, None))
+        self.assertEqual(Payment.objects.get().status, 'completed')
+
+    def test_only_instrument_refusals_count_as_declines(self):
+        declined = json.dumps({'name': 'UNPROCESSABLE_ENTITY', 'details': [{'issue': 'INSTRUMENT_DECLINED'}]})
+        invalid = json.dumps({'name': 'INVALID_REQUEST', 'details': [{'issue': 'MISSING_REQUIRED_PARAMETER'}]})
+        self.assertTrue(is_paypal_decline(PayPalError('declined', 422, declined)))
+        self.assertFalse(is_paypal_decline(PayPalError('bad request', 400, declined)))
+        self.assertFalse(is_paypal_decline(PayPalError('invalid', 422, invalid)))
+        self.assertFalse(is_paypal_decline(PayPalError('not found', 404, '<html>')))
+        self.assertFalse(is_paypal_decline(PayPalError('timeout')))
+
+
+# Admin actions are audited; write them inline rather than from the writer thread
+@override_settings(AUDIT_LOG_ASYNC=False)
+class AdminRefundTest(APITestCase):
+    def setUp(self):
+        self.fake = FakePayPal()
+        self.addCleanup(self.fake.stop)
+        use_fake_paypal(self, self.fake)
+        self.admin = User.objects.create_user(
+            username='refunds', email='refunds@example.com', password='testpass123', is_staff=True
+        )
+        self.client.force_authenticate(user=self.admin)
+        self.order = Order.objects.create(user=self.admin, amount='30.00', status='paid')
+        self.payment = Payment.objects.create(
+            order=self.order, provider='paypal', provider_payment_id='PP-1', provider_capture_id='CAP-1',
+            amount='30.00', status='completed'
+        )
+
+    def _refund(self, payment=None, **data):
+        return self.client.post(
+            f'/api/payments/admin/payments/{(payment or self.payment).payment_id}/refund/', data, format='json'
+        )
+
+    def test_refunds_go_through_the_payment_gateway(self):
+        self.assertEqual(self._refund(amount='40.00').status_code, status.HTTP_400_BAD_REQUEST)
+
+        partial = self._refund(amount='10.00')
+        self.assertEqual(partial.status_code, status.HTTP_200_OK)
+        self.assertEqual((partial.data['status'], partial.data['refunded_amount']), ('completed', '10.00'))
+
+        rest = self._refund()
+        self.assertEqual(rest.status_code, status.HTTP_200_OK)
+        self.assertEqual((rest.data['status'], rest.data['refunded_amount']), ('refunded', '30.00'))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'refunded')
+        refunds = [request for request in self.fake.requests if request[1] == '/v2/payments/captures/CAP-1/refund']
+        self.assertEqual(len(refunds), 2)
+        self.assertEqual(self._refund().status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_providers_without_refunds_are_rejected(self):
+        mpesa = Payment.objects.create(
+            order=Order.objects.create(user=self.admin, amount='1500.00', currency='KES', status='paid'),
+            provider='mpesa', provider_payment_id='ws_CO_1', amount='1500.00', currency='KES', status='completed'
+        )
+        response = self._refund(payment=mpesa)
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertIn('does not support refunds', response.data['error'])
+        self.assertEqual(Payment.objects.get(pk=mpesa.pk).status, 'completed')
+
+
+class PaymentReconciliationTest(APITestCase):
+    def setUp(self):
+        self.fake = FakePayPal()
+        self.addCleanup(self.fake.stop)
+        use_fake_paypal(self, self.fake)
+        self.user = User.objects.create_user(username='payer', email='payer@example.com', password='testpass123')
+        self.now = timezone.now()
+        self.program = Program.objects.create(
+            title='Backend Bootcamp', description='APIs', duration='12 Weeks', level='Beginner',
+            technologies='Python'
+        )
+        self.plan = PricingPlan.objects.create(name='Bootcamp', price='30.00', program=self.program)
+
+    def _payment(self, paypal_order_id, status='pending', age=timedelta(hours=2)):
+        order = Order.objects.create(
+            user=self.user, pricing_plan=self.plan, amount=30,
+            status='paid' if status == 'completed' else 'processing'
+        )
+        payment = Payment.objects.create(
+            order=order, provider='paypal', provider_payment_id=paypal_order_id, amount=30, status=status,
+            completed_at=self.now - age if status == 'completed' else None
+        )
+        Payment.objects.filter(pk=payment.pk).update(created_at=self.now - age)
+        return payment
+
+    def _paypal_order(self, order_id, status='COMPLETED', capture_status=None):
+        units = [{'payments': {'captures': [{'id': f'CAP-{order_id}', 'status': capture_status}]}}] \
+            if capture_status else []
+        self.fake.orders[order_id] = {'id': order_id, 'status': status, 'purchase_units': units}
+
+    def test_repairs_drifted_payments_and_reports_them(self):
+        lost = self._payment('PP-LOST')
+        refunded = self._payment('PP-REFUNDED', status='completed')
+        gone = self._payment('PP-GONE')
+        open_order = self._payment('PP-OPEN')
+        fresh = self._payment('PP-FRESH', age=timedelta(minutes=1))
+        self._paypal_order('PP-LOST', capture_status='COMPLETED')
+        self._paypal_order('PP-REFUNDED', capture_status='REFUNDED')
+        self._paypal_order('PP-OPEN', status='CREATED')
+        self._paypal_order('PP-FRESH', capture_status='COMPLETED')
+
+        counts, report = reconcile_payments(batch_size=2, max_workers=4, rate=None, now=self.now)
+
+        self.assertEqual(counts['corrected'], 3)
+        self.assertEqual(counts['unchanged'], 1)
+        self.assertEqual(
+            {row['payment_id']: row['action'] for row in report},
+            {str(lost.payment_id): 'completed', str(refunded.payment_id): 'refunded', str(gone.payment_id): 'failed'}
+        )
+        statuses = {payment.pk: (payment.status, payment.order.status) for payment in Payment.objects.all()}
+        self.assertEqual(statuses[lost.pk], ('completed', 'paid'))
+        self.assertEqual(statuses[refunded.pk], ('refunded', 'refunded'))
+        self.assertEqual(statuses[gone.pk], ('failed', 'failed'))
+        self.assertEqual(statuses[open_order.pk], ('pending', 'processing'))
+        self.assertEqual(statuses[fresh.pk], ('pending', 'processing'))
+        self.assertEqual(Payment.objects.get(pk=lost.pk).provider_capture_id, 'CAP-PP-LOST')
+        # The buyer whose capture was lost is enrolled like one captured normally
+        self.assertTrue(Enrollment.objects.filter(user=self.user, program=self.program).exists())
+        # The ledger sees bulk corrections too (one completion was recorded at creation)
+        ledger = LedgerDaily.objects.filter(provider='paypal').aggregate(
+            completed=Sum('payments_completed'), refunds=Sum('refunds'), failed=Sum('payments_failed')
+        )
+        self.assertEqual(ledger, {'completed': 2, 'refunds': 1, 'failed': 1})
+        # Every lookup shared the pooled connection and token
+        self.assertEqual(self.fake.token_calls, 1)
+
+    def test_captures_paypal_completed_after_an_error_are_repaired(self):
+        # Recorded as failed by a capture view that gave up on PayPal's answer
+        failed = self._payment('PP-FAILED', status='failed')
+        Order.objects.filter(pk=failed.order_id).update(status='failed')
+        self._paypal_order('PP-FAILED', capture_status='COMPLETED')
+
+        # A capture whose answer is lost now leaves the payment pending
+        timed_out = self._payment('PP-TIMEOUT')
+        self._paypal_order('PP-TIMEOUT', status='APPROVED')
+        self.fake.fail_next = [500] * 3
+        self.client.force_authenticate(user=self.user)
+        with self.assertLogs('payments.paypal_service', level='WARNING'):
+            response = self.client.post('/api/payments/paypal/capture-order/', {
+                'order_id': str(timed_out.order.order_id), 'paypal_order_id': 'PP-TIMEOUT'
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(Payment.objects.get(pk=timed_out.pk).status, 'pending')
+        self.assertEqual(Order.objects.get(pk=timed_out.order_id).status, 'processing')
+        self._paypal_order('PP-TIMEOUT', capture_status='COMPLETED')
+
+        counts, report = reconcile_payments(rate=None, now=self.now)
+
+        self.assertEqual(counts['corrected'], 2)
+        for payment in (failed, timed_out):
+            payment = Payment.objects.select_related('order').get(pk=payment.pk)
+            self.assertEqual((payment.status, payment.order.status), ('completed', 'paid'))
+        self.assertTrue(Enrollment.objects.filter(user=self.user, program=self.program).exists())
+        ledger = LedgerDaily.objects.filter(provider='paypal').aggregate(
+            completed=Sum('payments_completed'), failed=Sum('payments_failed')
+        )
+        self.assertEqual(ledger, {'completed': 2, 'failed': 0})
+
+    def test_dry_run_and_provider_errors_change_nothing(self):
+        lost = self._payment('PP-LOST')
+        busy = self._payment('PP-BUSY')
+        self._paypal_order('PP-LOST', capture_status='COMPLETED')
+        self._paypal_order('PP-BUSY', capture_status='COMPLETED')
+        self.fake.fail_next = [500] * 3
+
+        out = StringIO()
+        with self.assertLogs('payments.paypal_service', level='WARNING'):
+            call_command('reconcile_payments', '--dry-run', '--workers', '1', stdout=out)
+
+        self.assertIn('1 completed', out.getvalue())
+        self.assertIn('1 error', out.getvalue())
+        self.assertEqual(Payment.objects.filter(pk__in=[lost.pk, busy.pk], status='pending').count(), 2)
+
+
+class AdminOrderListingTest(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='finance', email='finance@example.com', password='x')
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='testpass123')
+        plan = PricingPlan.objects.create(name='Bootcamp', price='200.00')
+        method = PaymentMethod.objects.create(name='PayPal', provider='paypal')
+        self.today = timezone.localdate()
+        self.orders = []
+        for days_ago, order_status in ((0, 'paid'), (1, 'paid'), (1, 'pending'), (2, 'paid'), (10, 'paid')):
+            order = Order.objects.create(
+                user=self.user, pricing_plan=plan, payment_method=method, amount='200.00', status=order_status,
+                metadata={'notes': 'x' * 100}
+            )
+            created_at = timezone.make_aware(datetime.combine(self.today - timedelta(days=days_ago), datetime.min.time()))
+            Order.objects.filter(pk=order.pk).update(created_at=created_at + timedelta(hours=12))
+            self.orders.append(order)
+        self.client.force_authenticate(user=self.admin)
+
+    def test_filters_by_status_and_day_range_with_keyset_pages(self):
+        params = {
+            'status': 'paid', 'start_date': str(self.today - timedelta(days=2)), 'end_date': str(self.today),
+            'page_size': 2
+        }
+        # Warm the per-process IP rule cache consulted by the middleware
+        self.client.get('/api/payments/admin/orders/')
+        with self.assertNumQueries(1):
+            first = self.client.get('/api/payments/admin/orders/', params)
+        second = self.client.get('/api/payments/admin/orders/', {**params, 'cursor': first.data['next_cursor']})
+
+        ids = [row['id'] for row in first.data['results'] + second.data['results']]
+        self.assertEqual(ids, [self.orders[0].id, self.orders[1].id, self.orders[3].id])
+        self.assertIsNone(second.data['next_cursor'])
+        row = first.data['results'][0]
+        self.assertEqual((row['plan_name'], row['payment_provider'], row['user_email']),
+                         ('Bootcamp', 'paypal', 'buyer@example.com'))
+        self.assertNotIn('metadata', row)
+
+        bad = self.client.get('/api/payments/admin/orders/', {'start_date': 'yesterday'})
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_streams_csv_export(self):
+        response = self.client.get('/api/payments/admin/orders/export/', {
+            'start_date': str(self.today - timedelta(days=1))
+        })
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('id,created_at,order_id,status,amount,currency'))
+        self.assertEqual([line.split(',')[0] for line in lines[1:]],
+                         [str(order.id) for order in (self.orders[1], self.orders[2], self.orders[0])])
+        self.assertIn('Bootcamp,paypal', lines[1])
+
+
+class IdempotencyKeyTest(APITestCase):
+    def setUp(self):
+        self.fake = FakePayPal()
+        self.addCleanup(self.fake.stop)
+        use_fake_paypal(self, self.fake)
+        self.user = User.objects.create_user(username='mobile', email='mobile@example.com', password='testpass123')
+        self.plan = PricingPlan.objects.create(name='Bootcamp', price='200.00')
+        Coupon.objects.create(
+            code='LAUNCH', discount_type='percentage', discount_value='25',
+            valid_from=timezone.now() - timedelta(days=1)
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def _create(self, key, coupon_code='LAUNCH'):
+        return self.client.post(
+            '/api/payments/orders/create/', {'pricing_plan_id': self.plan.id, 'coupon_code': coupon_code},
+            format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retried_order_is_created_once(self):
+        first, retry = self._create('order-1'), self._create('order-1')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['order_id'], first.data['order_id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(CouponUsage.objects.count(), 1)
+
+        reused = self._create('order-1', coupon_code='')
+        self.assertEqual(reused.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self._create('order-2')
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_retried_capture_is_not_sent_to_paypal_again(self):
+        order = Order.objects.create(user=self.user, pricing_plan=self.plan, amount='200.00')
+        paypal_order = paypal_service.create_order('200.00', order_id=order.order_id)['paypal_order_id']
+        Payment.objects.create(order=order, provider='paypal', provider_payment_id=paypal_order, amount='200.00')
+
+        body = {'order_id': str(order.order_id), 'paypal_order_id': paypal_order}
+        responses = [
+            self.client.post('/api/payments/paypal/capture-order/', body, format='json', HTTP_IDEMPOTENCY_KEY='cap-1')
+            for _ in range(2)
+        ]
+
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(responses[1].data, responses[0].data)
+        captures = [request for request in self.fake.requests if request[1].endswith('/capture')]
+        self.assertEqual(len(captures), 1)
+        self.assertEqual(Payment.objects.get().status, 'completed')
+
+    def test_retry_after_a_failed_capture_looks_the_payment_up(self):
+        order = Order.objects.create(user=self.user, pricing_plan=self.plan, amount='200.00', status='processing')
+        paypal_order = paypal_service.create_order('200.00', order_id=order.order_id)['paypal_order_id']
+        Payment.objects.create(order=order, provider='paypal', provider_payment_id=paypal_order, amount='200.00')
+        body = {'order_id': str(order.order_id), 'paypal_order_id': paypal_order}
+
+        self.fake.fail_next = [500] * 3
+        with self.assertLogs('payments.paypal_service', level='WARNING'):
+            first = self.client.post('/api/payments/paypal/capture-order/', body, format='json',
+                                     HTTP_IDEMPOTENCY_KEY='cap-2')
+        self.assertEqual(first.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(IdempotencyKey.objects.get(key='cap-2').status, 'failed')
+        captures = len([request for request in self.fake.requests if request[1].endswith('/capture')])
+        # PayPal captured the order although every answer was lost
+        self.fake.orders[paypal_order].update(status='COMPLETED', payer={'payer_id': 'FAKEPAYER'})
+        self.fake.orders[paypal_order]['purchase_units'][0]['payments'] = {
+            'captures': [{'id': f'CAP-{paypal_order}', 'status': 'COMPLETED'}]
+        }
+
+        retry = self.client.post('/api/payments/paypal/capture-order/', body, format='json',
+                                 HTTP_IDEMPOTENCY_KEY='cap-2')
+
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(len([request for request in self.fake.requests if request[1].endswith('/capture')]), captures)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.status, payment.provider_capture_id), ('completed', f'CAP-{paypal_order}'))
+        self.assertEqual(payment.provider_payer_id, 'FAKEPAYER')
+        self.assertEqual(IdempotencyKey.objects.get(key='cap-2').status, 'completed')
+
+    def test_capture_retries_never_capture_twice_or_fail_a_completed_payment(self):
+        order = Order.objects.create(user=self.user, pricing_plan=self.plan, amount='200.00', status='processing')
+        paypal_order = paypal_service.create_order('200.00', order_id=order.order_id)['paypal_order_id']
+        payment = Payment.objects.create(
+            order=order, provider='paypal', provider_payment_id=paypal_order, amount='200.00'
+        )
+        body = {'order_id': str(order.order_id), 'paypal_order_id': paypal_order}
+
+        # The first attempt reached PayPal but its answer was lost; the retry
+        # reuses the payment's request id and gets the original capture back
+        paypal_service.capture_order(paypal_order, request_id=f'capture-{payment.payment_id}')
+        response = self.client.post('/api/payments/paypal/capture-order/', body, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['order']['status'], 'paid')
+        self.assertEqual(Payment.objects.get().provider_capture_id, f'CAP-{paypal_order}')
+
+        # Another retry is answered locally and leaves the payment completed
+        response = self.client.post('/api/payments/paypal/capture-order/', body, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        captures = [request for request in self.fake.requests if request[1].endswith('/capture')]
+        self.assertEqual(len(captures), 2)
+        self.assertEqual({request[2] for request in captures}, {f'capture-{payment.payment_id}'})
+        self.assertEqual((Payment.objects.get().status, Order.objects.get().status), ('completed', 'paid'))
+
+    def test_capture_already_made_under_another_request_id_completes_the_payment(self):
+        order = Order.objects.create(user=self.user, pricing_plan=self.plan, amount='200.00', status='processing')
+        paypal_order = paypal_service.create_order('200.00', order_id=order.order_id)['paypal_order_id']
+        Payment.objects.create(order=order, provider='paypal', provider_payment_id=paypal_order, amount='200.00')
+        paypal_service.capture_order(paypal_order)
+
+        response = self.client.post(
+            '/api/payments/paypal/capture-order/',
+            {'order_id': str(order.order_id), 'paypal_order_id': paypal_order}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.status, payment.provider_capture_id), ('completed', f'CAP-{paypal_order}'))
+
+    def test_concurrent_retry_conflicts_and_expired_keys_are_purged(self):
+        IdempotencyKey.objects.create(
+            user=self.user, scope='create-order', key='busy', request_fingerprint='x',
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+        self.assertEqual(self._create('busy').status_code, status.HTTP_409_CONFLICT)
+        # Still within the slowest provider call (timeouts x attempts plus backoff)
+        self.assertGreater(in_progress_timeout(), timedelta(seconds=3 * 20 + 2 * 10))
+        IdempotencyKey.objects.filter(key='busy').update(updated_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(self._create('busy').status_code, status.HTTP_409_CONFLICT)
+        IdempotencyKey.objects.filter(key='busy').update(updated_at=timezone.now() - in_progress_timeout())
+        self.assertEqual(self._create('busy').status_code, status.HTTP_201_CREATED)
+
+        self._create('old')
+        IdempotencyKey.objects.filter(key='old').update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1 ', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['busy'])
+
+
+@override_settings(MPESA_CALLBACK_BASE_URL='https://api.example.com', MPESA_CALLBACK_TOKEN='callback-token')
+class MpesaPaymentTest(APITestCase):
+    def setUp(self):
+        self.fake = FakeMpesa()
+        self.addCleanup(self.fake.stop)
+        use_fake_mpesa(self, self.fake)
+        self.user = User.objects.create_user(username='wanjiku', email='wanjiku@example.com', password='testpass123')
+        self.order = Order.objects.create(user=self.user, amount='1500.00', currency='KES')
+        self.client.force_authenticate(user=self.user)
+
+    def _push(self, order=None, phone_number='0712 345 678'):
+        return self.client.post(
+            '/api/payments/mpesa/stk-push/',
+            {'order_id': str((order or self.order).order_id), 'phone_number': phone_number}, format='json'
+        )
+
+    def _callback(self, checkout_id, result_code=0, token='callback-token', amount=1500.0):
+        callback = {'MerchantRequestID': 'MR-1', 'CheckoutRequestID': checkout_id, 'ResultCode': result_code,
+                    'ResultDesc': 'The service request is processed successfully.'}
+        if result_code == 0:
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': amount},
+                {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+                {'Name': 'TransactionDate', 'Value': 20261019102115},
+                {'Name': 'PhoneNumber', 'Value': 254712345678},
+            ]}
+        return self.client.generic(
+            'POST', f'/api/payments/mpesa/callback/{token}/', json.dumps({'Body': {'stkCallback': callback}}),
+            content_type='application/json'
+        )
+
+    def test_stk_push_completes_through_the_callback(self):
+        response = self._push()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        checkout_id = response.data['checkout_request_id']
+        push = self.fake.pushes[0]
+        self.assertEqual((push['PhoneNumber'], push['Amount']), ('254712345678', 1500))
+        self.assertEqual(push['CallBackURL'], 'https://api.example.com/api/payments/mpesa/callback/callback-token/')
+        self.assertEqual(base64.b64decode(push['Password']).decode(), f"174379passkey{push['Timestamp']}")
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'processing')
+
+        self.fake.results[checkout_id] = 0
+        acknowledged = self._callback(checkout_id)
+        self._callback(checkout_id)
+        self.assertEqual(acknowledged.data, {'ResultCode': 0, 'ResultDesc': 'Accepted'})
+        self.assertEqual(WebhookEvent.objects.get(provider='mpesa').event_id, checkout_id)
+
+        self.assertEqual(process_webhook_events(), {'processed': 1})
+        payment = Payment.objects.get(provider='mpesa')
+        self.assertEqual((payment.status, payment.provider_capture_id), ('completed', 'NLJ7RT61SV'))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'paid')
+        # Token fetched once for the push and the confirming query
+        self.assertEqual(self.fake.token_calls, 1)
+
+    def test_unconfirmed_callbacks_are_not_applied(self):
+        checkout_id = self._push().data['checkout_request_id']
+        self.assertEqual(self._callback(checkout_id, token='guessed').status_code, status.HTTP_404_NOT_FOUND)
+
+        # Claims success while M-Pesa has no answer yet, then while it reports a cancellation
+        self._callback(checkout_id)
+        with self.assertLogs('payments.webhooks', 'INFO') as logs:
+            self.assertEqual(process_webhook_events(), {'received': 1})
+        # Waiting on M-Pesa is not a failure and does not use up an attempt
+        self.assertEqual([record.levelname for record in logs.records], ['INFO'])
+        self.assertEqual(WebhookEvent.objects.get(provider='mpesa').attempts, 0)
+        self.fake.results[checkout_id] = 1032
+        self.assertEqual(process_webhook_events(now=timezone.now() + timedelta(minutes=5)), {'invalid': 1})
+        self.assertEqual(Payment.objects.get(provider='mpesa').status, 'pending')
+
+        # The lost cancellation is picked up by reconciliation
+        counts, _ = reconcile_payments(rate=None, now=timezone.now() + timedelta(hours=1))
+        self.assertEqual(counts['failed'], 1)
+        self.assertEqual(Payment.objects.get(provider='mpesa').status, 'failed')
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'failed')
+
+    def test_callback_amount_must_match_the_payment(self):
+        checkout_id = self._push().data['checkout_request_id']
+        self.fake.results[checkout_id] = 0
+        self._callback(checkout_id, amount=1.0)
+
+        with self.assertLogs('payments.webhooks', 'WARNING'):
+            self.assertEqual(process_webhook_events(), {'invalid': 1})
+        payment = Payment.objects.get(provider='mpesa')
+        self.assertEqual((payment.status, payment.provider_capture_id), ('pending', ''))
+
+    def test_rejects_unpayable_orders_and_unknown_providers(self):
+        dollars = Order.objects.create(user=self.user, amount='20.00', currency='USD')
+        self.assertEqual(self._push(order=dollars).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._push(phone_number='+1 555 0100').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.fake.pushes, [])
+        with self.assertRaises(GatewayError):
+            get_gateway('stripe')
+
+
+class CouponContentionTest(TransactionTestCase):
+    """500 concurrent redemptions of a coupon limited to 100 uses"""
+    REDEMPTIONS = 500
+    MAX_USES = 100
+
+    def test_no_oversell_under_contention(self):
+        coupon = Coupon.objects.create(
+            code='FLASH', discount_type='fixed', discount_value='10', max_uses=self.MAX_USES,
+            valid_from=timezone.now() - timedelta(days=1)
+        )
+        users = User.objects.bulk_create([
+            User(username=f'buyer{index}', email=f'buyer{index}@example.com') for index in range(self.REDEMPTIONS)
+        ])
+        orders = Order.objects.bulk_create([Order(user=user, amount=90) for user in users])
+        start = threading.Barrier(50)
+
+        def redeem(args):
+            user, order = args
+            try:
+                start.wait(timeout=5)
+            except threading.BrokenBarrierError:
+                pass
+            try:
+                while True:
+                    try:
+                        Coupon(pk=coupon.pk, max_uses_per_user=1).redeem(user, order)
+                        return True
+                    except CouponRedemptionError:
+                        return False
+                    except OperationalError:
+                        # SQLite allows one writer at a time; PostgreSQL waits on the row lock instead
+                        time.sleep(0.001)
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            results = list(executor.map(redeem, zip(users, orders)))
+
+        coupon.refresh_from_db()
+        self.assertEqual(sum(results), self.MAX_USES)
+        self.assertEqual(coupon.times_used, self.MAX_USES)
+        self.assertEqual(CouponUsage.objects.filter(coupon=coupon).count(), self.MAX_USES)
@@ -29,11 +29,22 @@ urlpatterns = [
     path('paypal/capture-order/', views.PayPalCaptureOrderView.as_view(), name='paypal-capture-order'),
     path('paypal/webhook/', views.PayPalWebhookView.as_view(), name='paypal-webhook'),
     
+    # ============== M-PESA ENDPOINTS ==============
+    path('mpesa/stk-push/', views.MpesaStkPushView.as_view(), name='mpesa-stk-push'),
+    path('mpesa/callback/<str:token>/', views.MpesaCallbackView.as_view(), name='mpesa-callback'),
+    
     # ============== ADMIN ENDPOINTS ==============
     path('admin/orders/', views.AdminOrderListView.as_view(), name='admin-orders'),
+    path('admin/orders/export/', views.AdminOrderExportView.as_view(), name='admin-order-export'),
     path('admin/orders/<uuid:order_id>/', views.AdminOrderDetailView.as_view(), name='admin-order-detail'),
+    path('admin/payments/<uuid:payment_id>/refund/', views.AdminPaymentRefundView.as_view(), name='admin-payment-refund'),
     path('admin/stats/', views.AdminPaymentStatsView.as_view(), name='admin-payment-stats'),
     
+    # Admin reports (daily ledger)
+    path('admin/reports/revenue/', views.AdminRevenueReportView.as_view(), name='admin-revenue-report'),
+    path('admin/reports/refunds/', views.AdminRefundReportView.as_view(), name='admin-refund-report'),
+    path('admin/reports/conversion/', views.AdminConversionReportView.as_view(), name='admin-conversion-report'),
+    
     # Admin pricing plans
     path('admin/plans/', views.AdminPricingPlanListCreateView.as_view(), name='admin-pricing-plans'),
     path('admin/plans/<int:pk>/', views.AdminPricingPlanDetailView.as_view(), name='admin-pricing-plan-detail'),
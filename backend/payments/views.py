@@ -2,20 +2,37 @@ from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
-from django.db.models import Sum, Count
+from django.db import transaction
+from django.http import Http404
+from django.db.models import Count, Q
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from rest_framework.exceptions import ValidationError
 
 from .models import (
     PaymentMethod, PricingPlan, Order, Payment, 
-    Subscription, Coupon, CouponUsage
+    Subscription, Coupon, CouponRedemptionError
 )
 from .serializers import (
     PaymentMethodSerializer, PricingPlanSerializer, OrderSerializer,
     PaymentSerializer, SubscriptionSerializer, CouponSerializer,
     CouponValidationSerializer, CreateOrderSerializer,
-    PayPalCreateOrderSerializer, PayPalCaptureSerializer, PaymentStatsSerializer
+    PayPalCreateOrderSerializer, PayPalCaptureSerializer, PaymentStatsSerializer,
+    AdminOrderListSerializer
+)
+from .gateways import get_gateway, normalize_phone_number, outcome_unknown
+from .webhooks import ingest_webhook
+from .catalog import get_catalog
+from .idempotency import idempotent
+from .clients import GatewayError
+from .exports import ORDER_EXPORT_COLUMNS
+from backend.exports import export_response
+from backend.pagination import KeysetPagination
+from .ledger import (
+    DEFAULT_REPORT_DAYS, GROUP_BY_FIELDS, PRIMARY_CURRENCY, ledger_report, revenue_by_currency, start_of_day
 )
-from .paypal_service import paypal_service
 
 
 # ============== PUBLIC VIEWS ==============
@@ -25,6 +42,14 @@ class PaymentMethodListView(generics.ListAPIView):
     queryset = PaymentMethod.objects.filter(is_active=True)
     serializer_class = PaymentMethodSerializer
     permission_classes = [AllowAny]
+    
+    def list(self, request, *args, **kwargs):
+        # Served from the cached catalog
+        methods = get_catalog().payment_methods
+        page = self.paginate_queryset(methods)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(methods)
 
 
 class PricingPlanListView(generics.ListAPIView):
@@ -41,6 +66,14 @@ class PricingPlanListView(generics.ListAPIView):
             queryset = queryset.filter(program_id=program_id)
         
         return queryset
+    
+    def list(self, request, *args, **kwargs):
+        # Served from the cached catalog
+        plans = get_catalog().plans_for(request.query_params.get('program_id'))
+        page = self.paginate_queryset(plans)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(plans)
 
 
 class PricingPlanDetailView(generics.RetrieveAPIView):
@@ -48,6 +81,12 @@ class PricingPlanDetailView(generics.RetrieveAPIView):
     queryset = PricingPlan.objects.filter(is_active=True)
     serializer_class = PricingPlanSerializer
     permission_classes = [AllowAny]
+    
+    def retrieve(self, request, *args, **kwargs):
+        plan = get_catalog().plan(kwargs['pk'])
+        if plan is None:
+            raise Http404
+        return Response(plan)
 
 
 class ValidateCouponView(APIView):
@@ -96,6 +135,7 @@ class CreateOrderView(APIView):
     """Create a new order"""
     permission_classes = [IsAuthenticated]
     
+    @idempotent('create-order')
     def post(self, request):
         serializer = CreateOrderSerializer(data=request.data)
         if not serializer.is_valid():
@@ -103,72 +143,51 @@ class CreateOrderView(APIView):
         
         data = serializer.validated_data
         
+        catalog = get_catalog()
+        
         # Get pricing plan
-        try:
-            pricing_plan = PricingPlan.objects.get(id=data['pricing_plan_id'], is_active=True)
-        except PricingPlan.DoesNotExist:
+        pricing_plan = catalog.plan(data['pricing_plan_id'])
+        if pricing_plan is None:
             return Response(
                 {'error': 'Pricing plan not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Calculate amount
-        amount = pricing_plan.price
-        coupon = None
-        
-        # Apply coupon if provided
-        if data.get('coupon_code'):
-            try:
-                coupon = Coupon.objects.get(code__iexact=data['coupon_code'])
-                if coupon.is_valid():
-                    # Check user's usage
-                    user_uses = CouponUsage.objects.filter(
-                        coupon=coupon, user=request.user
-                    ).count()
-                    
-                    if user_uses < coupon.max_uses_per_user:
-                        if coupon.discount_type == 'percentage':
-                            discount = amount * (coupon.discount_value / 100)
-                        else:
-                            discount = coupon.discount_value
-                        amount = max(0, amount - discount)
-            except Coupon.DoesNotExist:
-                pass
+        # Effective price with the coupon, precomputed in the catalog
+        price = catalog.plan_prices[pricing_plan['id']]
+        amount, coupon = catalog.price(pricing_plan['id'], data.get('coupon_code'))
         
         # Get payment method
-        payment_method = None
-        if data.get('payment_method_id'):
-            try:
-                payment_method = PaymentMethod.objects.get(id=data['payment_method_id'])
-            except PaymentMethod.DoesNotExist:
-                pass
-        
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            pricing_plan=pricing_plan,
-            amount=amount,
-            currency=pricing_plan.currency,
-            payment_method=payment_method,
-            billing_name=data.get('billing_name', ''),
-            billing_email=data.get('billing_email', request.user.email),
-            billing_address=data.get('billing_address', ''),
-            billing_country=data.get('billing_country', ''),
-            metadata={
-                'original_amount': str(pricing_plan.price),
-                'coupon_code': data.get('coupon_code', '')
-            }
-        )
+        payment_method_id = data.get('payment_method_id')
+        if payment_method_id not in catalog.payment_method_ids:
+            payment_method_id = None
         
-        # Record coupon usage
-        if coupon:
-            CouponUsage.objects.create(
-                coupon=coupon,
+        with transaction.atomic():
+            # Create order
+            order = Order.objects.create(
                 user=request.user,
-                order=order
+                pricing_plan_id=pricing_plan['id'],
+                amount=amount,
+                currency=pricing_plan['currency'],
+                payment_method_id=payment_method_id,
+                billing_name=data.get('billing_name', ''),
+                billing_email=data.get('billing_email', request.user.email),
+                billing_address=data.get('billing_address', ''),
+                billing_country=data.get('billing_country', ''),
+                metadata={
+                    'original_amount': str(price),
+                    'coupon_code': data.get('coupon_code', '')
+                }
             )
-            coupon.times_used += 1
-            coupon.save()
+            
+            # Redeem the coupon atomically; if it is no longer available
+            # (expired, used up, per-user limit) the order keeps the full price
+            if coupon:
+                try:
+                    coupon.instance().redeem(request.user, order)
+                except CouponRedemptionError:
+                    order.amount = price
+                    order.save(update_fields=['amount', 'updated_at'])
         
         return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
@@ -232,24 +251,17 @@ class PayPalCreateOrderView(APIView):
         
         try:
             # Create PayPal order
-            description = f"Code2Deploy - {order.pricing_plan.name}" if order.pricing_plan else "Code2Deploy Payment"
-            
-            paypal_result = paypal_service.create_order(
-                amount=float(order.amount),
-                currency=order.currency,
-                description=description,
-                order_id=order.order_id
-            )
+            result = get_gateway('paypal').create_payment(order)
             
             # Create payment record
-            payment = Payment.objects.create(
+            Payment.objects.create(
                 order=order,
                 provider='paypal',
-                provider_payment_id=paypal_result['paypal_order_id'],
+                provider_payment_id=result.provider_payment_id,
                 amount=order.amount,
                 currency=order.currency,
                 status='pending',
-                provider_response=paypal_result.get('raw_response', {})
+                provider_response=result.raw
             )
             
             # Update order status
@@ -258,8 +270,8 @@ class PayPalCreateOrderView(APIView):
             
             return Response({
                 'order_id': str(order.order_id),
-                'paypal_order_id': paypal_result['paypal_order_id'],
-                'approval_url': paypal_result['approval_url']
+                'paypal_order_id': result.provider_payment_id,
+                'approval_url': result.redirect_url
             })
             
         except Exception as e:
@@ -273,6 +285,7 @@ class PayPalCaptureOrderView(APIView):
     """Capture (complete) a PayPal payment after user approval"""
     permission_classes = [IsAuthenticated]
     
+    @idempotent('paypal-capture')
     def post(self, request):
         order_id = request.data.get('order_id')
         paypal_order_id = request.data.get('paypal_order_id')
@@ -302,45 +315,63 @@ class PayPalCaptureOrderView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        if payment.status == 'completed':
+            # A retry of a capture that already went through
+            return self._completed(order)
+        if payment.status != 'pending':
+            return Response(
+                {'error': f'Payment cannot be captured. Current status: {payment.status}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         try:
-            # Capture the PayPal order
-            capture_result = paypal_service.capture_order(paypal_order_id)
+            gateway = get_gateway('paypal')
+            result = None
+            if request.idempotent_retry:
+                # The failed attempt may have captured the order already
+                result = gateway.query_status(payment)
+            if result is None or result.status != 'completed':
+                # Capture the PayPal order
+                result = gateway.capture_payment(payment)
             
-            if capture_result['status'] == 'COMPLETED':
+            if result.status == 'completed':
                 # Update payment record
-                payment.provider_payer_id = capture_result.get('payer', {}).get('payer_id', '')
-                payment.mark_as_completed(capture_result.get('raw_response', {}))
+                payment.provider_payer_id = result.payer_id
+                payment.provider_capture_id = result.capture_id
+                payment.mark_as_completed(result.raw)
                 
                 # Enroll user in program if applicable
-                if order.pricing_plan and order.pricing_plan.program:
-                    from programs.models import Enrollment
-                    Enrollment.objects.get_or_create(
-                        user=request.user,
-                        program=order.pricing_plan.program,
-                        defaults={'status': 'ongoing'}
-                    )
+                order.enroll_user()
                 
-                return Response({
-                    'success': True,
-                    'message': 'Payment completed successfully',
-                    'order': OrderSerializer(order).data
-                })
+                return self._completed(order)
             else:
                 payment.status = 'failed'
-                payment.provider_response = capture_result.get('raw_response', {})
+                payment.provider_response = result.raw
                 payment.save()
+                if payment.status == 'completed':
+                    # The webhook completed it meanwhile
+                    return self._completed(order)
                 
                 order.status = 'failed'
                 order.save()
                 
                 return Response(
-                    {'error': 'Payment was not completed', 'status': capture_result['status']},
+                    {'error': 'Payment was not completed', 'status': result.provider_status},
                     status=status.HTTP_400_BAD_REQUEST
                 )
                 
         except Exception as e:
+            if isinstance(e, GatewayError) and outcome_unknown(e):
+                # PayPal may have captured the money before the answer was lost,
+                # so the payment stays pending for the webhook or reconciliation
+                return Response(
+                    {'error': f'Could not confirm the capture with PayPal: {str(e)}', 'status': 'pending'},
+                    status=status.HTTP_502_BAD_GATEWAY
+                )
             payment.status = 'failed'
             payment.save()
+            if payment.status == 'completed':
+                return self._completed(order)
             
             order.status = 'failed'
             order.save()
@@ -349,73 +380,181 @@ class PayPalCaptureOrderView(APIView):
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+    
+    def _completed(self, order):
+        order.refresh_from_db()
+        return Response({
+            'success': True,
+            'message': 'Payment completed successfully',
+            'order': OrderSerializer(order).data
+        })
 
 
 class PayPalWebhookView(APIView):
-    """Handle PayPal webhooks"""
+    """
+    Handle PayPal webhooks
+
+    The raw event is stored and acknowledged right away; verification and
+    state changes happen in process_webhook_events.
+    """
     permission_classes = [AllowAny]
+    authentication_classes = []
     
     def post(self, request):
-        # Verify webhook signature
-        # Note: In production, always verify the webhook signature
+        event = ingest_webhook('paypal', request.body, request.headers)
+        if event is None:
+            return Response({'error': 'Invalid webhook payload'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': 'received'})
+
+
+# ============== M-PESA VIEWS ==============
+
+class MpesaStkPushView(APIView):
+    """Prompt the customer's phone to pay an order with M-Pesa"""
+    permission_classes = [IsAuthenticated]
+    
+    @idempotent('mpesa-stk-push')
+    def post(self, request):
+        order_id = request.data.get('order_id')
+        phone_number = normalize_phone_number(request.data.get('phone_number'))
+        
+        if not order_id or not phone_number:
+            return Response(
+                {'error': 'Order ID and a Safaricom phone number are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         try:
-            event_type = request.data.get('event_type')
-            resource = request.data.get('resource', {})
-            
-            if event_type == 'CHECKOUT.ORDER.APPROVED':
-                # Order was approved, ready for capture
-                paypal_order_id = resource.get('id')
-                # You might want to notify the frontend here
-                
-            elif event_type == 'PAYMENT.CAPTURE.COMPLETED':
-                # Payment was captured
-                capture_id = resource.get('id')
-                paypal_order_id = resource.get('supplementary_data', {}).get('related_ids', {}).get('order_id')
-                
-                if paypal_order_id:
-                    try:
-                        payment = Payment.objects.get(provider_payment_id=paypal_order_id)
-                        if payment.status != 'completed':
-                            payment.mark_as_completed(resource)
-                    except Payment.DoesNotExist:
-                        pass
-            
-            elif event_type == 'PAYMENT.CAPTURE.REFUNDED':
-                # Payment was refunded
-                capture_id = resource.get('id')
-                # Handle refund logic
-            
-            return Response({'status': 'received'})
-            
-        except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            order = Order.objects.get(order_id=order_id, user=request.user)
+        except Order.DoesNotExist:
+            return Response(
+                {'error': 'Order not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        if order.status != 'pending':
+            return Response(
+                {'error': f'Order cannot be paid. Current status: {order.status}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            result = get_gateway('mpesa').create_payment(order, phone_number=phone_number)
+        except GatewayError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST if e.status_code == 400 else status.HTTP_502_BAD_GATEWAY
+            )
+        
+        # The payment completes when the callback arrives (see webhooks._stk_callback)
+        Payment.objects.create(
+            order=order,
+            provider='mpesa',
+            provider_payment_id=result.provider_payment_id,
+            provider_payer_id=result.payer_id,
+            amount=order.amount,
+            currency=order.currency,
+            status='pending',
+            provider_response=result.raw
+        )
+        order.status = 'processing'
+        order.save()
+        
+        return Response({
+            'order_id': str(order.order_id),
+            'checkout_request_id': result.provider_payment_id,
+            'message': result.message
+        })
+
+
+class MpesaCallbackView(APIView):
+    """
+    Receive STK push results from Safaricom
+
+    The URL carries MPESA_CALLBACK_TOKEN since Daraja does not sign
+    callbacks; the callback is stored as a webhook event and confirmed with
+    an STK query before process_webhook_events applies it.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+    
+    def post(self, request, token):
+        if not get_gateway('mpesa').check_callback_token(token):
+            raise Http404
+        event = ingest_webhook('mpesa', request.body, request.headers)
+        if event is None:
+            return Response({'error': 'Invalid callback payload'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
 
 
 # ============== ADMIN VIEWS ==============
 
-class AdminOrderListView(generics.ListAPIView):
-    """Admin view for all orders"""
+def filter_admin_orders(request):
+    """
+    Apply the status and date range filters shared by browsing and export.
+
+    Dates are turned into created_at bounds (start of start_date up to the
+    start of the day after end_date) so the created_at indexes are used.
+    """
     queryset = Order.objects.all()
-    serializer_class = OrderSerializer
+    
+    # Filter by status
+    status_filter = request.query_params.get('status')
+    if status_filter:
+        queryset = queryset.filter(status=status_filter)
+    
+    # Filter by date range
+    for param, offset, lookup in (('start_date', 0, 'created_at__gte'), ('end_date', 1, 'created_at__lt')):
+        value = request.query_params.get(param)
+        if not value:
+            continue
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError({param: 'Use YYYY-MM-DD'})
+        queryset = queryset.filter(**{lookup: start_of_day(day + timedelta(days=offset))})
+    
+    return queryset
+
+
+class AdminOrderPagination(KeysetPagination):
+    page_size = 50
+    max_page_size = 200
+
+
+class AdminOrderListView(generics.ListAPIView):
+    """Admin view for all orders, newest first with keyset pagination"""
+    serializer_class = AdminOrderListSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = AdminOrderPagination
+    list_fields = [
+        'id', 'order_id', 'user_id', 'user__email', 'billing_name', 'pricing_plan_id', 'pricing_plan__name',
+        'amount', 'currency', 'status', 'payment_method_id', 'payment_method__provider', 'created_at', 'paid_at'
+    ]
     
     def get_queryset(self):
-        queryset = Order.objects.all()
-        
-        # Filter by status
-        status_filter = self.request.query_params.get('status')
-        if status_filter:
-            queryset = queryset.filter(status=status_filter)
-        
-        # Filter by date range
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
-        if start_date:
-            queryset = queryset.filter(created_at__date__gte=start_date)
-        if end_date:
-            queryset = queryset.filter(created_at__date__lte=end_date)
-        
-        return queryset
+        return filter_admin_orders(self.request).select_related(
+            'user', 'pricing_plan', 'payment_method'
+        ).only(*self.list_fields)
+
+
+class AdminOrderExportView(APIView):
+    """Admin: Stream orders as CSV or NDJSON for finance, resumable from a row cursor"""
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        try:
+            return export_response(
+                filter_admin_orders(request),
+                ORDER_EXPORT_COLUMNS,
+                request.query_params.get('export_format', 'csv'),
+                'orders',
+                cursor=request.query_params.get('cursor')
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class AdminOrderDetailView(generics.RetrieveUpdateAPIView):
@@ -426,32 +565,138 @@ class AdminOrderDetailView(generics.RetrieveUpdateAPIView):
     lookup_field = 'order_id'
 
 
+class AdminPaymentRefundView(APIView):
+    """Admin: Refund a completed payment, fully or in part, through its provider"""
+    permission_classes = [IsAdminUser]
+    
+    @idempotent('payment-refund')
+    def post(self, request, payment_id):
+        try:
+            payment = Payment.objects.select_related('order').get(payment_id=payment_id)
+        except Payment.DoesNotExist:
+            return Response({'error': 'Payment not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if payment.status != 'completed':
+            return Response(
+                {'error': f'Payment cannot be refunded. Current status: {payment.status}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Omitted for a refund of whatever has not been refunded yet
+        amount = request.data.get('amount')
+        if amount is not None:
+            remaining = Decimal(payment.amount) - Decimal(payment.refunded_amount or 0)
+            try:
+                amount = Decimal(str(amount))
+            except InvalidOperation:
+                amount = None
+            if amount is None or not Decimal('0') < amount <= remaining:
+                return Response(
+                    {'error': f'Refund amount must be more than 0 and at most {remaining}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        try:
+            result = get_gateway(payment.provider).refund_payment(payment, amount, request.data.get('note', ''))
+        except GatewayError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST if e.status_code == 400 else status.HTTP_502_BAD_GATEWAY
+            )
+        
+        if result.refunded_amount is None:
+            # Recorded by the provider's refund webhook once it completes
+            return Response(
+                {'message': 'Refund submitted', 'status': result.provider_status},
+                status=status.HTTP_202_ACCEPTED
+            )
+        
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().select_related('order').get(pk=payment.pk)
+            payment.record_refund(result.refunded_amount, result.raw)
+        return Response(PaymentSerializer(payment).data)
+
+
 class AdminPaymentStatsView(APIView):
     """Get payment statistics for admin dashboard"""
     permission_classes = [IsAdminUser]
     
     def get(self, request):
-        # Overall stats
-        total_revenue = Order.objects.filter(status='paid').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
+        # Net revenue per currency from the daily ledger; amounts in different
+        # currencies are never added together
+        revenue = revenue_by_currency()
         
-        total_orders = Order.objects.count()
-        paid_orders = Order.objects.filter(status='paid').count()
-        pending_orders = Order.objects.filter(status='pending').count()
-        failed_orders = Order.objects.filter(status='failed').count()
-        refunded_orders = Order.objects.filter(status='refunded').count()
+        counts = Order.objects.aggregate(
+            total_orders=Count('id'),
+            paid_orders=Count('id', filter=Q(status='paid')),
+            pending_orders=Count('id', filter=Q(status='pending')),
+            failed_orders=Count('id', filter=Q(status='failed')),
+            refunded_orders=Count('id', filter=Q(status='refunded'))
+        )
         
         return Response({
-            'total_revenue': total_revenue,
-            'total_orders': total_orders,
-            'paid_orders': paid_orders,
-            'pending_orders': pending_orders,
-            'failed_orders': failed_orders,
-            'refunded_orders': refunded_orders
+            'total_revenue': revenue.get(PRIMARY_CURRENCY, 0),
+            'revenue_by_currency': revenue,
+            **counts
         })
 
 
+class LedgerReportView(APIView):
+    """
+    Ledger totals for a date range, per currency.
+
+    Query params: start and end (YYYY-MM-DD, inclusive; the last 30 days by
+    default) and group_by, a comma separated list of day, plan and provider.
+    """
+    permission_classes = [IsAdminUser]
+    fields = ()
+    
+    def get(self, request):
+        end = request.query_params.get('end')
+        start = request.query_params.get('start')
+        try:
+            end = parse_date(end) if end else timezone.localdate()
+            start = parse_date(start) if start else end - timedelta(days=DEFAULT_REPORT_DAYS - 1)
+        except ValueError:
+            start = end = None
+        if start is None or end is None:
+            return Response({'error': 'start and end must be dates (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({'error': 'start must not be after end'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        group_by = [name for name in request.query_params.get('group_by', '').split(',') if name]
+        unknown = [name for name in group_by if name not in GROUP_BY_FIELDS]
+        if unknown:
+            return Response(
+                {'error': f'Unknown group_by: {", ".join(unknown)}; use {", ".join(GROUP_BY_FIELDS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        dimensions = {'currency'}
+        for name in group_by:
+            dimensions.update(GROUP_BY_FIELDS[name])
+        results = [
+            {name: value for name, value in row.items() if name in dimensions or name in self.fields}
+            for row in ledger_report(start, end, group_by)
+        ]
+        return Response({'start': start, 'end': end, 'group_by': group_by, 'results': results})
+
+
+class AdminRevenueReportView(LedgerReportView):
+    """Completed payments, gross, refunded and net amounts"""
+    fields = ('payments_completed', 'gross_amount', 'refunded_amount', 'net_amount')
+
+
+class AdminRefundReportView(LedgerReportView):
+    """Refund counts and amounts"""
+    fields = ('refunds', 'refunded_amount', 'payments_completed', 'gross_amount')
+
+
+class AdminConversionReportView(LedgerReportView):
+    """Orders created against payments completed and failed"""
+    fields = ('orders_created', 'payments_completed', 'payments_failed', 'conversion_rate')
+
+
 class AdminPricingPlanListCreateView(generics.ListCreateAPIView):
     """Admin view to list/create pricing plans"""
     queryset = PricingPlan.objects.all()
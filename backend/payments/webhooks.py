@@ -0,0 +1,365 @@
+"""
+Payment Webhooks
+Ingestion stores the raw event keyed by (provider, event id) with a single
+INSERT ... ON CONFLICT DO NOTHING and returns, so the provider gets its 200
+at once and redeliveries are no-ops. Each provider's gateway identifies its
+events (see payments/gateways.py).
+
+process_webhook_events then has the gateway verify each event (PayPal
+signatures are checked locally against PayPal's signing certificate, cached
+per process and in the cache backend; M-Pesa callbacks are confirmed with an
+STK query, and retried without counting an attempt while M-Pesa has no
+result yet) and applies payment transitions in event time order. Transitions only move
+forward (pending -> completed -> refunded), so a late or concurrently
+processed event cannot undo a newer state. Partial refunds only raise the
+payment's refunded amount; it becomes refunded once fully refunded.
+"""
+import base64
+import hashlib
+import json
+import logging
+import zlib
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlparse
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .gateways import ResultPending, get_gateway, paypal_refund_total
+from .models import Payment, WebhookEvent
+from .paypal_service import paypal_service
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADERS = (
+    'PAYPAL-AUTH-ALGO', 'PAYPAL-CERT-URL', 'PAYPAL-TRANSMISSION-ID',
+    'PAYPAL-TRANSMISSION-SIG', 'PAYPAL-TRANSMISSION-TIME',
+)
+
+# Signing certificates are only fetched over HTTPS from these hosts
+CERT_HOSTS = ('api.paypal.com', 'api.sandbox.paypal.com', 'api-m.paypal.com', 'api-m.sandbox.paypal.com')
+CERT_CACHE_TIMEOUT = 24 * 60 * 60
+
+MAX_ATTEMPTS = 8
+
+# Claimed events are left to other workers until this has passed
+CLAIM_LEASE = timedelta(minutes=5)
+
+# Events the provider has no result for yet are checked again after
+# PENDING_RETRY_DELAY, and fail once they have waited PENDING_TIMEOUT
+PENDING_RETRY_DELAY = timedelta(seconds=30)
+PENDING_TIMEOUT = timedelta(days=1)
+
+_certificates = {}
+
+
+class WebhookVerificationError(Exception):
+    """The event cannot be verified and should not be retried as is"""
+
+
+def ingest_webhook(provider, raw_body, headers):
+    """
+    Store a webhook for later processing.
+
+    Returns:
+        the WebhookEvent (unsaved instance when it was a redelivery), or None
+        if the body is not a JSON event the provider's gateway recognises
+    """
+    try:
+        body = raw_body.decode('utf-8')
+        payload = json.loads(body)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+
+    parsed = get_gateway(provider).parse_webhook(payload, headers)
+    if parsed is None:
+        return None
+
+    event = WebhookEvent(
+        provider=provider,
+        event_id=parsed['event_id'][:255],
+        event_type=parsed['event_type'][:100],
+        event_time=parsed['event_time'] or timezone.now(),
+        headers=parsed['headers'],
+        body=body
+    )
+    WebhookEvent.objects.bulk_create([event], ignore_conflicts=True)
+    return event
+
+
+def _certificate_cache_key(url):
+    return f'payments:paypal-cert:{hashlib.sha1(url.encode()).hexdigest()}'
+
+
+def cache_certificate(url, pem):
+    """Store a signing certificate so verification does not fetch it"""
+    cache.set(_certificate_cache_key(url), pem, CERT_CACHE_TIMEOUT)
+    _certificates.pop(url, None)
+
+
+def get_certificate_key(url):
+    """Public key of a PayPal signing certificate"""
+    parsed = urlparse(url or '')
+    if parsed.scheme != 'https' or parsed.hostname not in CERT_HOSTS:
+        raise WebhookVerificationError(f'Untrusted certificate URL: {url}')
+
+    now = timezone.now()
+    entry = _certificates.get(url)
+    if entry and entry[1] > now:
+        return entry[0]
+
+    key = _certificate_cache_key(url)
+    pem = cache.get(key)
+    if pem is None:
+        response = paypal_service.session.get(url, timeout=paypal_service.timeout)
+        response.raise_for_status()
+        pem = response.text
+        cache.set(key, pem, CERT_CACHE_TIMEOUT)
+
+    certificate = x509.load_pem_x509_certificate(pem.encode())
+    if not certificate.not_valid_before_utc <= now < certificate.not_valid_after_utc:
+        raise WebhookVerificationError(f'Certificate {url} is not currently valid')
+    public_key = certificate.public_key()
+    _certificates[url] = (public_key, min(certificate.not_valid_after_utc, now + timedelta(seconds=CERT_CACHE_TIMEOUT)))
+    return public_key
+
+
+def verify_paypal_signature(headers, body, webhook_id):
+    """
+    Check a webhook signature without calling PayPal.
+
+    PayPal signs "<transmission id>|<transmission time>|<webhook id>|<crc32 of
+    the raw body>" with SHA256withRSA.
+    """
+    missing = [name for name in SIGNATURE_HEADERS if not headers.get(name)]
+    if missing:
+        raise WebhookVerificationError(f'Missing signature headers: {", ".join(missing)}')
+    if headers['PAYPAL-AUTH-ALGO'] != 'SHA256withRSA':
+        raise WebhookVerificationError(f'Unsupported signature algorithm: {headers["PAYPAL-AUTH-ALGO"]}')
+
+    message = '|'.join([
+        headers['PAYPAL-TRANSMISSION-ID'],
+        headers['PAYPAL-TRANSMISSION-TIME'],
+        webhook_id,
+        str(zlib.crc32(body.encode('utf-8'))),
+    ])
+    try:
+        signature = base64.b64decode(headers['PAYPAL-TRANSMISSION-SIG'])
+        get_certificate_key(headers['PAYPAL-CERT-URL']).verify(
+            signature, message.encode(), padding.PKCS1v15(), hashes.SHA256()
+        )
+    except (InvalidSignature, ValueError):
+        return False
+    return True
+
+
+def verify_paypal_event(event):
+    mode = getattr(settings, 'PAYPAL_WEBHOOK_VERIFICATION', 'local')
+    if mode == 'none':
+        return True
+    webhook_id = getattr(settings, 'PAYPAL_WEBHOOK_ID', '')
+    if not webhook_id:
+        raise WebhookVerificationError('PAYPAL_WEBHOOK_ID is not configured')
+    if mode == 'api':
+        return paypal_service.verify_webhook_signature(event.headers, json.loads(event.body), webhook_id)
+    return verify_paypal_signature(event.headers, event.body, webhook_id)
+
+
+def verify_event(event):
+    return get_gateway(event.provider).verify_webhook(event)
+
+
+def _find_payment(resource):
+    """Payment for a capture or refund resource, locked for update"""
+    payments = Payment.objects.select_for_update().select_related('order').filter(provider='paypal')
+    order_id = (resource.get('supplementary_data') or {}).get('related_ids', {}).get('order_id')
+    if order_id:
+        payment = payments.filter(provider_payment_id=order_id).first()
+        if payment:
+            return payment
+    for link in resource.get('links') or []:
+        href = link.get('href', '')
+        if link.get('rel') == 'up' and '/captures/' in href:
+            return payments.filter(provider_capture_id=href.rstrip('/').rsplit('/', 1)[-1]).first()
+    return None
+
+
+def _capture_completed(payload):
+    resource = payload.get('resource') or {}
+    payment = _find_payment(resource)
+    if payment is None:
+        return 'ignored', 'Payment not found'
+    if payment.status not in ('completed', 'refunded'):
+        payment.provider_capture_id = resource.get('id', '')
+        payment.mark_as_completed(resource)
+        payment.order.enroll_user()
+    return 'processed', ''
+
+
+def _capture_denied(payload):
+    resource = payload.get('resource') or {}
+    payment = _find_payment(resource)
+    if payment is None:
+        return 'ignored', 'Payment not found'
+    if payment.status == 'pending':
+        payment.status = 'failed'
+        payment.provider_response = resource
+        payment.save()
+        if payment.order.status in ('pending', 'processing'):
+            payment.order.status = 'failed'
+            payment.order.save()
+    return 'processed', ''
+
+
+def _capture_refunded(payload):
+    resource = payload.get('resource') or {}
+    payment = _find_payment(resource)
+    if payment is None:
+        return 'ignored', 'Payment not found'
+    payment.record_refund(paypal_refund_total(payment, resource))
+    return 'processed', ''
+
+
+def _stk_callback(payload):
+    """Result of an M-Pesa STK push; ResultCode 0 means the customer paid"""
+    callback = payload['Body']['stkCallback']
+    payment = Payment.objects.select_for_update().select_related('order').filter(
+        provider='mpesa', provider_payment_id=callback['CheckoutRequestID']
+    ).first()
+    if payment is None:
+        return 'ignored', 'Payment not found'
+
+    if int(callback.get('ResultCode', -1)) == 0:
+        if payment.status not in ('completed', 'refunded'):
+            items = {
+                item.get('Name'): item.get('Value')
+                for item in (callback.get('CallbackMetadata') or {}).get('Item') or []
+            }
+            # The STK query confirms the outcome but not the metadata, so the
+            # callback must at least claim the amount that was requested
+            try:
+                amount = Decimal(str(items.get('Amount')))
+            except InvalidOperation:
+                amount = None
+            if amount != Decimal(payment.amount):
+                logger.warning(
+                    f"M-Pesa callback for {callback['CheckoutRequestID']} reports amount {items.get('Amount')}, "
+                    f"expected {payment.amount}"
+                )
+                return 'invalid', f"Callback amount {items.get('Amount')} does not match {payment.amount}"
+            payment.provider_capture_id = str(items.get('MpesaReceiptNumber') or '')
+            payment.provider_payer_id = str(items.get('PhoneNumber') or payment.provider_payer_id)
+            payment.mark_as_completed(callback)
+            payment.order.enroll_user()
+    elif payment.status == 'pending':
+        payment.status = 'failed'
+        payment.provider_response = callback
+        payment.save()
+        if payment.order.status in ('pending', 'processing'):
+            payment.order.status = 'failed'
+            payment.order.notes = callback.get('ResultDesc', '')
+            payment.order.save()
+    return 'processed', ''
+
+
+HANDLERS = {
+    'paypal': {
+        'PAYMENT.CAPTURE.COMPLETED': _capture_completed,
+        'PAYMENT.CAPTURE.DENIED': _capture_denied,
+        'PAYMENT.CAPTURE.DECLINED': _capture_denied,
+        'PAYMENT.CAPTURE.REFUNDED': _capture_refunded,
+        'PAYMENT.CAPTURE.REVERSED': _capture_refunded,
+    },
+    'mpesa': {
+        'STK_CALLBACK': _stk_callback,
+    },
+}
+
+
+def _process_event(event, now):
+    event.attempts += 1
+    try:
+        # Verification may fetch a certificate or call the provider, so it
+        # runs before any transaction or row lock is taken
+        if not verify_event(event):
+            status, error = 'invalid', 'Signature verification failed'
+        else:
+            handler = HANDLERS.get(event.provider, {}).get(event.event_type)
+            if handler is None:
+                status, error = 'ignored', ''
+            else:
+                with transaction.atomic():
+                    status, error = handler(json.loads(event.body))
+    except WebhookVerificationError as e:
+        status, error = 'invalid', str(e)
+    except ResultPending as e:
+        error = str(e)
+        if event.received_at and event.received_at <= now - PENDING_TIMEOUT:
+            logger.error(f"Giving up on webhook event {event.event_id}: {error}")
+            status = 'failed'
+        else:
+            # Not a failure: the event is checked again without using an attempt
+            event.attempts -= 1
+            logger.info(f"Webhook event {event.event_id} is waiting for the provider: {error}")
+            status = 'received'
+            event.next_attempt_at = now + PENDING_RETRY_DELAY
+    except Exception as e:
+        logger.error(f"Failed to process webhook event {event.event_id} (attempt {event.attempts}): {str(e)}")
+        error = str(e)
+        if event.attempts >= MAX_ATTEMPTS:
+            status = 'failed'
+        else:
+            status = 'received'
+            event.next_attempt_at = now + timedelta(seconds=min(30 * 2 ** (event.attempts - 1), 3600))
+
+    event.status = status
+    event.last_error = error
+    if status != 'received':
+        event.processed_at = now
+    event.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'processed_at'])
+    return status
+
+
+def process_webhook_events(batch_size=100, now=None):
+    """
+    Verify and apply the next batch of due events, oldest event time first.
+
+    The batch is claimed with SKIP LOCKED and leased by pushing its
+    next_attempt_at forward, so several workers can run without applying an
+    event twice, and no lock is held while events are verified. Events of a
+    worker that dies mid-batch are picked up again when the lease runs out.
+
+    Returns:
+        Counter of resulting statuses
+    """
+    now = now or timezone.now()
+    counts = Counter()
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True).filter(
+                status='received', next_attempt_at__lte=now
+            ).order_by('event_time', 'id')[:batch_size]
+        )
+        WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(
+            next_attempt_at=now + CLAIM_LEASE
+        )
+    for event in events:
+        counts[_process_event(event, now)] += 1
+    return counts
+
+
+def replay_webhook_events(queryset):
+    """Queue events for another round of processing"""
+    return queryset.update(
+        status='received', attempts=0, next_attempt_at=timezone.now(), last_error='', processed_at=None
+    )
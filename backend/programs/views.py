@@ -7,6 +7,7 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework import status
 from .models import Program, Enrollment
 from .serializers import ProgramSerializer, EnrollmentSerializer, MessageSerializer, ProgramStatsSerializer
+from security.audit import audited
 
 # Create your views here.
 
@@ -23,6 +24,7 @@ class ProgramRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 class EnrollInProgramView(APIView):
     permission_classes = [IsAuthenticated]
     serializer_class = MessageSerializer
+    @audited('enrollment', 'Enrolled in program {program_id}', target_model=Program, target_param='program_id')
     def post(self, request, program_id):
         user = request.user
         try:
@@ -57,6 +59,7 @@ class EnrollInProgramBodyView(APIView):
     """
     permission_classes = [IsAuthenticated]
     
+    @audited('enrollment', 'Enrolled in program {target_id}', target_model=Program, target_param='program_id')
     def post(self, request):
         user = request.user
         program_id = request.data.get('program_id')
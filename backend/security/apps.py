@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class SecurityConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'security' 
\ No newline at end of file
+    name = 'security'
+
+    def ready(self):
+        import security.signals
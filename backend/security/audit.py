@@ -0,0 +1,251 @@
+"""
+Audit Log Writer
+Buffers audit events in memory and writes them with bulk_create from a
+background thread, so recording an event never waits on the database
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .ipfilter import get_enforcement_ip
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 10000
+DEFAULT_FLUSH_INTERVAL_MS = 500
+DEFAULT_FLUSH_BATCH = 200
+# Consecutive failed writes before a batch is given up
+DEFAULT_MAX_WRITE_ATTEMPTS = 5
+
+
+def get_client_ip(request):
+    """Client IP; X-Forwarded-For is only trusted for the configured proxy hops"""
+    return get_enforcement_ip(request)
+
+
+def write_audit_events(events):
+    from .models import AuditLog
+    AuditLog.objects.bulk_create([AuditLog(**event) for event in events], batch_size=500)
+
+
+class AuditBuffer:
+    """
+    Bounded ring buffer of pending audit events.
+
+    A daemon thread flushes every `flush_interval_ms` or as soon as
+    `flush_batch` events are waiting. When the database cannot keep up the
+    oldest events are dropped rather than growing memory without bound.
+    A batch whose write fails goes back to the front of the buffer and is
+    retried on the next interval, up to `max_write_attempts` times.
+    """
+
+    def __init__(self, writer=write_audit_events, max_size=DEFAULT_BUFFER_SIZE,
+                 flush_interval_ms=DEFAULT_FLUSH_INTERVAL_MS, flush_batch=DEFAULT_FLUSH_BATCH,
+                 max_write_attempts=DEFAULT_MAX_WRITE_ATTEMPTS):
+        self.writer = writer
+        self.max_size = max_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_batch = flush_batch
+        self.max_write_attempts = max_write_attempts
+        self.dropped = 0
+        self._failures = 0
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._events = deque(maxlen=self.max_size)
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork; pre-fork servers start one per worker
+        if self._pid != os.getpid():
+            self._reset()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+            self._thread.start()
+
+    def append(self, event, start_thread=True):
+        with self._condition:
+            if self._pid != os.getpid():
+                self._reset()
+            if len(self._events) == self.max_size:
+                self.dropped += 1
+            self._events.append(event)
+            if len(self._events) >= self.flush_batch:
+                self._condition.notify()
+        if start_thread:
+            self._ensure_thread()
+
+    def __len__(self):
+        return len(self._events)
+
+    def _drain(self):
+        with self._condition:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def _requeue(self, events):
+        with self._condition:
+            # Ahead of events appended meanwhile; the oldest go if it overflows
+            events = events + list(self._events)
+            overflow = max(len(events) - self.max_size, 0)
+            self.dropped += overflow
+            self._events.clear()
+            self._events.extend(events[overflow:])
+
+    def flush(self):
+        """Write all pending events; returns the number written"""
+        with self._flush_lock:
+            events = self._drain()
+            if not events:
+                return 0
+            try:
+                self.writer(events)
+            except Exception as e:
+                self._failures += 1
+                if self._failures >= self.max_write_attempts:
+                    self._failures = 0
+                    self.dropped += len(events)
+                    logger.error(f"Dropped {len(events)} audit events after {self.max_write_attempts} failed writes: {str(e)}")
+                else:
+                    self._requeue(events)
+                    logger.warning(f"Failed to write {len(events)} audit events, will retry: {str(e)}")
+                return 0
+            self._failures = 0
+            return len(events)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # After a failed write, wait for the interval before retrying
+                if (len(self._events) < self.flush_batch or self._failures) and not self._stopping:
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+            close_old_connections()
+            self.flush()
+            if stopping:
+                return
+
+    def stop(self):
+        """Flush everything still buffered and stop the writer thread"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush()
+
+
+audit_buffer = AuditBuffer(
+    max_size=getattr(settings, 'AUDIT_BUFFER_SIZE', DEFAULT_BUFFER_SIZE),
+    flush_interval_ms=getattr(settings, 'AUDIT_FLUSH_INTERVAL_MS', DEFAULT_FLUSH_INTERVAL_MS),
+    flush_batch=getattr(settings, 'AUDIT_FLUSH_BATCH', DEFAULT_FLUSH_BATCH),
+)
+
+# Durable shutdown: gunicorn workers and management commands exit through atexit
+atexit.register(audit_buffer.stop)
+
+
+def record_audit_event(action, description, user=None, request=None, target=None,
+                       target_model=None, target_id=None, metadata=None):
+    """
+    Queue an audit event.
+
+    Args:
+        action: One of AuditLog.ACTION_TYPES
+        description: Human readable description
+        user: Acting user (defaults to the authenticated request user)
+        request: Request to take IP address and user agent from
+        target: Model instance the action applied to
+        target_model/target_id: Target by model class and primary key, without loading it
+        metadata: Extra JSON-serializable data
+    """
+    if not getattr(settings, 'AUDIT_LOGGING_ENABLED', True):
+        return
+
+    if user is None and request is not None:
+        request_user = getattr(request, 'user', None)
+        if request_user is not None and request_user.is_authenticated:
+            user = request_user
+
+    if target is not None:
+        target_model, target_id = type(target), target.pk
+
+    content_type_id = None
+    object_id = None
+    if target_model is not None and target_id is not None:
+        try:
+            object_id = int(target_id)
+            content_type_id = ContentType.objects.get_for_model(target_model).id
+        except (TypeError, ValueError):
+            object_id = None
+
+    event = {
+        'user_id': user.pk if user is not None else None,
+        'action': action,
+        'description': description,
+        'ip_address': get_client_ip(request) if request is not None else None,
+        'user_agent': request.META.get('HTTP_USER_AGENT', '') if request is not None else '',
+        'content_type_id': content_type_id,
+        'object_id': object_id,
+        'metadata': metadata or {},
+        'created_at': timezone.now(),
+    }
+
+    if getattr(settings, 'AUDIT_LOG_ASYNC', True):
+        audit_buffer.append(event)
+    else:
+        audit_buffer.append(event, start_thread=False)
+        audit_buffer.flush()
+
+
+def audited(action, description=None, target_model=None, target_param=None):
+    """
+    Decorator for view methods that records an audit event on success.
+
+    Args:
+        action: One of AuditLog.ACTION_TYPES
+        description: Format string, filled from URL kwargs and request data
+        target_model: Model the action applies to
+        target_param: URL kwarg or request body field holding the target id
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(view, request, *args, **kwargs):
+            response = view_method(view, request, *args, **kwargs)
+            if getattr(response, 'status_code', 500) < 400:
+                target_id = None
+                if target_param:
+                    target_id = kwargs.get(target_param)
+                    if target_id is None and hasattr(request, 'data'):
+                        target_id = request.data.get(target_param)
+
+                text = description or f'{request.method} {request.path}'
+                try:
+                    text = text.format(**kwargs, target_id=target_id)
+                except (KeyError, IndexError):
+                    pass
+
+                record_audit_event(
+                    action,
+                    text,
+                    request=request,
+                    target_model=target_model,
+                    target_id=target_id,
+                    metadata={'status_code': response.status_code}
+                )
+            return response
+        return wrapper
+    return decorator
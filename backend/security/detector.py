@@ -0,0 +1,232 @@
+"""
+Anomaly Detector
+Sliding-window counters per IP and per account, fed by failed logins and
+throttled requests, that emit deduplicated SecurityEvent rows when a
+threshold trips.
+
+Rule counters live in the shared cache as one small counter per key and
+time bucket, so every worker adds to and reads the same totals, and events
+are deduplicated across workers through the cache too. The 24 hour
+suspicion summary is kept the same way, with a shared map of the IPs
+holding the highest totals, so every worker reports the same top list.
+"""
+import hashlib
+import heapq
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(key):
+    return hashlib.sha1(str(key).lower().encode()).hexdigest()
+
+
+class CacheWindow:
+    """Per-key sliding window counts kept in the shared cache, one entry per bucket"""
+
+    def __init__(self, name, window_seconds, bucket_seconds):
+        self.name = name
+        self.bucket_seconds = bucket_seconds
+        self.size = max(1, window_seconds // bucket_seconds)
+        self.timeout = (self.size + 1) * bucket_seconds
+
+    def _keys(self, key, now):
+        epoch = int(now // self.bucket_seconds)
+        prefix = f'security:window:{self.name}:{_digest(key)}'
+        return [f'{prefix}:{bucket}' for bucket in range(epoch - self.size + 1, epoch + 1)]
+
+    def add(self, key, now, amount=1):
+        """Count an event and return the key's total over the window"""
+        keys = self._keys(key, now)
+        if not cache.add(keys[-1], amount, self.timeout):
+            try:
+                cache.incr(keys[-1], amount)
+            except ValueError:
+                # Expired between add and incr
+                cache.set(keys[-1], amount, self.timeout)
+        return sum(cache.get_many(keys).values())
+
+    def total(self, key, now):
+        return sum(cache.get_many(self._keys(key, now)).values())
+
+
+class CacheSummary:
+    """
+    Per-key counts over a window in the shared cache, plus a shared map of
+    the keys with the highest totals. The map is rewritten without a lock,
+    so a concurrent write can drop an update; each entry carries the key's
+    shared total, so its next event puts it back.
+    """
+
+    def __init__(self, name, window_seconds, bucket_seconds, size):
+        self.window = CacheWindow(name, window_seconds, bucket_seconds)
+        self.window_seconds = window_seconds
+        self.size = size
+        self.key = f'security:summary:{name}'
+
+    def add(self, key, now, amount=1):
+        """Count an event and return the key's total over the window"""
+        total = self.window.add(key, now, amount)
+        leaders = {
+            name: entry for name, entry in (cache.get(self.key) or {}).items()
+            if entry[1] > now - self.window_seconds
+        }
+        leaders[key] = (total, now)
+        if len(leaders) > self.size:
+            leaders = dict(heapq.nlargest(self.size, leaders.items(), key=lambda item: item[1][0]))
+        cache.set(self.key, leaders, self.window_seconds)
+        return total
+
+    def top(self, now, limit):
+        """Highest current totals among the tracked keys, read in one round trip"""
+        keys = {name: self.window._keys(name, now) for name in cache.get(self.key) or {}}
+        values = cache.get_many([key for bucket_keys in keys.values() for key in bucket_keys])
+        totals = ((name, sum(values.get(key, 0) for key in bucket_keys)) for name, bucket_keys in keys.items())
+        return [item for item in heapq.nlargest(limit, totals, key=lambda item: item[1]) if item[1] > 0]
+
+
+@dataclass
+class Rule:
+    name: str
+    event_type: str
+    threshold: int
+    window: int  # seconds
+    bucket: int  # seconds
+    severity: str
+    critical_threshold: int = None
+
+
+DEFAULT_RULES = [
+    Rule('ip_failed_logins', 'failed_login', threshold=10, window=300, bucket=10,
+         severity='medium', critical_threshold=100),
+    Rule('account_failed_logins', 'failed_login', threshold=5, window=900, bucket=30,
+         severity='high'),
+    Rule('ip_accounts_targeted', 'suspicious_activity', threshold=5, window=600, bucket=30,
+         severity='high'),
+    Rule('ip_throttled', 'rate_limit_exceeded', threshold=3, window=600, bucket=30,
+         severity='medium', critical_threshold=50),
+]
+
+# Suspicion summary backing the dashboard's top_suspicious_ips
+SUMMARY_WINDOW = 24 * 60 * 60
+SUMMARY_BUCKET = 15 * 60
+# IPs tracked for the top list
+SUMMARY_SIZE = 100
+
+
+class AnomalyDetector:
+    def __init__(self, rules=None, clock=time.time):
+        self.rules = {rule.name: rule for rule in (rules or DEFAULT_RULES)}
+        self.windows = {
+            name: CacheWindow(name, rule.window, rule.bucket) for name, rule in self.rules.items()
+        }
+        self.summary = CacheSummary('suspicious_ips', SUMMARY_WINDOW, SUMMARY_BUCKET, SUMMARY_SIZE)
+        self.clock = clock
+
+    def _check(self, rule_name, key, now, amount=1, **event):
+        rule = self.rules.get(rule_name)
+        if rule is None:
+            return None
+        total = self.windows[rule_name].add(key, now, amount)
+        if total < rule.threshold:
+            return None
+        severity = 'critical' if rule.critical_threshold and total >= rule.critical_threshold else rule.severity
+        return rule, total, severity, event
+
+    def record_failed_login(self, ip_address=None, username=None, user_agent=''):
+        """Count a failed login and emit events for any tripped rule"""
+        now = self.clock()
+        tripped = []
+        if ip_address:
+            self.summary.add(ip_address, now)
+            tripped.append(self._check('ip_failed_logins', ip_address, now, ip_address=ip_address))
+            targeted = self.rules.get('ip_accounts_targeted')
+            # Each account counts once per IP and window
+            if username and targeted and cache.add(
+                f'security:detector:target:{_digest((ip_address, username))}', 1, targeted.window
+            ):
+                tripped.append(self._check('ip_accounts_targeted', ip_address, now, ip_address=ip_address))
+        if username:
+            tripped.append(self._check(
+                'account_failed_logins', username.lower(), now, ip_address=ip_address, username=username
+            ))
+        return self._emit(tripped, user_agent)
+
+    def record_throttle(self, ip_address, route=None, user=None, user_agent=''):
+        """Count a throttled request and emit an event if the rule trips"""
+        if not ip_address:
+            return []
+        now = self.clock()
+        self.summary.add(ip_address, now)
+        tripped = [self._check('ip_throttled', ip_address, now, ip_address=ip_address, route=route, user=user)]
+        return self._emit(tripped, user_agent)
+
+    def _emit(self, tripped, user_agent):
+        from .models import SecurityEvent
+
+        events = []
+        for item in tripped:
+            if item is None:
+                continue
+            rule, total, severity, event = item
+            key = event.get('username') or event.get('ip_address')
+            # One event per rule and key per window, across workers sharing the cache
+            if not cache.add(f'security:detector:{rule.name}:{_digest(key)}', 1, rule.window):
+                continue
+
+            user = event.get('user')
+            events.append(SecurityEvent(
+                event_type=rule.event_type,
+                severity=severity,
+                description=f'{rule.name}: {total} events from {key} in {rule.window // 60} minutes',
+                user=user if user is not None and getattr(user, 'is_authenticated', False) else None,
+                ip_address=event.get('ip_address'),
+                user_agent=user_agent or '',
+                details={
+                    'rule': rule.name,
+                    'count': total,
+                    'window_seconds': rule.window,
+                    'username': event.get('username'),
+                    'route': event.get('route'),
+                }
+            ))
+        if events:
+            try:
+                events = SecurityEvent.objects.bulk_create(events)
+            except Exception as e:
+                logger.error(f"Failed to store {len(events)} security events: {str(e)}")
+                return []
+        return events
+
+    def top_suspicious_ips(self, limit=10):
+        """IPs with the most failed logins and throttles in the last 24 hours"""
+        top = self.summary.top(self.clock(), limit)
+        return [{'ip_address': ip_address, 'count': count} for ip_address, count in top]
+
+
+detector = AnomalyDetector()
+
+
+def top_suspicious_ips(limit=10):
+    """
+    Detector summary, falling back to the last day's SecurityEvents when the
+    cache holds none (e.g. after it was cleared).
+    """
+    from .models import SecurityEvent
+
+    top = detector.top_suspicious_ips(limit)
+    if top:
+        return top
+    since = timezone.now() - timedelta(seconds=SUMMARY_WINDOW)
+    return list(
+        SecurityEvent.objects.filter(created_at__gte=since, ip_address__isnull=False).values(
+            'ip_address'
+        ).annotate(count=Count('id')).order_by('-count')[:limit]
+    )
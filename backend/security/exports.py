@@ -0,0 +1,46 @@
+"""
+Log Exports
+Columns of the audit and privacy log exports, streamed by backend.exports
+"""
+
+
+def _user_id(row):
+    return row.user_id
+
+
+def _username(row):
+    return row.user.username if row.user_id else ''
+
+
+def _email(row):
+    return row.user.email if row.user_id else ''
+
+
+# (column, model fields to load, getter)
+AUDIT_LOG_COLUMNS = [
+    ('id', ['id'], lambda row: row.id),
+    ('created_at', ['created_at'], lambda row: row.created_at.isoformat()),
+    ('action', ['action'], lambda row: row.action),
+    ('description', ['description'], lambda row: row.description),
+    ('user_id', ['user_id'], _user_id),
+    ('username', ['user__username'], _username),
+    ('email', ['user__email'], _email),
+    ('ip_address', ['ip_address'], lambda row: row.ip_address),
+    ('user_agent', ['user_agent'], lambda row: row.user_agent),
+    ('object_id', ['object_id'], lambda row: row.object_id),
+    ('metadata', ['metadata'], lambda row: row.metadata),
+]
+
+PRIVACY_LOG_COLUMNS = [
+    ('id', ['id'], lambda row: row.id),
+    ('created_at', ['created_at'], lambda row: row.created_at.isoformat()),
+    ('action', ['action'], lambda row: row.action),
+    ('description', ['description'], lambda row: row.description),
+    ('user_id', ['user_id'], _user_id),
+    ('username', ['user__username'], _username),
+    ('email', ['user__email'], _email),
+    ('data_categories', ['data_categories'], lambda row: row.data_categories),
+    ('legal_basis', ['legal_basis'], lambda row: row.legal_basis),
+    ('retention_period', ['retention_period'], lambda row: row.retention_period),
+    ('ip_address', ['ip_address'], lambda row: row.ip_address),
+]
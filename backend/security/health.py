@@ -0,0 +1,366 @@
+"""
+System Health Probes
+Pluggable health checks that record compact SystemHealth samples, and the
+downsampling of old samples into SystemHealthHourly rollups.
+
+Checks are listed in settings.HEALTH_CHECKS as dotted paths to HealthCheck
+subclasses; each returns a CheckResult and any exception it raises is
+recorded as a critical sample.
+"""
+import abc
+import logging
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Avg, Count, Max, Q
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import SystemHealth, SystemHealthHourly
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEALTH_CHECKS = [
+    'security.health.DatabaseLatencyCheck',
+    'security.health.ConnectionPoolCheck',
+    'security.health.LogDiskSpaceCheck',
+    'security.health.CacheCheck',
+    'security.health.EmailOutboxCheck',
+    'security.health.CloudinaryCheck',
+]
+
+# Order used when picking the worst status of an hour
+STATUS_SEVERITY = {'healthy': 0, 'maintenance': 1, 'warning': 2, 'critical': 3}
+
+SAMPLE_RETENTION_HOURS = 24
+HOURLY_RETENTION_DAYS = 90
+
+
+@dataclass
+class CheckResult:
+    status: str
+    message: str
+    response_time: float = None
+    metrics: dict = field(default_factory=dict)
+
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def _status_for(value, warning, critical, higher_is_worse=True):
+    if value is None:
+        return 'healthy'
+    if higher_is_worse:
+        return 'critical' if value >= critical else 'warning' if value >= warning else 'healthy'
+    return 'critical' if value <= critical else 'warning' if value <= warning else 'healthy'
+
+
+class HealthCheck(abc.ABC):
+    """Base class for health checks; subclasses set `component` and implement run()"""
+    component = None
+
+    @abc.abstractmethod
+    def run(self):
+        """Probe the component and return a CheckResult"""
+
+
+class DatabaseLatencyCheck(HealthCheck):
+    component = 'database'
+    warning_ms = 100
+    critical_ms = 1000
+
+    def run(self):
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        latency = _elapsed_ms(started)
+        return CheckResult(
+            _status_for(latency, self.warning_ms, self.critical_ms),
+            f'Round trip {latency}ms',
+            response_time=latency,
+            metrics={'vendor': connection.vendor}
+        )
+
+
+class ConnectionPoolCheck(HealthCheck):
+    """Share of PostgreSQL's max_connections in use by this database"""
+    component = 'connection_pool'
+    warning_percent = 75
+    critical_percent = 90
+
+    def run(self):
+        if connection.vendor != 'postgresql':
+            return CheckResult('healthy', f'Connection pooling not applicable to {connection.vendor}')
+
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW max_connections')
+            max_connections = int(cursor.fetchone()[0])
+            cursor.execute(
+                "SELECT COUNT(*), COUNT(*) FILTER (WHERE state = 'active') "
+                "FROM pg_stat_activity WHERE datname = current_database()"
+            )
+            in_use, active = cursor.fetchone()
+
+        saturation = round(in_use * 100 / max_connections, 1)
+        return CheckResult(
+            _status_for(saturation, self.warning_percent, self.critical_percent),
+            f'{in_use}/{max_connections} connections in use',
+            metrics={'in_use': in_use, 'active': active, 'max': max_connections, 'saturation': saturation}
+        )
+
+
+class LogDiskSpaceCheck(HealthCheck):
+    component = 'storage'
+    warning_free_percent = 15
+    critical_free_percent = 5
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(settings.BASE_DIR, 'logs')
+
+    def run(self):
+        path = self.path if os.path.exists(self.path) else settings.BASE_DIR
+        usage = shutil.disk_usage(path)
+        free_percent = round(usage.free * 100 / usage.total, 1)
+        return CheckResult(
+            _status_for(free_percent, self.warning_free_percent, self.critical_free_percent, higher_is_worse=False),
+            f'{free_percent}% free on the logs volume',
+            metrics={'free_mb': usage.free // (1024 * 1024), 'free_percent': free_percent}
+        )
+
+
+def _cache_hit_rate():
+    """Server-side hit rate when the backend exposes it (Redis or memcached)"""
+    client = getattr(cache, '_cache', None)
+    hits = misses = None
+    try:
+        if hasattr(client, 'get_stats'):
+            stats = client.get_stats()
+            hits = sum(int(server_stats.get(b'get_hits', server_stats.get('get_hits', 0))) for _, server_stats in stats)
+            misses = sum(int(server_stats.get(b'get_misses', server_stats.get('get_misses', 0))) for _, server_stats in stats)
+        elif hasattr(client, 'get_client'):
+            info = client.get_client().info('stats')
+            hits, misses = info['keyspace_hits'], info['keyspace_misses']
+    except Exception as e:
+        logger.warning(f"Could not read cache statistics: {str(e)}")
+        return None
+    if hits is None or not hits + misses:
+        return None
+    return round(hits * 100 / (hits + misses), 1)
+
+
+class CacheCheck(HealthCheck):
+    component = 'cache'
+    warning_ms = 20
+    critical_ms = 250
+    warning_hit_rate = 80
+    critical_hit_rate = 50
+
+    def run(self):
+        key = f'health:{uuid.uuid4().hex}'
+        started = time.perf_counter()
+        cache.set(key, 1, 30)
+        found = cache.get(key)
+        cache.delete(key)
+        latency = _elapsed_ms(started)
+
+        if found != 1:
+            return CheckResult('critical', 'Cache did not return a written value', response_time=latency)
+
+        hit_rate = _cache_hit_rate()
+        status = max(
+            _status_for(latency, self.warning_ms, self.critical_ms),
+            _status_for(hit_rate, self.warning_hit_rate, self.critical_hit_rate, higher_is_worse=False),
+            key=STATUS_SEVERITY.get
+        )
+        message = f'Round trip {latency}ms'
+        if hit_rate is not None:
+            message += f', {hit_rate}% hit rate'
+        return CheckResult(status, message, response_time=latency, metrics={'hit_rate': hit_rate})
+
+
+class EmailOutboxCheck(HealthCheck):
+    """Digest emails waiting to be sent, and how many are overdue"""
+    component = 'email'
+    grace = timedelta(hours=2)
+    warning_overdue = 1
+    critical_overdue = 1000
+
+    def run(self):
+        from notifications.models import NotificationDigestItem
+
+        now = timezone.now()
+        counts = NotificationDigestItem.objects.filter(sent_at__isnull=True).aggregate(
+            depth=Count('id'),
+            overdue=Count('id', filter=(
+                Q(frequency='daily', created_at__lt=now - timedelta(days=1) - self.grace)
+                | Q(frequency='weekly', created_at__lt=now - timedelta(days=7) - self.grace)
+            ))
+        )
+        return CheckResult(
+            _status_for(counts['overdue'], self.warning_overdue, self.critical_overdue),
+            f"{counts['depth']} digest items queued, {counts['overdue']} overdue",
+            metrics=counts
+        )
+
+
+class CloudinaryCheck(HealthCheck):
+    component = 'media_storage'
+    warning_ms = 1000
+    critical_ms = 5000
+
+    def __init__(self, ping=None):
+        self.ping = ping
+
+    def run(self):
+        if self.ping is None:
+            import cloudinary
+            import cloudinary.api
+            if not cloudinary.config().cloud_name:
+                return CheckResult('warning', 'Cloudinary is not configured')
+            self.ping = cloudinary.api.ping
+
+        started = time.perf_counter()
+        self.ping()
+        latency = _elapsed_ms(started)
+        return CheckResult(
+            _status_for(latency, self.warning_ms, self.critical_ms),
+            f'Cloudinary reachable in {latency}ms',
+            response_time=latency
+        )
+
+
+def get_health_checks():
+    return [import_string(path)() for path in getattr(settings, 'HEALTH_CHECKS', DEFAULT_HEALTH_CHECKS)]
+
+
+def run_health_checks(checks=None):
+    """
+    Run every check once and store one SystemHealth sample per component.
+
+    Returns:
+        list of saved SystemHealth rows
+    """
+    samples = []
+    for check in checks if checks is not None else get_health_checks():
+        started = time.perf_counter()
+        try:
+            result = check.run()
+        except Exception as e:
+            logger.error(f"Health check {check.component} failed: {str(e)}")
+            result = CheckResult('critical', str(e)[:500], response_time=_elapsed_ms(started))
+        samples.append(SystemHealth(
+            component=check.component,
+            status=result.status,
+            message=result.message,
+            response_time=result.response_time,
+            metrics=result.metrics
+        ))
+    return SystemHealth.objects.bulk_create(samples)
+
+
+def downsample_health_samples(older_than_hours=None, hourly_retention_days=None, now=None):
+    """
+    Fold raw samples older than the retention window into hourly rollups.
+
+    Rollups are merged with existing rows for the same component and hour,
+    so the job can run at any interval. Rollups past their own retention are
+    deleted.
+
+    Returns:
+        dict with counts of samples folded and hourly rows written
+    """
+    now = now or timezone.now()
+    if older_than_hours is None:
+        older_than_hours = getattr(settings, 'HEALTH_SAMPLE_RETENTION_HOURS', SAMPLE_RETENTION_HOURS)
+    if hourly_retention_days is None:
+        hourly_retention_days = getattr(settings, 'HEALTH_HOURLY_RETENTION_DAYS', HOURLY_RETENTION_DAYS)
+    cutoff = (now - timedelta(hours=older_than_hours)).replace(minute=0, second=0, microsecond=0)
+
+    with transaction.atomic():
+        old_samples = SystemHealth.objects.filter(created_at__lt=cutoff)
+        rows = list(old_samples.annotate(hour=TruncHour('created_at')).order_by().values('component', 'hour').annotate(
+            samples=Count('id'),
+            healthy_samples=Count('id', filter=Q(status='healthy')),
+            warning_samples=Count('id', filter=Q(status='warning')),
+            critical_samples=Count('id', filter=Q(status='critical')),
+            maintenance_samples=Count('id', filter=Q(status='maintenance')),
+            avg_response_time=Avg('response_time'),
+            max_response_time=Max('response_time'),
+        ))
+
+        existing = {
+            (rollup.component, rollup.hour): rollup
+            for rollup in SystemHealthHourly.objects.select_for_update().filter(hour__lt=cutoff, hour__in={
+                row['hour'] for row in rows
+            })
+        }
+        to_create, to_update = [], []
+        folded = 0
+        for row in rows:
+            folded += row['samples']
+            statuses = {
+                'critical': row['critical_samples'],
+                'warning': row['warning_samples'],
+                'maintenance': row['maintenance_samples'],
+            }
+            worst = next((status for status, count in statuses.items() if count), 'healthy')
+            rollup = existing.get((row['component'], row['hour']))
+            if rollup is None:
+                to_create.append(SystemHealthHourly(
+                    component=row['component'],
+                    hour=row['hour'],
+                    samples=row['samples'],
+                    healthy_samples=row['healthy_samples'],
+                    warning_samples=row['warning_samples'],
+                    critical_samples=row['critical_samples'],
+                    maintenance_samples=row['maintenance_samples'],
+                    avg_response_time=row['avg_response_time'],
+                    max_response_time=row['max_response_time'],
+                    worst_status=worst
+                ))
+                continue
+
+            if row['avg_response_time'] is not None:
+                if rollup.avg_response_time is None:
+                    rollup.avg_response_time = row['avg_response_time']
+                else:
+                    rollup.avg_response_time = (
+                        rollup.avg_response_time * rollup.samples + row['avg_response_time'] * row['samples']
+                    ) / (rollup.samples + row['samples'])
+                rollup.max_response_time = max(
+                    value for value in (rollup.max_response_time, row['max_response_time']) if value is not None
+                )
+            rollup.samples += row['samples']
+            rollup.healthy_samples += row['healthy_samples']
+            rollup.warning_samples += row['warning_samples']
+            rollup.critical_samples += row['critical_samples']
+            rollup.maintenance_samples += row['maintenance_samples']
+            rollup.worst_status = max(rollup.worst_status, worst, key=STATUS_SEVERITY.get)
+            to_update.append(rollup)
+
+        SystemHealthHourly.objects.bulk_create(to_create)
+        SystemHealthHourly.objects.bulk_update(to_update, [
+            'samples', 'healthy_samples', 'warning_samples', 'critical_samples', 'maintenance_samples',
+            'avg_response_time', 'max_response_time', 'worst_status'
+        ])
+        old_samples.delete()
+        SystemHealthHourly.objects.filter(hour__lt=now - timedelta(days=hourly_retention_days)).delete()
+
+    return {'samples': folded, 'hourly_rows': len(to_create) + len(to_update)}
+
+
+def latest_health(queryset=None):
+    """Most recent sample per component in a single query"""
+    queryset = SystemHealth.objects.all() if queryset is None else queryset
+    latest_ids = queryset.order_by().values('component').annotate(latest_id=Max('id')).values('latest_id')
+    return list(SystemHealth.objects.filter(id__in=latest_ids).order_by('component'))
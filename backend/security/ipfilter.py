@@ -0,0 +1,170 @@
+"""
+IP Filter
+In-memory blocklist/allowlist built from IPRule rows.
+
+Networks are merged into sorted, non-overlapping integer intervals per
+address family, so a lookup is one bisect over interval starts. Each worker
+polls IPRuleSetVersion at most every IP_RULES_RELOAD_INTERVAL seconds and
+rebuilds its ruleset when the version has moved or a rule has expired.
+Allow rules take precedence over block rules.
+"""
+import bisect
+import ipaddress
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RELOAD_INTERVAL = 5
+
+
+class IntervalSet:
+    """Sorted, merged [start, end] integer ranges with O(log n) membership"""
+
+    def __init__(self, ranges=()):
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = [start for start, _ in merged]
+        self.ends = [end for _, end in merged]
+
+    def __contains__(self, value):
+        index = bisect.bisect_right(self.starts, value) - 1
+        return index >= 0 and value <= self.ends[index]
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def parse_network(value):
+    """
+    Normalize a CIDR or single address.
+
+    Raises:
+        ValueError if the value is not a valid network
+    """
+    return ipaddress.ip_network(value.strip(), strict=False)
+
+
+class IPRuleSet:
+    """Immutable snapshot of the active rules"""
+
+    def __init__(self, rules=(), version=0, expires_at=None):
+        ranges = {('block', 4): [], ('block', 6): [], ('allow', 4): [], ('allow', 6): []}
+        for action, network in rules:
+            try:
+                network = parse_network(network)
+            except ValueError:
+                logger.warning(f"Ignoring invalid IP rule network: {network}")
+                continue
+            ranges[(action, network.version)].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+        self.sets = {key: IntervalSet(value) for key, value in ranges.items()}
+        self.version = version
+        self.expires_at = expires_at
+
+    def is_blocked(self, ip_address):
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        value = int(address)
+        if value in self.sets[('allow', address.version)]:
+            return False
+        return value in self.sets[('block', address.version)]
+
+
+def load_ruleset(version=None):
+    from .models import IPRule, IPRuleSetVersion
+
+    if version is None:
+        version = IPRuleSetVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+    now = timezone.now()
+    rows = list(IPRule.objects.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now)).values_list(
+        'action', 'network', 'expires_at'
+    ))
+    expiries = [expires_at for _, _, expires_at in rows if expires_at is not None]
+    return IPRuleSet(
+        [(action, network) for action, network, _ in rows],
+        version=version,
+        expires_at=min(expiries) if expiries else None
+    )
+
+
+def bump_version():
+    """Tell every worker to reload its ruleset"""
+    from .models import IPRuleSetVersion
+
+    updated = IPRuleSetVersion.objects.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now())
+    if not updated:
+        IPRuleSetVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+class IPFilter:
+    """Per-process holder of the current ruleset with version polling"""
+
+    def __init__(self, reload_interval=DEFAULT_RELOAD_INTERVAL, clock=time.monotonic):
+        self.reload_interval = reload_interval
+        self.clock = clock
+        self.ruleset = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        from .models import IPRuleSetVersion
+
+        now = self.clock()
+        ruleset = self.ruleset
+        if ruleset is not None and now - self._checked_at < self.reload_interval:
+            if ruleset.expires_at is None or ruleset.expires_at > timezone.now():
+                return ruleset
+
+        with self._lock:
+            if self.ruleset is not ruleset:
+                return self.ruleset
+            try:
+                version = IPRuleSetVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+                expired = ruleset is not None and ruleset.expires_at is not None and ruleset.expires_at <= timezone.now()
+                if ruleset is None or version != ruleset.version or expired:
+                    self.ruleset = load_ruleset(version)
+            except Exception as e:
+                # Fail open: keep the last known rules if the database is unavailable
+                logger.error(f"Failed to reload IP rules: {str(e)}")
+                if self.ruleset is None:
+                    self.ruleset = IPRuleSet()
+            self._checked_at = now
+            return self.ruleset
+
+    def is_blocked(self, ip_address):
+        if not ip_address:
+            return False
+        return self._refresh().is_blocked(ip_address)
+
+
+ip_filter = IPFilter(reload_interval=getattr(settings, 'IP_RULES_RELOAD_INTERVAL', DEFAULT_RELOAD_INTERVAL))
+
+
+def get_enforcement_ip(request):
+    """
+    Client address for enforcement.
+
+    Only trusts as many X-Forwarded-For hops as IP_FILTER_PROXY_COUNT, since
+    the leftmost entries are supplied by the client and can be forged.
+    """
+    proxies = getattr(settings, 'IP_FILTER_PROXY_COUNT', 0)
+    if proxies:
+        forwarded = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR')
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from security.partitions import (
+    get_partitioned_models, create_partitions, detach_partitions, list_partitions, is_postgresql
+)
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming monthly partitions and detach expired ones for the security log tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Months of partitions to create beyond the current one')
+        parser.add_argument('--detach-older-than', type=int, default=None,
+                            help='Detach months older than this many months (defaults to LOG_PARTITION_RETENTION_MONTHS)')
+        parser.add_argument('--drop', action='store_true',
+                            help='Drop detached partitions instead of keeping them as standalone tables')
+        parser.add_argument('--no-detach', action='store_true',
+                            help='Only create partitions')
+        parser.add_argument('--list', action='store_true',
+                            help='List partitions and exit')
+
+    def handle(self, *args, **options):
+        for model in get_partitioned_models():
+            table = model._meta.db_table
+
+            if options['list']:
+                partitions = list_partitions(model)
+                self.stdout.write(f"{table}: {', '.join(partitions) if partitions else 'no partitions'}")
+                continue
+
+            if is_postgresql():
+                created = create_partitions(model, months_ahead=options['months_ahead'])
+                self.stdout.write(f"{table}: ensured {len(created)} partitions")
+
+            if not options['no_detach']:
+                detached = detach_partitions(
+                    model,
+                    older_than_months=options['detach_older_than'],
+                    drop=options['drop']
+                )
+                action = 'Dropped' if options['drop'] else 'Detached'
+                self.stdout.write(self.style.SUCCESS(
+                    f"{table}: {action} {len(detached)} partitions"
+                    + (f" ({', '.join(detached)})" if detached else '')
+                ))
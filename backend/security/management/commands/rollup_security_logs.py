@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from security.stats import rollup_security_logs, DEFAULT_ROLLUP_HOURS
+
+
+class Command(BaseCommand):
+    help = 'Rebuild hourly security log counters used by the security dashboard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=DEFAULT_ROLLUP_HOURS,
+                            help='Number of full hours to re-aggregate')
+        parser.add_argument('--all', action='store_true',
+                            help='Re-aggregate all history')
+
+    def handle(self, *args, **options):
+        hours = None if options['all'] else options['hours']
+        written = rollup_security_logs(hours=hours)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {'all' if hours is None else hours} hours into {written} counter rows"
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from security.health import run_health_checks, downsample_health_samples
+
+
+class Command(BaseCommand):
+    help = 'Run system health probes, store samples and fold old samples into hourly rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Seconds between runs; 0 runs once and exits')
+        parser.add_argument('--downsample-every', type=int, default=3600,
+                            help='Seconds between downsampling passes when looping')
+        parser.add_argument('--no-downsample', action='store_true',
+                            help='Only record samples')
+
+    def handle(self, *args, **options):
+        last_downsample = 0
+        while True:
+            close_old_connections()
+            samples = run_health_checks()
+            summary = ', '.join(f'{sample.component}={sample.status}' for sample in samples)
+            self.stdout.write(f'Recorded {len(samples)} health samples: {summary}')
+
+            if not options['no_downsample'] and time.monotonic() - last_downsample >= options['downsample_every']:
+                result = downsample_health_samples()
+                last_downsample = time.monotonic()
+                self.stdout.write(self.style.SUCCESS(
+                    f"Folded {result['samples']} samples into {result['hourly_rows']} hourly rollups"
+                ))
+
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,114 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+
+from .audit import record_audit_event
+from .detector import detector
+from .ipfilter import ip_filter, get_enforcement_ip
+from .profiling import QueryRecorder, request_profiler, DEFAULT_SAMPLE_RATE
+
+
+class IPFilterMiddleware:
+    """
+    Rejects requests from blocked IP ranges. Placed ahead of sessions,
+    authentication and body parsing so blocked traffic costs one lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if getattr(settings, 'IP_FILTER_ENABLED', True) and ip_filter.is_blocked(get_enforcement_ip(request)):
+            return JsonResponse({'detail': 'Forbidden'}, status=403)
+        return self.get_response(request)
+
+
+class AuditLogMiddleware:
+    """
+    Records successful state-changing requests made by staff users against
+    admin endpoints. The event is queued in memory; the database write
+    happens on the audit writer thread.
+    """
+    MUTATING_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if (
+            request.method in self.MUTATING_METHODS
+            and '/admin/' in request.path
+            and response.status_code < 400
+            and getattr(settings, 'AUDIT_LOGGING_ENABLED', True)
+        ):
+            # DRF copies the token-authenticated user onto the Django request
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated and user.is_staff:
+                match = getattr(request, 'resolver_match', None)
+                record_audit_event(
+                    'admin_action',
+                    f'{request.method} {request.path}',
+                    user=user,
+                    request=request,
+                    metadata={
+                        'status_code': response.status_code,
+                        'route': match.view_name if match else None,
+                    }
+                )
+
+        return response
+
+
+class RequestProfilingMiddleware:
+    """
+    Profiles a sample of requests: wall time, query count and time, and
+    response size, aggregated per URL route name.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (
+            not getattr(settings, 'PROFILING_ENABLED', True)
+            or random.random() >= getattr(settings, 'PROFILING_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+        ):
+            return self.get_response(request)
+
+        queries = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        wall_time = (time.perf_counter() - started) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else '<unresolved>'
+        size = 0 if response.streaming else len(response.content)
+        request_profiler.record(route, wall_time, queries, size)
+        return response
+
+
+class AnomalyDetectionMiddleware:
+    """Feeds throttled (429) responses to the anomaly detector"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.status_code == 429:
+            match = getattr(request, 'resolver_match', None)
+            detector.record_throttle(
+                get_enforcement_ip(request),
+                route=match.view_name if match else request.path,
+                user=getattr(request, 'user', None),
+                user_agent=request.META.get('HTTP_USER_AGENT', '')
+            )
+
+        return response
@@ -0,0 +1,102 @@
+from datetime import date, datetime, time, timezone as dt_timezone
+
+from django.db import migrations
+from django.utils import timezone
+
+# Frozen copy of security.partitions as it stood when this migration was
+# written, so later changes there cannot alter what the migration does
+PARTITIONED_MODELS = ('security.AuditLog', 'security.SecurityEvent', 'security.RateLimitLog')
+MONTHS_AHEAD = 3
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def convert_to_partitioned(schema_editor, table):
+    """
+    Rebuild a table as one range-partitioned by created_at, with a monthly
+    partition from its oldest row through MONTHS_AHEAD months from now and
+    a DEFAULT partition for anything outside them
+    """
+    connection = schema_editor.connection
+    qn = schema_editor.quote_name
+    legacy = f'{table}_legacy'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = %s AND n.nspname = current_schema()",
+            [table]
+        )
+        row = cursor.fetchone()
+        if row and row[0] == 'p':
+            return
+
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE contype = 'p')",
+            [table]
+        )
+        index_definitions = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f'SELECT MIN(created_at) FROM {qn(table)}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+        cursor.execute(
+            f'CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING ALL EXCLUDING INDEXES) '
+            f'PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, created_at)')
+
+        now = timezone.now()
+        month = date(oldest.year, oldest.month, 1)
+        last = add_months(date(now.year, now.month, 1), MONTHS_AHEAD)
+        while month <= last:
+            lower = datetime.combine(month, time.min, dt_timezone.utc)
+            upper = datetime.combine(add_months(month, 1), time.min, dt_timezone.utc)
+            name = f'{table}_p{month.year:04d}{month.month:02d}'
+            cursor.execute(
+                f'CREATE TABLE {qn(name)} PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)',
+                [lower, upper]
+            )
+            month = add_months(month, 1)
+        cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(legacy)}')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)",
+            [table]
+        )
+        cursor.execute(f'DROP TABLE {qn(legacy)}')
+
+        for definition in index_definitions:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+
+
+def partition_log_tables(apps, schema_editor):
+    # Native range partitioning is PostgreSQL only; other backends keep a
+    # single live table and archive whole months into per-month tables
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for label in PARTITIONED_MODELS:
+        convert_to_partitioned(schema_editor, apps.get_model(label)._meta.db_table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0002_auditlog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_log_tables, migrations.RunPython.noop),
+    ]
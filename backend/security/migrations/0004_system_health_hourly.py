@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0003_partition_log_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SystemHealthHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('component', models.CharField(max_length=100)),
+                ('hour', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('healthy_samples', models.PositiveIntegerField(default=0)),
+                ('warning_samples', models.PositiveIntegerField(default=0)),
+                ('critical_samples', models.PositiveIntegerField(default=0)),
+                ('avg_response_time', models.FloatField(blank=True, null=True)),
+                ('max_response_time', models.FloatField(blank=True, null=True)),
+                ('worst_status', models.CharField(choices=[('healthy', 'Healthy'), ('warning', 'Warning'), ('critical', 'Critical'), ('maintenance', 'Maintenance')], max_length=20)),
+            ],
+            options={
+                'ordering': ['-hour'],
+                'unique_together': {('component', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0004_system_health_hourly'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route', models.CharField(max_length=200)),
+                ('period_start', models.DateTimeField()),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('wall_time_total', models.FloatField(default=0)),
+                ('wall_time_histogram', models.JSONField(default=list)),
+                ('query_count_total', models.PositiveIntegerField(default=0)),
+                ('query_time_total', models.FloatField(default=0)),
+                ('max_queries', models.PositiveIntegerField(default=0)),
+                ('response_bytes_total', models.BigIntegerField(default=0)),
+                ('n_plus_one_requests', models.PositiveIntegerField(default=0)),
+                ('worst_repeated_query', models.TextField(blank=True)),
+                ('worst_repeat_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-period_start', 'route'],
+                'indexes': [models.Index(fields=['period_start'], name='security_re_period__335e7a_idx')],
+                'unique_together': {('route', 'period_start')},
+            },
+        ),
+    ]
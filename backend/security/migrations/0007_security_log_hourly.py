@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0006_ip_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecurityLogHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('audit', 'Audit Log'), ('security_event', 'Security Event'), ('rate_limit', 'Rate Limit Log'), ('rate_limit_ip', 'Rate Limit Log by IP')], max_length=20)),
+                ('hour', models.DateTimeField()),
+                ('kind', models.CharField(max_length=50)),
+                ('severity', models.CharField(blank=True, max_length=20)),
+                ('action_taken', models.CharField(blank=True, max_length=50)),
+                ('ip_address', models.CharField(blank=True, max_length=45)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['source', 'hour'], name='sec_hourly_source_hour_idx')],
+                'unique_together': {('source', 'hour', 'kind', 'severity', 'action_taken', 'ip_address')},
+            },
+        ),
+    ]
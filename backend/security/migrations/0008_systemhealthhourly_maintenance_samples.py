@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0007_security_log_hourly'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemhealthhourly',
+            name='maintenance_samples',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
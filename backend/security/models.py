@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
@@ -37,7 +38,8 @@ class AuditLog(models.Model):
     
     # Additional metadata
     metadata = models.JSONField(default=dict, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens, not when the buffered write reaches the database
+    created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-created_at']
@@ -130,6 +132,34 @@ class SystemHealth(models.Model):
         return f"{self.component} - {self.status} at {self.created_at}"
 
 
+
+class SystemHealthHourly(models.Model):
+    """Hourly rollup of SystemHealth samples older than the raw retention window"""
+    component = models.CharField(max_length=100)
+    hour = models.DateTimeField()
+    samples = models.PositiveIntegerField(default=0)
+    healthy_samples = models.PositiveIntegerField(default=0)
+    warning_samples = models.PositiveIntegerField(default=0)
+    critical_samples = models.PositiveIntegerField(default=0)
+    maintenance_samples = models.PositiveIntegerField(default=0)
+    avg_response_time = models.FloatField(null=True, blank=True)  # in milliseconds
+    max_response_time = models.FloatField(null=True, blank=True)
+    worst_status = models.CharField(max_length=20, choices=SystemHealth.STATUS_CHOICES)
+
+    class Meta:
+        ordering = ['-hour']
+        unique_together = ['component', 'hour']
+
+    @property
+    def uptime(self):
+        if not self.samples:
+            return None
+        return round(self.healthy_samples * 100 / self.samples, 2)
+
+    def __str__(self):
+        return f"{self.component} - {self.worst_status} for {self.hour}"
+
+
 class RateLimitLog(models.Model):
     """Rate limiting logs for monitoring and analysis"""
     LIMIT_TYPES = [
@@ -203,4 +233,95 @@ class DataPrivacyLog(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.action} for {self.user} at {self.created_at}" 
\ No newline at end of file
+        return f"{self.action} for {self.user} at {self.created_at}" 
+
+
+class RequestMetric(models.Model):
+    """Per-route request profile for one hour, flushed from the in-memory profiler"""
+    route = models.CharField(max_length=200)
+    period_start = models.DateTimeField()
+    requests = models.PositiveIntegerField(default=0)
+    wall_time_total = models.FloatField(default=0)  # in milliseconds
+    wall_time_histogram = models.JSONField(default=list)  # counts per LATENCY_BUCKETS_MS bucket
+    query_count_total = models.PositiveIntegerField(default=0)
+    query_time_total = models.FloatField(default=0)  # in milliseconds
+    max_queries = models.PositiveIntegerField(default=0)
+    response_bytes_total = models.BigIntegerField(default=0)
+    n_plus_one_requests = models.PositiveIntegerField(default=0)
+    worst_repeated_query = models.TextField(blank=True)
+    worst_repeat_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-period_start', 'route']
+        unique_together = ['route', 'period_start']
+        indexes = [
+            models.Index(fields=['period_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.route} - {self.requests} requests from {self.period_start}"
+
+
+class IPRule(models.Model):
+    """Blocked or explicitly allowed IP ranges, enforced by IPFilterMiddleware"""
+    ACTIONS = [
+        ('block', 'Block'),
+        ('allow', 'Allow'),
+    ]
+
+    network = models.CharField(max_length=64)  # CIDR, e.g. 203.0.113.0/24 or a single address
+    action = models.CharField(max_length=10, choices=ACTIONS, default='block')
+    reason = models.CharField(max_length=255, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='ip_rules')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['action', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.network}"
+
+
+class IPRuleSetVersion(models.Model):
+    """Single-row counter bumped whenever IP rules change, polled by every worker"""
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"IP rules v{self.version}"
+
+
+class SecurityLogHourly(models.Model):
+    """
+    Hourly counts of AuditLog, SecurityEvent and RateLimitLog rows, rebuilt by
+    rollup_security_logs. Unused dimensions are stored as empty strings.
+    """
+    SOURCES = [
+        ('audit', 'Audit Log'),
+        ('security_event', 'Security Event'),
+        ('rate_limit', 'Rate Limit Log'),
+        ('rate_limit_ip', 'Rate Limit Log by IP'),
+    ]
+
+    source = models.CharField(max_length=20, choices=SOURCES)
+    hour = models.DateTimeField()
+    kind = models.CharField(max_length=50)  # action, event_type or limit_type
+    severity = models.CharField(max_length=20, blank=True)
+    action_taken = models.CharField(max_length=50, blank=True)
+    ip_address = models.CharField(max_length=45, blank=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-hour']
+        unique_together = ['source', 'hour', 'kind', 'severity', 'action_taken', 'ip_address']
+        indexes = [
+            models.Index(fields=['source', 'hour'], name='sec_hourly_source_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} {self.kind} at {self.hour}: {self.count}"
@@ -0,0 +1,292 @@
+"""
+Monthly Log Partitions
+Time-partitioned, append-only storage for AuditLog, SecurityEvent and
+RateLimitLog.
+
+On PostgreSQL each table is range-partitioned by created_at with one
+partition per month, so the planner only visits the months a query's
+created_at window overlaps and old months are removed with an O(1)
+DETACH/DROP. Other backends keep one live table and move whole months into
+per-month tables (<table>_pYYYYMM) when they are detached.
+"""
+import logging
+from datetime import date, datetime, time, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_MODELS = ('security.AuditLog', 'security.SecurityEvent', 'security.RateLimitLog')
+
+# Months kept attached before detach_partitions removes them
+DEFAULT_RETENTION_MONTHS = {
+    'security.AuditLog': 24,
+    'security.SecurityEvent': 24,
+    'security.RateLimitLog': 3,
+}
+
+
+def get_partitioned_models():
+    from django.apps import apps
+    return [apps.get_model(label) for label in PARTITIONED_MODELS]
+
+
+def get_retention_months(model):
+    retention = {**DEFAULT_RETENTION_MONTHS, **getattr(settings, 'LOG_PARTITION_RETENTION_MONTHS', {})}
+    return retention[model._meta.label]
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(start, end):
+    """Months from the month containing start through the month containing end"""
+    month = month_start(start)
+    last = month_start(end)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month.year:04d}{month.month:02d}'
+
+
+def month_bounds(month):
+    lower = timezone.make_aware(datetime.combine(month, time.min), dt_timezone.utc)
+    upper = timezone.make_aware(datetime.combine(add_months(month, 1), time.min), dt_timezone.utc)
+    return lower, upper
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+# ---------------------------------------------------------------------------
+# PostgreSQL native partitioning
+# ---------------------------------------------------------------------------
+
+def is_partitioned(table):
+    if not is_postgresql():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = %s AND n.nspname = current_schema()",
+            [table]
+        )
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def convert_to_partitioned(model, months_ahead=3):
+    """
+    Rebuild a model's table as a PostgreSQL range-partitioned table.
+
+    The primary key becomes (id, created_at), as PostgreSQL requires the
+    partition key in every unique constraint. Indexes and foreign keys are
+    recreated on the parent under their original names, existing rows are
+    copied into monthly partitions and a DEFAULT partition catches rows
+    outside the created ranges.
+    """
+    table = model._meta.db_table
+    if is_partitioned(table):
+        return
+
+    legacy = f'{table}_legacy'
+    qn = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE contype = 'p')",
+            [table]
+        )
+        index_definitions = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f'SELECT MIN(created_at) FROM {qn(table)}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+        cursor.execute(
+            f'CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING ALL EXCLUDING INDEXES) '
+            f'PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, created_at)')
+
+        _create_pg_partitions(cursor, table, oldest, add_months(month_start(timezone.now()), months_ahead))
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(legacy)}')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)",
+            [table]
+        )
+        cursor.execute(f'DROP TABLE {qn(legacy)}')
+
+        for definition in index_definitions:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+
+    logger.info(f"Converted {table} to monthly partitions")
+
+
+def _create_pg_partitions(cursor, table, start, end):
+    """
+    Create the monthly partitions from start through end that do not exist.
+
+    PostgreSQL refuses to add a partition while the DEFAULT partition holds
+    rows in its range, so a month with such rows is built as a plain table,
+    filled with the rows moved out of the default and then attached.
+    """
+    qn = connection.ops.quote_name
+    default = f'{table}_default'
+    cursor.execute('SELECT to_regclass(%s)', [default])
+    has_default = cursor.fetchone()[0] is not None
+    created = []
+    for month in month_range(start, end):
+        name = partition_name(table, month)
+        lower, upper = month_bounds(month)
+        cursor.execute('SELECT to_regclass(%s)', [name])
+        if cursor.fetchone()[0] is not None:
+            created.append(name)
+            continue
+        if not has_default:
+            cursor.execute(
+                f'CREATE TABLE {qn(name)} PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)',
+                [lower, upper]
+            )
+            created.append(name)
+            continue
+        cursor.execute(
+            f'CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        )
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {qn(default)} WHERE created_at >= %s AND created_at < %s RETURNING *) '
+            f'INSERT INTO {qn(name)} SELECT * FROM moved',
+            [lower, upper]
+        )
+        if cursor.rowcount:
+            logger.info(f"Moved {cursor.rowcount} rows from {default} into {name}")
+        cursor.execute(
+            f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)',
+            [lower, upper]
+        )
+        created.append(name)
+    return created
+
+
+def list_partitions(model):
+    """
+    Attached (PostgreSQL) or archived (other backends) monthly partitions.
+
+    Returns:
+        list of partition table names, oldest first
+    """
+    table = model._meta.db_table
+    if is_postgresql():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = %s",
+                [table]
+            )
+            names = [row[0] for row in cursor.fetchall()]
+    else:
+        names = connection.introspection.table_names()
+    prefix = f'{table}_p'
+    return sorted(name for name in names if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+
+def create_partitions(model, months_ahead=3):
+    """Create partitions for the current month and the next `months_ahead` months"""
+    if not is_partitioned(model._meta.db_table):
+        return []
+    current = month_start(timezone.now())
+    with transaction.atomic(), connection.cursor() as cursor:
+        return _create_pg_partitions(cursor, model._meta.db_table, current, add_months(current, months_ahead))
+
+
+def detach_partitions(model, older_than_months=None, drop=False, now=None):
+    """
+    Remove whole months older than the retention window from the live table.
+
+    On PostgreSQL partitions are detached (and optionally dropped) without
+    touching individual rows. Elsewhere the month's rows are moved into a
+    <table>_pYYYYMM table (or deleted when drop=True).
+
+    Returns:
+        list of partition names detached
+    """
+    table = model._meta.db_table
+    qn = connection.ops.quote_name
+    months = older_than_months if older_than_months is not None else get_retention_months(model)
+    cutoff = add_months(month_start(now or timezone.now()), -months)
+    detached = []
+
+    if is_postgresql():
+        if not is_partitioned(table):
+            return detached
+        for name in list_partitions(model):
+            if name >= partition_name(table, cutoff):
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+                if drop:
+                    cursor.execute(f'DROP TABLE {qn(name)}')
+            detached.append(name)
+        return detached
+
+    oldest = model.objects.order_by('created_at').values_list('created_at', flat=True).first()
+    if oldest is None:
+        return detached
+    existing = set(connection.introspection.table_names())
+    for month in month_range(oldest, add_months(cutoff, -1)):
+        name = partition_name(table, month)
+        lower, upper = month_bounds(month)
+        rows = model.objects.filter(created_at__gte=lower, created_at__lt=upper)
+        if not rows.exists():
+            continue
+        with transaction.atomic():
+            if not drop:
+                with connection.cursor() as cursor:
+                    if name in existing:
+                        cursor.execute(
+                            f'INSERT INTO {qn(name)} SELECT * FROM {qn(table)} WHERE created_at >= %s AND created_at < %s',
+                            [lower, upper]
+                        )
+                    else:
+                        cursor.execute(
+                            f'CREATE TABLE {qn(name)} AS SELECT * FROM {qn(table)} WHERE created_at >= %s AND created_at < %s',
+                            [lower, upper]
+                        )
+                        existing.add(name)
+            rows.delete()
+        detached.append(name)
+    return detached
+
+
+def partition_window(queryset, start, end=None):
+    """
+    Restrict a log queryset to a created_at window.
+
+    Always applying both bounds lets PostgreSQL prune every partition
+    outside [start, end).
+    """
+    end = end or timezone.now()
+    return queryset.filter(created_at__gte=start, created_at__lt=end)
@@ -0,0 +1,312 @@
+"""
+Request Profiling
+Per-route wall time, query count/time and response size, aggregated in
+fixed-bucket histograms in memory and flushed into hourly RequestMetric rows.
+
+Only a configurable share of requests is profiled (PROFILING_SAMPLE_RATE),
+so the cost of timing and query wrapping stays off most requests. Aggregates
+whose write fails are merged back and go out with the next flush.
+"""
+import atexit
+import bisect
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the wall-time histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 75, 100, 150, 250, 400, 600, 1000, 1500, 2500, 5000, 10000)
+
+DEFAULT_SAMPLE_RATE = 0.05
+DEFAULT_FLUSH_INTERVAL = 60
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+
+
+def bucket_index(value):
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, value)
+
+
+def histogram_percentile(histogram, quantile):
+    """
+    Estimate a percentile from bucket counts by interpolating inside the bucket.
+
+    The open-ended last bucket reports its lower bound.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = quantile * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS_MS[index - 1] if index else 0
+            if index >= len(LATENCY_BUCKETS_MS):
+                return float(lower)
+            upper = LATENCY_BUCKETS_MS[index]
+            return round(lower + (upper - lower) * (rank - seen) / count, 2)
+        seen += count
+    return float(LATENCY_BUCKETS_MS[-1])
+
+
+class QueryRecorder:
+    """connection.execute_wrapper callable counting and timing queries"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.statements[sql] += 1
+
+    def most_repeated(self):
+        if not self.statements:
+            return '', 0
+        return self.statements.most_common(1)[0]
+
+
+class RouteStats:
+    __slots__ = (
+        'requests', 'wall_time_total', 'histogram', 'query_count_total', 'query_time_total',
+        'max_queries', 'response_bytes_total', 'n_plus_one_requests',
+        'worst_repeated_query', 'worst_repeat_count',
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.wall_time_total = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.query_count_total = 0
+        self.query_time_total = 0.0
+        self.max_queries = 0
+        self.response_bytes_total = 0
+        self.n_plus_one_requests = 0
+        self.worst_repeated_query = ''
+        self.worst_repeat_count = 0
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.wall_time_total += other.wall_time_total
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        self.query_count_total += other.query_count_total
+        self.query_time_total += other.query_time_total
+        self.max_queries = max(self.max_queries, other.max_queries)
+        self.response_bytes_total += other.response_bytes_total
+        self.n_plus_one_requests += other.n_plus_one_requests
+        if other.worst_repeat_count > self.worst_repeat_count:
+            self.worst_repeat_count = other.worst_repeat_count
+            self.worst_repeated_query = other.worst_repeated_query
+
+
+class RequestProfiler:
+    """In-memory per-route aggregates, flushed to RequestMetric on an interval"""
+
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL, n_plus_one_threshold=DEFAULT_N_PLUS_ONE_THRESHOLD):
+        self.flush_interval = flush_interval
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def record(self, route, wall_time, queries, response_bytes=0):
+        """
+        Add one profiled request.
+
+        Args:
+            route: URL route name
+            wall_time: Request wall time in milliseconds
+            queries: QueryRecorder used for the request
+            response_bytes: Size of the response body
+        """
+        repeated_query, repeats = queries.most_repeated()
+        with self._lock:
+            stats = self._stats.get(route)
+            if stats is None:
+                stats = self._stats[route] = RouteStats()
+            stats.requests += 1
+            stats.wall_time_total += wall_time
+            stats.histogram[bucket_index(wall_time)] += 1
+            stats.query_count_total += queries.count
+            stats.query_time_total += queries.duration
+            stats.max_queries = max(stats.max_queries, queries.count)
+            stats.response_bytes_total += response_bytes
+            if repeats >= self.n_plus_one_threshold:
+                stats.n_plus_one_requests += 1
+                if repeats > stats.worst_repeat_count:
+                    stats.worst_repeat_count = repeats
+                    stats.worst_repeated_query = repeated_query[:2000]
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self._last_flush = time.monotonic()
+            threading.Thread(target=self._background_flush, name='request-profiler-flush', daemon=True).start()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def _drain(self):
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        return stats
+
+    def _restore(self, pending):
+        """Put aggregates that could not be written back in front of newer ones"""
+        with self._lock:
+            for route, stats in self._stats.items():
+                if route in pending:
+                    pending[route].merge(stats)
+                else:
+                    pending[route] = stats
+            self._stats = pending
+
+    def flush(self, now=None):
+        """Merge pending aggregates into the current hour's RequestMetric rows"""
+        from .models import RequestMetric
+
+        with self._flush_lock:
+            pending = self._drain()
+            if not pending:
+                return 0
+            period_start = (now or timezone.now()).replace(minute=0, second=0, microsecond=0)
+            try:
+                with transaction.atomic():
+                    existing = {
+                        metric.route: metric
+                        for metric in RequestMetric.objects.select_for_update().filter(
+                            period_start=period_start, route__in=list(pending)
+                        )
+                    }
+                    to_create, to_update = [], []
+                    for route, stats in pending.items():
+                        metric = existing.get(route)
+                        if metric is None:
+                            metric = RequestMetric(
+                                route=route,
+                                period_start=period_start,
+                                wall_time_histogram=[0] * len(stats.histogram)
+                            )
+                            to_create.append(metric)
+                        else:
+                            metric.updated_at = timezone.now()
+                            to_update.append(metric)
+                        metric.requests += stats.requests
+                        metric.wall_time_total += stats.wall_time_total
+                        metric.wall_time_histogram = [
+                            a + b for a, b in zip(metric.wall_time_histogram, stats.histogram)
+                        ]
+                        metric.query_count_total += stats.query_count_total
+                        metric.query_time_total += stats.query_time_total
+                        metric.max_queries = max(metric.max_queries, stats.max_queries)
+                        metric.response_bytes_total += stats.response_bytes_total
+                        metric.n_plus_one_requests += stats.n_plus_one_requests
+                        if stats.worst_repeat_count > metric.worst_repeat_count:
+                            metric.worst_repeat_count = stats.worst_repeat_count
+                            metric.worst_repeated_query = stats.worst_repeated_query
+
+                    RequestMetric.objects.bulk_create(to_create)
+                    RequestMetric.objects.bulk_update(to_update, [
+                        'requests', 'wall_time_total', 'wall_time_histogram', 'query_count_total',
+                        'query_time_total', 'max_queries', 'response_bytes_total',
+                        'n_plus_one_requests', 'worst_repeated_query', 'worst_repeat_count', 'updated_at'
+                    ])
+            except Exception as e:
+                logger.error(f"Failed to flush request metrics for {len(pending)} routes: {str(e)}")
+                self._restore(pending)
+                return 0
+            return len(pending)
+
+
+request_profiler = RequestProfiler(
+    flush_interval=getattr(settings, 'PROFILING_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+    n_plus_one_threshold=getattr(settings, 'PROFILING_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD),
+)
+
+
+def _flush_at_exit():
+    """Write what is left at shutdown, unless there is nowhere to write it"""
+    from .models import RequestMetric
+
+    if not request_profiler._stats or not getattr(settings, 'PROFILING_ENABLED', True):
+        return
+    try:
+        if RequestMetric._meta.db_table not in connection.introspection.table_names():
+            return
+    except Exception:
+        return
+    request_profiler.flush()
+
+
+atexit.register(_flush_at_exit)
+
+
+def summarize_metrics(metrics):
+    """
+    Combine RequestMetric rows per route.
+
+    Returns:
+        list of dicts with request counts, p50/p95/p99 wall time, average
+        query count/time and N+1 indicators
+    """
+    routes = {}
+    for metric in metrics:
+        route = routes.get(metric.route)
+        if route is None:
+            route = routes[metric.route] = {
+                'route': metric.route,
+                'requests': 0,
+                'wall_time_total': 0.0,
+                'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                'query_count_total': 0,
+                'query_time_total': 0.0,
+                'max_queries': 0,
+                'response_bytes_total': 0,
+                'n_plus_one_requests': 0,
+                'worst_repeated_query': '',
+                'worst_repeat_count': 0,
+            }
+        route['requests'] += metric.requests
+        route['wall_time_total'] += metric.wall_time_total
+        route['histogram'] = [a + b for a, b in zip(route['histogram'], metric.wall_time_histogram)]
+        route['query_count_total'] += metric.query_count_total
+        route['query_time_total'] += metric.query_time_total
+        route['max_queries'] = max(route['max_queries'], metric.max_queries)
+        route['response_bytes_total'] += metric.response_bytes_total
+        route['n_plus_one_requests'] += metric.n_plus_one_requests
+        if metric.worst_repeat_count > route['worst_repeat_count']:
+            route['worst_repeat_count'] = metric.worst_repeat_count
+            route['worst_repeated_query'] = metric.worst_repeated_query
+
+    summary = []
+    for route in routes.values():
+        requests = route['requests'] or 1
+        summary.append({
+            'route': route['route'],
+            'requests': route['requests'],
+            'p50': histogram_percentile(route['histogram'], 0.50),
+            'p95': histogram_percentile(route['histogram'], 0.95),
+            'p99': histogram_percentile(route['histogram'], 0.99),
+            'avg_wall_time': round(route['wall_time_total'] / requests, 2),
+            'avg_queries': round(route['query_count_total'] / requests, 2),
+            'avg_query_time': round(route['query_time_total'] / requests, 2),
+            'max_queries': route['max_queries'],
+            'avg_response_bytes': route['response_bytes_total'] // requests,
+            'n_plus_one_requests': route['n_plus_one_requests'],
+            'worst_repeated_query': route['worst_repeated_query'],
+            'worst_repeat_count': route['worst_repeat_count'],
+        })
+    return summary
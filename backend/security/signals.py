@@ -0,0 +1,25 @@
+from django.contrib.auth.signals import user_login_failed
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .detector import detector
+from .ipfilter import bump_version, get_enforcement_ip
+from .models import IPRule
+
+
+@receiver(user_login_failed)
+def track_failed_login(sender, credentials, request=None, **kwargs):
+    """Feed failed authentication attempts to the anomaly detector"""
+    username = credentials.get('username') or credentials.get('email')
+    detector.record_failed_login(
+        ip_address=get_enforcement_ip(request) if request is not None else None,
+        username=username,
+        user_agent=request.META.get('HTTP_USER_AGENT', '') if request is not None else ''
+    )
+
+
+@receiver(post_save, sender=IPRule)
+@receiver(post_delete, sender=IPRule)
+def reload_ip_rules(sender, instance, **kwargs):
+    """Bump the ruleset version so every worker reloads its IP rules"""
+    bump_version()
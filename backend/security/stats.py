@@ -0,0 +1,207 @@
+"""
+Security Log Rollups
+Hourly counters for the audit, security event and rate limit logs so the
+dashboard windows sum a few dozen bucket rows instead of scanning the logs.
+
+Hours that have been rolled up are read from SecurityLogHourly; anything
+before the oldest or after the newest rolled-up hour (and the partial hour
+at the start of a window) is counted live over the created_at index.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import AuditLog, SecurityEvent, RateLimitLog, SecurityLogHourly
+
+# Hours re-aggregated on each rollup so rows written late are picked up
+DEFAULT_ROLLUP_HOURS = 48
+
+# Rollup dimension -> log field, per source
+SOURCES = {
+    'audit': (AuditLog, {'kind': 'action'}),
+    'security_event': (SecurityEvent, {'kind': 'event_type', 'severity': 'severity'}),
+    'rate_limit': (RateLimitLog, {'kind': 'limit_type', 'action_taken': 'action_taken'}),
+    'rate_limit_ip': (RateLimitLog, {
+        'kind': 'limit_type', 'action_taken': 'action_taken', 'ip_address': 'ip_address'
+    }),
+}
+
+
+def start_of_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_security_logs(hours=DEFAULT_ROLLUP_HOURS, now=None):
+    """
+    Rebuild the hourly counters for the last `hours` full hours.
+
+    The range reaches back to the newest counter when rollups were missed,
+    and covers all history on the first run or when hours is None, so the
+    counters never leave a gap. Each source is replaced from a single GROUP
+    BY over the created_at range. The current hour is never materialized;
+    it is counted live.
+
+    Returns:
+        number of counter rows written
+    """
+    end = start_of_hour(now or timezone.now())
+    start = None
+    if hours is not None:
+        latest = SecurityLogHourly.objects.aggregate(latest=Max('hour'))['latest']
+        if latest is not None:
+            start = min(end - timedelta(hours=hours), latest + timedelta(hours=1))
+
+    counters = []
+    for source, (model, fields) in SOURCES.items():
+        logs = model.objects.filter(created_at__lt=end)
+        if start is not None:
+            logs = logs.filter(created_at__gte=start)
+        rows = logs.annotate(
+            hour=TruncHour('created_at')
+        ).values('hour', *fields.values()).annotate(total=Count('id')).order_by()
+        for row in rows:
+            counters.append(SecurityLogHourly(
+                source=source,
+                hour=row['hour'],
+                count=row['total'],
+                **{dimension: row[field] or '' for dimension, field in fields.items()}
+            ))
+
+    stale = SecurityLogHourly.objects.filter(hour__lt=end)
+    if start is not None:
+        stale = stale.filter(hour__gte=start)
+    with transaction.atomic():
+        stale.delete()
+        SecurityLogHourly.objects.bulk_create(counters, batch_size=1000)
+
+    return len(counters)
+
+
+def _rolled_range(source):
+    """First rolled-up hour and the hour after the last one, or (None, None)"""
+    bounds = SecurityLogHourly.objects.filter(source=source).aggregate(first=Min('hour'), latest=Max('hour'))
+    if bounds['latest'] is None:
+        return None, None
+    return bounds['first'], bounds['latest'] + timedelta(hours=1)
+
+
+def _live_counts(source, start, end, group_by, filters):
+    model, fields = SOURCES[source]
+    queryset = model.objects.filter(**{fields[dimension]: value for dimension, value in filters.items()})
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=end)
+    if not group_by:
+        return Counter({(): queryset.count()})
+    columns = [fields[dimension] for dimension in group_by]
+    rows = queryset.values(*columns).annotate(total=Count('id')).order_by()
+    return Counter({tuple(row[column] or '' for column in columns): row['total'] for row in rows})
+
+
+def _rolled_counts(source, start, end, group_by, filters):
+    queryset = SecurityLogHourly.objects.filter(source=source, hour__lt=end, **filters)
+    if start is not None:
+        queryset = queryset.filter(hour__gte=start)
+    if not group_by:
+        return Counter({(): queryset.aggregate(total=Sum('count'))['total'] or 0})
+    rows = queryset.values(*group_by).annotate(total=Sum('count')).order_by()
+    return Counter({tuple(row[dimension] for dimension in group_by): row['total'] for row in rows})
+
+
+def log_counts(source, since=None, group_by=(), now=None, **filters):
+    """
+    Count log rows created since `since` (all time when None).
+
+    Args:
+        source: Key of SOURCES
+        group_by: Rollup dimensions to group on (kind, severity, action_taken, ip_address)
+        filters: Exact matches on rollup dimensions
+
+    Returns:
+        Counter keyed by tuples of the group_by values
+    """
+    now = now or timezone.now()
+    rolled_from, rolled_until = _rolled_range(source)
+    if rolled_until is None or (since is not None and since >= rolled_until):
+        return _live_counts(source, since, None, group_by, filters)
+
+    counts = Counter()
+    if since is None or since < rolled_from:
+        # Logs older than the first counter (e.g. written before rollups began)
+        counts.update(_live_counts(source, since, rolled_from, group_by, filters))
+        first_hour = rolled_from
+    else:
+        first_hour = start_of_hour(since)
+        if first_hour < since:
+            # Partial first hour: count its tail live instead of the whole bucket
+            first_hour += timedelta(hours=1)
+            counts.update(_live_counts(source, since, min(first_hour, rolled_until), group_by, filters))
+    if first_hour < rolled_until:
+        counts.update(_rolled_counts(source, first_hour, rolled_until, group_by, filters))
+    counts.update(_live_counts(source, rolled_until, None, group_by, filters))
+    return counts
+
+
+def log_total(source, since=None, now=None, **filters):
+    return log_counts(source, since, now=now, **filters)[()]
+
+
+def security_dashboard_stats(now=None):
+    """Windowed counts for SecurityDashboardView"""
+    now = now or timezone.now()
+    seven_days_ago = now - timedelta(days=7)
+    twenty_four_hours_ago = now - timedelta(hours=24)
+
+    events_by_type = log_counts('security_event', group_by=('kind',), now=now)
+
+    return {
+        'audit_logs': {
+            'total': log_total('audit', now=now),
+            'recent_7_days': log_total('audit', seven_days_ago, now=now),
+            'last_24_hours': log_total('audit', twenty_four_hours_ago, now=now),
+        },
+        'security_events': {
+            'total': sum(events_by_type.values()),
+            'recent_7_days': log_total('security_event', seven_days_ago, now=now),
+            'by_type': [
+                {'event_type': event_type, 'count': count}
+                for (event_type,), count in events_by_type.most_common(5)
+            ],
+        },
+        'rate_limiting': {
+            'total_logs': log_total('rate_limit', now=now),
+            'blocked_24h': log_total('rate_limit', twenty_four_hours_ago, now=now, action_taken='blocked'),
+        },
+    }
+
+
+def rate_limit_stats(since=None, limit_type=None, action_taken=None, now=None):
+    """Totals and top IPs for RateLimitMonitoringView"""
+    filters = {}
+    if limit_type:
+        filters['kind'] = limit_type
+    if action_taken:
+        filters['action_taken'] = action_taken
+
+    by_action = log_counts('rate_limit', since, group_by=('action_taken',), now=now, **filters)
+    by_ip = log_counts('rate_limit_ip', since, group_by=('ip_address',), now=now, **filters)
+
+    total = sum(by_action.values())
+    blocked = by_action[('blocked',)]
+    return {
+        'statistics': {
+            'total_requests': total,
+            'blocked_requests': blocked,
+            'allowed_requests': by_action[('allowed',)],
+            'block_rate': (blocked / total * 100) if total > 0 else 0
+        },
+        'top_ips': [
+            {'ip_address': ip_address, 'count': count}
+            for (ip_address,), count in by_ip.most_common(10)
+        ],
+    }
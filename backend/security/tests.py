@@ -0,0 +1,874 @@
+import gzip
+import json
+import logging
+import os
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+from django.db import DatabaseError, connection
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase
+from rest_framework import status
+from programs.models import Program
+from backend import metrics
+from backend.logs import (
+    CompressingRotatingFileHandler, JsonFormatter, QueuedRotatingFileHandler, RequestContextFilter,
+    RequestContextMiddleware, SamplingFilter
+)
+from .models import (
+    AuditLog, IPRule, RateLimitLog, RequestMetric, SecurityEvent, SecurityLogHourly, SystemHealth,
+    SystemHealthHourly
+)
+from .audit import AuditBuffer
+from .detector import AnomalyDetector, CacheSummary
+from .ipfilter import IntervalSet, IPFilter, IPRuleSet, ip_filter
+from .health import (
+    CloudinaryCheck, DatabaseLatencyCheck, HealthCheck, run_health_checks, downsample_health_samples
+)
+from .profiling import (
+    LATENCY_BUCKETS_MS, QueryRecorder, bucket_index, histogram_percentile, request_profiler
+)
+from .partitions import (
+    add_months, create_partitions, detach_partitions, is_partitioned, list_partitions, month_start, partition_name,
+    partition_window
+)
+from .stats import log_counts, log_total, rollup_security_logs, start_of_hour
+
+User = get_user_model()
+
+
+class AuditBufferTest(TestCase):
+    def test_flushes_when_batch_is_full(self):
+        written = []
+        flushed = threading.Event()
+
+        def writer(events):
+            written.extend(events)
+            flushed.set()
+
+        buffer = AuditBuffer(writer=writer, flush_interval_ms=60000, flush_batch=3)
+        for i in range(3):
+            buffer.append({'n': i})
+
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual([event['n'] for event in written], [0, 1, 2])
+        buffer.stop()
+
+    def test_flushes_on_interval_and_stop(self):
+        written = []
+        buffer = AuditBuffer(writer=written.extend, flush_interval_ms=10, flush_batch=1000)
+        buffer.append({'n': 1})
+        buffer.stop()
+        self.assertEqual(written, [{'n': 1}])
+
+    def test_ring_buffer_drops_oldest(self):
+        written = []
+        buffer = AuditBuffer(writer=written.extend, max_size=2)
+        for i in range(3):
+            buffer.append({'n': i}, start_thread=False)
+        buffer.flush()
+        self.assertEqual([event['n'] for event in written], [1, 2])
+        self.assertEqual(buffer.dropped, 1)
+
+    def test_failed_writes_are_retried_then_dropped(self):
+        written = []
+        failures = [RuntimeError('database is down')] * 2
+
+        def writer(events):
+            if failures:
+                raise failures.pop()
+            written.extend(events)
+
+        buffer = AuditBuffer(writer=writer, max_write_attempts=2)
+        buffer.append({'n': 1}, start_thread=False)
+        self.assertEqual(buffer.flush(), 0)
+        buffer.append({'n': 2}, start_thread=False)
+        self.assertEqual(buffer.flush(), 0)
+        # The second consecutive failure gives the batch up
+        self.assertEqual((len(buffer), buffer.dropped), (0, 2))
+
+        buffer.append({'n': 3}, start_thread=False)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(written, [{'n': 3}])
+
+        failures.append(RuntimeError('database is down'))
+        buffer.append({'n': 4}, start_thread=False)
+        buffer.flush()
+        buffer.flush()
+        self.assertEqual(written, [{'n': 3}, {'n': 4}])
+
+
+@override_settings(AUDIT_LOG_ASYNC=False, EMAIL_NOTIFICATIONS_ENABLED=False)
+class AuditCaptureTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='audituser',
+            email='audit@example.com',
+            password='testpass123'
+        )
+        self.admin = User.objects.create_user(
+            username='auditadmin',
+            email='auditadmin@example.com',
+            password='testpass123',
+            is_staff=True
+        )
+
+    def test_login_is_audited(self):
+        response = self.client.post(
+            '/api/auth/jwt/create/',
+            {'username': 'audituser', 'password': 'testpass123'},
+            HTTP_USER_AGENT='AuditTest/1.0',
+            REMOTE_ADDR='203.0.113.7'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        log = AuditLog.objects.get(action='login')
+        self.assertEqual(log.user, self.user)
+        self.assertEqual(log.ip_address, '203.0.113.7')
+        self.assertEqual(log.user_agent, 'AuditTest/1.0')
+
+    @override_settings(IP_FILTER_PROXY_COUNT=1)
+    def test_forged_forwarded_for_entries_are_ignored(self):
+        self.client.post(
+            '/api/auth/jwt/create/',
+            {'username': 'audituser', 'password': 'testpass123'},
+            HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.7',
+            REMOTE_ADDR='10.0.0.2'
+        )
+        self.assertEqual(AuditLog.objects.get(action='login').ip_address, '203.0.113.7')
+
+    def test_enrollment_records_target(self):
+        program = Program.objects.create(
+            title='Audited Program',
+            description='Audit',
+            duration='4 Weeks',
+            level='Beginner',
+            technologies='Python'
+        )
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(f'/api/enroll/{program.id}/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        log = AuditLog.objects.get(action='enrollment')
+        self.assertEqual(log.content_object, program)
+        self.assertEqual(log.user, self.user)
+
+    def test_admin_mutations_are_audited(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post('/api/notifications/admin/send/', {
+            'notification_type': 'system_announcement',
+            'title': 'Hello',
+            'message': 'Everyone',
+            'user_ids': [self.user.id]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        log = AuditLog.objects.get(action='admin_action')
+        self.assertEqual(log.user, self.admin)
+        self.assertEqual(log.metadata['route'], 'notifications:admin-send')
+
+
+class LogPartitionTest(TestCase):
+    def _log_at(self, year, month, day):
+        return AuditLog.objects.create(
+            action='login',
+            description='Partition test',
+            created_at=datetime(year, month, day, 12, tzinfo=dt_timezone.utc)
+        )
+
+    def test_detach_moves_expired_months_out_of_live_table(self):
+        old = self._log_at(2026, 1, 15)
+        self._log_at(2026, 2, 1)
+        recent = self._log_at(2026, 9, 30)
+        now = datetime(2026, 10, 19, tzinfo=dt_timezone.utc)
+
+        detached = detach_partitions(AuditLog, older_than_months=6, now=now)
+
+        self.assertEqual(detached, ['security_auditlog_p202601', 'security_auditlog_p202602'])
+        self.assertEqual(list(AuditLog.objects.values_list('id', flat=True)), [recent.id])
+        self.assertEqual(list_partitions(AuditLog), detached)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM security_auditlog_p202601')
+            self.assertEqual(cursor.fetchall(), [(old.id,)])
+
+    def test_partition_window_bounds_both_ends(self):
+        inside = self._log_at(2026, 5, 10)
+        self._log_at(2026, 4, 30)
+        self._log_at(2026, 6, 1)
+
+        queryset = partition_window(
+            AuditLog.objects.all(),
+            datetime(2026, 5, 1, tzinfo=dt_timezone.utc),
+            datetime(2026, 6, 1, tzinfo=dt_timezone.utc)
+        )
+        self.assertEqual(list(queryset), [inside])
+
+    @skipUnless(connection.vendor == 'postgresql', 'native partitioning is PostgreSQL only')
+    def test_new_months_take_their_rows_out_of_the_default_partition(self):
+        self.assertTrue(is_partitioned('security_auditlog'))
+        future = add_months(month_start(timezone.now()), 12)
+        log = self._log_at(future.year, future.month, 15)
+
+        created = create_partitions(AuditLog, months_ahead=12)
+
+        name = partition_name('security_auditlog', future)
+        self.assertIn(name, created)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {name}')
+            self.assertEqual(cursor.fetchall(), [(log.id,)])
+            cursor.execute('SELECT COUNT(*) FROM security_auditlog_default WHERE id = %s', [log.id])
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(AuditLog.objects.get(pk=log.pk), log)
+
+
+class SecurityLogRollupTest(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='rollupadmin',
+            email='rollupadmin@example.com',
+            password='testpass123',
+            is_staff=True
+        )
+        self.now = timezone.now()
+
+    def _rate_limit(self, hours_ago, ip_address='10.0.0.1', action_taken='blocked'):
+        log = RateLimitLog.objects.create(
+            limit_type='login',
+            ip_address=ip_address,
+            request_count=10,
+            limit_threshold=5,
+            window_seconds=60,
+            action_taken=action_taken
+        )
+        # created_at is auto_now_add
+        RateLimitLog.objects.filter(pk=log.pk).update(created_at=self.now - timedelta(hours=hours_ago))
+        return log
+
+    def test_windows_combine_rollups_with_live_tail(self):
+        for hours_ago in (0, 5.5, 23.5, 25, 100):
+            AuditLog.objects.create(
+                action='login', description='Rollup test', created_at=self.now - timedelta(hours=hours_ago)
+            )
+        rollup_security_logs(hours=200, now=self.now)
+        # The current hour is never materialized
+        self.assertEqual(SecurityLogHourly.objects.filter(source='audit').count(), 4)
+
+        # Rolled-up hours no longer need the raw rows
+        AuditLog.objects.filter(created_at__lt=self.now - timedelta(hours=24, minutes=30)).delete()
+        AuditLog.objects.create(action='logout', description='Live', created_at=self.now)
+
+        self.assertEqual(log_total('audit', now=self.now), 6)
+        self.assertEqual(log_total('audit', self.now - timedelta(hours=24), now=self.now), 4)
+        self.assertEqual(log_counts('audit', group_by=('kind',), now=self.now)[('logout',)], 1)
+
+    def test_logs_outside_the_rolled_range_still_count(self):
+        self._rate_limit(100)
+        self._rate_limit(3)
+        # Counters that only cover the last 48 hours, as left by an earlier rollup
+        SecurityLogHourly.objects.create(
+            source='rate_limit', hour=start_of_hour(self.now - timedelta(hours=3)),
+            kind='login', action_taken='blocked', count=1
+        )
+        self.assertEqual(log_total('rate_limit', now=self.now), 2)
+
+        # Missed rollups are caught up from the newest counter
+        self._rate_limit(60)
+        SecurityLogHourly.objects.filter(source='rate_limit').update(
+            hour=start_of_hour(self.now - timedelta(hours=100))
+        )
+        rollup_security_logs(hours=2, now=self.now)
+        self.assertEqual(log_total('rate_limit', now=self.now), 3)
+
+    def test_rate_limit_monitoring_reads_rollups(self):
+        self._rate_limit(3, '10.0.0.1')
+        self._rate_limit(4, '10.0.0.1')
+        self._rate_limit(5, '10.0.0.2', action_taken='allowed')
+        self._rate_limit(48, '10.0.0.3')
+        rollup_security_logs(hours=72)
+        self._rate_limit(0, '10.0.0.2')
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/api/security/rate-limit-monitoring/', {'hours': 24})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['statistics']['total_requests'], 4)
+        self.assertEqual(response.data['statistics']['blocked_requests'], 3)
+        self.assertEqual(response.data['top_ips'], [
+            {'ip_address': '10.0.0.1', 'count': 2},
+            {'ip_address': '10.0.0.2', 'count': 2},
+        ])
+
+        response = self.client.get('/api/security/dashboard/')
+        self.assertEqual(response.data['rate_limiting'], {'total_logs': 5, 'blocked_24h': 3})
+
+
+class AuditLogBrowseExportTest(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='exportadmin',
+            email='exportadmin@example.com',
+            password='testpass123',
+            is_staff=True
+        )
+        self.client.force_authenticate(user=self.admin)
+        AuditLog.objects.bulk_create([
+            AuditLog(action='login', description=f'Login {i}', user=self.admin, metadata={'n': i})
+            for i in range(5)
+        ])
+
+    def test_keyset_browsing(self):
+        response = self.client.get('/api/security/audit-logs/', {'page_size': 2, 'count': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        seen = [row['id'] for row in response.data['results']]
+
+        while response.data['next_cursor']:
+            response = self.client.get('/api/security/audit-logs/', {
+                'page_size': 2, 'cursor': response.data['next_cursor']
+            })
+            seen.extend(row['id'] for row in response.data['results'])
+
+        self.assertEqual(seen, sorted(AuditLog.objects.values_list('id', flat=True), reverse=True))
+
+    def test_security_events_browse_by_cursor(self):
+        SecurityEvent.objects.bulk_create([
+            SecurityEvent(event_type='suspicious_activity', severity='low', description=f'Event {i}')
+            for i in range(3)
+        ])
+        response = self.client.get('/api/security/security-events/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        seen = [row['id'] for row in response.data['results']]
+
+        response = self.client.get('/api/security/security-events/', {
+            'page_size': 2, 'cursor': response.data['next_cursor']
+        })
+        seen.extend(row['id'] for row in response.data['results'])
+        self.assertIsNone(response.data['next_cursor'])
+        self.assertEqual(seen, sorted(SecurityEvent.objects.values_list('id', flat=True), reverse=True))
+
+    def test_csv_export_resumes_from_cursor(self):
+        response = self.client.get('/api/security/audit-logs/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'created_at', 'action'])
+        self.assertEqual(len(lines), 6)
+
+        cursor = lines[2].rsplit(',', 1)[1]
+        response = self.client.get('/api/security/audit-logs/export/', {'cursor': cursor})
+        resumed = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(resumed[1:], lines[3:])
+
+    def test_ndjson_export(self):
+        response = self.client.get('/api/security/audit-logs/export/', {'export_format': 'ndjson'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([record['metadata']['n'] for record in records], [0, 1, 2, 3, 4])
+        self.assertEqual(records[0]['username'], 'exportadmin')
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/security/audit-logs/export/', {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class HealthProbeTest(APITestCase):
+    def test_checks_record_samples_and_failures(self):
+        class BrokenCheck(HealthCheck):
+            component = 'broken'
+
+            def run(self):
+                raise RuntimeError('probe exploded')
+
+        pings = []
+        with self.assertLogs('security.health', level='ERROR'):
+            samples = run_health_checks([
+                DatabaseLatencyCheck(),
+                CloudinaryCheck(ping=lambda: pings.append(1)),
+                BrokenCheck(),
+            ])
+
+        statuses = {sample.component: sample.status for sample in samples}
+        self.assertEqual(statuses, {'database': 'healthy', 'media_storage': 'healthy', 'broken': 'critical'})
+        self.assertEqual(pings, [1])
+        self.assertEqual(SystemHealth.objects.get(component='broken').message, 'probe exploded')
+
+    def test_downsample_merges_into_hourly_rollups(self):
+        now = datetime(2026, 10, 19, 12, 30, tzinfo=dt_timezone.utc)
+        hour = datetime(2026, 10, 17, 9, tzinfo=dt_timezone.utc)
+        for status_value, response_time in [('healthy', 10), ('healthy', 30), ('warning', 50)]:
+            sample = SystemHealth.objects.create(
+                component='database', status=status_value, message='', response_time=response_time
+            )
+            SystemHealth.objects.filter(pk=sample.pk).update(created_at=hour.replace(minute=15))
+        recent = SystemHealth.objects.create(component='database', status='healthy', message='')
+        SystemHealth.objects.filter(pk=recent.pk).update(created_at=now)
+
+        result = downsample_health_samples(older_than_hours=24, now=now)
+        self.assertEqual(result, {'samples': 3, 'hourly_rows': 1})
+        self.assertEqual(list(SystemHealth.objects.values_list('pk', flat=True)), [recent.pk])
+
+        rollup = SystemHealthHourly.objects.get(component='database', hour=hour)
+        self.assertEqual((rollup.samples, rollup.healthy_samples, rollup.warning_samples), (3, 2, 1))
+        self.assertEqual(rollup.worst_status, 'warning')
+        self.assertEqual(rollup.avg_response_time, 30)
+        self.assertEqual(rollup.max_response_time, 50)
+
+        critical = SystemHealth.objects.create(component='database', status='critical', message='', response_time=90)
+        SystemHealth.objects.filter(pk=critical.pk).update(created_at=hour.replace(minute=45))
+        downsample_health_samples(older_than_hours=24, now=now)
+
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.samples, rollup.critical_samples), (4, 1))
+        self.assertEqual(rollup.worst_status, 'critical')
+        self.assertEqual(rollup.avg_response_time, 45)
+        self.assertEqual(rollup.max_response_time, 90)
+
+    def test_maintenance_samples_are_kept_in_rollups_and_history_is_bounded(self):
+        now = timezone.now()
+        hour = (now - timedelta(days=2)).replace(minute=0, second=0, microsecond=0)
+        for minute in (10, 20):
+            sample = SystemHealth.objects.create(component='email', status='maintenance', message='Upgrade')
+            SystemHealth.objects.filter(pk=sample.pk).update(created_at=hour.replace(minute=minute))
+            downsample_health_samples(older_than_hours=24, now=now)
+
+        rollup = SystemHealthHourly.objects.get(component='email', hour=hour)
+        self.assertEqual((rollup.samples, rollup.maintenance_samples, rollup.worst_status), (2, 2, 'maintenance'))
+
+        admin = User.objects.create_user(
+            username='healthadmin', email='healthadmin@example.com', password='testpass123', is_staff=True
+        )
+        self.client.force_authenticate(user=admin)
+        for hours, expected in (('72', 1), ('-5', 0), ('lots', 0), (str(10 ** 12), 1)):
+            response = self.client.get('/api/security/system-health/', {'hours': hours})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.json()['hourly']), expected, hours)
+        self.assertEqual(response.json()['hourly'][0]['maintenance_samples'], 2)
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, EMAIL_NOTIFICATIONS_ENABLED=False)
+class RequestProfilingTest(APITestCase):
+    def setUp(self):
+        request_profiler.flush()
+        RequestMetric.objects.all().delete()
+        self.admin = User.objects.create_user(
+            username='profileadmin',
+            email='profileadmin@example.com',
+            password='testpass123',
+            is_staff=True
+        )
+        self.client.force_authenticate(user=self.admin)
+
+    def test_histogram_percentiles(self):
+        histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        histogram[bucket_index(7)] = 50  # 5-10ms
+        histogram[bucket_index(120)] = 50  # 100-150ms
+        self.assertEqual(histogram_percentile(histogram, 0.5), 10)
+        self.assertEqual(histogram_percentile(histogram, 0.99), 149)
+        self.assertIsNone(histogram_percentile([0] * len(histogram), 0.5))
+
+    def test_requests_are_profiled_and_reported(self):
+        AuditLog.objects.bulk_create([
+            AuditLog(action='login', description=f'Login {i}', user=self.admin) for i in range(3)
+        ])
+        for _ in range(3):
+            self.client.get('/api/security/audit-logs/')
+
+        response = self.client.get('/api/security/performance/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        routes = {route['route']: route for route in response.data['routes']}
+        audit = routes['security:audit-logs']
+        self.assertEqual(audit['requests'], 3)
+        self.assertGreater(audit['avg_queries'], 0)
+        self.assertIsNotNone(audit['p95'])
+
+        metric = RequestMetric.objects.get(route='security:audit-logs')
+        self.assertEqual(sum(metric.wall_time_histogram), 3)
+        self.assertGreater(metric.response_bytes_total, 0)
+
+    def test_repeated_queries_flag_n_plus_one(self):
+        queries = QueryRecorder()
+        queries.statements['SELECT * FROM users_user WHERE id = %s'] = 12
+        queries.count = 13
+        request_profiler.record('programs:program-list', 40.0, queries, 1024)
+        request_profiler.flush()
+
+        response = self.client.get('/api/security/performance/')
+        offender = response.data['n_plus_one_offenders'][0]
+        self.assertEqual(offender['route'], 'programs:program-list')
+        self.assertEqual(offender['worst_repeat_count'], 12)
+
+    def test_failed_flush_keeps_aggregates_for_the_next_one(self):
+        queries = QueryRecorder()
+        request_profiler.record('programs:program-list', 40.0, queries)
+        with mock.patch.object(RequestMetric.objects, 'bulk_create', side_effect=DatabaseError('database is down')):
+            with self.assertLogs('security.profiling', 'ERROR'):
+                self.assertEqual(request_profiler.flush(), 0)
+        request_profiler.record('programs:program-list', 60.0, queries)
+
+        self.assertEqual(request_profiler.flush(), 1)
+        metric = RequestMetric.objects.get(route='programs:program-list')
+        self.assertEqual((metric.requests, metric.wall_time_total), (2, 100.0))
+
+
+def _increment_in_child(directory):
+    with override_settings(METRICS_DIR=directory):
+        metrics.http_requests.inc(5, view='child:view', method='GET', status=200)
+
+
+class MetricsExpositionTest(APITestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(METRICS_DIR=self.directory, METRICS_AUTH_TOKEN='')
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def test_values_from_every_process_are_summed(self):
+        metrics.http_requests.inc(view='child:view', method='GET', status=200)
+        child = multiprocessing.get_context('fork').Process(target=_increment_in_child, args=(self.directory,))
+        child.start()
+        child.join(10)
+
+        output = metrics.generate_latest()
+        self.assertIn('http_requests_total{method="GET",status="200",view="child:view"} 6.0', output)
+        # The exited child's file still counts, but not as a live worker
+        self.assertIn('gunicorn_workers 1', output)
+
+    def test_dead_process_values_are_archived(self):
+        child = multiprocessing.get_context('fork').Process(target=_increment_in_child, args=(self.directory,))
+        child.start()
+        child.join(10)
+        metrics.mark_process_dead(child.pid)
+        metrics.mark_process_dead(child.pid)
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f'metrics_{child.pid}.db')))
+        samples, pids = metrics.collect_samples()
+        self.assertNotIn(child.pid, pids)
+        output = metrics.generate_latest()
+        self.assertIn('http_requests_total{method="GET",status="200",view="child:view"} 5.0', output)
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics.http_request_duration.observe(0.02, view='hist:view')
+        metrics.http_request_duration.observe(0.3, view='hist:view')
+
+        output = metrics.generate_latest()
+        self.assertIn('http_request_duration_seconds_bucket{view="hist:view",le="0.01"} 0.0', output)
+        self.assertIn('http_request_duration_seconds_bucket{view="hist:view",le="0.025"} 1.0', output)
+        self.assertIn('http_request_duration_seconds_bucket{view="hist:view",le="+Inf"} 2.0', output)
+        self.assertIn('http_request_duration_seconds_count{view="hist:view"} 2.0', output)
+
+    @override_settings(EMAIL_NOTIFICATIONS_ENABLED=False)
+    def test_metrics_endpoint(self):
+        self.client.get('/api/security/dashboard/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_requests counter', body)
+        self.assertIn('view="security:security-dashboard"', body)
+        self.assertIn('# TYPE email_outbox_depth gauge', body)
+
+        with override_settings(METRICS_AUTH_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class LogPipelineTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'django.log')
+
+    def _logger(self, handler):
+        logger = logging.getLogger('security.tests.pipeline')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger
+
+    def test_queued_handler_writes_json_with_request_context(self):
+        handler = QueuedRotatingFileHandler(self.path)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(RequestContextFilter())
+        self.addCleanup(handler.close)
+        logger = self._logger(handler)
+        user = User.objects.create_user(username='loguser', email='loguser@example.com', password='testpass123')
+
+        def view(request):
+            request.user = user
+            logger.info('inside request')
+            return JsonResponse({})
+
+        request = RequestFactory().get('/api/auth/profile/', HTTP_X_REQUEST_ID='abc-123')
+        response = RequestContextMiddleware(view)(request)
+        logger.warning('outside request')
+        handler.flush()
+
+        with open(self.path) as log_file:
+            inside, outside = [json.loads(line) for line in log_file]
+        self.assertEqual(response['X-Request-ID'], 'abc-123')
+        self.assertEqual((inside['message'], inside['request_id'], inside['user_id']), ('inside request', 'abc-123', user.id))
+        self.assertEqual((outside['level'], outside['request_id']), ('WARNING', None))
+
+    def test_rotation_by_size_and_time_gzips_backups(self):
+        handler = CompressingRotatingFileHandler(self.path, max_bytes=100, backup_count=3)
+        self.addCleanup(handler.close)
+        logger = self._logger(handler)
+
+        for index in range(6):
+            logger.info(f'line {index} ' + 'x' * 40)
+        handler.rollover_at = 0
+        logger.info('after midnight')
+
+        backups = sorted(name for name in os.listdir(self.directory) if name.endswith('.gz'))
+        self.assertEqual(backups, ['django.log.1.gz', 'django.log.2.gz', 'django.log.3.gz'])
+        with gzip.open(os.path.join(self.directory, 'django.log.1.gz'), 'rt') as rotated:
+            self.assertIn('line 5', rotated.read())
+        with open(self.path) as current:
+            self.assertEqual(current.read(), 'after midnight\n')
+
+    def test_processes_sharing_a_file_rotate_once_and_follow_rotation(self):
+        # Two handlers on one file stand in for two gunicorn workers
+        first = CompressingRotatingFileHandler(self.path, max_bytes=0, compress=False)
+        second = CompressingRotatingFileHandler(self.path, max_bytes=0, compress=False)
+        for handler in (first, second):
+            self.addCleanup(handler.close)
+        first_logger, second_logger = self._logger(first), logging.getLogger('security.tests.pipeline.second')
+        second_logger.propagate = False
+        second_logger.addHandler(second)
+        self.addCleanup(second_logger.removeHandler, second)
+
+        first_logger.info('first before')
+        second_logger.info('second before')
+        first.rollover_at = second.rollover_at = time.time()
+        first_logger.info('first after')
+        second_logger.info('second after')
+
+        with open(self.path + '.1') as rotated:
+            self.assertEqual(rotated.read(), 'first before\nsecond before\n')
+        with open(self.path) as current:
+            self.assertEqual(current.read(), 'first after\nsecond after\n')
+        self.assertFalse(os.path.exists(self.path + '.2'))
+
+    def test_dropped_records_are_counted(self):
+        handler = QueuedRotatingFileHandler(self.path, queue_size=1)
+        self.addCleanup(handler.close)
+        # No listener drains the queue
+        handler._ensure_listener = lambda: None
+        with override_settings(METRICS_DIR=self.directory):
+            for message in ('kept', 'dropped'):
+                handler.enqueue(logging.LogRecord('x', logging.INFO, __file__, 1, message, None, None))
+            output = metrics.generate_latest()
+        self.assertEqual(handler.dropped, 1)
+        self.assertIn('log_records_dropped_total 1.0', output)
+
+    def test_sampling_keeps_warnings_and_whole_requests(self):
+        sampler = SamplingFilter(rate=0.5)
+        record = logging.LogRecord('users.views.profile', logging.INFO, __file__, 1, 'update', None, None)
+        warning = logging.LogRecord('users.views.profile', logging.WARNING, __file__, 1, 'failed', None, None)
+        self.assertTrue(SamplingFilter(rate=0).filter(warning))
+        self.assertFalse(SamplingFilter(rate=0).filter(record))
+
+        kept = []
+        for index in range(200):
+            def view(request):
+                decisions = {sampler.filter(record) for _ in range(3)}
+                self.assertEqual(len(decisions), 1)
+                kept.append(decisions.pop())
+                return JsonResponse({})
+            RequestContextMiddleware(view)(RequestFactory().get('/', HTTP_X_REQUEST_ID=f'req-{index}'))
+        self.assertTrue(40 < sum(kept) < 160)
+
+
+class AnomalyDetectorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1_000_000.0
+        self.detector = AnomalyDetector(clock=lambda: self.now)
+
+    def test_summary_expires_old_buckets(self):
+        summary = CacheSummary('test', window_seconds=60, bucket_seconds=10, size=10)
+        self.assertEqual(summary.add('ip', 0), 1)
+        self.assertEqual(summary.add('ip', 35), 2)
+        self.assertEqual(summary.top(59, 10), [('ip', 2)])
+        self.assertEqual(summary.top(65, 10), [('ip', 1)])
+        self.assertEqual(summary.top(200, 10), [])
+
+    def test_summary_keeps_the_highest_totals(self):
+        summary = CacheSummary('test', window_seconds=60, bucket_seconds=10, size=2)
+        for key, count in (('a', 3), ('b', 1), ('c', 2)):
+            for _ in range(count):
+                summary.add(key, 0)
+        self.assertEqual(summary.top(1, 10), [('a', 3), ('c', 2)])
+
+    def test_account_threshold_emits_one_event_per_window(self):
+        for _ in range(4):
+            self.assertEqual(self.detector.record_failed_login('198.51.100.1', 'victim'), [])
+        events = self.detector.record_failed_login('198.51.100.2', 'victim')
+        self.assertEqual([(event.event_type, event.severity) for event in events], [('failed_login', 'high')])
+        self.assertEqual(events[0].details['username'], 'victim')
+
+        # Still over the threshold, but deduplicated until the window passes
+        self.assertEqual(self.detector.record_failed_login('198.51.100.3', 'victim'), [])
+        self.assertEqual(SecurityEvent.objects.count(), 1)
+
+    def test_workers_share_counters_through_the_cache(self):
+        other_worker = AnomalyDetector(clock=lambda: self.now)
+        for _ in range(2):
+            self.detector.record_failed_login('198.51.100.1', 'shared')
+            other_worker.record_failed_login('198.51.100.1', 'shared')
+        self.assertEqual(SecurityEvent.objects.count(), 0)
+        events = other_worker.record_failed_login('198.51.100.1', 'Shared')
+        self.assertEqual([event.details['count'] for event in events], [5])
+
+        self.now += 15 * 60
+        self.assertEqual(self.detector.windows['account_failed_logins'].total('shared', self.now), 0)
+        # Both workers report the same suspicion summary
+        self.assertEqual(self.detector.top_suspicious_ips(), other_worker.top_suspicious_ips())
+        self.assertEqual(self.detector.top_suspicious_ips(), [{'ip_address': '198.51.100.1', 'count': 5}])
+
+    def test_credential_stuffing_counts_distinct_accounts(self):
+        for _ in range(10):
+            self.detector.record_failed_login('203.0.113.50', 'same-user-stuffing')
+        self.assertFalse(SecurityEvent.objects.filter(event_type='suspicious_activity').exists())
+
+        for i in range(5):
+            self.detector.record_failed_login('203.0.113.51', f'stuffed-{i}')
+        event = SecurityEvent.objects.get(event_type='suspicious_activity')
+        self.assertEqual(event.ip_address, '203.0.113.51')
+
+    def test_throttles_feed_summary(self):
+        for _ in range(3):
+            self.detector.record_throttle('192.0.2.9', route='auth-login')
+        self.detector.record_throttle('192.0.2.10')
+        self.assertTrue(SecurityEvent.objects.filter(event_type='rate_limit_exceeded', ip_address='192.0.2.9').exists())
+        self.assertEqual(self.detector.top_suspicious_ips(1), [{'ip_address': '192.0.2.9', 'count': 3}])
+
+        self.now += 25 * 60 * 60
+        self.assertEqual(self.detector.top_suspicious_ips(), [])
+
+
+class FailedLoginDetectionTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='targeted', email='targeted@example.com', password='testpass123')
+
+    def test_failed_logins_generate_security_event(self):
+        for _ in range(5):
+            response = self.client.post(
+                '/api/auth/jwt/create/',
+                {'username': 'targeted', 'password': 'wrong'},
+                REMOTE_ADDR='198.51.100.77'
+            )
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        event = SecurityEvent.objects.get(event_type='failed_login')
+        self.assertEqual(event.details['username'], 'targeted')
+        self.assertEqual(event.ip_address, '198.51.100.77')
+
+
+class IPFilterTest(TestCase):
+    def test_interval_set_merges_and_bisects(self):
+        intervals = IntervalSet([(10, 20), (15, 30), (31, 35), (50, 60)])
+        self.assertEqual(intervals.starts, [10, 50])
+        self.assertIn(10, intervals)
+        self.assertIn(35, intervals)
+        self.assertNotIn(36, intervals)
+        self.assertNotIn(9, intervals)
+        self.assertIn(60, intervals)
+
+    def test_ruleset_cidr_and_allow_precedence(self):
+        with self.assertLogs('security.ipfilter', level='WARNING'):
+            ruleset = IPRuleSet([
+                ('block', '203.0.113.0/24'),
+                ('allow', '203.0.113.8/29'),
+                ('block', '2001:db8::/32'),
+                ('block', 'not-an-ip'),
+            ])
+        self.assertTrue(ruleset.is_blocked('203.0.113.200'))
+        self.assertFalse(ruleset.is_blocked('203.0.113.9'))
+        self.assertFalse(ruleset.is_blocked('198.51.100.1'))
+        self.assertTrue(ruleset.is_blocked('2001:db8::1'))
+        self.assertTrue(ruleset.is_blocked('::ffff:203.0.113.1'))
+        self.assertFalse(ruleset.is_blocked('garbage'))
+
+    def test_reloads_when_version_bumps(self):
+        clock = [0.0]
+        ip_filter_under_test = IPFilter(reload_interval=5, clock=lambda: clock[0])
+        self.assertFalse(ip_filter_under_test.is_blocked('192.0.2.1'))
+
+        rule = IPRule.objects.create(network='192.0.2.0/24')
+        self.assertFalse(ip_filter_under_test.is_blocked('192.0.2.1'))  # within the poll interval
+        clock[0] = 6
+        with self.assertNumQueries(2):
+            self.assertTrue(ip_filter_under_test.is_blocked('192.0.2.1'))
+        with self.assertNumQueries(0):
+            self.assertTrue(ip_filter_under_test.is_blocked('192.0.2.2'))
+
+        rule.delete()
+        clock[0] = 12
+        self.assertFalse(ip_filter_under_test.is_blocked('192.0.2.1'))
+
+
+class IPFilterMiddlewareTest(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='ipadmin', email='ipadmin@example.com', password='testpass123', is_staff=True
+        )
+        ip_filter.ruleset = None
+
+    def tearDown(self):
+        ip_filter.ruleset = None
+
+    def test_blocked_ranges_are_rejected_early(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post('/api/security/ip-rules/', {
+            'network': '198.51.100.7/16', 'reason': 'Credential stuffing'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['network'], '198.51.0.0/16')
+
+        ip_filter.ruleset = None
+        response = self.client.get('/api/programs/', REMOTE_ADDR='198.51.4.4')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.json(), {'detail': 'Forbidden'})
+        self.assertNotEqual(self.client.get('/api/programs/', REMOTE_ADDR='192.0.2.4').status_code, 403)
+
+    @override_settings(IP_FILTER_PROXY_COUNT=1)
+    def test_only_trusted_forwarded_hop_is_used(self):
+        IPRule.objects.create(network='192.0.2.66')
+        ip_filter.ruleset = None
+        # A forged leftmost hop cannot dodge the block
+        response = self.client.get(
+            '/api/programs/', HTTP_X_FORWARDED_FOR='10.0.0.1, 192.0.2.66', REMOTE_ADDR='10.1.1.1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_rejects_invalid_network(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post('/api/security/ip-rules/', {'network': '300.1.1.1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expiry_without_offset_is_made_aware(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post('/api/security/ip-rules/', {
+            'network': '192.0.2.9', 'expires_at': '2030-01-01T12:00:00'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        expires_at = IPRule.objects.get(pk=response.data['id']).expires_at
+        self.assertTrue(timezone.is_aware(expires_at))
+        self.assertEqual(expires_at, timezone.make_aware(datetime(2030, 1, 1, 12)))
+
+        response = self.client.post('/api/security/ip-rules/', {
+            'network': '192.0.2.10', 'expires_at': '2030-02-30T12:00:00'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,7 +1,9 @@
 from django.urls import path
 from .views import (
     SecurityDashboardView, AuditLogView, SecurityEventView,
-    SystemHealthView, RateLimitMonitoringView, DataPrivacyView
+    SystemHealthView, RateLimitMonitoringView, DataPrivacyView,
+    AuditLogExportView, DataPrivacyExportView, RequestPerformanceView,
+    IPRuleView, IPRuleDetailView
 )
 
 app_name = 'security'
@@ -9,9 +11,14 @@ app_name = 'security'
 urlpatterns = [
     path('dashboard/', SecurityDashboardView.as_view(), name='security-dashboard'),
     path('audit-logs/', AuditLogView.as_view(), name='audit-logs'),
+    path('audit-logs/export/', AuditLogExportView.as_view(), name='audit-logs-export'),
     path('security-events/', SecurityEventView.as_view(), name='security-events'),
     path('security-events/<int:event_id>/', SecurityEventView.as_view(), name='security-event-detail'),
     path('system-health/', SystemHealthView.as_view(), name='system-health'),
     path('rate-limit-monitoring/', RateLimitMonitoringView.as_view(), name='rate-limit-monitoring'),
     path('data-privacy/', DataPrivacyView.as_view(), name='data-privacy'),
+    path('performance/', RequestPerformanceView.as_view(), name='request-performance'),
+    path('ip-rules/', IPRuleView.as_view(), name='ip-rules'),
+    path('ip-rules/<int:rule_id>/', IPRuleDetailView.as_view(), name='ip-rule-detail'),
+    path('data-privacy/export/', DataPrivacyExportView.as_view(), name='data-privacy-export'),
 ] 
\ No newline at end of file
@@ -2,10 +2,24 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser
 from rest_framework import status
-from django.db.models import Count, Q
+from django.conf import settings
+from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import timedelta
-from .models import AuditLog, SecurityEvent, SystemHealth, RateLimitLog, DataPrivacyLog
+from .models import (
+    AuditLog, SecurityEvent, SystemHealth, SystemHealthHourly, RateLimitLog, DataPrivacyLog, RequestMetric,
+    IPRule
+)
+from .partitions import partition_window
+from .health import HOURLY_RETENTION_DAYS, latest_health
+from .stats import security_dashboard_stats, rate_limit_stats
+from .detector import top_suspicious_ips as top_suspicious_ips_summary
+from .ipfilter import parse_network
+from .profiling import request_profiler, summarize_metrics, DEFAULT_SAMPLE_RATE
+from .exports import AUDIT_LOG_COLUMNS, PRIVACY_LOG_COLUMNS
+from backend.exports import export_response
+from backend.pagination import KeysetPagination
 from rest_framework import serializers
 
 
@@ -25,53 +39,30 @@ class SecurityDashboardView(APIView):
     serializer_class = SecurityStatsSerializer
     
     def get(self, request):
-        # Get date ranges
         now = timezone.now()
-        thirty_days_ago = now - timedelta(days=30)
-        seven_days_ago = now - timedelta(days=7)
         twenty_four_hours_ago = now - timedelta(hours=24)
-        
-        # Audit log statistics
-        total_audit_logs = AuditLog.objects.count()
-        recent_audit_logs = AuditLog.objects.filter(created_at__gte=seven_days_ago).count()
-        audit_logs_24h = AuditLog.objects.filter(created_at__gte=twenty_four_hours_ago).count()
-        
-        # Security event statistics
-        total_security_events = SecurityEvent.objects.count()
+
+        # Windowed counts come from the hourly rollups plus a live tail
+        counts = security_dashboard_stats(now)
+
+        # Resolution state changes after the fact, so these stay live
         unresolved_security_events = SecurityEvent.objects.filter(resolved=False).count()
         critical_security_events = SecurityEvent.objects.filter(severity='critical', resolved=False).count()
-        recent_security_events = SecurityEvent.objects.filter(created_at__gte=seven_days_ago).count()
-        
-        # Rate limiting statistics
-        total_rate_limit_logs = RateLimitLog.objects.count()
-        blocked_requests_24h = RateLimitLog.objects.filter(
-            action_taken='blocked',
-            created_at__gte=twenty_four_hours_ago
-        ).count()
         
         # System health statistics
         system_health_status = SystemHealth.objects.filter(
             created_at__gte=twenty_four_hours_ago
         ).order_by('-created_at').first()
         
-        # Top security events by type
-        security_events_by_type = SecurityEvent.objects.values('event_type').annotate(
-            count=Count('id')
-        ).order_by('-count')[:5]
-        
         # Top IP addresses with security events
-        top_suspicious_ips = SecurityEvent.objects.values('ip_address').annotate(
-            count=Count('id')
-        ).filter(ip_address__isnull=False).order_by('-count')[:10]
+        top_suspicious_ips = top_suspicious_ips_summary(10)
         
         # Recent audit logs
         recent_audit_logs_list = AuditLog.objects.select_related('user').order_by('-created_at')[:20]
         
         stats = {
             'audit_logs': {
-                'total': total_audit_logs,
-                'recent_7_days': recent_audit_logs,
-                'last_24_hours': audit_logs_24h,
+                **counts['audit_logs'],
                 'recent_logs': [
                     {
                         'action': log.action,
@@ -82,17 +73,12 @@ class SecurityDashboardView(APIView):
                 ]
             },
             'security_events': {
-                'total': total_security_events,
+                **counts['security_events'],
                 'unresolved': unresolved_security_events,
                 'critical': critical_security_events,
-                'recent_7_days': recent_security_events,
-                'by_type': list(security_events_by_type),
                 'top_suspicious_ips': list(top_suspicious_ips)
             },
-            'rate_limiting': {
-                'total_logs': total_rate_limit_logs,
-                'blocked_24h': blocked_requests_24h
-            },
+            'rate_limiting': counts['rate_limiting'],
             'system_health': {
                 'status': system_health_status.status if system_health_status else 'unknown',
                 'component': system_health_status.component if system_health_status else None,
@@ -103,46 +89,86 @@ class SecurityDashboardView(APIView):
         return Response(stats)
 
 
+class LogPagination(KeysetPagination):
+    page_size = 50
+    max_page_size = 500
+
+
+def filter_audit_logs(request, default_days=30):
+    """Apply the action/user/IP/days filters shared by browsing and export"""
+    queryset = AuditLog.objects.all()
+
+    action = request.query_params.get('action')
+    user_id = request.query_params.get('user_id')
+    ip_address = request.query_params.get('ip_address')
+    days = request.query_params.get('days', default_days)
+
+    if action:
+        queryset = queryset.filter(action=action)
+
+    if user_id:
+        queryset = queryset.filter(user_id=user_id)
+
+    if ip_address:
+        queryset = queryset.filter(ip_address=ip_address)
+
+    # Filter by date range
+    try:
+        days = int(days)
+        date_from = timezone.now() - timedelta(days=days)
+        queryset = partition_window(queryset, date_from)
+    except ValueError:
+        pass
+
+    return queryset
+
+
+def filter_privacy_logs(request, default_days=30):
+    queryset = DataPrivacyLog.objects.all()
+
+    action = request.query_params.get('action')
+    user_id = request.query_params.get('user_id')
+    days = request.query_params.get('days', default_days)
+
+    if action:
+        queryset = queryset.filter(action=action)
+
+    if user_id:
+        queryset = queryset.filter(user_id=user_id)
+
+    try:
+        days = int(days)
+        date_from = timezone.now() - timedelta(days=days)
+        queryset = queryset.filter(created_at__gte=date_from)
+    except ValueError:
+        pass
+
+    return queryset
+
+
+def log_export_response(request, queryset, columns, filename):
+    try:
+        return export_response(
+            queryset,
+            columns,
+            request.query_params.get('export_format', 'csv'),
+            filename,
+            cursor=request.query_params.get('cursor')
+        )
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
 class AuditLogView(APIView):
-    """Admin: View audit logs with filtering"""
+    """Admin: Browse audit logs newest first with keyset pagination"""
     permission_classes = [IsAdminUser]
     serializer_class = MessageSerializer
     
     def get(self, request):
-        # Get query parameters
-        action = request.query_params.get('action')
-        user_id = request.query_params.get('user_id')
-        ip_address = request.query_params.get('ip_address')
-        days = request.query_params.get('days', 30)
-        
-        # Build queryset
-        queryset = AuditLog.objects.select_related('user')
-        
-        # Apply filters
-        if action:
-            queryset = queryset.filter(action=action)
-        
-        if user_id:
-            queryset = queryset.filter(user_id=user_id)
-        
-        if ip_address:
-            queryset = queryset.filter(ip_address=ip_address)
-        
-        # Filter by date range
-        try:
-            days = int(days)
-            date_from = timezone.now() - timedelta(days=days)
-            queryset = queryset.filter(created_at__gte=date_from)
-        except ValueError:
-            pass
-        
-        # Pagination
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 50))
-        start = (page - 1) * page_size
-        end = start + page_size
-        
-        audit_logs = queryset[start:end]
+        queryset = filter_audit_logs(request).select_related('user')
+
+        paginator = LogPagination()
+        audit_logs = paginator.paginate_queryset(queryset, request, view=self)
         
         log_data = []
         for log in audit_logs:
@@ -161,16 +187,22 @@ class AuditLogView(APIView):
                 'created_at': log.created_at.isoformat()
             })
         
-        return Response({
-            'audit_logs': log_data,
-            'total_count': queryset.count(),
-            'page': page,
-            'page_size': page_size
-        })
+        return paginator.get_paginated_response(log_data)
+
+
+class AuditLogExportView(APIView):
+    """Admin: Stream audit logs as CSV or NDJSON, resumable from a row cursor"""
+    permission_classes = [IsAdminUser]
+    serializer_class = MessageSerializer
+
+    def get(self, request):
+        return log_export_response(
+            request, filter_audit_logs(request, default_days=365), AUDIT_LOG_COLUMNS, 'audit-logs'
+        )
 
 
 class SecurityEventView(APIView):
-    """Admin: View and manage security events"""
+    """Admin: Browse security events newest first with keyset pagination, and resolve them"""
     permission_classes = [IsAdminUser]
     serializer_class = MessageSerializer
     
@@ -199,17 +231,12 @@ class SecurityEventView(APIView):
         try:
             days = int(days)
             date_from = timezone.now() - timedelta(days=days)
-            queryset = queryset.filter(created_at__gte=date_from)
+            queryset = partition_window(queryset, date_from)
         except ValueError:
             pass
         
-        # Pagination
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 50))
-        start = (page - 1) * page_size
-        end = start + page_size
-        
-        security_events = queryset[start:end]
+        paginator = LogPagination()
+        security_events = paginator.paginate_queryset(queryset, request, view=self)
         
         event_data = []
         for event in security_events:
@@ -235,12 +262,7 @@ class SecurityEventView(APIView):
                 'created_at': event.created_at.isoformat()
             })
         
-        return Response({
-            'security_events': event_data,
-            'total_count': queryset.count(),
-            'page': page,
-            'page_size': page_size
-        })
+        return paginator.get_paginated_response(event_data)
     
     def patch(self, request, event_id):
         """Resolve a security event"""
@@ -269,7 +291,14 @@ class SystemHealthView(APIView):
         # Get query parameters
         component = request.query_params.get('component')
         status_filter = request.query_params.get('status')
-        hours = request.query_params.get('hours', 24)
+        try:
+            hours = int(request.query_params.get('hours', 24))
+        except ValueError:
+            hours = 24
+        # Nothing older than the hourly rollups is kept
+        max_hours = getattr(settings, 'HEALTH_HOURLY_RETENTION_DAYS', HOURLY_RETENTION_DAYS) * 24
+        hours = min(max(hours, 1), max_hours)
+        time_from = timezone.now() - timedelta(hours=hours)
         
         # Build queryset
         queryset = SystemHealth.objects.all()
@@ -281,38 +310,47 @@ class SystemHealthView(APIView):
         if status_filter:
             queryset = queryset.filter(status=status_filter)
         
-        # Filter by time range
-        try:
-            hours = int(hours)
-            time_from = timezone.now() - timedelta(hours=hours)
-            queryset = queryset.filter(created_at__gte=time_from)
-        except ValueError:
-            pass
+        queryset = queryset.filter(created_at__gte=time_from)
         
-        # Get latest status for each component
-        components = queryset.values('component').distinct()
+        # Latest status for each component, plus hourly rollups for older history
         health_data = []
-        
-        for comp in components:
-            latest = queryset.filter(component=comp['component']).order_by('-created_at').first()
-            if latest:
-                health_data.append({
-                    'component': latest.component,
-                    'status': latest.status,
-                    'message': latest.message,
-                    'response_time': latest.response_time,
-                    'error_rate': latest.error_rate,
-                    'uptime': latest.uptime,
-                    'metrics': latest.metrics,
-                    'created_at': latest.created_at.isoformat()
-                })
+        for latest in latest_health(queryset):
+            health_data.append({
+                'component': latest.component,
+                'status': latest.status,
+                'message': latest.message,
+                'response_time': latest.response_time,
+                'error_rate': latest.error_rate,
+                'uptime': latest.uptime,
+                'metrics': latest.metrics,
+                'created_at': latest.created_at.isoformat()
+            })
+
+        history = SystemHealthHourly.objects.all()
+        if component:
+            history = history.filter(component=component)
+        history = history.filter(hour__gte=time_from)
+
+        hourly_data = []
+        for rollup in history.order_by('component', 'hour'):
+            hourly_data.append({
+                'component': rollup.component,
+                'hour': rollup.hour.isoformat(),
+                'status': rollup.worst_status,
+                'samples': rollup.samples,
+                'maintenance_samples': rollup.maintenance_samples,
+                'uptime': rollup.uptime,
+                'avg_response_time': rollup.avg_response_time,
+                'max_response_time': rollup.max_response_time
+            })
         
         return Response({
             'system_health': health_data,
             'total_components': len(health_data),
             'healthy_components': len([h for h in health_data if h['status'] == 'healthy']),
             'warning_components': len([h for h in health_data if h['status'] == 'warning']),
-            'critical_components': len([h for h in health_data if h['status'] == 'critical'])
+            'critical_components': len([h for h in health_data if h['status'] == 'critical']),
+            'hourly': hourly_data
         })
 
 
@@ -338,22 +376,16 @@ class RateLimitMonitoringView(APIView):
             queryset = queryset.filter(action_taken=action_taken)
         
         # Filter by time range
+        time_from = None
         try:
             hours = int(hours)
             time_from = timezone.now() - timedelta(hours=hours)
-            queryset = queryset.filter(created_at__gte=time_from)
+            queryset = partition_window(queryset, time_from)
         except ValueError:
             pass
         
-        # Get statistics
-        total_requests = queryset.count()
-        blocked_requests = queryset.filter(action_taken='blocked').count()
-        allowed_requests = queryset.filter(action_taken='allowed').count()
-        
-        # Top IP addresses
-        top_ips = queryset.values('ip_address').annotate(
-            count=Count('id')
-        ).order_by('-count')[:10]
+        # Statistics and top IPs from the hourly rollups
+        stats = rate_limit_stats(time_from, limit_type=limit_type, action_taken=action_taken)
         
         # Recent logs
         recent_logs = queryset.order_by('-created_at')[:20]
@@ -377,13 +409,7 @@ class RateLimitMonitoringView(APIView):
             })
         
         return Response({
-            'statistics': {
-                'total_requests': total_requests,
-                'blocked_requests': blocked_requests,
-                'allowed_requests': allowed_requests,
-                'block_rate': (blocked_requests / total_requests * 100) if total_requests > 0 else 0
-            },
-            'top_ips': list(top_ips),
+            **stats,
             'recent_logs': log_data
         })
 
@@ -394,36 +420,10 @@ class DataPrivacyView(APIView):
     serializer_class = MessageSerializer
     
     def get(self, request):
-        # Get query parameters
-        action = request.query_params.get('action')
-        user_id = request.query_params.get('user_id')
-        days = request.query_params.get('days', 30)
-        
-        # Build queryset
-        queryset = DataPrivacyLog.objects.select_related('user')
-        
-        # Apply filters
-        if action:
-            queryset = queryset.filter(action=action)
-        
-        if user_id:
-            queryset = queryset.filter(user_id=user_id)
-        
-        # Filter by date range
-        try:
-            days = int(days)
-            date_from = timezone.now() - timedelta(days=days)
-            queryset = queryset.filter(created_at__gte=date_from)
-        except ValueError:
-            pass
-        
-        # Pagination
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 50))
-        start = (page - 1) * page_size
-        end = start + page_size
-        
-        privacy_logs = queryset[start:end]
+        queryset = filter_privacy_logs(request).select_related('user')
+
+        paginator = LogPagination()
+        privacy_logs = paginator.paginate_queryset(queryset, request, view=self)
         
         log_data = []
         for log in privacy_logs:
@@ -444,9 +444,131 @@ class DataPrivacyView(APIView):
                 'created_at': log.created_at.isoformat()
             })
         
+        return paginator.get_paginated_response(log_data)
+
+
+class DataPrivacyExportView(APIView):
+    """Admin: Stream data privacy logs as CSV or NDJSON, resumable from a row cursor"""
+    permission_classes = [IsAdminUser]
+    serializer_class = MessageSerializer
+
+    def get(self, request):
+        return log_export_response(
+            request, filter_privacy_logs(request, default_days=365), PRIVACY_LOG_COLUMNS, 'data-privacy'
+        )
+
+
+class RequestPerformanceView(APIView):
+    """Admin: Per-route latency percentiles, query counts and N+1 offenders"""
+    permission_classes = [IsAdminUser]
+    serializer_class = MessageSerializer
+
+    def get(self, request):
+        try:
+            hours = int(request.query_params.get('hours', 24))
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({'detail': 'hours and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Include this worker's unflushed samples
+        request_profiler.flush()
+
+        time_from = (timezone.now() - timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0)
+        routes = summarize_metrics(RequestMetric.objects.filter(period_start__gte=time_from))
+
+        slowest = sorted(routes, key=lambda route: route['p95'] or 0, reverse=True)[:limit]
+        n_plus_one = sorted(
+            (route for route in routes if route['n_plus_one_requests']),
+            key=lambda route: (route['n_plus_one_requests'], route['worst_repeat_count']),
+            reverse=True
+        )[:limit]
+
         return Response({
-            'privacy_logs': log_data,
-            'total_count': queryset.count(),
-            'page': page,
-            'page_size': page_size
-        }) 
\ No newline at end of file
+            'hours': hours,
+            'sample_rate': getattr(settings, 'PROFILING_SAMPLE_RATE', DEFAULT_SAMPLE_RATE),
+            'total_routes': len(routes),
+            'profiled_requests': sum(route['requests'] for route in routes),
+            'routes': slowest,
+            'n_plus_one_offenders': [
+                {
+                    'route': route['route'],
+                    'n_plus_one_requests': route['n_plus_one_requests'],
+                    'avg_queries': route['avg_queries'],
+                    'max_queries': route['max_queries'],
+                    'worst_repeat_count': route['worst_repeat_count'],
+                    'worst_repeated_query': route['worst_repeated_query'],
+                }
+                for route in n_plus_one
+            ]
+        })
+
+
+def ip_rule_data(rule):
+    return {
+        'id': rule.id,
+        'network': rule.network,
+        'action': rule.action,
+        'reason': rule.reason,
+        'expires_at': rule.expires_at.isoformat() if rule.expires_at else None,
+        'created_by': rule.created_by.username if rule.created_by else None,
+        'created_at': rule.created_at.isoformat()
+    }
+
+
+class IPRuleView(APIView):
+    """Admin: List and add IP block/allow rules"""
+    permission_classes = [IsAdminUser]
+    serializer_class = MessageSerializer
+
+    def get(self, request):
+        queryset = IPRule.objects.select_related('created_by')
+        action = request.query_params.get('action')
+        if action:
+            queryset = queryset.filter(action=action)
+        if request.query_params.get('active', '').lower() == 'true':
+            queryset = queryset.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+
+        return Response({'ip_rules': [ip_rule_data(rule) for rule in queryset]})
+
+    def post(self, request):
+        action = request.data.get('action', 'block')
+        if action not in dict(IPRule.ACTIONS):
+            return Response({'detail': 'action must be "block" or "allow".'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            network = parse_network(str(request.data.get('network', '')))
+        except ValueError:
+            return Response({'detail': 'network must be an IP address or CIDR range.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        expires_at = request.data.get('expires_at')
+        if expires_at:
+            try:
+                expires_at = parse_datetime(str(expires_at))
+            except ValueError:
+                expires_at = None
+            if expires_at is None:
+                return Response({'detail': 'expires_at must be an ISO 8601 datetime.'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(expires_at):
+                # Without an offset the time is read in the site's time zone
+                expires_at = timezone.make_aware(expires_at)
+
+        rule = IPRule.objects.create(
+            network=str(network),
+            action=action,
+            reason=request.data.get('reason', ''),
+            expires_at=expires_at or None,
+            created_by=request.user
+        )
+        return Response(ip_rule_data(rule), status=status.HTTP_201_CREATED)
+
+
+class IPRuleDetailView(APIView):
+    """Admin: Remove an IP rule"""
+    permission_classes = [IsAdminUser]
+    serializer_class = MessageSerializer
+
+    def delete(self, request, rule_id):
+        deleted, _ = IPRule.objects.filter(id=rule_id).delete()
+        if not deleted:
+            return Response({'detail': 'IP rule not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -25,8 +25,10 @@ from programs.models import Enrollment
 from events.models import EventRegistration
 from django.utils import timezone
 from rest_framework.permissions import AllowAny
+from security.audit import record_audit_event
 
 logger = logging.getLogger(__name__)
+profile_logger = logging.getLogger(f'{__name__}.profile')
 
 
 def is_email_configured():
@@ -245,7 +247,7 @@ class CustomTokenCreateView(APIView):
         if not username or not password:
             return Response({'detail': 'Username and password are required.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        user = authenticate(username=username, password=password)
+        user = authenticate(request, username=username, password=password)
         
         if not user:
             return Response({'detail': 'Invalid credentials.'}, status=status.HTTP_401_UNAUTHORIZED)
@@ -254,6 +256,7 @@ class CustomTokenCreateView(APIView):
             return Response({'detail': 'Please confirm your email before logging in.'}, status=status.HTTP_400_BAD_REQUEST)
         
         refresh = RefreshToken.for_user(user)
+        record_audit_event('login', f'User {user.username} logged in', user=user, request=request)
         
         return Response({
             'access': str(refresh.access_token),
@@ -359,19 +362,19 @@ class UserProfileView(RetrieveUpdateAPIView):
         return self.request.user
 
     def partial_update(self, request, *args, **kwargs):
-        logger.info(f"UserProfileView.partial_update called by {request.user.username}")
-        logger.info(f"Request data keys: {request.data.keys()}")
+        profile_logger.info(f"UserProfileView.partial_update called by {request.user.username}")
+        profile_logger.info(f"Request data keys: {request.data.keys()}")
         if 'avatar' in request.FILES:
-            logger.info(f"Avatar file found in request.FILES: {request.FILES['avatar'].name}")
+            profile_logger.info(f"Avatar file found in request.FILES: {request.FILES['avatar'].name}")
         elif 'avatar' in request.data:
-            logger.info(f"Avatar found in request.data: {type(request.data['avatar'])}")
+            profile_logger.info(f"Avatar found in request.data: {type(request.data['avatar'])}")
             
         try:
             response = super().partial_update(request, *args, **kwargs)
-            logger.info(f"Profile update successful for {request.user.username}")
+            profile_logger.info(f"Profile update successful for {request.user.username}")
             return response
         except Exception as e:
-            logger.error(f"Profile update failed for {request.user.username}: {str(e)}")
+            profile_logger.error(f"Profile update failed for {request.user.username}: {str(e)}")
             raise e
 
 class UserEnrollmentsView(ListAPIView):
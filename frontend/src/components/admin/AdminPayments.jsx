@@ -206,7 +206,7 @@ const AdminPayments = () => {
                                                         </div>
                                                     </td>
                                                     <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-600">
-                                                        {order.pricing_plan_details?.name || 'N/A'}
+                                                        {order.plan_name || 'N/A'}
                                                     </td>
                                                     <td className="px-6 py-4 whitespace-nowrap text-sm font-medium text-gray-900">
                                                         {paymentService.formatCurrency(order.amount, order.currency)}
@@ -21,8 +21,11 @@ const AdminSecurity = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [activeTab, setActiveTab] = useState('dashboard');
-  const [currentPage, setCurrentPage] = useState(1);
-  const [totalPages, setTotalPages] = useState(1);
+  // Logs are keyset paginated: keep the cursor of every page visited so
+  // Previous can step back, and the next page's cursor from the response
+  const [pageCursors, setPageCursors] = useState(['']);
+  const [nextCursor, setNextCursor] = useState(null);
+  const cursor = pageCursors[pageCursors.length - 1];
 
   useEffect(() => {
     if (activeTab === 'dashboard') {
@@ -32,7 +35,7 @@ const AdminSecurity = () => {
     } else if (activeTab === 'security-events') {
       fetchSecurityEvents();
     }
-  }, [activeTab, currentPage]);
+  }, [activeTab, cursor]);
 
   const fetchSecurityStats = async () => {
     try {
@@ -60,10 +63,10 @@ const AdminSecurity = () => {
   const fetchAuditLogs = async () => {
     try {
       setLoading(true);
-      const params = new URLSearchParams({
-        page: currentPage,
-        page_size: 20
-      });
+      const params = new URLSearchParams({ page_size: 20 });
+      if (cursor) {
+        params.set('cursor', cursor);
+      }
 
       const response = await fetch(`${API_BASE_URL}/security/audit-logs/?${params}`, {
         headers: {
@@ -75,7 +78,7 @@ const AdminSecurity = () => {
       if (response.ok) {
         const data = await response.json();
         setAuditLogs(data.results || []);
-        setTotalPages(Math.ceil((data.count || 0) / 20));
+        setNextCursor(data.next_cursor || null);
       } else {
         toast.error('Failed to fetch audit logs');
       }
@@ -89,10 +92,10 @@ const AdminSecurity = () => {
   const fetchSecurityEvents = async () => {
     try {
       setLoading(true);
-      const params = new URLSearchParams({
-        page: currentPage,
-        page_size: 20
-      });
+      const params = new URLSearchParams({ page_size: 20 });
+      if (cursor) {
+        params.set('cursor', cursor);
+      }
 
       const response = await fetch(`${API_BASE_URL}/security/security-events/?${params}`, {
         headers: {
@@ -104,7 +107,7 @@ const AdminSecurity = () => {
       if (response.ok) {
         const data = await response.json();
         setSecurityEvents(data.results || []);
-        setTotalPages(Math.ceil((data.count || 0) / 20));
+        setNextCursor(data.next_cursor || null);
       } else {
         toast.error('Failed to fetch security events');
       }
@@ -497,7 +500,11 @@ const AdminSecurity = () => {
             return (
               <button
                 key={tab.id}
-                onClick={() => setActiveTab(tab.id)}
+                onClick={() => {
+                  setActiveTab(tab.id);
+                  setPageCursors(['']);
+                  setNextCursor(null);
+                }}
                 className={`flex items-center space-x-3 px-8 py-4 text-sm font-semibold whitespace-nowrap border-b-3 transition-all duration-300 ${activeTab === tab.id
                     ? 'border-b-4 border-[#30d9fe] text-[#03325a] bg-gradient-to-t from-blue-50 to-transparent'
                     : 'border-transparent text-gray-600 hover:text-gray-900 hover:bg-gray-50'
@@ -519,43 +526,22 @@ const AdminSecurity = () => {
       </div>
 
       {/* Pagination for logs and events */}
-      {(activeTab === 'audit-logs' || activeTab === 'security-events') && totalPages > 1 && (
+      {(activeTab === 'audit-logs' || activeTab === 'security-events') && (pageCursors.length > 1 || nextCursor) && (
         <div className="flex justify-center">
           <nav className="flex items-center space-x-2 bg-white rounded-xl shadow-lg p-2 border border-gray-100">
             <button
-              onClick={() => setCurrentPage(Math.max(1, currentPage - 1))}
-              disabled={currentPage === 1}
+              onClick={() => setPageCursors(pageCursors.slice(0, -1))}
+              disabled={pageCursors.length === 1}
               className="px-4 py-2 text-sm font-semibold text-gray-700 bg-white border border-gray-200 rounded-lg hover:bg-gradient-to-r hover:from-blue-50 hover:to-blue-100 hover:border-blue-300 disabled:opacity-50 disabled:cursor-not-allowed transition-all duration-300"
             >
               Previous
             </button>
-            {Array.from({ length: Math.min(5, totalPages) }, (_, i) => {
-              let page;
-              if (totalPages <= 5) {
-                page = i + 1;
-              } else if (currentPage <= 3) {
-                page = i + 1;
-              } else if (currentPage >= totalPages - 2) {
-                page = totalPages - 4 + i;
-              } else {
-                page = currentPage - 2 + i;
-              }
-              return (
-                <button
-                  key={page}
-                  onClick={() => setCurrentPage(page)}
-                  className={`px-4 py-2 text-sm font-semibold rounded-lg transition-all duration-300 ${currentPage === page
-                      ? 'bg-[#30d9fe] text-[#03325a] shadow-lg transform scale-110'
-                      : 'text-gray-700 bg-white border border-gray-200 hover:bg-gradient-to-r hover:from-blue-50 hover:to-blue-100 hover:border-blue-300'
-                    }`}
-                >
-                  {page}
-                </button>
-              );
-            })}
+            <span className="px-4 py-2 text-sm font-semibold rounded-lg bg-[#30d9fe] text-[#03325a] shadow-lg">
+              {pageCursors.length}
+            </span>
             <button
-              onClick={() => setCurrentPage(Math.min(totalPages, currentPage + 1))}
-              disabled={currentPage === totalPages}
+              onClick={() => setPageCursors([...pageCursors, nextCursor])}
+              disabled={!nextCursor}
               className="px-4 py-2 text-sm font-semibold text-gray-700 bg-white border border-gray-200 rounded-lg hover:bg-gradient-to-r hover:from-blue-50 hover:to-blue-100 hover:border-blue-300 disabled:opacity-50 disabled:cursor-not-allowed transition-all duration-300"
             >
               Next